@@ -5,6 +5,11 @@ The network class used in the draculab simulator.
 
 from draculab import unit_types, synapse_types, plant_models, syn_reqs  # names of models and requirements
 import numpy as np
+import operator
+import os
+import pickle
+import sys
+from time import perf_counter # used when profiling simulations
 from cython_utils import * # interpolation and integration methods including cython_get_act*,
 #from requirements import *  # not sure this is necessary
 from array import array # optionally used for the unit's buffer
@@ -30,6 +35,560 @@ def upd_unit(u, t):
             u.upd_flat_inp_sum(time)
     return u        
 
+def sample_rows(pool, row_ids, k, autapses=True, rep=False):
+    """ Sample k entries of an ID array for each entry of another ID array.
+
+        Auxiliary to network.conn_pairs. For each ID in row_ids, k indexes of
+        'pool' are chosen at random with np.random.choice. When autapses is
+        False, the entries of 'pool' equal to the row's ID are never chosen.
+        The random numbers are drawn in the same order as in earlier versions
+        of network.connect, so seeded networks keep their connections.
+
+        Args:
+            pool: 1D integer array with the IDs to choose from.
+            row_ids: 1D integer array with one ID per row.
+            k: number of entries to choose for each row.
+            autapses: if False, the ID of a row can't be chosen for that row.
+            rep: whether the sampling is done with replacement.
+        Returns:
+            A (len(row_ids), k) integer array with indexes of 'pool'.
+        Raises:
+            ValueError if a row has less than k valid entries and rep is False,
+            or no valid entries.
+    """
+    idxs = np.zeros((len(row_ids), k), dtype=int)
+    if k == 0:
+        return idxs
+    all_idx = np.arange(len(pool))
+    for r, uid in enumerate(row_ids.tolist()):
+        cand = all_idx if autapses else all_idx[pool != uid]
+        if len(cand) < (1 if rep else k):
+            raise ValueError('Not enough candidates to sample ' + str(k) + 
+                             ' connections without autapses or multapses')
+        idxs[r] = np.random.choice(cand, size=k, replace=rep)
+    return idxs
+
+
+def is_state_value(v):
+    """ Returns True if 'v' is a number, a numeric array, or a list or tuple of those.
+
+        These are the values that network.dynamic_state copies from the
+        attributes of units, synapses, plants, and population update objects.
+    """
+    if type(v) in (bool, int, float, complex) or isinstance(v, (np.number, np.bool_)):
+        return True
+    if isinstance(v, np.ndarray):
+        return v.dtype.kind in 'biufc'
+    if type(v) in (list, tuple):
+        return all([is_state_value(x) for x in v])
+    return False
+
+
+def copy_state(dst, src):
+    """ Returns a copy of the value 'src', reusing 'dst' when possible.
+
+        'src' is a value for which is_state_value is True. When 'dst' is a
+        writeable array with the same shape and dtype as 'src', the values are
+        copied into 'dst', and 'dst' is returned. Lists of the same length are
+        also copied element by element. Thus, arrays that are shared by several
+        objects (e.g. the views created by population updates) remain shared
+        after their values are restored.
+    """
+    if isinstance(src, np.ndarray):
+        if isinstance(dst, np.ndarray) and dst.shape == src.shape and \
+           dst.dtype == src.dtype and dst.flags.writeable:
+            if dst is not src:
+                dst[...] = src
+            return dst
+        return np.array(src)
+    if type(src) is list:
+        if type(dst) is list and len(dst) == len(src):
+            for i, x in enumerate(src):
+                dst[i] = copy_state(dst[i], x)
+            return dst
+        return [copy_state(None, x) for x in src]
+    if type(src) is tuple:
+        if type(dst) is not tuple or len(dst) != len(src):
+            dst = (None,) * len(src)
+        return tuple([copy_state(d, x) for d, x in zip(dst, src)])
+    return src
+
+
+class noise_stream():
+    """ A source of standard normal samples pre-generated in blocks.
+
+        Noisy units and synapses draw a small amount of noise on each update
+        (e.g. min_buff_size samples per simulation step). Rather than calling
+        the random number generator every time, a noise_stream obtains many
+        draws with a single call to its numpy.random.Generator, and hands them
+        out one draw at a time.
+
+        Each stream has its own generator, seeded from a numpy.random.SeedSequence
+        whose spawn key identifies the unit or synapse using it (see 
+        network.get_noise_stream). Because of this the noise received by an
+        element does not depend on how many other noisy elements exist, on the
+        order of their updates, or on how the network is partitioned.
+    """
+    def __init__(self, seed_seq, size=None, block_size=80):
+        """ The noise_stream constructor.
+
+            Args:
+                seed_seq: a numpy.random.SeedSequence used to seed the generator.
+                size: number of samples in each draw. If None, each draw is a
+                      scalar.
+                block_size: approximate number of samples generated with each
+                            call to the generator.
+        """
+        self.seed_seq = seed_seq
+        self.rng = np.random.default_rng(seed_seq)
+        self.size = size
+        if size is None:
+            self.n_draws = max(1, int(block_size))
+            self.shape = (self.n_draws,)
+        else:
+            self.n_draws = max(1, int(block_size) // size) # draws per block
+            self.shape = (self.n_draws, size)
+        self.block = None
+        self.pos = self.n_draws # index of the next draw in block
+
+    def draw(self):
+        """ Return the next draw of standard normal noise.
+
+            Returns:
+                A float when the stream was created with size=None. Otherwise a
+                1D numpy array with 'size' samples. This array is a view of the
+                current block, so it should not be modified.
+        """
+        if self.pos == self.n_draws:
+            self.block = self.rng.standard_normal(self.shape)
+            self.pos = 0
+        self.pos += 1
+        return self.block[self.pos-1]
+
+
+class linear_propagator():
+    """ Exact integration of linear and noisy_linear units in a flat network.
+
+        When all the synapses received by a linear unit are static, its input sum
+        is a weighted sum of delayed activities. Since no delay is shorter than
+        min_delay, the inputs for a whole simulation step are already stored in
+        the acts array, and the units are uncoupled during the step. Each unit
+        then follows
+            y' = b*I(t) - a*y + mu + sigma*xi(t),
+        where I(t) is the input sum and xi(t) is white noise. With I(t) linearly
+        interpolated between substeps, this has an exact solution for each
+        substep of length h:
+            y(t+h) = E*y(t) + p0*I(t) + p1*I(t+h) + mu*q + s*n,
+        with E = exp(-a*h), q = (1-E)/a, p1 = b*(h-q)/(a*h), p0 = b*q - p1, n a
+        standard normal sample, and s = sigma*sqrt((1-E^2)/(2*a)), the exact
+        standard deviation of the noise accumulated in the substep.
+
+        The input sums of all the units come from a single product of a weight
+        matrix and the delayed activities. The matrix is sparse, unless all its
+        entries are used (e.g. with all_to_all connections), so a diverging
+        activity doesn't reach units that don't receive it. The columns of the matrix are the distinct
+        (source, delay) pairs, so units receiving the same delayed activity
+        share its column. Weights are read again at each step, but the decay
+        rates and noise parameters are taken from the units when the propagator
+        is created.
+
+        The units in the propagator don't call their upd_flat_inp_sum or
+        flat_update methods (see network.init_linear_props), but their inp_sum
+        attribute remains a view of the input sums at each substep.
+    """
+    def __init__(self, net, units):
+        """ The linear_propagator constructor.
+
+            Args:
+                net: a flat network.
+                units: a list with the linear and noisy_linear units to propagate.
+        """
+        from scipy.sparse import csr_matrix
+        self.net = net
+        self.units = units
+        self.ids = np.array([u.ID for u in units], dtype=int)
+        self.rows = np.array([net.first_idx[uid] for uid in self.ids], dtype=int)
+        mbs = net.min_buff_size
+        h = net.min_delay / mbs
+        # the synapses received by the units, in the order of net.inp_base
+        starts = net.inp_starts[self.ids]
+        ends = net.inp_starts[self.ids+1]
+        self.syn_idx = np.concatenate([np.arange(s, e, dtype=int) for s, e in 
+                                       zip(starts, ends)] + [np.zeros(0, dtype=int)])
+        post = np.repeat(np.arange(len(units), dtype=int), ends-starts)
+        # columns of the weight matrix are the distinct values of inp_base
+        cols, col_of_syn = np.unique(net.inp_base[self.syn_idx], return_inverse=True)
+        col_of_syn = col_of_syn.reshape(-1)
+        # inp_idx[j, s] is the index in the flattened acts array of the value
+        # in column j for the time t + s*h (before acts is rolled)
+        self.inp_idx = cols[:, np.newaxis] + np.arange(mbs+1, dtype=int)
+        shape = (len(units), len(cols))
+        # synapses with the same unit and column are added together
+        W = csr_matrix((np.arange(1., len(self.syn_idx)+1.), (post, col_of_syn)),
+                       shape=shape)
+        W.sum_duplicates() # also sorts the indices
+        self.dense = W.nnz > 0 and W.nnz == shape[0] * shape[1]
+        if self.dense:
+            # position of each synapse in the raveled dense matrix
+            self.w_pos = post * shape[1] + col_of_syn
+            self.w_size = shape[0] * shape[1]
+            self.W = np.zeros(shape)
+        else:
+            key = post * shape[1] + col_of_syn
+            nz_keys = np.repeat(np.arange(shape[0]), np.diff(W.indptr)) * shape[1] + W.indices
+            self.w_pos = np.searchsorted(nz_keys, key) # entry of W.data for each synapse
+            self.W = W
+        # inp[i, s] is the input sum of the i-th unit at time t + s*h
+        self.inp = np.zeros((len(units), mbs+1))
+        for i, u in enumerate(units):
+            u.inp_sum = self.inp[i, :mbs]
+        # coefficients of the exact solution
+        rtau = np.array([u.rtau for u in units])
+        lambd = np.array([getattr(u, 'lambd', 1.) for u in units])
+        noisy = [hasattr(u, 'noise_stream') for u in units]
+        mu = np.array([u.mu if nz else 0. for u, nz in zip(units, noisy)])
+        sigma = np.array([u.sigma if nz else 0. for u, nz in zip(units, noisy)])
+        a = lambd * rtau
+        nz = a != 0.
+        a_nz = np.where(nz, a, 1.)
+        self.E = np.exp(-a * h)
+        q = np.where(nz, -np.expm1(-a * h) / a_nz, h)
+        p1 = np.where(nz, (h - q) / (a_nz * h), 0.5 * h)
+        self.p0 = (rtau * (q - p1))[:, np.newaxis]
+        self.p1 = (rtau * p1)[:, np.newaxis]
+        self.muq = (mu * q)[:, np.newaxis]
+        sd = sigma * np.sqrt(np.where(nz, -np.expm1(-2. * a * h) / (2. * a_nz), h))
+        self.noisy = np.flatnonzero(noisy)
+        self.sd = sd[self.noisy][:, np.newaxis]
+        self.streams = [units[i].noise_stream for i in self.noisy]
+        self.drive = np.zeros((len(units), mbs))
+
+    def update_inputs(self, time):
+        """ Obtains the input sums of the current step, before acts is rolled. """
+        w = self.net.get_syn_weights(time)[self.syn_idx]
+        vals = self.net.acts.reshape(-1)[self.inp_idx]
+        if self.dense:
+            self.W[...] = np.bincount(self.w_pos, weights=w, 
+                          minlength=self.w_size).reshape(self.W.shape)
+            np.matmul(self.W, vals, out=self.inp)
+        else:
+            self.W.data[:] = np.bincount(self.w_pos, weights=w, minlength=self.W.nnz)
+            self.inp[...] = self.W @ vals
+
+    def update(self, time):
+        """ Advances the units one step, after acts is rolled. """
+        acts = self.net.acts
+        mbs = self.drive.shape[1]
+        base = acts.shape[1] - mbs
+        drive = self.drive
+        np.multiply(self.p0, self.inp[:, :-1], out=drive)
+        drive += self.p1 * self.inp[:, 1:]
+        drive += self.muq
+        if len(self.streams) > 0:
+            drive[self.noisy] += self.sd * np.array([s.draw() for s in self.streams])
+        y = acts[self.rows, base-1]
+        for idx in range(mbs):
+            y = self.E * y + drive[:, idx]
+            acts[self.rows, base+idx] = y
+
+
+class step_profiler():
+    """ Accumulates the wall time and number of calls of the parts of a simulation step.
+
+        A network uses a step_profiler after network.start_profiling is called.
+        Times are accumulated for keys (kind, name), where 'kind' is one of:
+            'phase' : the parts of a step (e.g. 'inp_sums', 'units', 'plants',
+                      'sources', 'requirements', 'synapses', 'store', 'stats').
+            'unit' : the integration of the units of a class.
+            'inp_sum' : the input sums of the units of a class.
+            'source' : the evaluation of source units.
+            'requirement' : the update of a requirement (e.g. 'lpf_fast').
+            'pop' : the population update objects of a class.
+            'synapse' : the update of the synapses of a type.
+            'plant' : the update of the plants of a class.
+    """
+    def __init__(self):
+        self.stats = {} # stats[(kind, name)] = [total seconds, number of calls]
+        self.steps = 0 # number of profiled simulation steps
+
+    def add(self, key, dt, calls=1):
+        """ Adds 'dt' seconds and 'calls' calls to the entry for 'key'. """
+        entry = self.stats.get(key)
+        if entry is None:
+            self.stats[key] = [dt, calls]
+        else:
+            entry[0] += dt
+            entry[1] += calls
+
+    def reset(self):
+        """ Removes all accumulated values. """
+        self.stats = {}
+        self.steps = 0
+
+    # The methods below are the timing hooks of network.flat_update
+    clock = staticmethod(perf_counter)
+
+    def timed(self, kind, objs):
+        """ Iterates over 'objs', timing the body of the loop for each object.
+
+            Args:
+                kind: the kind of entry (see profile_key).
+                objs: the units, plants, synapses, requirement functions, or
+                      population update objects of the loop.
+            Yields:
+                The elements of 'objs'. The time until the next element is
+                requested is added to the entry of the current one.
+        """
+        for obj in objs:
+            t0 = perf_counter()
+            yield obj
+            self.add(profile_key(kind, obj), perf_counter() - t0)
+
+    def lap(self, kind, obj, t0):
+        """ Adds the time since t0 to the entry of 'obj', and returns that time. """
+        dt = perf_counter() - t0
+        self.add(profile_key(kind, obj), dt)
+        return dt
+
+    def phase(self, name, t0):
+        """ Adds the time since t0 to the phase 'name', and returns the current time. """
+        t = perf_counter()
+        self.add(('phase', name), t - t0)
+        return t
+
+    def as_dict(self):
+        """ Returns the accumulated values as builtins.
+
+            Returns:
+                A dictionary with the entries:
+                'steps' : number of profiled simulation steps.
+                'total' : total seconds in all phases.
+                'entries' : a list with a dictionary for each (kind, name) key,
+                            sorted by decreasing time, with the entries 'kind',
+                            'name', 'time', 'calls', and 'share' (fraction of the
+                            total time).
+        """
+        total = sum([v[0] for (kind, _), v in self.stats.items() if kind == 'phase'])
+        entries = [{'kind' : kind, 'name' : name, 'time' : t, 'calls' : n,
+                    'share' : t / total if total > 0. else 0.}
+                   for (kind, name), (t, n) in self.stats.items()]
+        entries.sort(key=lambda e: -e['time'])
+        return {'steps' : self.steps, 'total' : total, 'entries' : entries}
+
+    def table(self, kinds=None):
+        """ Returns a string with a table of the accumulated values.
+
+            Args:
+                kinds: a list with the kinds of entries to include. If None,
+                       all kinds are included.
+        """
+        rep = self.as_dict()
+        lines = ['%d steps, %.4f s total' % (rep['steps'], rep['total']),
+                 '%-12s %-32s %10s %12s %12s %7s' % ('kind', 'name', 'calls',
+                 'time [s]', 'per call[us]', 'share')]
+        for e in rep['entries']:
+            if kinds is not None and e['kind'] not in kinds:
+                continue
+            lines.append('%-12s %-32s %10d %12.4f %12.2f %6.1f%%' % (e['kind'],
+                         e['name'][:32], e['calls'], e['time'],
+                         1e6 * e['time'] / max(e['calls'], 1), 100. * e['share']))
+        return '\n'.join(lines)
+
+
+class null_timer():
+    """ The timing hooks of network.flat_update when there is no profiler.
+
+        The methods have the arguments of those in step_profiler, and measure
+        nothing, so the step loop is the same with and without profiling.
+        'timed' returns its 'objs' argument, so loops over units or synapses
+        have no extra cost per object.
+    """
+    @staticmethod
+    def clock():
+        return 0.
+
+    def timed(self, kind, objs):
+        return objs
+
+    def lap(self, kind, obj, t0):
+        return 0.
+
+    def phase(self, name, t0):
+        return 0.
+
+    def add(self, key, dt, calls=1):
+        pass
+
+NULL_TIMER = null_timer()
+
+
+def profile_key(kind, obj):
+    """ Returns the step_profiler key for an object timed in flat_update.
+
+        Args:
+            kind: 'unit', 'inp_sum', 'source', 'plant', 'synapse', 'requirement',
+                  'pop', or 'pop_inputs' (the input sums of a population update).
+            obj: the object that was timed.
+        Returns:
+            The tuple (kind, name) described in step_profiler.
+    """
+    if kind == 'pop':
+        return ('pop', pop_label(obj))
+    if kind == 'pop_inputs':
+        return ('pop', pop_label(obj) + ' inputs')
+    if kind == 'synapse':
+        return ('synapse', obj.type.name)
+    if kind == 'requirement':
+        name = getattr(obj, '__name__', type(obj).__name__)
+        return ('requirement', name[4:] if name[:4] == 'upd_' else name)
+    return (kind, type(obj).__name__)
+
+
+def pop_label(pop):
+    """ Returns the name used to identify a population update object in reports.
+
+        The name is the class name, followed by the name of the requirement when
+        the object updates one (e.g. 'w_norm_pop l1_norm_factor').
+    """
+    req = getattr(pop, 'req', None)
+    if isinstance(req, syn_reqs):
+        return type(pop).__name__ + ' ' + req.name
+    return type(pop).__name__
+
+
+def is_compiled(f):
+    """ Whether a function or bound method is compiled code (e.g. from cython_utils). """
+    return not hasattr(getattr(f, '__func__', f), '__code__')
+
+
+class run_progress():
+    """ The state of a simulation, passed to the callback of run and flat_run.
+
+        Attributes:
+            net: the network being simulated.
+            step: number of simulation steps completed in this run.
+            n_steps: total number of steps that this run will simulate.
+            sim_time: current simulation time.
+            elapsed: wall time since the run started, in seconds.
+            steps_per_s: simulation steps per second of wall time.
+            eta: estimated wall time to complete the run, in seconds.
+            stopped: True if the callback stopped the run.
+            reason: the value returned by the callback that stopped the run.
+            data: a dictionary where callbacks can keep values between calls.
+
+        A run usually corresponds to one call of network.run or flat_run. A
+        simulation split in several calls (e.g. one per input presentation) is
+        a single run for the callback when the same run_progress object, created
+        with the total number of steps, is passed to all the calls.
+    """
+    def __init__(self, net, n_steps):
+        self.net = net
+        self.n_steps = n_steps
+        self.step = 0
+        self.sim_time = net.sim_time
+        self.elapsed = 0.
+        self.steps_per_s = 0.
+        self.eta = float('inf')
+        self.stopped = False
+        self.reason = None
+        self.data = {}
+        self.start = perf_counter()
+
+    def advance(self, step):
+        """ Updates the progress values after 'step' steps have been simulated. """
+        self.step = step
+        self.sim_time = self.net.sim_time
+        self.elapsed = perf_counter() - self.start
+        self.steps_per_s = step / self.elapsed if self.elapsed > 0. else float('inf')
+        self.eta = (self.n_steps - step) / self.steps_per_s if step > 0 else float('inf')
+
+    @property
+    def acts(self):
+        """ A numpy array with the current activity of all units.
+
+            The array is created only when this attribute is read. For flat
+            networks it is taken from the network's activities array.
+        """
+        net = self.net
+        if net.flat:
+            return net.acts[net.first_idx, -1].copy()
+        return np.array([u.get_act(net.sim_time) for u in net.units])
+
+
+def progress_printer(end='\r'):
+    """ Returns a run callback that prints the progress of the simulation.
+
+        Args:
+            end: string printed after each progress line.
+        Returns:
+            A function callback(progress) that never stops the run.
+    """
+    def callback(progress):
+        print('step %d/%d, t=%.3f, %.1f steps/s, ETA %.1f s' % (progress.step,
+              progress.n_steps, progress.sim_time, progress.steps_per_s,
+              progress.eta), end=end)
+    return callback
+
+
+def divergence_stopper(max_abs=1e6):
+    """ Returns a run callback that stops when activities are not finite or too large.
+
+        Args:
+            max_abs: largest absolute value accepted for the activities.
+        Returns:
+            A function callback(progress) that returns a string explaining why the
+            run was stopped, or None.
+    """
+    def callback(progress):
+        acts = progress.acts
+        if not np.all(np.isfinite(acts)):
+            return 'non-finite activities at t=' + str(progress.sim_time)
+        if np.max(np.abs(acts), initial=0.) > max_abs:
+            return 'activities larger than ' + str(max_abs) + ' at t=' + str(progress.sim_time)
+    return callback
+
+
+def convergence_stopper(tol=1e-6, checks=3):
+    """ Returns a run callback that stops when activities no longer change.
+
+        The run stops when the largest change in the activities between
+        consecutive calls of the callback is smaller than 'tol' for 'checks'
+        consecutive calls.
+
+        Args:
+            tol: tolerance for the largest change of the activities.
+            checks: number of consecutive calls where the change must be small.
+        Returns:
+            A function callback(progress) that returns a string explaining why the
+            run was stopped, or None.
+    """
+    def callback(progress):
+        acts = progress.acts
+        prev = progress.data.get('conv_acts')
+        progress.data['conv_acts'] = acts
+        if prev is None or np.max(np.abs(acts - prev), initial=0.) >= tol:
+            progress.data['conv_count'] = 0
+            return None
+        progress.data['conv_count'] = progress.data.get('conv_count', 0) + 1
+        if progress.data['conv_count'] >= checks:
+            return 'activities converged at t=' + str(progress.sim_time)
+    return callback
+
+
+def combine_callbacks(*callbacks):
+    """ Returns a run callback that calls several callbacks in order.
+
+        The combined callback stops the run with the value returned by the first
+        callback that returns a true value. The callbacks after it are not called.
+    """
+    def callback(progress):
+        for cb in callbacks:
+            reason = cb(progress)
+            if reason:
+                return reason
+    return callback
+
+
 class network():
     """ 
     This class has the tools to build and simulate a network.
@@ -58,6 +617,30 @@ class network():
                 rtol = relative tolerance in the ODE integrator.
                 atol = absolute tolerance in the ODE integrator.
                 See: https://docs.scipy.org/doc/scipy/reference/generated/scipy.integrate.odeint.html
+                pop_updates = if False, flat networks will not use population
+                              updates for requirements (see init_pop_updates).
+                              Defaults to True.
+                seed = an integer used to seed the random number generators of
+                       the noise streams (see get_noise_stream). When absent
+                       fresh entropy is used, and stored in self.seed so the
+                       simulation can be reproduced.
+                noise_block = approximate number of samples pre-generated by
+                              each noise stream with a single call to its
+                              generator. Defaults to 8*min_buff_size, the
+                              noise of 8 simulation steps for a noisy unit.
+                flat_integ = integration method used in flat networks for units
+                             that request 'odeint' or 'solve_ivp'. Either 'euler',
+                             one of the Runge-Kutta methods 'heun', 'ssprk3',
+                             and 'rk4' (see unit.flat_rk_update), or 'exp_leak'
+                             (see unit.flat_exp_leak_update), which is used for
+                             units with a leak_rate, while other units use
+                             'euler'. Defaults to 'euler'.
+                exact_linear = if True, flat networks integrate linear and
+                               noisy_linear units that only receive static
+                               synapses with the exact solution of their
+                               dynamics (see init_linear_props). Defaults to False.
+        Raises:
+            ValueError
         """
         self.sim_time = 0.0  # current simulation time [ms]
         self.n_units = 0     # current number of units in the network
@@ -68,6 +651,11 @@ class network():
         self.delays = [] # delays[i][j] is the delay of the j-th connection to unit i 
         self.act = []    # act[i][j] is the function from which unit i obtains its j-th input
         self.syns = []   # syns[i][j] is the synapse object for the j-th connection to unit i
+        # The next 2 lists index the projections sent by each unit
+        self.out_syns = [] # out_syns[i] has the (postID, syns_loc) pairs of the synapses 
+                           # sent by unit i, so syns[postID][syns_loc].preID == i
+        self.plant_out_syns = [] # plant_out_syns[i] has (plantID, port, index) triples,
+                                 # so plants[plantID].inp_syns[port][index].preID == i
         self.min_delay = params['min_delay'] # minimum transmission delay
         self.min_buff_size = int(params['min_buff_size'])  # number of values stored during
                                                            # a minimum delay period
@@ -75,7 +663,30 @@ class network():
         else: self.rtol = 1e-6 # relative tolerance of the integrator
         if 'atol' in params: self.atol = params['atol']
         else: self.atol = 1e-6 # absolute tolerance of the integrator
+        if 'pop_updates' in params: self.use_pop_updates = params['pop_updates']
+        else: self.use_pop_updates = True
+        if 'flat_integ' in params: self.flat_integ = params['flat_integ']
+        else: self.flat_integ = 'euler'
+        from units.units import RK_TABLEAUS # imported here to avoid an import cycle
+        if self.flat_integ not in ['euler', 'exp_leak'] and self.flat_integ not in RK_TABLEAUS:
+            raise ValueError('Unknown flat_integ integration method: ' + str(self.flat_integ))
+        if 'exact_linear' in params: self.exact_linear = params['exact_linear']
+        else: self.exact_linear = False
+        self.pop_updates = [] # population update objects used in flat_update
+        self.pop_inp_updates = [] # population updates of input sums in flat_update
+        self.pop_syn_updates = [] # population updates of synapses in flat_update
+        self.linear_props = [] # linear_propagator objects used in flat_update
+        self.integ_units = [] # units that integrate themselves in flat_update
+        self.syn_index_ready = False # whether the index from init_syn_index is current
+        # The seed sequence that roots all the noise streams
+        self.seed_seq = np.random.SeedSequence(params['seed'] if 'seed' in params else None)
+        self.seed = self.seed_seq.entropy
+        if 'noise_block' in params: self.noise_block = params['noise_block']
+        else: self.noise_block = 8 * self.min_buff_size
+        self.noise_streams = {} # noise_streams[key] is the stream with spawn key 'key'
         self.flat = False # This network has not been "flattened"
+        self.profiler = None # step_profiler used by run and flat_run (see start_profiling)
+        self.stream_stats = [] # statistics updated by run and flat_run (see add_stats)
         
 
     def create(self, n, params):
@@ -255,6 +866,9 @@ class network():
         except NotImplementedError:
             raise NotImplementedError('Attempting to create a unit with an unknown type')
 
+        # the units may look at their projections during construction
+        self.out_syns += [[] for i in range(n)]
+        self.plant_out_syns += [[] for i in range(n)]
         for ID in unit_list:
             for par in listed:
                 params_copy[par] = params[par][ID-self.n_units]
@@ -266,6 +880,7 @@ class network():
         self.act += [[] for i in range(n)]
         self.syns += [[] for i in range(n)]
         # note:  [[]]*n causes all empty lists to be the same object 
+        self.syn_index_ready = False # the synapse index needs the new units
         # running init_pre_syn_update for the new units
         for unit in [self.units[idx] for idx in unit_list]:
             unit.init_pre_syn_update()
@@ -341,101 +956,39 @@ class network():
         if self.flat:
             raise AssertionError("Adding connections to a flattened network")
 
-        # Retrieve the synapse class from its type object
-        syn_class = syn_spec['type'].get_class()
-
         # If 'allow_autapses' not in dictionary, set default value
         if not ('allow_autapses' in conn_spec): conn_spec['allow_autapses'] = True
         # If 'allow_multapses' not in dictionary, set default value
         if not ('allow_multapses' in conn_spec): conn_spec['allow_multapses'] = False
        
-        # The units connected depend on the connectivity rule in conn_spec
-        # We'll specify  connectivity by creating a list of 2-tuples with all the
-        # pairs of units to connect
-        connections = []  # the list with all the connection pairs as (source,target)
-
-        if conn_spec['allow_multapses']:
-            rep = True  # sampling will be done with replacement
-        else:
-            rep = False
+        # The units connected depend on the connectivity rule in conn_spec.
+        # Connection k goes from unit pre[k] to unit post[k].
+        pre, post = self.conn_pairs(from_list, to_list, conn_spec)
+        n_conns = len(pre)  # number of connections we'll make
 
-        if conn_spec['rule'] == 'fixed_outdegree':  #<----------------------
-            assert len(to_list) >= conn_spec['outdegree'] or rep, ['Outdegree larger ' +
-                                             'than number of targets']
-            for u in from_list:
-                if conn_spec['allow_autapses']:
-                    #targets = random.sample(to_list, conn_spec['outdegree'])
-                    targets = np.random.choice(to_list, size=conn_spec['outdegree'], 
-                                               replace=rep)
-                else:
-                    to_copy = to_list.copy()
-                    while u in to_copy:
-                        to_copy.remove(u)
-                    #targets = random.sample(to_copy, conn_spec['outdegree'])
-                    targets = np.random.choice(to_copy, size=conn_spec['outdegree'], 
-                                               replace=rep)
-                connections += [(u,y) for y in targets]
-        elif conn_spec['rule'] == 'fixed_indegree':   #<----------------------
-            assert len(from_list) >= conn_spec['indegree'] or rep, ['Indegree larger ' +
-                                                              'than number of sources']
-            for u in to_list:
-                if conn_spec['allow_autapses']:
-                    #sources = random.sample(from_list, conn_spec['indegree'])
-                    sources = np.random.choice(from_list, size=conn_spec['indegree'],
-                                               replace=rep)
-                else:
-                    from_copy = from_list.copy()
-                    while u in from_copy:
-                        from_copy.remove(u)
-                    #sources = random.sample(from_copy, conn_spec['indegree'])
-                    sources = np.random.choice(from_copy, size=conn_spec['indegree'],
-                                               replace=rep)
-                connections += [(x,u) for x in sources]
-        elif conn_spec['rule'] == 'all_to_all':    #<----------------------
-            targets = to_list
-            sources = from_list
-            if conn_spec['allow_autapses']:
-                connections = [(x,y) for x in sources for y in targets]
-            else:
-                connections = [(x,y) for x in sources for y in targets if x != y]
-        elif conn_spec['rule'] == 'one_to_one':   #<----------------------
-            if len(to_list) != len(from_list):
-                raise ValueError('one_to_one connectivity requires equal number ' +
-                                 'of sources and targets')
-            connections = list(zip(from_list, to_list))
-            if conn_spec['allow_autapses'] == False:
-                connections = [(x,y) for x,y in connections if x != y]
-        else:
-            raise ValueError('Attempting connect with an unknown rule')
-            
-        n_conns = len(connections)  # number of connections we'll make
-
-        # Initialize the weights. We'll create a list called 'weights' that
-        # has a weight for each entry in 'connections'
+        # Initialize the weights. We'll create an array called 'weights' that
+        # has a weight for each connection
         if type(syn_spec['init_w']) is dict: 
             w_dict = syn_spec['init_w']
             if w_dict['distribution'] == 'uniform':  #<----------------------
                 weights = np.random.uniform(w_dict['low'], w_dict['high'], n_conns)
             elif w_dict['distribution'] == 'equal_norm':  #<----------------------
-                # For each unit in 'to_list', get the indexes where it appears 
-                # in 'connections', create a vector with the given norm, and 
-                # distribute it with those indexes in the 'weights' vector
-                weights = np.zeros(len(connections)) # initializing 
-                for unit in to_list:  # For each unit in 'to_list'
-                    idx_list = []
-                    for idx,conn in enumerate(connections): # get indexes where unit appears
-                        if conn[1] == unit:
-                            idx_list.append(idx)
-                    if len(idx_list) > 0:  # create the vector, 
-                                           # set it in 'weights' using the indexes
-                        norm_vec = np.random.uniform(0.,1.,len(idx_list))
-                        norm_vec = (w_dict['norm'] / np.linalg.norm(norm_vec)) * norm_vec
-                        for id_u, id_w in enumerate(idx_list):
-                            weights[id_w] = norm_vec[id_u]
+                # For each unit in 'to_list', create a vector with the given norm,
+                # and place it in the entries of 'weights' for its connections.
+                # The connections of each target come from a stable sort.
+                weights = np.zeros(n_conns)
+                order = np.argsort(post, kind='stable')
+                sorted_post = post[order]
+                for unit in to_list:
+                    idx = order[np.searchsorted(sorted_post, unit, 'left'):
+                                np.searchsorted(sorted_post, unit, 'right')]
+                    if len(idx) > 0:
+                        norm_vec = np.random.uniform(0.,1.,len(idx))
+                        weights[idx] = (w_dict['norm'] / np.linalg.norm(norm_vec)) * norm_vec
             else:
                 raise NotImplementedError('Initializing weights with an unknown distribution')
         elif type(syn_spec['init_w']) in [float, int, np.float_, np.int_]:
-            weights = [float(syn_spec['init_w'])] * n_conns
+            weights = float(syn_spec['init_w'])
         elif type(syn_spec['init_w']) is list or type(syn_spec['init_w']) is np.ndarray:
             if len(syn_spec['init_w']) == n_conns:
                 weights = syn_spec['init_w']
@@ -444,8 +997,8 @@ class network():
         else:
             raise TypeError('The value given to the initial weights is of the wrong type')
 
-        # Initialize the delays. We'll create a list 'delayz' that
-        # has a delay value for each entry in 'connections'
+        # Initialize the delays. We'll create an array 'delayz' that
+        # has a delay value for each connection
         if type(conn_spec['delay']) is dict: 
             d_dict = conn_spec['delay']
             if d_dict['distribution'] == 'uniform':  #<----------------------
@@ -457,16 +1010,10 @@ class network():
             else:
                 raise NotImplementedError('Initializing delays with an unknown distribution')
         elif type(conn_spec['delay']) is float or type(conn_spec['delay']) is int:
-            if (conn_spec['delay']+1e-6)%self.min_delay < 2e-6:
-                delayz = [float(conn_spec['delay'])] * n_conns
-            else:
-                raise ValueError('Delays should be multiples of the network minimum delay')
+            delayz = float(conn_spec['delay'])
         elif type(conn_spec['delay']) is list:
             if len(conn_spec['delay']) == n_conns:
                 delayz = conn_spec['delay']
-                for dely in delayz:
-                    if (dely+1e-6)%self.min_delay > 2e-6:
-                        raise ValueError('Delays should be multiples of the network minimum delay')
             else:
                 raise ValueError('Received wrong number of delays to initialize connections')
         else:
@@ -475,46 +1022,166 @@ class network():
         # Initialize the input ports, if specified in the syn_spec dictionary
         if 'inp_ports' in syn_spec:
             if type(syn_spec['inp_ports']) is int:
-                portz = [syn_spec['inp_ports']]*n_conns
+                portz = syn_spec['inp_ports']
             elif type(syn_spec['inp_ports']) is list:
                 if len(syn_spec['inp_ports']) == n_conns:
                     portz = syn_spec['inp_ports']
                 else:
-                    print(syn_spec['inp_ports'])
-                    print(n_conns)
                     raise ValueError('Number of input ports specified does not ' +
                                      'match number of connections created')
             else:
                 raise TypeError('Input ports were specified with the wrong data type')
         else:
-            portz = [0]*n_conns
+            portz = 0
 
-        # To specify connectivity, you need to update 3 lists: delays, act, and syns
-        # Using 'connections', 'weights', 'delayz', and 'portz' this is straightforward
-        for idx, (source,target) in enumerate(connections):
-            # specify that 'target' neuron has the 'source' input
-            self.act[target].append(self.units[source].get_act)
-            # add a new synapse object for our connection
-            syn_params = syn_spec.copy() # a copy of syn_spec just for this connection
-            syn_params['preID'] = source
+        self.connect_arrays(pre, post, syn_spec, weights, delayz, portz)
+
+
+    def conn_pairs(self, from_list, to_list, conn_spec):
+        """ Obtain the connections specified by a connection rule.
+
+            The pairs of units to connect are generated with array operations.
+            For the 'fixed_outdegree' rule the connections are ordered by
+            source, following the order in from_list; for 'fixed_indegree' they
+            are ordered by target, following the order in to_list.
+
+            Args:
+                from_list, to_list, conn_spec: same as in network.connect. The
+                'allow_autapses' and 'allow_multapses' entries must be in conn_spec.
+            Returns:
+                pre, post: 1D integer arrays. Connection k goes from unit pre[k]
+                           to unit post[k].
+            Raises:
+                ValueError.
+        """
+        from_arr = np.array(from_list, dtype=int)
+        to_arr = np.array(to_list, dtype=int)
+        autapses = conn_spec['allow_autapses']
+        rep = conn_spec['allow_multapses'] # sampling with replacement
+
+        if conn_spec['rule'] == 'fixed_outdegree':  #<----------------------
+            assert len(to_list) >= conn_spec['outdegree'] or rep, ['Outdegree larger ' +
+                                             'than number of targets']
+            k = conn_spec['outdegree']
+            pre = np.repeat(from_arr, k)
+            post = to_arr[sample_rows(to_arr, from_arr, k, autapses, rep)].ravel()
+        elif conn_spec['rule'] == 'fixed_indegree':   #<----------------------
+            assert len(from_list) >= conn_spec['indegree'] or rep, ['Indegree larger ' +
+                                                              'than number of sources']
+            k = conn_spec['indegree']
+            pre = from_arr[sample_rows(from_arr, to_arr, k, autapses, rep)].ravel()
+            post = np.repeat(to_arr, k)
+        elif conn_spec['rule'] == 'all_to_all':    #<----------------------
+            pre = np.repeat(from_arr, len(to_arr))
+            post = np.tile(to_arr, len(from_arr))
+        elif conn_spec['rule'] == 'one_to_one':   #<----------------------
+            if len(to_list) != len(from_list):
+                raise ValueError('one_to_one connectivity requires equal number ' +
+                                 'of sources and targets')
+            pre = from_arr
+            post = to_arr
+        else:
+            raise ValueError('Attempting connect with an unknown rule')
+        if not autapses and conn_spec['rule'] in ['all_to_all', 'one_to_one']:
+            keep = pre != post
+            pre, post = pre[keep], post[keep]
+        return pre, post
+
+
+    def connect_arrays(self, pre, post, syn_spec, weights, delays, ports=0):
+        """ Create connections specified by arrays, one entry per connection.
+
+            This is the bulk version of network.connect. Connection k goes from
+            unit pre[k] to unit post[k], with weight weights[k], delay delays[k],
+            and input port ports[k]. The arrays are validated at once, and the
+            new synapses are appended to the network grouped by target unit. 
+            A single parameter dictionary is reused to create all the synapses.
+            In self.syns[post[k]] the new synapses keep the order they have in
+            the arrays.
+
+            Args:
+                pre: array-like with the IDs of the presynaptic units.
+                post: array-like with the IDs of the postsynaptic units.
+                syn_spec: a dictionary used to initialize the synapses. It must
+                          include the 'type' entry. The 'init_w' and 'inp_ports'
+                          entries, if present, are ignored.
+                weights: scalar, or array-like with one initial weight per connection.
+                delays: scalar, or array-like with one delay per connection.
+                        Delays should be multiples of the network minimum delay.
+                ports: scalar, or array-like with one input port per connection.
+            Raises:
+                ValueError, AssertionError.
+        """
+        if self.flat:
+            raise AssertionError("Adding connections to a flattened network")
+        pre = np.asarray(pre, dtype=int).ravel()
+        post = np.asarray(post, dtype=int).ravel()
+        n_conns = len(pre)
+        if len(post) != n_conns:
+            raise ValueError('pre and post arrays have different lengths')
+        if n_conns == 0:
+            return
+        if (max(pre.max(), post.max()) > self.n_units-1 or
+            min(pre.min(), post.min()) < 0):
+            raise ValueError('Attempting to connect units with an ID out of range')
+        # broadcasting scalars, checking the number of entries
+        arrays = []
+        for name, arr in [('weights', weights), ('delays', delays), ('ports', ports)]:
+            arr = np.asarray(arr)
+            if arr.ndim == 0:
+                arr = np.full(n_conns, arr)
+            elif arr.size != n_conns:
+                raise ValueError('Received wrong number of ' + name + 
+                                 ' to initialize connections')
+            arrays.append(arr.ravel())
+        weights = arrays[0].astype(float)
+        delays = arrays[1].astype(float)
+        ports = arrays[2].astype(int)
+        if np.any((delays+1e-6)%self.min_delay > 2e-6):
+            raise ValueError('Delays should be multiples of the network minimum delay')
+
+        syn_class = syn_spec['type'].get_class()
+        syn_params = syn_spec.copy() # a single copy modified for each connection
+        syn_params.pop('init_w', None)
+        syn_params.pop('inp_ports', None)
+        # Python scalars for the synapse attributes and the delays lists
+        pre_l, w_l, dely_l, port_l = (pre.tolist(), weights.tolist(), 
+                                      delays.tolist(), ports.tolist())
+        # To specify connectivity, you need to update 3 lists: delays, act, and syns.
+        # The connections are grouped by target with a stable sort.
+        order = np.argsort(post, kind='stable')
+        targets, starts = np.unique(post[order], return_index=True)
+        ends = np.append(starts[1:], n_conns)
+        for target, st, en in zip(targets.tolist(), starts, ends):
+            idxs = order[st:en].tolist()
+            syn_list = self.syns[target]
             syn_params['postID'] = target
-            syn_params['init_w'] = weights[idx]
-            syn_params['inp_port'] = portz[idx]
-            syn_params['syns_loc'] = len(self.syns[target]) # location in syns[postID]
-            self.syns[target].append(syn_class(syn_params, self))
-            # specify the delay of the connection
-            self.delays[target].append( delayz[idx] )
-            if self.units[source].delay <= delayz[idx]: # this is the longest delay for this source
-                self.units[source].delay = delayz[idx]+self.min_delay
-                # added self.min_delay because the ODE solver may ask for values out of range,
-                # depending on the order in which the units are updated (e.g. when a unit asks
-                # for activation values to a units that has already updated, those values will
-                # be 'min_delay' too old for the updated unit).
-                # After changing the delay we need to init_buffers again. Done below.
+            for idx in idxs:
+                syn_params['preID'] = pre_l[idx]
+                syn_params['init_w'] = w_l[idx]
+                syn_params['inp_port'] = port_l[idx]
+                syn_params['syns_loc'] = len(syn_list) # location in syns[postID]
+                # some constructors look at the synapses already in syn_list
+                syn_list.append(syn_class(syn_params, self))
+                self.out_syns[pre_l[idx]].append((target, syn_params['syns_loc']))
+            self.act[target].extend([self.units[pre_l[idx]].get_act for idx in idxs])
+            self.delays[target].extend([dely_l[idx] for idx in idxs])
+
+        # The longest delay of each source becomes its delay, plus min_delay
+        # because the ODE solver may ask for values out of range, depending on the
+        # order in which the units are updated (e.g. when a unit asks for 
+        # activation values to a units that has already updated, those values
+        # will be 'min_delay' too old for the updated unit).
+        sources = np.unique(pre)
+        max_dels = np.full(self.n_units, -np.inf)
+        np.maximum.at(max_dels, pre, delays)
+        for uid in sources.tolist():
+            if self.units[uid].delay <= max_dels[uid]:
+                self.units[uid].delay = max_dels[uid] + self.min_delay
 
         # After connecting, run init_pre_syn_update and init_buffers for all the units connected 
-        connected = [x for x,y in connections] + [y for x,y in connections]
-        for u in set(connected):
+        self.syn_index_ready = False # new synapses invalidate the synapse index
+        for u in np.union1d(sources, targets).tolist():
             self.units[u].init_pre_syn_update()
             self.units[u].init_buffers() # this should go second, so it uses the new syn_needs
 
@@ -597,7 +1264,15 @@ class network():
         inp_funcs = [self.units[uid].get_act for uid in unitIDs]
         ports = conn_spec['inp_ports'] 
         # Now just use this auxiliary function in the plant class
-        self.plants[plantID].append_inputs(inp_funcs, ports, delys, synaps)
+        plant = self.plants[plantID]
+        n_inps = [len(syn_list) for syn_list in plant.inp_syns] # inputs before appending
+        plant.append_inputs(inp_funcs, ports, delys, synaps)
+        # index the new projections in plant_out_syns
+        if type(ports) in [int, np.int_]:
+            ports = [ports] * len(synaps)
+        for syn, port in zip(synaps, ports):
+            self.plant_out_syns[syn.preID].append((plantID, port, n_inps[port]))
+            n_inps[port] += 1
 
         # You may need to update the delay of some sending units
         for dely, unit in zip(delys, [self.units[ID] for ID in unitIDs]):
@@ -760,6 +1435,7 @@ class network():
             syn_params['inp_port'] = port
             syn_params['plant_out'] = output
             syn_params['plant_id'] = plantID
+            syn_params['syns_loc'] = len(self.syns[target]) # location in syns[postID]
             self.syns[target].append(syn_class(syn_params, self))
 
             # specify the delay of the connection
@@ -775,12 +1451,40 @@ class network():
                 self.plants[plantID].init_buffers() # update plant buffers
                 
         # After connecting, run init_pre_syn_update and init_buffers for all the units connected 
+        self.syn_index_ready = False # new synapses invalidate the synapse index
         connected = [y for x,y,z in connections] 
         for u in set(connected):
             self.units[u].init_pre_syn_update()
             self.units[u].init_buffers() # this should go second, so it uses the new syn_needs
 
 
+    def get_noise_stream(self, key, size=None):
+        """ Return a noise_stream object for a unit or a synapse.
+
+            The generator of the stream is seeded with a SeedSequence that has
+            the network's seed as its entropy, and 'key' as its spawn key. Thus,
+            each unit or synapse receives the same noise whenever the network
+            has the same seed, regardless of the rest of the network.
+            The keys used by draculab are (0, ID) for units, and
+            (1, postID, syns_loc) for synapses.
+
+            Args:
+                key: a tuple of non-negative integers identifying the stream.
+                size: number of samples in each draw (see noise_stream).
+            Returns:
+                A noise_stream object, also stored in self.noise_streams[key].
+            Raises:
+                ValueError if a stream with the same key was already created.
+        """
+        key = tuple(key)
+        if key in self.noise_streams:
+            raise ValueError('The noise stream with key ' + str(key) +
+                             ' was already created')
+        seed_seq = np.random.SeedSequence(self.seed, spawn_key=key)
+        self.noise_streams[key] = noise_stream(seed_seq, size, self.noise_block)
+        return self.noise_streams[key]
+
+
     def flatten(self):
         """ Move the buffers into the network object. 
         
@@ -842,37 +1546,33 @@ class network():
                                    dtype=self.bf_type) # used to create values for 
                                                        # 'times' (optionally)
         # copy info about the unit buffers into the network object
-        self.has_buffer = [False] * self.n_units # does the unit have a buffer?
-        self.init_ts_idx = [0] * self.n_units # first index of ts to consider for each unit 
-        self.buff_len = [0] * self.n_units # length of buffer for each unit
-        self.first_idx = [0] * self.n_units # first_idx[i] indicates the row of the acts
+        units_with_buffer = [hasattr(u, 'buffer') for u in self.units]
+        has_buffer = np.array(units_with_buffer, dtype=bool)
+        dims = np.array([u.dim if hb else 1 for u, hb in zip(self.units, units_with_buffer)],
+                        dtype=int) # number of rows in acts for each unit
+        buff_len = np.array([u.buffer.shape[-1] if hb else 0 
+                             for u, hb in zip(self.units, units_with_buffer)], dtype=int)
+        # To get past values of source units we no longer call their get_act
+        # function, but instead we rely on the values stored in acts
+        src_len = np.array([int(round(u.delay/self.min_delay)) * self.min_buff_size
+                            for u in self.units], dtype=int)
+        first_idx = np.zeros(self.n_units, dtype=int)
+        first_idx[1:] = np.cumsum(dims)[:-1]
+        n_u_vars = int(dims.sum()) # number of rows in acts used by units
+        self.has_buffer = units_with_buffer # does the unit have a buffer?
+        self.buff_len = buff_len.tolist() # length of buffer for each unit
+        self.init_ts_idx = (self.ts_buff_size - np.where(has_buffer, buff_len, 
+                            src_len)).tolist() # first index of ts to consider for each unit 
+        self.first_idx = first_idx.tolist() # first_idx[i] indicates the row of the acts
                                             # array with the first state variable (by
                                             # convention the activity) for the i-th unit
-        n_u_vars = 0 # auxiliary variable to fill self.first_idx
-        for uid, u in enumerate(self.units):
-            if hasattr(u, 'buffer'):
-                self.has_buffer[uid] = True
-                self.buff_len[uid]  = u.buffer.shape[-1]
-                self.init_ts_idx[uid] = self.ts_buff_size - self.buff_len[uid]
-                self.first_idx[uid] = n_u_vars
-                n_u_vars += u.dim
-            else: # initialize init_ts_idx and first_idx for source units
-                # To get past values of source units we no longer call their get_act
-                # function, but instead we rely on the values stored in acts
-                self.init_ts_idx[uid] = self.ts_buff_size - (int(round(u.delay/self.min_delay))
-                                                          * self.min_buff_size)
-                self.first_idx[uid] = n_u_vars
-                n_u_vars += 1
-        # get a version of self.delays where time units are number of buffer intervals
-        self.step_dels = [ [ self.min_buff_size*int(round(d/self.min_delay)) for d in l]
-                                                                   for l in self.delays]
         # If there are plants, you'll need to store past values for all their state 
         # variables. Since the indexes of units and plants are independent, you need to
         # create an index for each state variable, in a way that won't collide with the
         # unit indexes. Plants are treated a bit differently from units due to the fact
         # that units only transmit their activity (first state variable).
         # p_st_var_idx[i][j] provides the index of the j-th state variable from the i-th 
-        # plant in the acts array, and in the inp_src list (defined below).
+        # plant in the acts array.
         # n_plant_vars counts the total number of state variables from all plants,
         # just as n_u_vars counted this for units.
         n_plant_vars = 0
@@ -884,46 +1584,69 @@ class network():
                 for var in range(plant.dim):
                     self.p_st_var_idx[pid].append(index)
                     index += 1
-        # For each unit obtain a vector with the index of input units or plants in acts
-        self.inp_src = [ [self.first_idx[syn.preID] for syn in l] for l in self.syns ]
-        # TODO: this may cause an index error when there are more plants than units
-        # The initialization of inp_src above will fail if there are plants. Modifying it.
-        if self.n_plants > 0:
-            for idx1, l in enumerate(self.syns):
-                for idx2, syn in enumerate(l):
-                    if hasattr(syn, 'plant_out'): # synapse comes from a plant
-                        self.inp_src[idx1][idx2] = self.p_st_var_idx[syn.plant_id][syn.plant_out]
+        # The inputs of all units are described by 3 arrays. The inputs of the unit
+        # with ID 'uid' have indexes inp_starts[uid]:inp_starts[uid+1], and come in 
+        # the same order as in self.syns[uid]. For the k-th input, inp_rows[k] is
+        # the row of its source in acts, and inp_cols[k] is the column in acts that
+        # holds the source's value for the first substep of the current timestep.
+        n_inps = [len(syn_list) for syn_list in self.syns]
+        self.inp_starts = np.zeros(self.n_units+1, dtype=int)
+        self.inp_starts[1:] = np.cumsum(n_inps)
+        all_syns = [syn for syn_list in self.syns for syn in syn_list]
+        from_plant = np.array([hasattr(syn, 'plant_out') for syn in all_syns], dtype=bool)
+        pre = np.array([syn.preID for syn in all_syns], dtype=int)
+        self.inp_rows = np.zeros(len(all_syns), dtype=int)
+        self.inp_rows[~from_plant] = first_idx[pre[~from_plant]]
+        for k in np.nonzero(from_plant)[0]: # synapses coming from plants
+            self.inp_rows[k] = self.p_st_var_idx[all_syns[k].plant_id][all_syns[k].plant_out]
+        # the delays in units of buffer intervals
+        step_dels = self.min_buff_size * np.rint(np.array([d for dl in self.delays 
+                    for d in dl], dtype=self.bf_type) / self.min_delay).astype(int)
+        self.inp_cols = self.ts_buff_size - step_dels - 1
+        # Index of each input's first value for this step in the flattened acts array
+        self.inp_base = self.inp_rows * self.ts_buff_size + self.inp_cols
         #======================================================================
         # Creating the acts array
         self.acts = np.zeros((n_u_vars+n_plant_vars, len(self.ts)), dtype=self.bf_type)
         #======================================================================
-        # acts_idx[u] is a complex index that allows unit u to extract from acts all
-        # the inputs it receives at each substep of the current timestep.
+        # acts_idx[u] is an index that allows unit u to extract all the inputs it 
+        # receives at each substep of the current timestep. It is a view of inp_base,
+        # with one entry per input. acts_win[acts_idx[u]] is the array with the
+        # inputs (see link_unit_buffers).
         self.acts_idx = [[] for _ in range(self.n_units)]
         for uid, u in enumerate(self.units):
             fix = self.first_idx[uid]
-            if hasattr(u, 'buffer'):
+            if self.has_buffer[uid]:
                 # initializing acts and acts_idx
                 self.acts[fix:fix+u.dim, self.init_ts_idx[uid]:] = \
-                          np.array([u.init_val] * self.buff_len[uid]).transpose() 
-                idx1 = [ [src]*self.min_buff_size for src in self.inp_src[uid] ]
-                idx2 = [list(range(self.ts_buff_size - self.step_dels[uid][inp] - 1, 
-                        self.ts_buff_size - self.step_dels[uid][inp] - 1 + self.min_buff_size))
-                        for inp in range(len(self.inp_src[uid]))]
-                self.acts_idx[uid] = (idx1, idx2)
+                          np.reshape(u.init_val, (u.dim, 1))
+                self.acts_idx[uid] = self.inp_base[self.inp_starts[uid]:self.inp_starts[uid+1]]
             else:  # for source units, also initialize their rows in acts
-                row = np.array([u.get_act(t) for t in self.ts[:]])
+                row = self.source_values(u, self.ts)
                 # sometimes the source units have not been initialized, 
                 # and return 'None' types. Thus this check:
-                if not any([v is None for v in row]):
-                    if not (np.isnan(row)).any():
-                        self.acts[fix,:] = row 
+                if row.dtype != object and not (np.isnan(row)).any():
+                    self.acts[fix,:] = row 
         # Reinitializing the unit buffers as views of act, and times as views of ts
         self.link_unit_buffers()
         # specify the integration function for all units
+        from units.units import RK_TABLEAUS # Runge-Kutta methods used by flat networks
         for uid, u in enumerate(self.units):
             if self.has_buffer[uid]:
-                if u.integ_meth in ["odeint", "solve_ivp", "euler"]:
+                flat_integ = getattr(self, 'flat_integ', 'euler')
+                if u.integ_meth in RK_TABLEAUS or (u.integ_meth in ["odeint",
+                   "solve_ivp"] and flat_integ in RK_TABLEAUS):
+                    # explicit Runge-Kutta methods
+                    u.rk_meth = u.integ_meth if u.integ_meth in RK_TABLEAUS else flat_integ
+                    u.flat_update = u.flat_rk_update
+                elif u.integ_meth == 'exp_leak' or (u.integ_meth in ["odeint",
+                     "solve_ivp"] and flat_integ == 'exp_leak' and u.leak_rate() is not None):
+                    # exponential Euler integration of the linear decay
+                    if u.leak_rate() is None:
+                        raise AssertionError('The exp_leak integration method requires ' +
+                            'a unit with a leak_rate, which ' + type(u).__name__ + ' lacks.')
+                    u.flat_update = u.flat_exp_leak_update
+                elif u.integ_meth in ["odeint", "solve_ivp", "euler"]:
                     if u.multidim:
                         u.flat_update = u.flat_euler_update_md
                     else:
@@ -958,15 +1681,15 @@ class network():
                 else:
                     raise NotImplementedError('The specified integration method is not \
                                                implemented for flat networks')
+        # group requirements and synapses that are updated for whole populations
+        self.upd_syns = [syn for syn_list in self.syns for syn in syn_list]
+        self.pop_syn_updates = []
+        if self.use_pop_updates:
+            self.init_pop_updates()
+        self.init_linear_props()
         # Reinitializing the buffers of plants as views of acts, times as views of ts
+        self.link_plant_buffers()
         for plant in self.plants:
-            svi = self.p_st_var_idx[plant.ID][0]
-            plant.buffer = np.ndarray(shape=(plant.dim, self.ts.size),
-                           buffer=self.acts[svi:svi+plant.dim, :],
-                           dtype=self.bf_type) 
-            plant.times = self.ts.view()
-            plant.buff_width = self.ts.size
-            plant.offset = plant.buff_width - self.min_buff_size
             # initialize buffer
             init_buff = np.transpose(np.array([plant.init_state]*plant.buff_width))
             np.copyto(plant.buffer, init_buff)
@@ -1003,6 +1726,36 @@ class network():
         #self.pool = ProcessingPool(nodes=10)
 
 
+    def source_values(self, u, times):
+        """ Evaluate the function of a source unit at several times.
+
+            The function is called once for each time, unless the unit declares it
+            as vectorized (see the 'vectorized' parameter of the source class), or
+            it is a numpy ufunc. Those functions are called with the 'times' array,
+            and if that fails, or does not return an array of the right shape, the
+            function is called once for each time.
+
+            Args:
+                u: a source unit.
+                times: a 1D numpy array with times.
+            Returns:
+                A 1D numpy array with the values of u.get_act at 'times'. Its
+                dtype is object if the function returned None for some time.
+        """
+        if getattr(u, 'vectorized', False) or isinstance(u.get_act, np.ufunc):
+            try:
+                row = u.get_act(times)
+                if (isinstance(row, np.ndarray) and row.shape == times.shape and
+                    row.dtype.kind in 'fiu'):
+                    return row
+            except Exception:
+                pass
+        row = [u.get_act(t) for t in times]
+        if any([v is None for v in row]):
+            return np.array(row, dtype=object)
+        return np.array(row, dtype=self.bf_type)
+
+
     def link_unit_buffers(self):
         """ Initializes the buffer, times, acts, and step_inps of all units.
         
@@ -1014,7 +1767,15 @@ class network():
             useful on its own sometimes. In particular, when the network is
             copied, sometimes the link between unit.acts and network.acts is
             lost.
+
+            The inputs of the units are read through 'acts_win', a strided view
+            of acts where acts_win[k] contains the min_buff_size values that 
+            start at position k of the flattened acts array.
         """
+        if not self.acts.flags['C_CONTIGUOUS']: # acts_win needs a flat view of acts
+            self.acts = np.ascontiguousarray(self.acts)
+        self.acts_win = np.lib.stride_tricks.sliding_window_view(self.acts.reshape(-1),
+                                                                  self.min_buff_size)
         for uid, u in enumerate(self.units):
             if self.has_buffer[uid]:
                 fix = self.first_idx[uid]
@@ -1050,11 +1811,12 @@ class network():
                 u.n_inps = len(idx[0])
                 """
                 u.acts = self.acts.view()
+                u.acts_win = self.acts_win
                 u.acts_idx = self.acts_idx[uid]
                 u.act_buff = self.acts[fix, self.init_ts_idx[uid]:]
                 # step_inps is a 2D numpy array. step_inps[j,k] provides the activity
                 # of the j-th input to unit i in the k-th substep of the current timestep.
-                u.step_inps = self.acts[self.acts_idx[uid]]
+                u.step_inps = self.acts_win[self.acts_idx[uid]]
                 """
                 # experimental bit to test with numba
                 #-----------------------------------------------------
@@ -1067,6 +1829,198 @@ class network():
                 #-----------------------------------------------------
                 """
 
+    def link_plant_buffers(self):
+        """ Initializes the buffer and times of all plants in a flat network.
+
+            As with link_unit_buffers, the buffer of each plant becomes a view of
+            the rows of acts that contain its state variables, and its times
+            become a view of the network's ts array.
+        """
+        for plant in self.plants:
+            svi = self.p_st_var_idx[plant.ID][0]
+            plant.buffer = np.ndarray(shape=(plant.dim, self.ts.size),
+                           buffer=self.acts[svi:svi+plant.dim, :],
+                           dtype=self.bf_type) 
+            plant.times = self.ts.view()
+            plant.buff_width = self.ts.size
+            plant.offset = plant.buff_width - self.min_buff_size
+
+    def init_pop_updates(self):
+        """ Create the population update objects used by flat_update.
+
+            A unit class may have a 'pop_reqs' dictionary whose keys are requirements
+            (from the syn_reqs Enum), and whose values are classes that can update that
+            requirement for a list of units at once, using array operations. 
+            The constructor of those classes receives the list of units and the
+            requirement, and they have an update(time) method.
+
+            This method groups the units with buffers that have the same requirement 
+            and population class, creates the population objects, and removes the
+            corresponding upd_<req> method from the 'functions' list of the units.
+            The population updates are called in flat_update after the pre_syn_update
+            of all units, which is consistent with requirements of priority 3.
+
+            The 'pop_reqs' dictionaries of all the parent classes are combined, so
+            a subclass only needs to include the entries it adds or overrides. A
+            requirement mapped to None does not use population updates.
+
+            Similarly, a unit class may have a 'pop_inp_sum' attribute with a class
+            whose constructor receives a list of units, and whose update(time) method
+            is called in flat_update after the input sums of all units are updated.
+            This is used to process the input sums of whole populations before the
+            units integrate their dynamics (e.g. the branches of double sigma units).
+
+            Finally, a synapse class may have a 'pop_update' attribute with a class
+            whose constructor receives a list of synapses of the same type, and whose
+            update(time) method updates all their weights. Those synapses are removed
+            from the 'upd_syns' list that flat_update uses to update synapses one by
+            one, and their population objects are placed in 'pop_syn_updates'.
+        """
+        groups = {} # groups[(req, pop_class)] = list of units
+        inp_groups = {} # inp_groups[pop_class] = list of units
+        for uid, u in enumerate(self.units):
+            if not self.has_buffer[uid]:
+                continue
+            if getattr(u, 'pop_inp_sum', None) is not None:
+                inp_groups.setdefault(u.pop_inp_sum, []).append(u)
+            pop_reqs = {}
+            for cls in reversed(type(u).__mro__):
+                pop_reqs.update(cls.__dict__.get('pop_reqs', {}))
+            for req, pop_class in pop_reqs.items():
+                if req in u.syn_needs and pop_class is not None:
+                    if req.get_priority() < 3:
+                        raise AssertionError('Population updates are only available ' +
+                                             'for requirements of priority 3')
+                    groups.setdefault((req, pop_class), []).append(u)
+        self.pop_updates = []
+        for (req, pop_class), unit_list in groups.items():
+            for u in unit_list:
+                upd = getattr(u, 'upd_'+req.name)
+                if upd in u.functions: # it may be absent in a restored network
+                    u.functions.remove(upd)
+            self.pop_updates.append(pop_class(unit_list, req))
+        self.pop_inp_updates = [pop_class(unit_list) 
+                                for pop_class, unit_list in inp_groups.items()]
+        syn_groups = {} # syn_groups[(pop_class, syn_type)] = list of synapses
+        self.upd_syns = []
+        for syn_list in self.syns:
+            for syn in syn_list:
+                if syn.pop_update is None:
+                    self.upd_syns.append(syn)
+                else:
+                    syn_groups.setdefault((syn.pop_update, syn.type), []).append(syn)
+        self.pop_syn_updates = [pop_class(syn_list) 
+                                for (pop_class, _), syn_list in syn_groups.items()]
+
+
+    def init_linear_props(self):
+        """ Create the linear_propagator used by flat_update, and the integ_units list.
+
+            When the exact_linear network parameter is True, the units of the linear
+            and noisy_linear classes (not their subclasses) are integrated by a
+            linear_propagator if they:
+                * receive only static synapses,
+                * use one of the default integration methods ('odeint', 'solve_ivp',
+                  'euler', 'euler_maru', or 'exp_euler'),
+                * don't have their own dt_fun (e.g. set on the instance).
+            Units that use 'euler_maru' or 'exp_euler' receive noise with their
+            mu and sigma parameters; the flat Euler method ignores them, so for
+            the other integration methods the propagator does too.
+
+            The remaining units with buffers are placed in the 'integ_units' list,
+            whose units call upd_flat_inp_sum and flat_update in each step.
+        """
+        lin_classes = [unit_types.linear.get_class(), unit_types.noisy_linear.get_class()]
+        static = synapse_types.static
+        prop_units = []
+        self.integ_units = []
+        for uid, u in enumerate(self.units):
+            if not self.has_buffer[uid]:
+                continue
+            if (getattr(self, 'exact_linear', False) and type(u) in lin_classes and
+                u.integ_meth in ['odeint', 'solve_ivp', 'euler', 'euler_maru', 'exp_euler']
+                and 'dt_fun' not in u.__dict__ and
+                all([syn.type == static for syn in self.syns[uid]])):
+                prop_units.append(u)
+            else:
+                self.integ_units.append(u)
+        self.linear_props = [linear_propagator(self, prop_units)] if len(prop_units) > 0 else []
+
+
+    def init_syn_index(self):
+        """ Create the index arrays used for segmented reductions over synapses.
+
+            All the synapses in self.syns are placed in the 'all_syns' list, ordered
+            by postsynaptic unit first, and by their position in self.syns[postID] 
+            second. Thus, the synapses received by the unit with ID 'uid' are
+            all_syns[in_starts[uid]:in_starts[uid+1]]. The arrays 'syn_post' and
+            'syn_pos' contain the postsynaptic unit and the position in its list of
+            synapses, so that all_syns[k] is self.syns[syn_post[k]][syn_pos[k]].
+
+            The synapses sent by the unit with ID 'uid' have indexes 
+            out_order[out_starts[uid]:out_starts[uid+1]] in all_syns. These arrays
+            are the flat form of self.out_syns, with the same order. Synapses 
+            coming from plants are not included in this outgoing index.
+
+            With these arrays, sums over the incoming or outgoing synapses of all
+            units can be obtained at once with segment_sum. The index is created
+            again after new units or synapses are added to the network.
+        """
+        self.all_syns = [syn for syn_list in self.syns for syn in syn_list]
+        n_syns = len(self.all_syns)
+        in_degs = [len(syn_list) for syn_list in self.syns]
+        self.in_starts = np.zeros(len(self.syns)+1, dtype=int)
+        self.in_starts[1:] = np.cumsum(in_degs)
+        self.syn_post = np.repeat(np.arange(len(self.syns), dtype=int), in_degs)
+        self.syn_pos = np.arange(n_syns, dtype=int) - self.in_starts[self.syn_post]
+        # the outgoing index comes from out_syns, sorted as all_syns in each segment
+        out_degs = [len(pairs) for pairs in self.out_syns]
+        self.out_starts = np.zeros(len(self.syns)+1, dtype=int)
+        self.out_starts[1:] = np.cumsum(out_degs)
+        pairs = np.array([pair for pairs in self.out_syns for pair in pairs], 
+                         dtype=int).reshape(-1, 2)
+        out_order = self.in_starts[pairs[:,0]] + pairs[:,1]
+        owner = np.repeat(np.arange(len(self.syns), dtype=int), out_degs)
+        self.out_order = out_order[np.lexsort((out_order, owner))]
+        self.syn_w = np.zeros(n_syns) # used by get_syn_weights
+        self.syn_w_time = None # time when syn_w was last filled
+        self.syn_index_ready = True
+
+
+    def get_syn_weights(self, time):
+        """ Returns a numpy array with the weights of all synapses in all_syns.
+
+            The array is filled once for each value of 'time', so all population
+            updates at the same simulation step share it. It should not be modified.
+        """
+        if not self.syn_index_ready:
+            self.init_syn_index()
+        if time != self.syn_w_time:
+            self.syn_w[:] = [syn.w for syn in self.all_syns]
+            self.syn_w_time = time
+        return self.syn_w
+
+
+    def segment_sum(self, values, starts):
+        """ Sums of contiguous segments of a 1D array.
+
+            Args:
+                values: a 1D numpy array.
+                starts: a 1D array of non-decreasing integers. Segment 'i' consists of
+                        values[starts[i]:starts[i+1]], so the number of segments is
+                        len(starts)-1. Empty segments are allowed.
+            Returns:
+                A 1D numpy array with the sum of each segment.
+        """
+        if len(starts) < 2:
+            return np.zeros(0)
+        starts = np.asarray(starts)
+        # a zero is appended so a segment may start at len(values)
+        sums = np.add.reduceat(np.append(values, 0.), starts[:-1])
+        sums[starts[:-1] == starts[1:]] = 0. # reduceat does not return 0 for empty segments
+        return sums
+
+
     def get_act(self, uid, t):
         """ Get the activity of unit with ID 'uid' at time 't'.
 
@@ -1078,6 +2032,29 @@ class network():
                                self.acts[self.first_idx[uid]][self.init_ts_idx[uid]:])
 
 
+    def get_acts(self, t):
+        """ Get the activities of all units at time 't' in a flat network.
+
+            This is a vectorized version of network.get_act, which reproduces
+            its single precision arithmetic, so the returned values are equal to
+            [self.get_act(uid, t) for uid in range(self.n_units)].
+
+            Returns:
+                A 1-D numpy array with the activity of each unit.
+        """
+        f32 = np.float32
+        init = np.asarray(self.init_ts_idx[:self.n_units])
+        rows = np.asarray(self.first_idx[:self.n_units])
+        t_bit = f32(self.ts_bit)
+        t = f32(t) - self.ts[init].astype(f32)
+        base = np.floor_divide(t, t_bit).astype(int)
+        rem = np.remainder(t, t_bit)
+        base = np.maximum(0, np.minimum(base, self.ts_buff_size - init - 2))
+        frac2 = (rem / t_bit).astype(f32)
+        act0 = self.acts[rows, init + base]
+        return act0 + frac2 * (self.acts[rows, init + base + 1] - act0)
+
+
     def get_act_by_step(self, uid, s):
         """ Get the activity of unit with ID 'uid' as it was 's' buffer time steps before.
 
@@ -1091,19 +2068,32 @@ class network():
 
 
     def flat_update(self, time):
-        """ Updates all state variables by advancing them one min_delay time step. """
+        """ Updates all state variables by advancing them one min_delay time step.
+
+            When the network is being profiled (see start_profiling) the time of
+            each part of the step is added to self.profiler. Otherwise the timing
+            hooks come from NULL_TIMER, and do nothing.
+        """
+        prof = getattr(self, 'profiler', None)
+        timer = NULL_TIMER if prof is None else prof
+        clock, timed, phase = timer.clock, timer.timed, timer.phase
+        t_phase = clock()
         # update the times array
         self.ts += self.min_delay 
         #self.ts = np.roll(self.ts, -self.min_buff_size)
         #self.ts[self.ts_buff_size-self.min_buff_size:] = self.ts_grid[1:]+time
         #----------------------------------------------------------------------
         # update input sums
-        for uid, u in enumerate(self.units):
-            if self.has_buffer[uid]:
-                if u.multiport and u.needs_mp_inp_sum:
-                    u.upd_flat_mp_inp_sum(time)
-                else:
-                    u.upd_flat_inp_sum(time)
+        for u in timed('inp_sum', self.integ_units):
+            if u.multiport and u.needs_mp_inp_sum:
+                u.upd_flat_mp_inp_sum(time)
+            else:
+                u.upd_flat_inp_sum(time)
+        for pop in timed('pop', self.pop_inp_updates):
+            pop.update(time)
+        for prop in timed('pop_inputs', self.linear_props):
+            prop.update_inputs(time)
+        t_phase = phase('inp_sums', t_phase)
         """
         # parallel update of input sums
         self.units = self.pool.map(lambda u: upd_unit(u, time), self.units)
@@ -1117,58 +2107,409 @@ class network():
         # roll the full acts array
         base = self.ts.size - self.min_buff_size
         self.acts[:,:base] = self.acts[:,self.min_buff_size:]
+        t_phase = phase('roll', t_phase)
         # update buffers
-        for uid, u in enumerate(self.units):
-            if self.has_buffer[uid]:
-                u.flat_update(time)
-        for p in self.plants:
+        for u in timed('unit', self.integ_units):
+            u.flat_update(time)
+        for prop in timed('pop', self.linear_props):
+            prop.update(time)
+        t_phase = phase('units', t_phase)
+        for p in timed('plant', self.plants):
             p.flat_update(time)
+        t_phase = phase('plants', t_phase)
         # update activities of source units and handle requirements
+        t_src = 0. # time spent in source units
         for uid, u in enumerate(self.units):
             if not self.has_buffer[uid]:
+                t0 = clock()
                 self.acts[self.first_idx[uid],base:] = [u.get_act(t) for t in self.ts[base:]]
-            # handle requirements
-            u.pre_syn_update(time)
+                t_src += timer.lap('source', u, t0)
+            # handle requirements (as in unit.pre_syn_update)
+            for f in timed('requirement', u.functions):
+                f(time)
             u.last_time = time # important to have it after pre_syn_update
+        for pop in timed('pop', self.pop_updates):
+            pop.update(time)
+        t = clock()
+        timer.add(('phase', 'sources'), t_src)
+        timer.add(('phase', 'requirements'), t - t_phase - t_src)
         # update synapses
-        for synli in self.syns:
-            for syn in synli:
-                syn.update(time)
+        for syn in timed('synapse', self.upd_syns):
+            syn.update(time)
+        for pop in timed('pop', self.pop_syn_updates):
+            pop.update(time)
+        phase('synapses', t)
+        if prof is not None:
+            prof.steps += 1
+
+
+    def add_stats(self, stat):
+        """ Adds a statistic that run and flat_run will update at each step.
+
+            Args:
+                stat: an object from tools.stream_stats (e.g. running_moments,
+                      histogram, correlation, windowed_mean, spectrum), or any
+                      object with the methods attach(net), and update(acts, time).
+                      'acts' is a numpy array with the activities of all units at
+                      the beginning of the step, and 'time' is the step's time.
+            Returns:
+                The 'stat' argument.
+        """
+        stat.attach(self)
+        if not hasattr(self, 'stream_stats'):
+            self.stream_stats = []
+        self.stream_stats.append(stat)
+        return stat
+
+
+    def remove_stats(self, stat=None):
+        """ Stops updating a statistic, or all of them if 'stat' is None. """
+        if stat is None:
+            self.stream_stats = []
+        else:
+            self.stream_stats.remove(stat)
+
+
+    def start_profiling(self):
+        """ Starts measuring the time spent in each part of the simulation steps.
+
+            After this method is called, run and flat_run accumulate their
+            timings in self.profiler, a step_profiler object. The results of the
+            simulation are the same as without profiling, but the simulation is
+            slower because of the time measurements.
+
+            When the network is flat the times are measured for each phase of
+            flat_update, for each unit class, requirement, population update
+            class, synapse type, and plant class. For non-flat networks the time
+            of unit.update (which includes the requirements and synapses of the
+            unit) is measured for each unit class.
+
+            Returns:
+                The step_profiler object. Calling start_profiling when the
+                network is being profiled resets the accumulated values.
+        """
+        if getattr(self, 'profiler', None) is None:
+            self.profiler = step_profiler()
+        else:
+            self.profiler.reset()
+        return self.profiler
+
+    def stop_profiling(self):
+        """ Stops profiling the simulation steps.
+
+            Returns:
+                The step_profiler object with the accumulated values, or None if
+                the network was not being profiled.
+        """
+        prof = getattr(self, 'profiler', None)
+        self.profiler = None
+        return prof
 
+    def profiled_step(self, time):
+        """ Updates the units and plants of a non-flat network, using self.profiler.
 
-    def flat_run(self, total_time):
+            Used by network.run when the network is being profiled. The time
+            of unit.update includes the requirements and synapses of the unit.
+        """
+        prof = self.profiler
+        clock = perf_counter
+        t_phase = clock()
+        for unit in self.units:
+            t0 = clock()
+            unit.update(time)
+            prof.add(('unit', type(unit).__name__), clock() - t0)
+        t = clock()
+        prof.add(('phase', 'units'), t - t_phase)
+        for plant in self.plants:
+            t0 = clock()
+            plant.update(time)
+            prof.add(('plant', type(plant).__name__), clock() - t0)
+        prof.add(('phase', 'plants'), clock() - t)
+        prof.steps += 1
+
+    def performance_report(self, steps=20, text=False):
+        """ Describes how each part of a flat network is simulated, and its cost.
+
+            Each entry of the report corresponds to a group of objects that
+            flat_update handles in the same way: the units of a class (their
+            integration, and their input sums), the source units of a class, a
+            requirement, a population update object, a synapse type, or a plant
+            class. The execution path of each group is one of:
+                'vectorized' : a population update object updates all the group
+                               with array operations.
+                'compiled' : each object calls compiled code (e.g. cython_utils).
+                'fallback' : each object is updated by Python code.
+            The 'reason' entry explains the path, e.g. why no population update
+            was used.
+
+            The cost shares are measured by simulating 'steps' steps with a
+            step_profiler. The state of the network is restored afterwards, so
+            the report doesn't change the simulation.
+
+            Args:
+                steps: number of simulation steps used to measure the costs. If
+                       0, the 'time' and 'share' entries are None.
+                text: if True, a string with a table is returned instead.
+            Returns:
+                A dictionary with the entries:
+                'steps' : number of measured steps.
+                'step_time' : average wall time of a step, in seconds.
+                'entries' : a list of dictionaries, sorted by decreasing cost, with
+                            the entries 'kind' ('unit', 'inp_sum', 'source',
+                            'requirement', 'synapse', or 'plant'), 'name', 'count'
+                            (number of units, synapses, or plants in the group),
+                            'path', 'reason', 'time' (average seconds per step),
+                            and 'share' (fraction of the step time).
+            Raises:
+                AssertionError if the network is not flat.
+        """
+        assert self.flat, 'performance_report requires a flat network'
+        pops_off = ' Population updates are disabled (pop_updates=False).' \
+                   if not self.use_pop_updates else ''
+        entries = [] # each entry: [kind, name, count, path, reason, profiler keys]
+        # units and their input sums
+        integ = {'flat_euler_update' : 'forward Euler', 'flat_euler_update_md' :
+                 'forward Euler', 'flat_euler_maru_update' : 'Euler-Maruyama',
+                 'flat_euler_maru_update_md' : 'Euler-Maruyama',
+                 'flat_exp_euler_update' : 'exponential Euler',
+                 'flat_rk_update' : 'an explicit Runge-Kutta method',
+                 'flat_exp_leak_update' : 'exponential Euler for its leak'}
+        pop_inp = {type(pop) : pop for pop in self.pop_inp_updates}
+        groups = {} # groups[(kind, class)] = list of objects
+        propagated = set([id(u) for prop in self.linear_props for u in prop.units])
+        for uid, u in enumerate(self.units):
+            if id(u) in propagated:
+                continue
+            kind = 'unit' if self.has_buffer[uid] else 'source'
+            groups.setdefault((kind, type(u)), []).append(u)
+        for prop in self.linear_props:
+            name = pop_label(prop)
+            classes = ', '.join(sorted(set([type(u).__name__ for u in prop.units])))
+            entries.append(['unit', name, len(prop.units), 'vectorized', 'Units of ' +
+                            classes + ' integrated with the exact solution of their ' +
+                            'linear dynamics.', [('pop', name)]])
+            entries.append(['inp_sum', name, len(prop.units), 'vectorized', 'Obtained ' +
+                            'with one ' + ('dense' if prop.dense else 'sparse') + ' matrix ' +
+                            'product for all units.', [('pop', name + ' inputs')]])
+        for (kind, cls), units in groups.items():
+            name = cls.__name__
+            if kind == 'source':
+                entries.append(['source', name, len(units), 'fallback', 'The Python ' +
+                    'function of each source is called at every substep.', [('source', name)]])
+                continue
+            upd = units[0].flat_update
+            meth = getattr(upd, '__name__', '')
+            path = 'compiled' if is_compiled(upd) else 'fallback'
+            reason = ('Each unit integrates its dynamics with ' + 
+                      (integ[meth] + ', calling dt_fun at every substep.' if meth in integ
+                       else 'its own ' + meth + ' method.'))
+            entries.append(['unit', name, len(units), path, reason, [('unit', name)]])
+            mp = units[0].multiport and units[0].needs_mp_inp_sum
+            reason = ('Each unit obtains its ' + ('input sum per port' if mp else 'input sum') +
+                      ' with numpy operations on a view of the activities array.')
+            pop = getattr(units[0], 'pop_inp_sum', None)
+            if pop is not None and pop in pop_inp:
+                reason += (' Afterwards ' + pop.__name__ + ' processes the input sums of ' +
+                           'the whole population.')
+            elif pop is not None:
+                reason += pops_off
+            keys = [('inp_sum', name)] + ([('pop', pop_label(pop_inp[pop]))]
+                                          if pop in pop_inp else [])
+            entries.append(['inp_sum', name, len(units), 'fallback', reason, keys])
+        # requirements
+        reqs = {} # reqs[name] = [number of units, set of unit classes, compiled?]
+        for uid, u in enumerate(self.units):
+            for f in u.functions:
+                name = getattr(f, '__name__', type(f).__name__)
+                name = name[4:] if name[:4] == 'upd_' else name
+                entry = reqs.setdefault(name, [0, set(), True])
+                entry[0] += 1
+                entry[1].add(type(u))
+                entry[2] = entry[2] and is_compiled(f)
+        for name, (count, classes, compiled) in reqs.items():
+            pop_able = [cls.__name__ for cls in classes if any([
+                        getattr(r, 'name', None) == name and p is not None
+                        for c in cls.__mro__ for r, p in c.__dict__.get('pop_reqs', {}).items()])]
+            if len(pop_able) > 0:
+                reason = 'Updated unit by unit.' + (pops_off if pops_off else
+                         ' Units of ' + ', '.join(sorted(pop_able)) + ' have no buffer.')
+            elif name in [r.name for r in syn_reqs] and syn_reqs[name].get_priority() < 3:
+                reason = ('No population update for this requirement. Its priority is ' +
+                          str(syn_reqs[name].get_priority()) + ', so it must be updated ' +
+                          'before other requirements of each unit.')
+            else:
+                reason = 'No population update for this requirement in ' + \
+                         ', '.join(sorted([cls.__name__ for cls in classes])) + '.'
+            entries.append(['requirement', name, count, 'compiled' if compiled else 
+                            'fallback', reason, [('requirement', name)]])
+        for pop in self.pop_updates:
+            entries.append(['requirement', pop.req.name, len(pop.units), 'vectorized',
+                            'Updated for all units by ' + type(pop).__name__ + '.',
+                            [('pop', pop_label(pop))]])
+        # synapses
+        syn_groups = {}
+        for syn in self.upd_syns:
+            syn_groups.setdefault(syn.type, []).append(syn)
+        for stype, syns in syn_groups.items():
+            cls = type(syns[0])
+            if cls.update is synapse_types.static.get_class().update:
+                reason = 'The update method does nothing, but it is called for each synapse.'
+            elif getattr(cls, 'pop_update', None) is not None:
+                reason = 'Updated synapse by synapse.' + pops_off
+            else:
+                reason = 'No population update for ' + cls.__name__ + '.'
+            entries.append(['synapse', stype.name, len(syns), 'compiled' if
+                            is_compiled(syns[0].update) else 'fallback', reason,
+                            [('synapse', stype.name)]])
+        for pop in self.pop_syn_updates:
+            stype = pop.syns[0].type.name if len(getattr(pop, 'syns', [])) > 0 \
+                    else type(pop).__name__
+            entries.append(['synapse', stype, len(getattr(pop, 'syns', [])),
+                            'vectorized', 'Updated for all synapses by ' +
+                            type(pop).__name__ + '.', [('pop', pop_label(pop))]])
+        # plants
+        plant_groups = {}
+        for p in self.plants:
+            plant_groups.setdefault(type(p), []).append(p)
+        for cls, plants in plant_groups.items():
+            entries.append(['plant', cls.__name__, len(plants), 'fallback', 'Each plant ' +
+                            'is integrated with solve_ivp, obtaining its inputs through ' +
+                            'get_input_sum.', [('plant', cls.__name__)]])
+        # measuring the costs
+        stats, step_time = {}, None
+        if steps > 0:
+            saved_prof = getattr(self, 'profiler', None)
+            snap = self.snapshot()
+            self.profiler = step_profiler()
+            try:
+                for _ in range(steps):
+                    self.flat_update(self.sim_time)
+                    self.sim_time += self.min_delay
+                stats = self.profiler.stats
+            finally:
+                self.profiler = saved_prof
+                self.restore(snap, global_rng=True)
+            step_time = sum([v[0] for (kind, _), v in stats.items() if kind == 'phase']) / steps
+        rep = []
+        for kind, name, count, path, reason, keys in entries:
+            t = sum([stats[k][0] for k in keys if k in stats]) / steps if steps > 0 else None
+            rep.append({'kind' : kind, 'name' : name, 'count' : count, 'path' : path,
+                        'reason' : reason, 'time' : t, 'share' : t / step_time
+                        if steps > 0 and step_time > 0. else None})
+        if steps > 0:
+            rep.sort(key=lambda e: -e['time'])
+        report = {'steps' : steps, 'step_time' : step_time, 'entries' : rep}
+        if not text:
+            return report
+        lines = ['%-12s %-30s %7s %-10s %7s  %s' % ('kind', 'name', 'count', 'path',
+                 'share', 'reason')]
+        for e in rep:
+            lines.append('%-12s %-30s %7d %-10s %7s  %s' % (e['kind'], e['name'][:30],
+                         e['count'], e['path'], '-' if e['share'] is None else
+                         '%6.1f%%' % (100. * e['share']), e['reason']))
+        if steps > 0:
+            lines.append('%.3g seconds per step, measured over %d steps' % (step_time, steps))
+        return '\n'.join(lines)
+
+    def flat_run(self, total_time, callback=None, every=100, store=True, progress=None):
         """ Simulate a flattened network for the given time. 
         
             Flat networks keep a single numpy array in the netwok object with 
             the contents of all buffers. However, all units have buffers which are views of
             a slice of that array. 
+
+            Args:
+                total_time: time that the simulation will last.
+                callback: an optional function callback(progress), called every
+                          'every' steps and after the last step, where 'progress'
+                          is a run_progress object. If the callback returns a
+                          true value the simulation stops, and the stored values
+                          are truncated at the current step.
+                every: number of steps between calls to the callback.
+                store: if False, the activities of units and plants are not
+                       stored, and empty lists are returned instead. This is
+                       used with statistics that are updated during the run
+                       (see network.add_stats).
+                progress: a run_progress object passed to the callback instead
+                          of a new one. Its step count, estimated time, and data
+                          continue from previous calls (see run_progress).
+            Returns:
+                The same 3-tuple (times, unit_store, plant_store) as network.run.
         """
         if not self.flat:
             self.flatten()
         Nsteps = int(total_time/self.min_delay)  # total number of simulation steps
-        unit_store = [np.zeros(Nsteps) for i in range(self.n_units)] # arrays to store unit activities
-        plant_store = [np.zeros((Nsteps,p.dim)) for p in self.plants] # arrays to store plant steps
+        if store:
+            unit_store = [np.zeros(Nsteps) for i in range(self.n_units)] # arrays to store unit activities
+            plant_store = [np.zeros((Nsteps,p.dim)) for p in self.plants] # arrays to store plant steps
+        else:
+            unit_store, plant_store = [], []
         times = np.zeros(Nsteps) + self.sim_time # array to store initial time of simulation steps
+        prof = getattr(self, 'profiler', None)
+        if callback is None:
+            progress = None
+        elif progress is None:
+            progress = run_progress(self, Nsteps)
+        first = 0 if progress is None else progress.step # steps in previous calls
+        stats = getattr(self, 'stream_stats', [])
 
         for step in range(Nsteps):
             times[step] = self.sim_time # self.sim_time persists between calls to network.run()
+            if prof is not None: t0 = perf_counter()
             
-            # store current unit activities
-            for uid, unit in enumerate(self.units):
-                unit_store[uid][step] = self.get_act(uid, self.sim_time)
-                #unit_store[uid][step] = self.get_act_by_step(uid, 0)
-           
-            # store current plant state variables 
-            for pid, plant in enumerate(self.plants):
-                plant_store[pid][step,:] = plant.get_state(self.sim_time)
+            if store:
+                # store current unit activities
+                for uid, unit in enumerate(self.units):
+                    unit_store[uid][step] = self.get_act(uid, self.sim_time)
+                    #unit_store[uid][step] = self.get_act_by_step(uid, 0)
+               
+                # store current plant state variables 
+                for pid, plant in enumerate(self.plants):
+                    plant_store[pid][step,:] = plant.get_state(self.sim_time)
+            if prof is not None: prof.add(('phase', 'store'), perf_counter() - t0)
+
+            if len(stats) > 0: # update the streaming statistics
+                if prof is not None: t0 = perf_counter()
+                cur_acts = self.get_acts(self.sim_time)
+                for stat in stats:
+                    stat.update(cur_acts, self.sim_time)
+                if prof is not None: prof.add(('phase', 'stats'), perf_counter() - t0)
             
             # update units and plants
             self.flat_update(self.sim_time)
             self.sim_time += self.min_delay
 
+            if progress is not None and ((first+step+1) % every == 0 or step+1 == Nsteps):
+                if self.report_progress(progress, first+step+1, callback):
+                    return self.truncate_run(step+1, times, unit_store, plant_store)
+
         return times, unit_store, plant_store
 
 
+    def report_progress(self, progress, step, callback):
+        """ Calls a run callback, and tells whether the run should stop.
+
+            Args:
+                progress: the run_progress object of the simulation.
+                step: number of steps simulated so far.
+                callback: a function callback(progress).
+            Returns:
+                True if the callback returned a true value.
+        """
+        progress.advance(step)
+        reason = callback(progress)
+        if reason:
+            progress.stopped = True
+            progress.reason = reason
+            return True
+        return False
+
+
+    def truncate_run(self, n, times, unit_store, plant_store):
+        """ Returns the values stored by run or flat_run in the first n steps. """
+        return times[:n], [a[:n] for a in unit_store], [a[:n] for a in plant_store]
+
+
     def save_state(self):
         """ Create a dictionary with the network's state.
 
@@ -1201,6 +2542,9 @@ class network():
                     ts: copy of network.ts if network flat.
                     lpf: buffers used for low-pass filtered activity.
                     sim_time: a copy of network.sim_time
+
+            network.dynamic_state returns a dictionary with all the values that
+            change during simulations, including all requirement variables.
         """
         state = {}
         state['units'] = [u.type for u in self.units]
@@ -1265,8 +2609,8 @@ class network():
                     lpf: buffers used for low-pass filtered activity.
                     sim_time: a copy of network.sim_time
         """
-        #TODO: Seems like I forgot to restor the lpf buffers. Also, all
-        # requirement variables.
+        # Only the lpf buffers are restored among the requirement variables.
+        # network.set_dynamic_state restores all of them.
 
         # testing network has the same signature
         for uid, u in enumerate(self.units):
@@ -1318,14 +2662,11 @@ class network():
             self.ts = state['ts']
             # link buffers as in self.flatten()
             self.link_unit_buffers()
-            for plant in self.plants:
-                svi = self.p_st_var_idx[plant.ID][0]
-                plant.buffer = np.ndarray(shape=(plant.dim, self.ts.size),
-                            buffer=self.acts[svi:svi+plant.dim, :],
-                            dtype=self.bf_type) 
-                plant.times = self.ts.view()
-                plant.buff_width = self.ts.size
-                plant.offset = plant.buff_width - self.min_buff_size
+            self.link_plant_buffers()
+        # copying the lpf buffers
+        for u, lpf in zip(self.units, state['lpf']):
+            for name, buff in lpf.items():
+                setattr(u, name, copy_state(getattr(u, name, None), buff))
            
         ## linking plants...
         ## TODO: Might need to update plant.inputs, plant.inp_syns as in append_inputs
@@ -1339,7 +2680,320 @@ class network():
         self.sim_time = state['sim_time']
 
 
-    def run(self, total_time):
+    def dynamic_state(self, into=None):
+        """ Returns a dictionary with all the values that change during a simulation.
+
+            Unlike save_state, this includes every numeric attribute of the units,
+            synapses, plants, and population update objects (e.g. the low-pass
+            filtered activities and all other requirements, the internal variables
+            of the synapses, the muscle variables of plants), the state of the
+            noise streams, and the state of numpy's global random generator, which
+            is used by some solvers. A network receiving this dictionary with
+            set_dynamic_state continues its simulation exactly as this network.
+
+            Numeric attributes are numbers, numeric arrays, and lists or tuples of
+            those (see is_state_value). Parameters are numbers as well, so they
+            are also included. Functions, units, synapses, and other objects are
+            considered part of the network's structure and are not included.
+
+            The arrays in the dictionary are copies. The dictionary can be stored
+            on disk with tools.net_store.save_checkpoint.
+
+            Args:
+                into: a dictionary previously returned by this method for the same
+                      network. When given, its arrays and lists are reused to store
+                      the current values (see copy_state), and it is returned.
+            Returns:
+                A dictionary with these entries:
+                structure: (number of units, of synapses, of plants, flat).
+                sim_time: a copy of network.sim_time.
+                acts, ts: copies of network.acts and network.ts if the network is
+                          flat, or None otherwise.
+                units: for each unit, a dictionary with its numeric attributes.
+                plants: for each plant, a dictionary with its numeric attributes.
+                plant_syns: for each plant and input port, a list with a dictionary
+                            for each synapse.
+                pops: a dictionary for each population update object.
+                syns: for each synapse class, in order of first appearance in
+                      all_syns, a tuple (class name, number of synapses, columns,
+                      lists). 'columns' is a dictionary whose values are arrays
+                      with the value of a scalar attribute for all the synapses of
+                      the class. 'lists' is a dictionary whose values are lists
+                      with the value of a non-scalar attribute for each synapse.
+                noise: noise[key] = (generator state, block, pos) for each stream.
+                np_random: the value of numpy.random.get_state().
+        """
+        if not self.syn_index_ready:
+            self.init_syn_index()
+        old = {} if into is None else into
+        state = {} if into is None else into
+        state['structure'] = (len(self.units), len(self.all_syns),
+                              len(self.plants), self.flat)
+        state['sim_time'] = self.sim_time
+        # old values of an entry that contains a list of dictionaries
+        old_list = lambda name, n: old[name] if name in old and \
+                                   len(old[name]) == n else [{}] * n
+        if self.flat:
+            state['acts'] = copy_state(old.get('acts'), self.acts)
+            state['ts'] = copy_state(old.get('ts'), self.ts)
+            # views of acts and ts are left out
+            u_skip = {'net', 'buffer', 'times', 'act_buff', 'acts', 'acts_win',
+                      'acts_idx', 'step_inps'}
+            p_skip = {'net', 'buffer', 'times'}
+        else:
+            state['acts'] = state['ts'] = None
+            u_skip = p_skip = {'net'}
+        obj_state = lambda obj, skip, d: {k : copy_state(d.get(k), v) for k, v in
+                                          obj.__dict__.items()
+                                          if k not in skip and is_state_value(v)}
+        state['units'] = [obj_state(u, u_skip, d) for u, d in 
+                          zip(self.units, old_list('units', len(self.units)))]
+        state['plants'] = [obj_state(p, p_skip, d) for p, d in
+                           zip(self.plants, old_list('plants', len(self.plants)))]
+        state['plant_syns'] = [[[obj_state(syn, {'net'}, {}) for syn in syn_list]
+                                for syn_list in p.inp_syns] for p in self.plants]
+        pops = self.pop_inp_updates + self.pop_updates + self.pop_syn_updates
+        state['pops'] = [obj_state(pop, {'net'}, d) for pop, d in
+                         zip(pops, old_list('pops', len(pops)))]
+        classes = self.syn_classes()
+        old_syns = old_list('syns', len(classes))
+        state['syns'] = []
+        for (cls, syns), old_cls in zip(classes.items(), old_syns):
+            old_cols = old_cls[2] if len(old_cls) > 0 else {}
+            old_lists = old_cls[3] if len(old_cls) > 0 else {}
+            cols = {}
+            lists = {}
+            for name, val in syns[0].__dict__.items():
+                if name == 'net' or not is_state_value(val):
+                    continue
+                try:
+                    vals = list(map(operator.attrgetter(name), syns))
+                except AttributeError: # some synapses lack the attribute
+                    continue
+                if type(val) in (bool, int, float) or isinstance(val, np.number):
+                    arr = np.array(vals)
+                    if arr.ndim == 1 and arr.dtype.kind in 'biuf':
+                        cols[name] = copy_state(old_cols.get(name), arr)
+                        continue
+                if all([is_state_value(v) for v in vals]):
+                    lists[name] = copy_state(old_lists.get(name), vals)
+            state['syns'].append((cls.__qualname__, len(syns), cols, lists))
+        old_noise = old.get('noise', {})
+        state['noise'] = {key : (s.rng.bit_generator.state, 
+                                 copy_state(old_noise.get(key, (0, None))[1], s.block),
+                                 s.pos) for key, s in self.noise_streams.items()}
+        state['np_random'] = np.random.get_state()
+        return state
+
+
+    def set_dynamic_state(self, state, global_rng=True):
+        """ Set the values in a dictionary created with dynamic_state.
+
+            The arrays of the network are modified in place when possible, so
+            views of them remain valid. The network must have the same structure
+            as the network that created the dictionary (usually it is the same
+            network, or one loaded with tools.net_store.load_network). Attributes
+            that didn't exist when the state was obtained keep their values.
+
+            Args:
+                state: a dictionary returned by network.dynamic_state.
+                global_rng: whether to also set the state of numpy's global random
+                            generator. This rewinds the generator for all the code
+                            in the process, not only for the network.
+            Raises:
+                ValueError if the structure of the network is different.
+        """
+        if not self.syn_index_ready:
+            self.init_syn_index()
+        structure = (len(self.units), len(self.all_syns), len(self.plants), self.flat)
+        pops = self.pop_inp_updates + self.pop_updates + self.pop_syn_updates
+        classes = self.syn_classes()
+        if tuple(state['structure']) != structure or len(pops) != len(state['pops']) \
+           or set(state['noise']) != set(self.noise_streams) or [(c.__qualname__, len(l)) for c, l in classes.items()] != \
+              [(s[0], s[1]) for s in state['syns']]:
+            raise ValueError('The state was obtained from a network with ' +
+                             'a different structure')
+        def set_obj(obj, d):
+            od = obj.__dict__
+            for k, v in d.items():
+                od[k] = copy_state(od.get(k), v)
+        if self.flat:
+            if self.acts.shape != state['acts'].shape:
+                raise ValueError('The state was obtained from a network with ' +
+                                 'a different structure')
+            self.acts[...] = state['acts']
+            self.ts[...] = state['ts']
+        for u, d in zip(self.units, state['units']):
+            set_obj(u, d)
+            if not self.flat and hasattr(u, 'buffer') and u.using_interp1d:
+                u.upd_interpolator()
+        for p, d in zip(self.plants, state['plants']):
+            set_obj(p, d)
+        for p, p_syns in zip(self.plants, state['plant_syns']):
+            for syn_list, d_list in zip(p.inp_syns, p_syns):
+                for syn, d in zip(syn_list, d_list):
+                    set_obj(syn, d)
+        for pop, d in zip(pops, state['pops']):
+            set_obj(pop, d)
+        for syns, (_, _, cols, lists) in zip(classes.values(), state['syns']):
+            for name, arr in cols.items():
+                # only the synapses whose value changed are modified
+                cur = np.array(list(map(operator.attrgetter(name), syns)))
+                if cur.shape == arr.shape:
+                    changed = np.flatnonzero(cur != arr)
+                else:
+                    changed = np.arange(len(syns))
+                for k, v in zip(changed.tolist(), arr[changed].tolist()):
+                    setattr(syns[k], name, v)
+            for name, vals in lists.items():
+                for syn, v in zip(syns, vals):
+                    syn.__dict__[name] = copy_state(syn.__dict__.get(name), v)
+        for key, (gen_state, block, pos) in state['noise'].items():
+            s = self.noise_streams[key]
+            s.rng.bit_generator.state = gen_state
+            s.block = None if block is None else copy_state(s.block, block)
+            s.pos = pos
+        if global_rng:
+            np.random.set_state(state['np_random'])
+        self.sim_time = state['sim_time']
+        self.syn_w_time = None # weights in syn_w may be stale
+
+
+    def snapshot(self, into=None):
+        """ Returns an in-memory copy of the network's dynamic state.
+
+            This is meant for simulations that return repeatedly to an earlier
+            state to try alternative inputs, as in reinforcement learning:
+            >>> snap = net.snapshot()
+            >>> for action in actions:
+            >>>     net.restore(snap)
+            >>>     ... # set the inputs for the action and run the network
+
+            Args:
+                into: a previous snapshot of this network. Its arrays are reused
+                      to store the current state, so taking many snapshots does
+                      not allocate new memory for them.
+            Returns:
+                The snapshot, a dictionary as those of network.dynamic_state. It
+                includes the state of numpy's global random generator, but
+                restore only sets it back for non-flat networks by default.
+        """
+        return self.dynamic_state(into)
+
+
+    def restore(self, snap, global_rng=None):
+        """ Copy the values of a snapshot back into the network.
+
+            The arrays of the network are overwritten in place, and the snapshot
+            is not modified, so it can be restored many times.
+
+            Flat networks draw their noise from their own noise streams, which
+            are always restored. By default, numpy's global random generator is
+            only restored for networks that are not flat, whose solvers and noisy
+            units use it. Otherwise code that uses np.random after restore
+            (e.g. the exploration of a reinforcement learning agent) would repeat
+            the same draws in every branch.
+
+            Args:
+                snap: a dictionary returned by network.snapshot.
+                global_rng: whether to restore the state of numpy's global random
+                            generator saved in the snapshot. None means
+                            'not self.flat'.
+            Raises:
+                ValueError if the snapshot comes from a network with a different
+                structure.
+        """
+        if global_rng is None:
+            global_rng = not self.flat
+        self.set_dynamic_state(snap, global_rng)
+
+
+    def fork(self, branch, args, n_procs=None):
+        """ Run several branches of the simulation in parallel processes.
+
+            For each value in 'args' a child process is created with os.fork, and
+            branch(net, arg) is called in it, where 'net' is the child's copy of
+            this network. Copy-on-write memory makes forking fast even for large
+            networks, and the network in the parent process is not modified.
+            Every branch starts from the current state, including the state of
+            the noise streams, so branches only differ because of 'arg'.
+
+            Args:
+                branch: a function branch(net, arg). Its return value is pickled to
+                        send it back to the parent process.
+                args: a list with one argument for each branch.
+                n_procs: maximum number of child processes running at the same
+                         time. If None, the number of CPUs is used.
+            Returns:
+                A list with the value returned by 'branch' for each argument.
+            Raises:
+                NotImplementedError if os.fork is not available (e.g. Windows).
+                An exception raised in a branch is raised again in the parent.
+        """
+        if not hasattr(os, 'fork'):
+            raise NotImplementedError('network.fork requires os.fork')
+        if n_procs is None:
+            n_procs = os.cpu_count() or 1
+        results = []
+        for start in range(0, len(args), max(1, n_procs)):
+            children = [] # (pid, reading end of the pipe) for each child
+            for arg in args[start:start+max(1, n_procs)]:
+                r, w = os.pipe()
+                pid = os.fork()
+                if pid == 0: # child process
+                    os.close(r)
+                    try:
+                        out = (True, branch(self, arg))
+                    except BaseException as e:
+                        out = (False, e)
+                    try:
+                        data = pickle.dumps(out)
+                    except Exception as e:
+                        data = pickle.dumps((False, TypeError('The branch ' +
+                                             'returned a value that can not ' +
+                                             'be pickled: ' + repr(e))))
+                    with os.fdopen(w, 'wb') as f:
+                        f.write(data)
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(0)
+                os.close(w)
+                children.append((pid, r))
+            for pid, r in children:
+                with os.fdopen(r, 'rb') as f:
+                    data = f.read()
+                os.waitpid(pid, 0)
+                results.append(pickle.loads(data) if len(data) > 0 else
+                               (False, ValueError('A branch process ended ' +
+                                                  'without returning')))
+        for ok, val in results:
+            if not ok:
+                raise val
+        return [val for _, val in results]
+
+
+    def syn_classes(self):
+        """ Returns a dictionary with the synapses in all_syns grouped by class.
+
+            The keys are the synapse classes, in order of first appearance in
+            all_syns, and the values are lists of synapses.
+        """
+        if not self.syn_index_ready:
+            self.init_syn_index()
+        types = list(map(type, self.all_syns))
+        if len(set(types)) < 2:
+            return {types[0] : list(self.all_syns)} if len(types) > 0 else {}
+        classes = {}
+        for syn in self.all_syns:
+            cls = type(syn)
+            if cls in classes:
+                classes[cls].append(syn)
+            else:
+                classes[cls] = [syn]
+        return classes
+
+
+    def run(self, total_time, callback=None, every=100, store=True, progress=None):
         """
         Simulate the network for the given time.
 
@@ -1351,6 +3005,23 @@ class network():
 
         Args:
             total_time: time that the simulation will last.
+            callback: an optional function callback(progress), called every
+                      'every' steps and after the last step, where 'progress' is
+                      a run_progress object with the current activities, the
+                      steps per second, and the estimated remaining time. If
+                      the callback returns a true value the simulation stops,
+                      and the returned arrays are truncated at the current step.
+                      progress.reason keeps the returned value. See
+                      progress_printer, divergence_stopper, and convergence_stopper.
+            every: number of steps between calls to the callback.
+            store: if False, the activities of units and plants are not stored,
+                   and unit_store and plant_store are empty lists. Statistics of
+                   the activities can be computed during the simulation with
+                   network.add_stats.
+            progress: an optional run_progress object, passed to the callback
+                      instead of a new one. Its step count, estimated time, and
+                      data continue from previous calls, so the callback sees a
+                      simulation split in several calls as a single run.
         
         Returns:
             The method returns a 3-tuple (times, unit_store, plant_store): 
@@ -1368,33 +3039,58 @@ class network():
         if self.flat:
             raise AssertionError('The run method is not used with flattened networks')
         Nsteps = int(total_time/self.min_delay) # total number of simulation steps
-        unit_store = [np.zeros(Nsteps) for i in range(self.n_units)] # arrays to
-                                                          #store unit activities
-        plant_store = [np.zeros((Nsteps,p.dim)) for p in self.plants] # arrays to
-                                                             # store plant states
+        if store:
+            unit_store = [np.zeros(Nsteps) for i in range(self.n_units)] # arrays to
+                                                              #store unit activities
+            plant_store = [np.zeros((Nsteps,p.dim)) for p in self.plants] # arrays to
+                                                                 # store plant states
+        else:
+            unit_store, plant_store = [], []
         times = np.zeros(Nsteps) + self.sim_time # array to store initial time of
                                                  # simulation steps
+        prof = getattr(self, 'profiler', None)
+        if callback is None:
+            progress = None
+        elif progress is None:
+            progress = run_progress(self, Nsteps)
+        first = 0 if progress is None else progress.step # steps in previous calls
+        stats = getattr(self, 'stream_stats', [])
 
         for step in range(Nsteps):
             times[step] = self.sim_time # sim_time persists between calls to network.run()
+            if prof is not None: t0 = perf_counter()
             
-            # store current unit activities
-            for uid, unit in enumerate(self.units):
-                unit_store[uid][step] = unit.get_act(self.sim_time)
-           
-            # store current plant state variables 
-            for pid, plant in enumerate(self.plants):
-                plant_store[pid][step,:] = plant.get_state(self.sim_time)
-            
-            # update units
-            for unit in self.units:
-                unit.update(self.sim_time)
+            if store or len(stats) > 0:
+                # store current unit activities
+                cur_acts = np.array([unit.get_act(self.sim_time) for unit in self.units])
+                if store:
+                    for uid in range(self.n_units):
+                        unit_store[uid][step] = cur_acts[uid]
+               
+                    # store current plant state variables 
+                    for pid, plant in enumerate(self.plants):
+                        plant_store[pid][step,:] = plant.get_state(self.sim_time)
+                # update the streaming statistics
+                for stat in stats:
+                    stat.update(cur_acts, self.sim_time)
+
+            if prof is not None: # timing the updates of each unit and plant
+                prof.add(('phase', 'store'), perf_counter() - t0)
+                self.profiled_step(self.sim_time)
+            else:
+                # update units
+                for unit in self.units:
+                    unit.update(self.sim_time)
 
-            # update plants
-            for plant in self.plants:
-                plant.update(self.sim_time)
+                # update plants
+                for plant in self.plants:
+                    plant.update(self.sim_time)
 
             self.sim_time += self.min_delay
 
+            if progress is not None and ((first+step+1) % every == 0 or step+1 == Nsteps):
+                if self.report_progress(progress, first+step+1, callback):
+                    return self.truncate_run(step+1, times, unit_store, plant_store)
+
         return times, unit_store, plant_store
 
@@ -685,7 +685,7 @@ def add_exp_scale_sort_mp(unit):
     exc_idx_rdc = [ idx for idx,syn in enumerate([unit.net.syns[unit.ID][i] 
                          for i in unit.port_idx[unit.rdc_port]]) if syn.w >= 0 ]
     autapse = False
-    autapse_idx = len(exc_idx_rdc) - 1
+    autapse_idx = len(exc_idx_rdc) # index of the fake autapse, if there is no real one
     for idx, syn in enumerate([unit.net.syns[unit.ID][eir] for eir in exc_idx_rdc]):
         if syn.preID == unit.ID: # if there is an excitatory autapse at the rdc port
             autapse_idx = idx
@@ -698,11 +698,26 @@ def add_exp_scale_sort_mp(unit):
         N = len(exc_idx_rdc) + 1 # an extra point for the fake autapse
     points = [ (k + 0.5) / (N + 1.) for k in range(N) ]
     ideal_rates = np.array([-(1./unit.c) * np.log(1.-(1.-np.exp(-unit.c))*pt) for pt in points])
+    # The synapses of the excitatory inputs at the rdc port, so their weights can be
+    # read without calling get_mp_weights.
+    exc_rdc_syns = [unit.net.syns[unit.ID][unit.port_idx[unit.rdc_port][eir]] 
+                    for eir in exc_idx_rdc]
+    # Preallocated arrays with the excitatory inputs and weights at the rdc port.
+    # When there is no autapse the last entry is reserved for the fake one.
+    sort_inp = np.zeros(N)
+    sort_w = np.zeros(N)
+    # rate_rank is the index that sorts sort_inp. It is kept between updates, since
+    # the rates change little from one step to the next.
+    rate_rank = np.arange(N)
     setattr(unit, 'scale_facs_rdc', scale_facs_rdc) 
     setattr(unit, 'exc_idx_rdc', exc_idx_rdc) 
     setattr(unit, 'autapse', autapse) 
     setattr(unit, 'autapse_idx', autapse_idx) 
     setattr(unit, 'ideal_rates', ideal_rates) 
+    setattr(unit, 'exc_rdc_syns', exc_rdc_syns) 
+    setattr(unit, 'sort_inp', sort_inp) 
+    setattr(unit, 'sort_w', sort_w) 
+    setattr(unit, 'rate_rank', rate_rank) 
 
 
 def add_exp_scale_sort_shrp(unit):
@@ -718,7 +733,7 @@ def add_exp_scale_sort_shrp(unit):
     exc_idx_rdc = [ idx for idx,syn in enumerate([unit.net.syns[unit.ID][i] 
                          for i in unit.port_idx[unit.rdc_port]]) if syn.w >= 0 ]
     autapse = False
-    autapse_idx = len(exc_idx_rdc) - 1
+    autapse_idx = len(exc_idx_rdc) # index of the fake autapse, if there is no real one
     for idx, syn in enumerate([unit.net.syns[unit.ID][eir] for eir in exc_idx_rdc]):
         if syn.preID == unit.ID: # if there is an excitatory autapse at the rdc port
             autapse_idx = idx
@@ -731,11 +746,26 @@ def add_exp_scale_sort_shrp(unit):
         N = len(exc_idx_rdc) + 1 # an extra point for the fake autapse
     points = [ (k + 0.5) / (N + 1.) for k in range(N) ]
     ideal_rates = np.array([-(1./unit.c) * np.log(1.-(1.-np.exp(-unit.c))*pt) for pt in points])
+    # The synapses of the excitatory inputs at the rdc port, so their weights can be
+    # read without calling get_mp_weights.
+    exc_rdc_syns = [unit.net.syns[unit.ID][unit.port_idx[unit.rdc_port][eir]] 
+                    for eir in exc_idx_rdc]
+    # Preallocated arrays with the excitatory inputs and weights at the rdc port.
+    # When there is no autapse the last entry is reserved for the fake one.
+    sort_inp = np.zeros(N)
+    sort_w = np.zeros(N)
+    # rate_rank is the index that sorts sort_inp. It is kept between updates, since
+    # the rates change little from one step to the next.
+    rate_rank = np.arange(N)
     setattr(unit, 'scale_facs_rdc', scale_facs_rdc) 
     setattr(unit, 'exc_idx_rdc', exc_idx_rdc) 
     setattr(unit, 'autapse', autapse) 
     setattr(unit, 'autapse_idx', autapse_idx) 
     setattr(unit, 'ideal_rates', ideal_rates) 
+    setattr(unit, 'exc_rdc_syns', exc_rdc_syns) 
+    setattr(unit, 'sort_inp', sort_inp) 
+    setattr(unit, 'sort_w', sort_w) 
+    setattr(unit, 'rate_rank', rate_rank) 
 
 
 def add_error(unit):
@@ -1258,6 +1288,11 @@ def add_xtra_del_inp_deriv_mp_sc_sum(unit):
     setattr(unit, 'xtra_del_inp_deriv_mp_sc_sum', xdidmss)
 
 
+def no_update(time):
+    """ Update function for requirements that don't change during the simulation. """
+    return None
+
+
 def add_exp_euler_vars(unit):
     """ Adds several variables used by the exp_euler integration method. """
     dt = unit.times[1] - unit.times[0] # same as unit.time_bit
@@ -1266,7 +1301,7 @@ def add_exp_euler_vars(unit):
     c2 = (eAt-1.)/A
     c3 = np.sqrt( (eAt**2. - 1.) / (2.*A) )
     sc3 = unit.sigma * c3 # used by flat_exp_euler_update
-    upd_exp_euler_vars = lambda t: None
+    upd_exp_euler_vars = no_update # a module-level function, so units can be stored
     setattr(unit, 'eAt', eAt)
     setattr(unit, 'c2', c2)
     setattr(unit, 'c3', c3)
@@ -1297,16 +1332,17 @@ def add_out_norm_factor(unit):
     else:
         sel_type = False
         syn_type_val = None
-    # Obtain indexes to all of the unit's connections in net.syns
+    # Obtain indexes to all of the unit's connections in net.syns,
+    # using the outgoing synapse index of the network
+    net = unit.net
     out_syns_idx = []
     out_w_abs_sum = 0.
-    for list_idx, syn_list in enumerate(unit.net.syns):
-        for syn_idx, syn in enumerate(syn_list):
-            if syn.preID == unit.ID:
-                if ((sel_type is True and syn_type_val == syn.type.value) or
-                    sel_type is False):                    
-                    out_syns_idx.append((list_idx, syn_idx))
-                    out_w_abs_sum += abs(syn.w)
+    for post, loc in sorted(net.out_syns[unit.ID]):
+        syn = net.syns[post][loc]
+        if ((sel_type is True and syn_type_val == syn.type.value) or
+            sel_type is False):                    
+            out_syns_idx.append((post, loc))
+            out_w_abs_sum += abs(syn.w)
                 
     out_norm_factor = unit.des_out_w_abs_sum / (out_w_abs_sum + 1e-32)
     setattr(unit, 'out_syns_idx', out_syns_idx)
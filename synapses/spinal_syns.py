@@ -7,6 +7,369 @@ from draculab import unit_types, synapse_types, syn_reqs  # names of models and
 from synapses.synapses import synapse
 import numpy as np
 
+#~~~~~~ POPULATION UPDATES FOR FLAT NETWORKS ~~~~~~~~~~
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# A synapse class can set its 'pop_update' attribute to a class whose 
+# constructor receives a list of synapses of the same type, and with an
+# update(time) method that updates all of them at once. When a network is
+# flattened, these synapses are removed from the per-synapse update loop
+# (see network.init_pop_updates).
+
+class rga_syn_pop():
+    """ Batched weight updates for synapses of the rga family.
+
+        Most terms in the rga learning rules depend only on the postsynaptic
+        unit, or on the unit and the error or lateral port. Those terms are
+        obtained once for each unit (or unit-port pair), and are expanded to all
+        synapses with an index array. The presynaptic lpf differences are
+        gathered for all synapses at once from the concatenated lpf buffers of
+        the presynaptic units. Normalization and soft bounding are then applied
+        as array operations, and the results are written back to the synapses.
+
+        All the synapses in the population must have the same type. Each type
+        has a kernel method named after it (e.g. rga_21 synapses use upd_rga_21),
+        which follows the update method of the corresponding synapse class.
+    """
+    def __init__(self, syns):
+        """ The class constructor.
+
+        Args:
+            syns: a list with synapse objects of the same type.
+        Raises:
+            NotImplementedError
+        """
+        self.syns = syns
+        self.net = syns[0].net
+        name = syns[0].type.name
+        if not hasattr(self, 'upd_' + name):
+            raise NotImplementedError('rga_syn_pop has no kernel for ' + name +
+                                      ' synapses')
+        self.kernel = getattr(self, 'upd_' + name)
+        units = self.net.units
+        post_ids = sorted(set([s.postID for s in syns]))
+        pre_ids = sorted(set([s.preID for s in syns]))
+        self.post = [units[uid] for uid in post_ids] # postsynaptic units
+        self.pre = [units[uid] for uid in pre_ids] # presynaptic units
+        post_loc = {uid : i for i, uid in enumerate(post_ids)}
+        pre_loc = {uid : i for i, uid in enumerate(pre_ids)}
+        # pidx[k], qidx[k] = index of the post, pre unit of syns[k] in post, pre
+        self.pidx = np.array([post_loc[s.postID] for s in syns], dtype=int)
+        self.qidx = np.array([pre_loc[s.preID] for s in syns], dtype=int)
+        self.d = np.array([s.delay_steps for s in syns], dtype=int)
+        self.alpha = np.array([s.alpha for s in syns])
+        self.w_sum = np.array([getattr(s, 'w_sum', 1.) for s in syns])
+        # unit-port and unit-delay pairs
+        self.err_p = self.pairs([s.err_port for s in syns])
+        self.lat_p = self.pairs([s.lat_port for s in syns])
+        self.de_p = self.pairs([s.po_de for s in syns])
+        if hasattr(syns[0], 'sig1'):
+            self.sig1 = np.array([s.sig1 for s in syns])
+            self.sig2 = np.array([s.sig2 for s in syns])
+        # per-synapse locations in the requirements of the postsynaptic unit
+        s_post = [units[s.postID] for s in syns]
+        if hasattr(syns[0], 'idm_id'):
+            self.idm = [(u, s.err_port, s.idm_id) for u, s in zip(s_post, syns)]
+        if hasattr(syns[0], 'sid_idx'):
+            self.sid = [(u, s.err_port, s.sid_idx) for u, s in zip(s_post, syns)]
+        if hasattr(syns[0], 'ddidm_idx'):
+            self.ddidm = [(u, s.port, s.ddidm_idx) for u, s in zip(s_post, syns)]
+        if hasattr(syns[0], 'normalize'):
+            self.normalize = np.array([s.normalize for s in syns], dtype=bool)
+        if hasattr(syns[0], 'del_mod'):
+            self.po_de = np.array([s.po_de for s in syns], dtype=int)
+            self.corr_alpha = np.array([s.corr_alpha for s in syns])
+            self.dm_alpha = np.array([s.dm_alpha for s in syns])
+            self.mod_max = np.array([s.mod_max for s in syns])
+            self.mod_min = np.array([s.mod_min for s in syns])
+
+    def pairs(self, vals):
+        """ Unique (postsynaptic unit, value) pairs for the given synapse values.
+
+            Args:
+                vals: a list with one hashable value for each synapse.
+            Returns:
+                A 2-tuple. The first element is a list of (unit, value) tuples
+                without repetitions. The second is an array with the index
+                in that list of the pair for each synapse.
+        """
+        keys = list(zip(self.pidx.tolist(), vals))
+        uniq = sorted(set(keys))
+        loc = {k : i for i, k in enumerate(uniq)}
+        return ([(self.post[p], v) for p, v in uniq], 
+                np.array([loc[k] for k in keys], dtype=int))
+
+    def post_vals(self, pairs, fun):
+        """ Returns fun(unit, value) for all pairs, expanded to all synapses. """
+        return np.array([fun(u, v) for u, v in pairs[0]])[pairs[1]]
+
+    def buff_vals(self, units, idx, name, steps):
+        """ Returns getattr(units[idx[k]], name)[-1-steps[k]] for all synapses k. """
+        buffs = [getattr(u, name) for u in units]
+        ends = np.cumsum([len(b) for b in buffs])
+        return np.concatenate(buffs)[ends[idx] - 1 - steps]
+
+    def get_attr(self, name):
+        """ Returns an array with an attribute of all synapses. """
+        return np.array([getattr(s, name) for s in self.syns])
+
+    def set_attr(self, name, vals):
+        """ Sets an attribute of all synapses from an array. """
+        for s, v in zip(self.syns, vals.tolist()):
+            setattr(s, name, v)
+
+    def update(self, time):
+        """ Update the weights of all synapses. """
+        self.kernel(time)
+
+    #~~~~~~~~~~~~~~~~ shared terms ~~~~~~~~~~~~~~~~
+    def up(self):
+        """ Postsynaptic lpf_fast - lpf_mid with delay po_de. """
+        return self.post_vals(self.de_p, lambda u, de: 
+                              u.get_lpf_fast(de) - u.get_lpf_mid(de))
+
+    def up_slow(self):
+        """ Postsynaptic lpf_mid - lpf_slow with delay po_de. """
+        return self.post_vals(self.de_p, lambda u, de: 
+                              u.get_lpf_mid(de) - u.get_lpf_slow(de))
+
+    def spj(self):
+        """ Presynaptic lpf_fast - lpf_mid with the delay of each synapse. """
+        return (self.buff_vals(self.pre, self.qidx, 'lpf_fast_buff', self.d) -
+                self.buff_vals(self.pre, self.qidx, 'lpf_mid_buff', self.d))
+
+    def norm(self):
+        """ Postsynaptic l1_norm_factor_mp at the error port plus presynaptic out_norm_factor. """
+        return (self.post_vals(self.err_p, lambda u, p: u.l1_norm_factor_mp[p]) +
+                np.array([u.out_norm_factor for u in self.pre])[self.qidx])
+
+    def acc(self):
+        """ Postsynaptic acc_slow. """
+        return np.array([u.acc_slow for u in self.post])[self.pidx]
+
+    def ejp(self):
+        """ Input derivative of each synapse at the error port. """
+        return np.array([u.inp_deriv_mp[p][i] for u, p, i in self.idm])
+
+    def slow_ejp(self):
+        """ Slow input derivative of each synapse at the error port. """
+        return np.array([u.slow_inp_deriv_mp[p][i] for u, p, i in self.sid])
+
+    def spj_del(self):
+        """ Delayed input derivative of each synapse. """
+        return np.array([u.double_del_inp_deriv_mp[0][p][i] for u, p, i in self.ddidm])
+
+    #~~~~~~~~~~~~~~~~ kernels ~~~~~~~~~~~~~~~~
+    def upd_rga(self, time):
+        """ Batched version of rga_synapse.update. """
+        xp = self.post_vals(self.lat_p, lambda u, p: u.del_avg_inp_deriv_mp[p])
+        up = self.up()
+        sp = self.post_vals(self.err_p, lambda u, p: u.avg_inp_deriv_mp[p])
+        spj = self.spj()
+        w = self.get_attr('w')
+        # weight normalization
+        norm_fac = .5 * self.w_sum * self.norm()
+        w += 0.05 * self.alpha * (norm_fac - 1.)*w
+        # soft weight bounding
+        dw = np.maximum(np.minimum(self.alpha * (up - xp) * (sp - spj) * w,
+                                   self.alpha), -self.alpha)
+        w += dw
+        self.set_attr('w', w)
+
+    def upd_gated_rga(self, time):
+        """ Batched version of gated_rga_synapse.update. """
+        xp = self.post_vals(self.lat_p, lambda u, p: u.del_avg_inp_deriv_mp[p])
+        up = self.up()
+        sp = self.post_vals(self.err_p, lambda u, p: u.avg_inp_deriv_mp[p])
+        spj = self.spj()
+        w = self.get_attr('w')
+        w *= self.w_sum*self.norm()
+        w += self.acc() * self.alpha * (up - xp) * (sp - spj)
+        self.set_attr('w', w)
+
+    def rga_21_terms(self, normal=False):
+        """ Terms shared by the rga_21 rules. Updates ep_slow and ejp_slow.
+
+            Args:
+                normal: whether the terms are normalized as in gated_normal_rga_21.
+            Returns:
+                cp, cip, epp, ejpp.
+        """
+        cp = self.post_vals(self.lat_p, lambda u, p: u.del_avg_inp_deriv_mp[p])
+        cip = self.up()
+        ep = self.post_vals(self.err_p, lambda u, p: u.avg_inp_deriv_mp[p])
+        ejp = self.ejp()
+        if normal:
+            normfac1 = 1. / (self.sig1 + np.abs(self.up_slow()))
+            normfac2 = 1. / (self.sig2 + np.abs(self.slow_ejp()))
+            cp = normfac1 * cp
+            cip = normfac1 * cip
+            ep = normfac2 * ep
+            ejp = normfac2 * ejp
+        ep_slow = self.get_attr('ep_slow')
+        ejp_slow = self.get_attr('ejp_slow')
+        ep_slow += 10.*self.net.min_delay*(ep - ep_slow)
+        ejp_slow += 10.*self.net.min_delay*(ejp - ejp_slow)
+        self.set_attr('ep_slow', ep_slow)
+        self.set_attr('ejp_slow', ejp_slow)
+        return cp, cip, ep - ep_slow, ejp - ejp_slow
+
+    def upd_rga_21(self, time):
+        """ Batched version of rga_21.update. """
+        cp, cip, epp, ejpp = self.rga_21_terms()
+        w = self.get_attr('w')
+        norm_fac = .5 * self.w_sum * self.norm()
+        w += 0.03 * self.alpha * (norm_fac - 1.)*w 
+        w -= self.alpha * (ejpp - epp) * (cip - cp) * w
+        self.set_attr('w', w)
+
+    def upd_gated_rga_21(self, time):
+        """ Batched version of gated_rga_21.update. """
+        cp, cip, epp, ejpp = self.rga_21_terms()
+        w = self.get_attr('w')
+        norm_fac = .5*self.norm()
+        w += self.alpha * (norm_fac - 1.)*w 
+        w -= self.acc() * self.alpha * (ejpp - epp) * (cip - cp)
+        self.set_attr('w', w)
+
+    def upd_gated_rga_21_dc(self, time):
+        """ Batched version of gated_rga_21_dc.update. """
+        cp, cip, epp, ejpp = self.rga_21_terms()
+        cp_now = self.post_vals(self.lat_p, lambda u, p: u.sc_inp_sum_deriv_mp[p])
+        w = self.get_attr('w')
+        norm_fac = .5*self.norm()
+        w += self.alpha * (norm_fac - 1.)*w 
+        w -= self.acc() * self.alpha * ((ejpp - epp) * (cip - cp) + cip*cp_now) 
+        self.set_attr('w', w)
+
+    def upd_gated_normal_rga_21(self, time):
+        """ Batched version of gated_normal_rga_21.update. """
+        cp, cip, epp, ejpp = self.rga_21_terms(normal=True)
+        w = self.get_attr('w')
+        norm_fac = .5*self.norm()
+        w += self.alpha * (norm_fac - 1.)*w 
+        w -= self.alpha * (ejpp - epp) * (cip - cp)
+        self.set_attr('w', w)
+
+    def normal_rga_terms(self):
+        """ Terms shared by normal_rga and gated_normal_rga. 
+
+            Returns:
+                up, xp, sp, spj.
+        """
+        normfac1 = 1. / (self.sig1 + np.abs(self.up_slow()))
+        avg_normfac1 = 1. / (self.sig1 + np.abs(self.post_vals(self.lat_p, 
+                             lambda u, p: u.avg_slow_inp_deriv_mp[p])))
+        normfac2 = 1. / (self.sig2 + np.abs(self.slow_ejp()))
+        avg_normfac2 = 1. / (self.sig2 + np.abs(self.post_vals(self.err_p, 
+                             lambda u, p: u.avg_slow_inp_deriv_mp[p])))
+        up = normfac1 * self.up()
+        xp = avg_normfac1 * self.post_vals(self.lat_p, 
+                                           lambda u, p: u.del_avg_inp_deriv_mp[p])
+        sp = avg_normfac2 * self.post_vals(self.err_p, 
+                                           lambda u, p: u.avg_inp_deriv_mp[p])
+        spj = normfac2 * self.spj()
+        return up, xp, sp, spj
+
+    def upd_normal_rga(self, time):
+        """ Batched version of normal_rga.update. """
+        up, xp, sp, spj = self.normal_rga_terms()
+        w = self.get_attr('w')
+        norm_fac = .5*self.norm()
+        w += self.alpha * (norm_fac - 1.)*w
+        w += self.alpha * (up - xp) * (sp - spj)
+        self.set_attr('w', w)
+
+    def upd_gated_normal_rga(self, time):
+        """ Batched version of gated_normal_rga.update. """
+        up, xp, sp, spj = self.normal_rga_terms()
+        w = self.get_attr('w')
+        w *= self.w_sum*self.norm()
+        w += self.acc() * self.alpha * (up - xp) * (sp - spj)
+        self.set_attr('w', w)
+
+    def rga_diff_terms(self, normal=False):
+        """ Terms shared by the rga_diff rules. 
+
+            Args:
+                normal: whether the terms are normalized as in gated_normal_rga_diff.
+            Returns:
+                up, xp, sp_now, sp_del, spj_now, spj_del.
+        """
+        up = self.up()
+        xp = self.post_vals(self.lat_p, lambda u, p: u.double_del_avg_inp_deriv_mp[1][p])
+        sp_now = self.post_vals(self.err_p, lambda u, p: u.avg_inp_deriv_mp[p])
+        sp_del = self.post_vals(self.err_p, 
+                                lambda u, p: u.double_del_avg_inp_deriv_mp[0][p])
+        spj_now = self.spj()
+        spj_del = self.spj_del()
+        if normal:
+            normfac1 = 1. / (self.sig1 + np.abs(self.up_slow()))
+            avg_normfac1 = 1. / (self.sig1 + np.abs(self.post_vals(self.lat_p, 
+                                 lambda u, p: u.avg_slow_inp_deriv_mp[p])))
+            normfac2 = 1. / (self.sig2 + np.abs(self.slow_ejp()))
+            avg_normfac2 = 1. / (self.sig2 + np.abs(self.post_vals(self.err_p, 
+                                 lambda u, p: u.avg_slow_inp_deriv_mp[p])))
+            up = normfac1 * up
+            xp = avg_normfac1 * xp
+            sp_now = avg_normfac2 * sp_now
+            sp_del = avg_normfac2 * sp_del
+            spj_now = normfac2 * spj_now
+            spj_del = normfac2 * spj_del
+        return up, xp, sp_now, sp_del, spj_now, spj_del
+
+    def upd_gated_rga_diff(self, time):
+        """ Batched version of gated_rga_diff_synapse.update. """
+        up, xp, sp_now, sp_del, spj_now, spj_del = self.rga_diff_terms()
+        w = self.get_attr('w')
+        w *= self.w_sum*self.norm()
+        w += self.acc() * self.alpha * (up - xp) * (
+                          (sp_now - spj_now) - (sp_del - spj_del))
+        self.set_attr('w', w)
+
+    def upd_gated_normal_rga_diff(self, time):
+        """ Batched version of gated_normal_rga_diff.update. """
+        up, xp, sp_now, sp_del, spj_now, spj_del = self.rga_diff_terms(normal=True)
+        w = self.get_attr('w')
+        w = np.where(self.normalize, w * (self.w_sum*self.norm()), w)
+        w += self.acc() * self.alpha * (up - xp) * (
+                          (sp_now - spj_now) - (sp_del - spj_del))
+        self.set_attr('w', w)
+
+    def slide_update(self, up, xp, sp_now, sp_del, spj_now, spj_del):
+        """ Update of weights, correlations, and delay modifiers in slide rules. """
+        w = self.get_attr('w')
+        w *= self.w_sum*self.norm()
+        corr1 = (up - xp) * (sp_del - spj_del)
+        corr2 = (up - xp) * (sp_now - spj_now)
+        c1 = self.get_attr('corr1')
+        c2 = self.get_attr('corr2')
+        del_mod = self.get_attr('del_mod')
+        c1 += self.corr_alpha * (corr1 - c1)
+        c2 += self.corr_alpha * (corr2 - c2)
+        del_mod += ( (self.mod_max - del_mod) * (del_mod - self.mod_min) *
+                     (np.abs(c2) - np.abs(c1)) ) * self.dm_alpha
+        w += self.acc() * self.alpha * (corr2 - corr1)
+        self.set_attr('corr1', c1)
+        self.set_attr('corr2', c2)
+        self.set_attr('del_mod', del_mod)
+        self.set_attr('w', w)
+
+    def upd_gated_slide_rga_diff(self, time):
+        """ Batched version of gated_slide_rga_diff.update. """
+        up, xp, sp_now, sp_del, spj_now, spj_del = self.rga_diff_terms()
+        # the postsynaptic delay is modified by each synapse
+        dm_steps = np.rint(self.get_attr('del_mod')/self.net.min_delay).astype(int)
+        po_de = self.po_de + dm_steps # effective postsynaptic delay
+        up = (self.buff_vals(self.post, self.pidx, 'lpf_fast_buff', po_de) -
+              self.buff_vals(self.post, self.pidx, 'lpf_mid_buff', po_de))
+        self.slide_update(up, xp, sp_now, sp_del, spj_now, spj_del)
+
+    def upd_gated_normal_slide_rga_diff(self, time):
+        """ Batched version of gated_normal_slide_rga_diff.update. """
+        terms = self.rga_diff_terms(normal=True)
+        self.slide_update(*terms)
+
+
 
 class diff_hebb_subsnorm_synapse2(synapse):
     """ A variation on the diff_hebb_subsnorm_synapse.
@@ -117,6 +480,8 @@ class rga_synapse(synapse):
         The current implementation normalizes the sum of the absolute values for
         the weights at the 'error' port, making them add to 1.
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -230,6 +595,8 @@ class gated_rga_synapse(synapse):
         presynaptic unit.
         
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -717,6 +1084,8 @@ class rga_21(synapse):
         The current implementation normalizes the sum of the absolute values for
         the weights at the 'error' port, making them add to 1.
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -849,6 +1218,8 @@ class gated_rga_21(synapse):
         The current implementation normalizes the sum of the absolute values for
         the weights at the 'error' port, making them add to 1.
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -961,6 +1332,8 @@ class gated_rga_21_dc(synapse):
         The current implementation normalizes the sum of the absolute values for
         the weights at the 'error' port, making them add to 1.
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -1086,6 +1459,8 @@ class gated_normal_rga_21(synapse):
         The current implementation normalizes the sum of the absolute values for
         the weights at the 'error' port, making them add to 1.
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -1237,6 +1612,8 @@ class normal_rga(synapse):
         presynaptic unit.
         
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -1380,6 +1757,8 @@ class gated_normal_rga(synapse):
         presynaptic unit.
         
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -1652,6 +2031,8 @@ class gated_rga_diff_synapse(synapse):
         presynaptic unit.
         
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -1789,6 +2170,8 @@ class gated_slide_rga_diff(synapse):
         presynaptic unit.
         
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -1958,6 +2341,8 @@ class gated_normal_rga_diff(synapse):
         presynaptic unit.
         
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -2079,6 +2464,8 @@ class noisy_gated_normal_rga_diff(gated_normal_rga_diff):
         of this drift depends on a given 'noise_amp' parameter, multiplied by
         the square root of the time between updates.
     """
+    pop_update = None # the noise is drawn in the per-synapse update
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -2098,13 +2485,16 @@ class noisy_gated_normal_rga_diff(gated_normal_rga_diff):
             self.decay = False
         self.dr_amp = params['dr_amp'] if 'dr_amp' in params else 0.01
         self.dr_std = np.sqrt(network.min_delay)*self.dr_amp
+        if not self.decay:
+            self.noise_stream = network.get_noise_stream((1, self.postID,
+                                                          self.syns_loc))
         
     def update(self, time):
         gated_normal_rga_diff.update(self, time)
         if self.decay:
             self.w -=  self.dc_fac*self.w
         else:
-            self.w += np.random.normal(loc=0., scale=self.dr_std)
+            self.w += self.dr_std * self.noise_stream.draw()
 
 
 class gated_normal_slide_rga_diff(synapse):
@@ -2161,6 +2551,8 @@ class gated_normal_slide_rga_diff(synapse):
         presynaptic unit.
         
     """
+    pop_update = rga_syn_pop # batched updates in flat networks
+
     def __init__(self, params, network):
         """ The class constructor.
 
@@ -2695,13 +3087,16 @@ class noisy_gated_diff_inp_sel(gated_diff_input_selection_synapse):
             self.decay = False
         self.dr_amp = params['dr_amp'] if 'dr_amp' in params else 0.01
         self.dr_std = np.sqrt(network.min_delay)*self.dr_amp
+        if not self.decay:
+            self.noise_stream = network.get_noise_stream((1, self.postID,
+                                                          self.syns_loc))
         
     def update(self, time):
         gated_diff_input_selection_synapse.update(self, time)
         if self.decay:
             self.w -=  self.dc_fac*self.w
         else:
-            self.w += np.random.normal(loc=0., scale=self.dr_std)
+            self.w += self.dr_std * self.noise_stream.draw()
 
 
 class gated_diff_inp_corr(synapse):
@@ -14,6 +14,7 @@ class synapse():
         units, and that this will be done whenever the simulation advances network.min_delay
         time units.
     """
+    pop_update = None # class for batched updates in flat networks (see network.init_pop_updates)
 
     def __init__(self, params, network):
         """ The class constructor. 
@@ -49,6 +49,112 @@ def align_points(times, data_times, data_points):
     return np.array([data_fun(t) for t in times])
 
 
+def sig_net(meth, mbs, flat_integ='euler', tau=0.02):
+    """ Returns the activities of recurrent sigmoidal units at the end of each 0.05 interval.
+
+        The units have time constant 'tau', and integration method 'meth', in a flat
+        network with 'mbs' substeps and the given flat_integ parameter.
+    """
+    net = network({'min_delay' : 0.01, 'min_buff_size' : mbs, 'flat_integ' : flat_integ})
+    src = net.create(1, {'type' : unit_types.source, 'init_val' : 0.5,
+                         'function' : lambda t: 0.5 + 0.4*np.sin(2.*np.pi*3.*t)})
+    params = {'type' : unit_types.sigmoidal, 'init_val' : 0.1, 'slope' : 3.,
+              'thresh' : 0.3, 'tau' : tau}
+    if meth is not None:
+        params['integ_meth'] = meth
+    sig = net.create(3, params)
+    net.connect(src, sig, {'rule' : 'all_to_all', 'delay' : 0.01},
+                {'type' : synapse_types.static, 'init_w' : 1.})
+    net.connect(sig, sig, {'rule' : 'one_to_one', 'delay' : 0.02},
+                {'type' : synapse_types.static, 'init_w' : -0.5})
+    net.flatten()
+    vals = []
+    for _ in range(20):
+        net.flat_run(0.05)
+        vals.append(net.acts[net.first_idx[1:], -1].copy())
+    return np.array(vals)
+
+
+def ds_net(unit_type, n_branches, pop_updates, N=6, extra={}, mbs=5):
+    """ A network with double sigma units driven by sinusoidal sources. """
+    np.random.seed(54321)
+    net = network({'min_delay' : 0.01, 'min_buff_size' : mbs, 'pop_updates' : pop_updates})
+    srcs = net.create(4, {'type' : unit_types.source, 'init_val' : 0.5, 
+                          'function' : lambda t: 0.5})
+    for i, s in enumerate(srcs):
+        net.units[s].set_function(lambda t, i=i: 0.5 + 0.4*np.sin(2.*t+i))
+    unit_params = {'type' : unit_type, 'init_val' : list(np.random.random(N)),
+                   'n_ports' : 4, 'slope' : 2., 'thresh' : .3, 'tau' : .05, 'phi' : .2,
+                   'tau_slow' : 1., 'tau_fast' : .05, 'rdc_port' : 1, 'tau_thr' : .01,
+                   'c' : 2., 'sharpen_port' : 3, 'tau_fix' : .1, 'thr_fix' : .2,
+                   'branch_params' : {'branch_w' : [.3, .5, .2, .4][:n_branches],
+                        'slopes' : {'distribution' : 'uniform', 'low' : 1., 'high' : 3.},
+                        'threshs' : {'distribution' : 'uniform', 'low' : -.2, 'high' : .5} } }
+    unit_params.update(extra)
+    units = net.create(N, unit_params)
+    conn_spec = {'rule' : 'all_to_all', 'delay' : 0.02}
+    syn_spec = {'type' : synapse_types.static, 'inp_ports' : [0,1,2,3]*N,
+                'init_w' : {'distribution' : 'uniform', 'low' : -.5, 'high' : 1.} }
+    net.connect(srcs, units, conn_spec, syn_spec)
+    conn_spec = {'rule' : 'fixed_indegree', 'indegree' : 4, 'delay' : 0.03,
+                 'allow_autapses' : False}
+    syn_spec = {'type' : synapse_types.static, 'init_w' : 0.3, 'inp_ports' : [0,1,2,3]*N}
+    net.connect(units, units, conn_spec, syn_spec)
+    return net, units
+
+
+def rga_net(syn_type, pop_updates, N=5):
+    """ gated_rga_inpsel_adapt_sig units connected with synapses of the given type. """
+    np.random.seed(1357)
+    net = network({'min_delay' : 0.01, 'min_buff_size' : 4, 'pop_updates' : pop_updates})
+    srcs = net.create(3, {'type' : unit_types.source, 'init_val' : 0.5, 
+                          'function' : lambda t: 0.5})
+    for i, s in enumerate(srcs):
+        net.units[s].set_function(lambda t, i=i: 0.5 + 0.4*np.sin(3.*t+i))
+    unit_params = {'type' : unit_types.gated_rga_inpsel_adapt_sig, 
+                   'init_val' : list(0.2 + 0.6*np.random.random(N)),
+                   'slope' : 3., 'thresh' : .3, 'tau' : .05, 'tau_fast' : .02,
+                   'tau_mid' : .1, 'tau_slow' : 1., 'integ_amp' : .1,
+                   'integ_decay' : .5, 'custom_inp_del' : 2, 'custom_inp_del2' : 4,
+                   'del_mod_max' : 2, 'del_mod_min' : -1, 'delay' : 0.1,
+                   'des_out_w_abs_sum' : 1.5, 'adapt_amp' : .2, 'tau_sda' : 5.}
+    units = net.create(N, unit_params)
+    net.connect(srcs, units, {'rule' : 'all_to_all', 'delay' : 0.02},
+                {'type' : synapse_types.static, 'inp_ports' : 2,
+                 'init_w' : {'distribution' : 'uniform', 'low' : .2, 'high' : .8}})
+    net.connect(units, units, {'rule' : 'fixed_indegree', 'indegree' : 2, 
+                'delay' : 0.02, 'allow_autapses' : False},
+                {'type' : synapse_types.static, 'init_w' : 0.3, 'inp_ports' : 1})
+    net.connect(units, units, {'rule' : 'fixed_indegree', 'indegree' : 3, 
+                'delay' : {'distribution' : 'uniform', 'low' : 0.01, 'high' : 0.05},
+                'allow_autapses' : False},
+                {'type' : syn_type, 'lrate' : 5., 'inp_ports' : 0, 
+                 'del_mod_tau' : 1., 'sig1' : .5, 'sig2' : .7,
+                 'init_w' : {'distribution' : 'uniform', 'low' : .1, 'high' : .6}})
+    return net
+
+
+def plant_net():
+    """ Noisy units connected with a pendulum. """
+    net = network({'min_delay' : 0.1, 'min_buff_size' : 4, 'seed' : 3})
+    src = net.create(1, {'type' : unit_types.source, 'init_val' : 0.5, 
+                         'function' : np.sin})
+    sigs = net.create(3, {'type' : unit_types.noisy_sigmoidal, 'init_val' : 0.1,
+                          'slope' : 1., 'thresh' : 0., 'tau' : 1., 'lambda' : 1.,
+                          'mu' : 0., 'sigma' : .3})
+    pend = net.create(1, {'type' : plant_models.pendulum, 'length' : 1., 
+                          'mass' : 1., 'mu' : 1., 'init_angle' : 0.3,
+                          'init_ang_vel' : 0.})
+    net.connect(src+sigs, sigs, {'rule' : 'all_to_all', 'delay' : 0.2},
+                {'type' : synapse_types.static, 'init_w' : 0.5})
+    net.set_plant_inputs(sigs, pend, {'inp_ports' : 0, 'delays' : 0.1},
+                         {'type' : synapse_types.static, 'init_w' : 1.})
+    net.set_plant_outputs(pend, sigs[:1], {'port_map' : [[(0,0)]], 
+                          'delays' : 0.2}, 
+                          {'type' : synapse_types.static, 'init_w' : 1.})
+    return net
+
+
 class test_comparison_1(unittest.TestCase):
     """ An automated version of the first comparison in test2.ipynb . """
 
@@ -630,6 +736,97 @@ class test_topology(unittest.TestCase):
         max_diff = np.amax(np.abs(retconn-conns))
         self.assertAlmostEqual(max_diff, 0.) 
 
+    def test_spatial_index(self):
+        """ filter_ids gives the same units with and without a spatial index. """
+        from tools.topology import spatial_index
+        topo = topology()
+        net = network({'min_delay' : 0.1, 'min_buff_size' : 4})
+        unit_pars = {'init_val' : 0.5, 'tau' : 1., 'type' : unit_types.linear}
+        geom = {'shape' : 'sheet', 'extent' : [2., 2.], 'center' : [0., 0.]}
+        ids = topo.create_group(net, dict(geom, arrangement='grid', rows=12, 
+                                          columns=12), unit_pars)
+        ids += topo.create_group(net, dict(geom, arrangement='random', 
+                                           n_units=50), unit_pars)
+        bound = {'center' : np.array([0., 0.]), 'extent' : np.array([2., 2.]),
+                 'lower_left' : np.array([-1., -1.]), 'upper_right' : np.array([1., 1.])}
+        specs = [0.5, {'linear' : {'c' : 1., 'a' : 2.}}, {'linear' : {'c' : 1., 'a' : -2.}},
+                 {'gaussian' : {'p_center' : 1., 'sigma' : 0.3}}, 
+                 {'circular' : {'radius' : 0.5}}, 
+                 {'annular' : {'inner_radius' : 0.2, 'outer_radius' : 0.5}},
+                 {'rectangular' : {'lower_left' : [-0.3, -0.2], 'upper_right' : [0.2, 0.4]}}]
+        for wrap in [False, True]:
+            if wrap:
+                dist = lambda x, y: topo.period_dist(x, y, bound)
+                fids_dic = {'edge_wrap' : True, 'distance' : dist, 'boundary' : bound}
+            else:
+                dist = lambda x, y: np.sqrt(sum((x-y)*(x-y)))
+                fids_dic = {'edge_wrap' : False, 'distance' : dist}
+            index = spatial_index(net, ids, bound if wrap else None)
+            for spec in specs:
+                for uid in [ids[0], ids[20], ids[150]]:
+                    center = net.units[uid].coordinates
+                    for id_list in [ids, ids[::3]]:
+                        self.assertEqual(
+                            topo.filter_ids(net, id_list, center, spec, fids_dic),
+                            topo.filter_ids(net, id_list, center, spec, 
+                                            dict(fids_dic, index=index)))
+
+
+    def test_fixed_connections(self):
+        """ topo_connect with number_of_connections, kernels, and no autapses. """
+        topo = topology()
+        net = network({'min_delay' : 0.1, 'min_buff_size' : 4})
+        ids = topo.create_group(net, {'shape' : 'sheet', 'extent' : [2., 2.], 
+                                'center' : [0., 0.], 'arrangement' : 'grid',
+                                'rows' : 10, 'columns' : 10},
+                                {'init_val' : 0.5, 'tau' : 1., 'type' : unit_types.linear})
+        conn_spec = {'connection_type' : 'convergent',
+                     'mask' : {'circular' : {'radius' : 0.7}},
+                     'kernel' : {'gaussian' : {'p_center' : 0.9, 'sigma' : 0.5}},
+                     'delays' : {'linear' : {'c' : 0.1, 'a' : 0.5}},
+                     'weights' : {'linear' : {'c' : 2., 'a' : 1.}},
+                     'number_of_connections' : 8,
+                     'allow_autapses' : False,
+                     'edge_wrap' : True,
+                     'boundary' : {'center' : [0., 0.], 'extent' : [2., 2.]}}
+        topo.topo_connect(net, ids, ids, conn_spec, {'type' : synapse_types.static})
+        bound = {'extent' : np.array([2., 2.])}
+        for uid in ids:
+            pres = [syn.preID for syn in net.syns[uid]]
+            self.assertEqual(len(pres), 8)
+            self.assertEqual(len(set(pres)), 8)
+            self.assertNotIn(uid, pres)
+            for syn, dely in zip(net.syns[uid], net.delays[uid]):
+                d = topo.period_dist(net.units[syn.preID].coordinates, 
+                                     net.units[uid].coordinates, bound)
+                self.assertLessEqual(d, 0.7)
+                self.assertAlmostEqual(syn.w, 2. - d)
+                self.assertAlmostEqual(dely, max(0.1, 0.1*round((0.1 + 0.5*d)/0.1)))
+
+    def test_dist_dim(self):
+        """ Masks use the full distance, and weights the one set by dist_dim. """
+        topo = topology()
+        net = network({'min_delay' : 0.1, 'min_buff_size' : 4})
+        ids = topo.create_group(net, {'shape' : 'sheet', 'extent' : [2., 2.],
+                                'center' : [0., 0.], 'arrangement' : 'grid',
+                                'rows' : 10, 'columns' : 10},
+                                {'init_val' : 0.5, 'tau' : 1., 'type' : unit_types.linear})
+        conn_spec = {'connection_type' : 'divergent',
+                     'mask' : {'circular' : {'radius' : 0.5}},
+                     'kernel' : 1.,
+                     'delays' : {'linear' : {'c' : 0.1, 'a' : 0.5}},
+                     'weights' : {'linear' : {'c' : 2., 'a' : 1.}},
+                     'edge_wrap' : False,
+                     'dist_dim' : 'x'}
+        topo.topo_connect(net, ids, ids, conn_spec, {'type' : synapse_types.static})
+        for uid in ids:
+            c = net.units[uid].coordinates
+            near = [i for i in ids if np.linalg.norm(net.units[i].coordinates - c) <= 0.5]
+            self.assertEqual(sorted([syn.preID for syn in net.syns[uid]]), near)
+            for syn in net.syns[uid]:
+                dx = abs(net.units[syn.preID].coordinates[0] - c[0])
+                self.assertAlmostEqual(syn.w, 2. - dx)
+
 
 class test_sigma_units(unittest.TestCase):
     """ Some of the sigma unit tests from test10.ipynb. """
@@ -773,5 +970,1320 @@ class test_sigma_units(unittest.TestCase):
             self.assertAlmostEqual( calc_vals[i] - sim_val, 0., places=2 )
 
 
+class test_pop_updates(unittest.TestCase):
+    """ Population updates of requirements in flat networks. """
+
+    def create_ssrdc_net(self, pop_updates, sort_rdc, sharp=False, N=12):
+        """ A network with sig_ssrdc(_sharp) units driven by sinusoidal sources. """
+        np.random.seed(12345)
+        net = network({'min_delay' : 0.01, 'min_buff_size' : 4, 'pop_updates' : pop_updates})
+        srcs = net.create(3, {'type' : unit_types.source, 'init_val' : 0.5, 
+                              'function' : lambda t: 0.5})
+        for i, s in enumerate(srcs):
+            net.units[s].set_function(lambda t, i=i: 0.5 + 0.3*np.sin(t+i))
+        unit_params = {'type' : unit_types.sig_ssrdc_sharp if sharp else unit_types.sig_ssrdc,
+                       'init_val' : list(np.random.random(N)),
+                       'slope' : 3., 'thresh' : .5, 'tau' : .02, 'tau_fast' : .05,
+                       'tau_scale' : .1, 'tau_relax' : 1., 'c' : 2., 'Kp' : .1,
+                       'rdc_port' : 0, 'sharpen_port' : 2, 'n_ports' : 3 if sharp else 2, 
+                       'sort_rdc' : sort_rdc }
+        units = net.create(N, unit_params)
+        conn_spec = {'rule' : 'fixed_indegree', 'indegree' : 6, 'allow_autapses' : True,
+                     'delay' : {'distribution' : 'uniform', 'low' : 0.01, 'high' : 0.1} }
+        syn_spec = {'type' : synapse_types.static, 'inp_ports' : 0,
+                    'init_w' : {'distribution' : 'uniform', 'low' : -.3, 'high' : 1.} }
+        net.connect(units, units, conn_spec, syn_spec)
+        conn_spec = {'rule' : 'all_to_all', 'delay' : 0.02}
+        syn_spec = {'type' : synapse_types.static, 'init_w' : 0.3, 'inp_ports' : 1}
+        net.connect(srcs, units, conn_spec, syn_spec)
+        if sharp: # half of the units receive input at the sharpen port
+            syn_spec = {'type' : synapse_types.static, 'init_w' : 1., 'inp_ports' : 2}
+            net.connect([srcs[0]], units[:N//2], conn_spec, syn_spec)
+        return net
+
+    def compare_runs(self, sort_rdc, sharp, places):
+        """ Simulate with and without population updates, and compare. """
+        net_pop = self.create_ssrdc_net(True, sort_rdc, sharp)
+        net_ref = self.create_ssrdc_net(False, sort_rdc, sharp)
+        pop_data = np.array(net_pop.flat_run(1.)[1])
+        ref_data = np.array(net_ref.flat_run(1.)[1])
+        self.assertEqual(len(net_pop.pop_updates), 1)
+        self.assertEqual(len(net_ref.pop_updates), 0)
+        self.assertAlmostEqual(np.abs(pop_data - ref_data).max(), 0., places=places)
+
+    def test_exp_scale_sort_mp(self):
+        self.compare_runs(True, False, 10)
+
+    def test_exp_scale_sort_shrp(self):
+        self.compare_runs(True, True, 10)
+
+    def test_exp_scale_mp(self):
+        # requirements of the same priority are executed in arbitrary order,
+        # so the per-unit updates may run before or after the balance_mp update
+        self.compare_runs(False, False, 3)
+
+    def test_exp_scale_shrp(self):
+        self.compare_runs(False, True, 3)
+
+    def test_scaled_input_sums(self):
+        """ The segmented input sums equal get_mp_input_sum at each update. """
+        for sort_rdc, sharp in [(True, False), (False, True)]:
+            net = self.create_ssrdc_net(True, sort_rdc, sharp)
+            net.flatten()
+            pop = net.pop_updates[0]
+            self.assertEqual(pop.fallback, [])
+            for u in pop.units:
+                self.assertIs(u.scale_facs_rdc.base, pop.coef)
+            errs = []
+            update = pop.update
+            def checked_update(time):
+                w, inp = pop.get_inputs(time)
+                sums = net.segment_sum(pop.coef * w * inp, pop.starts)
+                errs.append(max([abs(s - u.get_mp_input_sum(time))
+                                 for s, u in zip(sums, pop.units)]))
+                update(time)
+            pop.update = checked_update
+            net.flat_run(0.2)
+            self.assertLess(max(errs), 1e-12)
+
+    def test_rate_rank(self):
+        """ The incrementally updated ranking sorts the inputs. """
+        net = self.create_ssrdc_net(True, True)
+        net.flat_run(0.5)
+        for u in net.units[3:]:
+            inp = u.sort_inp.copy()
+            inp[:len(u.exc_idx_rdc)] = u.mp_inputs[u.rdc_port][u.exc_idx_rdc]
+            if not u.autapse:
+                inp[-1] = u.buffer[-1]
+            self.assertTrue(np.all(np.diff(inp[u.rate_rank]) >= 0.))
+
+    def test_sort_scale_baseline(self):
+        """ sort_scale equals the original per-unit formula, with a fake autapse. """
+        from units.ds_rdc import sort_scale
+        net = self.create_ssrdc_net(True, True)
+        net.flat_run(0.3)
+        time = net.sim_time
+        n_fake = 0
+        for u in net.units[3:]:
+            # the formula of the original upd_exp_scale_sort_mp
+            exc_rdc_inp = u.mp_inputs[u.rdc_port][u.exc_idx_rdc]
+            exc_rdc_w = u.get_mp_weights(time)[u.rdc_port][u.exc_idx_rdc]
+            aut_idx = u.autapse_idx
+            if not u.autapse:
+                exc_rdc_inp = np.concatenate((exc_rdc_inp, [u.buffer[-1]]))
+                exc_rdc_w = np.concatenate((exc_rdc_w, [0]))
+                aut_idx = len(exc_rdc_inp) - 1
+                self.assertEqual(u.autapse_idx, aut_idx)
+                n_fake += 1
+            rate_rank = np.argsort(exc_rdc_inp, kind='stable')
+            ideal_exc_inp = np.dot(exc_rdc_w[rate_rank], u.ideal_rates)
+            my_ideal_rate = u.ideal_rates[np.where(rate_rank == aut_idx)[0][0]]
+            n = len(u.exc_idx_rdc)
+            I = (np.sum(u.scale_facs_rdc[u.exc_idx_rdc] * exc_rdc_inp[:n] * exc_rdc_w[:n])
+                 - u.get_mp_input_sum(time))
+            self.assertAlmostEqual(sort_scale(u, time), (my_ideal_rate - I) / ideal_exc_inp,
+                                   places=10)
+        self.assertTrue(n_fake > 0)
+
+
+class test_ds_branches(unittest.TestCase):
+    """ Branch-matrix evaluation of double sigma units. """
+
+    def compare_runs(self, unit_type, n_branches):
+        """ Simulate with and without batched branch evaluation, and compare. """
+        net_pop, units = ds_net(unit_type, n_branches, True)
+        net_ref = ds_net(unit_type, n_branches, False)[0]
+        pop_data = np.array(net_pop.flat_run(0.5)[1])
+        ref_data = np.array(net_ref.flat_run(0.5)[1])
+        self.assertEqual(len(net_pop.pop_inp_updates), 1)
+        self.assertEqual(len(net_ref.pop_inp_updates), 0)
+        self.assertAlmostEqual(np.abs(pop_data - ref_data).max(), 0., places=10)
+        # the branch-matrix sums agree with the explicit per-branch expression
+        for uid in units:
+            u = net_pop.units[uid]
+            x = np.array([u.mp_inp_sum[p][-1] for p in u.br_ports])
+            if u.normal: # normalized by the slow average of each branch input
+                y = np.array([u.lpf_slow_mp_inp_sum[p] for p in u.br_ports])
+                x = (x - y) / y
+            ds = sum([ w * (1./(1.+np.exp(-sl*(xi-th))) - u.phi) for w, sl, th, xi
+                       in zip(u.br_w, u.slopes, u.threshs, x) ])
+            if u.soma:
+                ds += u.mp_inp_sum[u.soma_port][-1]
+            self.assertAlmostEqual(u.branch_sum(np.array(u.mp_inp_sum))[-1], ds, places=12)
+
+    def test_double_sigma(self):
+        self.compare_runs(unit_types.double_sigma, 4)
+
+    def test_sds_normal(self):
+        self.compare_runs(unit_types.sds_n, 3)
+
+    def test_ds_normal_sharp(self):
+        self.compare_runs(unit_types.ds_n_sharp, 3)
+
+    def test_ssrdc_sharp(self):
+        """ Flat and non-flat runs of the ssrdc_sharp double sigma units agree. """
+        for unit_type, n_br in [(unit_types.ds_ssrdc_sharp, 3), (unit_types.sds_n_ssrdc_sharp, 2)]:
+            extra = {'tau_scale' : .1, 'tau_relax' : .5, 'Kp' : .5, 'sort_rdc' : True}
+            net, units = ds_net(unit_type, n_br, False, extra=extra)
+            flat_data = np.array(net.flat_run(0.5)[1])
+            u = net.units[units[0]]
+            self.assertEqual(u.ds_inp_sum.shape, (net.min_buff_size,))
+            ref_data = np.array(ds_net(unit_type, n_br, False,
+                                extra=extra)[0].run(0.5)[1])
+            self.assertTrue(np.isfinite(flat_data).all())
+            self.assertLess(np.abs(flat_data[units] - ref_data[units]).max(), 1e-2)
+
+class test_syn_index(unittest.TestCase):
+    """ Segmented sums over the synapse index of the network. """
+
+    def create_norm_net(self, pop_updates, N=6):
+        """ A network with out_norm_am_sig units that have the normalization requirements. """
+        np.random.seed(2468)
+        net = network({'min_delay' : 0.01, 'min_buff_size' : 4, 'pop_updates' : pop_updates})
+        srcs = net.create(3, {'type' : unit_types.source, 'init_val' : 0.5, 
+                              'function' : lambda t: 0.5})
+        units = net.create(N, {'type' : unit_types.out_norm_am_sig, 'init_val' : 0.5,
+                               'slope' : 2., 'thresh' : .2, 'tau' : .05, 'tau_slow' : 1.,
+                               'des_out_w_abs_sum' : 2.})
+        for uid in units:
+            net.units[uid].syn_needs.update([syn_reqs.l1_norm_factor, 
+                        syn_reqs.l1_norm_factor_mp, syn_reqs.w_sum_mp, 
+                        syn_reqs.out_norm_factor])
+        w_spec = {'distribution' : 'uniform', 'low' : -1., 'high' : 1.}
+        net.connect(srcs, units, {'rule' : 'all_to_all', 'delay' : 0.02},
+                    {'type' : synapse_types.static, 'init_w' : w_spec, 
+                     'inp_ports' : [0, 1, 1]*N})
+        # the last unit sends no projections (an empty outgoing segment)
+        net.connect(units[:-1], units[1:], {'rule' : 'fixed_indegree', 'indegree' : 3,
+                    'delay' : 0.03}, {'type' : synapse_types.static, 
+                    'init_w' : w_spec, 'inp_ports' : 0})
+        return net, units
+
+    def test_segment_sum(self):
+        net = network({'min_delay' : 0.01, 'min_buff_size' : 4})
+        vals = np.array([1., 2., 3., 4., 5.])
+        sums = net.segment_sum(vals, [0, 2, 2, 5, 5])
+        self.assertTrue(np.array_equal(sums, np.array([3., 0., 12., 0.])))
+
+    def test_index(self):
+        net, units = self.create_norm_net(True)
+        # add_out_norm_factor uses out_syns, without building the index
+        self.assertFalse(net.syn_index_ready)
+        self.assertTrue(hasattr(net.units[units[0]], 'out_syns_idx'))
+        net.init_syn_index()
+        for k, syn in enumerate(net.all_syns):
+            self.assertIs(syn, net.syns[net.syn_post[k]][net.syn_pos[k]])
+        for uid in range(net.n_units):
+            out = net.out_order[net.out_starts[uid]:net.out_starts[uid+1]]
+            n_out = sum([syn.preID == uid for syn in net.all_syns])
+            self.assertEqual(len(out), n_out)
+            self.assertTrue(all([net.all_syns[k].preID == uid for k in out]))
+            # out_order is the flat form of out_syns
+            self.assertEqual(out.tolist(), [net.in_starts[post] + loc for post, loc
+                                            in sorted(net.out_syns[uid])])
+
+    def test_norm_factors(self):
+        """ Population updates of the normalization factors match the per-unit ones. """
+        net_pop, units = self.create_norm_net(True)
+        net_ref = self.create_norm_net(False)[0]
+        pop_data = np.array(net_pop.flat_run(0.5)[1])
+        ref_data = np.array(net_ref.flat_run(0.5)[1])
+        self.assertEqual(len(net_pop.pop_updates), 4)
+        self.assertAlmostEqual(np.abs(pop_data - ref_data).max(), 0., places=12)
+        for uid in units:
+            u_pop = net_pop.units[uid]
+            u_ref = net_ref.units[uid]
+            self.assertAlmostEqual(u_pop.l1_norm_factor, u_ref.l1_norm_factor, places=12)
+            self.assertAlmostEqual(u_pop.out_norm_factor, u_ref.out_norm_factor, 
+                                   delta=1e-12*u_ref.out_norm_factor)
+            for p in range(2):
+                self.assertAlmostEqual(u_pop.l1_norm_factor_mp[p], 
+                                       u_ref.l1_norm_factor_mp[p], places=12)
+                self.assertAlmostEqual(u_pop.w_sum_mp[p], u_ref.w_sum_mp[p], places=12)
+            ws = np.array([syn.w for syn in net_pop.syns[uid] if syn.port == 1])
+            self.assertAlmostEqual(u_pop.w_sum_mp[1], ws.sum(), places=12)
+
+
+class test_rga_pop(unittest.TestCase):
+    """ Batched updates of synapses in the rga family. """
+
+    def test_rga_family(self):
+        """ Batched and per-synapse updates produce the same weights. """
+        types = ['rga', 'gated_rga', 'rga_21', 'gated_rga_21', 'gated_rga_21_dc',
+                 'gated_normal_rga_21', 'normal_rga', 'gated_normal_rga', 
+                 'gated_rga_diff', 'gated_normal_rga_diff', 'gated_slide_rga_diff',
+                 'gated_normal_slide_rga_diff']
+        for name in types:
+            with self.subTest(syn_type=name):
+                syn_type = getattr(synapse_types, name)
+                net_pop = rga_net(syn_type, True)
+                net_ref = rga_net(syn_type, False)
+                pop_data = np.array(net_pop.flat_run(0.5)[1])
+                ref_data = np.array(net_ref.flat_run(0.5)[1])
+                self.assertEqual(len(net_pop.pop_syn_updates), 1)
+                self.assertEqual(len(net_ref.pop_syn_updates), 0)
+                w_pop = np.array([s.w for l in net_pop.syns for s in l])
+                w_ref = np.array([s.w for l in net_ref.syns for s in l])
+                self.assertAlmostEqual(np.abs(pop_data - ref_data).max(), 0., places=12)
+                self.assertAlmostEqual(np.abs(w_pop - w_ref).max(), 0., places=12)
+
+
+class test_noise_streams(unittest.TestCase):
+    """ Reproducibility of the network's noise streams. """
+
+    def create_noisy_net(self, seed, n_units=3):
+        """ A network with unconnected noisy units using both flat integrators. """
+        net = network({'min_delay' : 0.1, 'min_buff_size' : 5, 'seed' : seed,
+                       'noise_block' : 32})
+        pars = {'type' : unit_types.noisy_sigmoidal, 'init_val' : 0.5,
+                'slope' : 1., 'thresh' : 0., 'tau' : 0.1, 'lambda' : 0.,
+                'mu' : 0., 'sigma' : 0.5}
+        net.create(n_units, pars) # Euler-Maruyama units
+        pars['lambda'] = 1.
+        net.create(n_units, pars) # exponential Euler units
+        return net
+
+    def test_block_sizes(self):
+        """ The samples don't depend on the size of the pre-generated blocks. """
+        seq = np.random.SeedSequence(7, spawn_key=(0, 3))
+        small = noise_stream(seq, size=4, block_size=8)
+        large = noise_stream(seq, size=4, block_size=1000)
+        for _ in range(10):
+            self.assertTrue(np.array_equal(small.draw(), large.draw()))
+
+    def test_reproducible(self):
+        """ Same seed gives the same run; the noise of a unit is its own. """
+        times, acts1, _ = self.create_noisy_net(11).flat_run(2.)
+        times, acts2, _ = self.create_noisy_net(11).flat_run(2.)
+        self.assertTrue(np.array_equal(acts1, acts2))
+        times, acts3, _ = self.create_noisy_net(12).flat_run(2.)
+        self.assertFalse(np.allclose(acts1, acts3))
+        # units keep their noise when other noisy units are added
+        times, acts4, _ = self.create_noisy_net(11, n_units=4).flat_run(2.)
+        self.assertTrue(np.array_equal(acts1[:3], acts4[:3]))
+
+    def test_unique_keys(self):
+        """ A noise stream key can't be used twice. """
+        net = self.create_noisy_net(3)
+        with self.assertRaises(ValueError):
+            net.get_noise_stream((0, 1), 5)
+
+
+class test_out_index(unittest.TestCase):
+    """ The index of the projections sent by each unit. """
+
+    def create_net(self):
+        """ Sources projecting to sigmoidals and to a pendulum. """
+        net = network({'min_delay' : 0.1, 'min_buff_size' : 5})
+        src_pars = {'init_val' : 0.5, 'function' : lambda t: 0.,
+                    'type' : unit_types.source}
+        sources = net.create(3, src_pars)
+        sig_pars = {'init_val' : 0.5, 'slope' : 1., 'thresh' : 0., 'tau' : 0.5,
+                    'type' : unit_types.sigmoidal}
+        sigs = net.create(4, sig_pars)
+        pend = net.create(1, {'type' : plant_models.pendulum, 'length' : 1.,
+                              'mass' : 1., 'mu' : 1., 'init_angle' : 0.,
+                              'init_ang_vel' : 0.})
+        conn_spec = {'rule' : 'all_to_all', 'delay' : 0.2, 
+                     'allow_autapses' : False}
+        syn_spec = {'init_w' : 0.5, 'type' : synapse_types.static}
+        net.connect(sources, sigs, conn_spec, syn_spec)
+        net.connect(sigs, sigs, conn_spec, syn_spec)
+        net.set_plant_inputs(sources[1:], pend, {'inp_ports' : 0, 'delays' : 0.1},
+                             {'init_w' : 1., 'type' : synapse_types.static})
+        net.set_plant_outputs(pend, sigs[:2], {'port_map' : [[(0,0)], [(1,0)]],
+                              'delays' : 0.1}, syn_spec)
+        return net, sources, sigs
+
+    def test_index(self):
+        """ The index finds the same synapses as a scan of the network. """
+        net, sources, sigs = self.create_net()
+        for uid in range(net.n_units):
+            scan = [(post, loc) for post, syn_list in enumerate(net.syns)
+                    for loc, syn in enumerate(syn_list) if syn.preID == uid
+                    and not hasattr(syn, 'plant_id')]
+            self.assertEqual(sorted(net.out_syns[uid]), scan)
+            pl_scan = [(0, port, idx) for port, syn_list in 
+                       enumerate(net.plants[0].inp_syns) for idx, syn in
+                       enumerate(syn_list) if syn.preID == uid]
+            self.assertEqual(net.plant_out_syns[uid], pl_scan)
+
+    def test_set_function(self):
+        """ set_function rewires the inputs of units and plants. """
+        net, sources, sigs = self.create_net()
+        fun = lambda t: 2.
+        net.units[sources[1]].set_function(fun)
+        for post, loc in net.out_syns[sources[1]]:
+            self.assertTrue(net.act[post][loc] is fun)
+        self.assertTrue(net.plants[0].inputs[0][0] is fun)
+        self.assertFalse(net.plants[0].inputs[0][1] is fun)
+
+
+class test_bulk_connect(unittest.TestCase):
+    """ Array-based connections. """
+
+    def create_net(self, n=20):
+        net = network({'min_delay' : 0.1, 'min_buff_size' : 5})
+        units = net.create(n, {'type' : unit_types.sigmoidal, 'init_val' : 0.5, 
+                        'slope' : 1., 'thresh' : 0., 'tau' : 1., 'n_ports' : 2})
+        return net, units
+
+    def test_rules(self):
+        """ Connection rules without autapses or multapses. """
+        syn_spec = {'type' : synapse_types.static, 
+                    'init_w' : {'distribution' : 'equal_norm', 'norm' : 2.}}
+        for rule, deg in [('fixed_indegree', 'indegree'), 
+                          ('fixed_outdegree', 'outdegree')]:
+            net, units = self.create_net()
+            net.connect(units, units, {'rule' : rule, deg : 19, 'delay' : 0.2,
+                        'allow_autapses' : False}, syn_spec)
+            for uid in units:
+                pres = [syn.preID for syn in net.syns[uid]]
+                self.assertEqual(sorted(pres), [i for i in units if i != uid])
+                w = np.array([syn.w for syn in net.syns[uid]])
+                self.assertAlmostEqual(np.linalg.norm(w), 2.)
+        net, units = self.create_net()
+        conn_spec = {'rule' : 'fixed_indegree', 'indegree' : 20, 'delay' : 0.2,
+                     'allow_autapses' : False}
+        with self.assertRaises(ValueError):
+            net.connect(units, units, conn_spec, syn_spec)
+        conn_spec['allow_multapses'] = True
+        net.connect(units, units, conn_spec, syn_spec)
+        for uid in units:
+            self.assertEqual(len(net.syns[uid]), 20)
+            self.assertFalse(uid in [syn.preID for syn in net.syns[uid]])
+
+    def test_connect_arrays(self):
+        """ Synapses, delays and ports from arrays. """
+        net, units = self.create_net(4)
+        pre = np.array([0, 1, 2, 0, 3])
+        post = np.array([1, 2, 1, 3, 1])
+        w = np.array([1., 2., 3., 4., 5.])
+        net.connect_arrays(pre, post, {'type' : synapse_types.static}, w, 
+                           [0.1, 0.2, 0.3, 0.4, 0.5], ports=[0, 0, 1, 0, 1])
+        self.assertEqual([syn.preID for syn in net.syns[1]], [0, 2, 3])
+        self.assertEqual([syn.w for syn in net.syns[1]], [1., 3., 5.])
+        self.assertEqual([syn.port for syn in net.syns[1]], [0, 1, 1])
+        self.assertEqual([syn.syns_loc for syn in net.syns[1]], [0, 1, 2])
+        self.assertEqual(net.delays[1], [0.1, 0.3, 0.5])
+        self.assertEqual(net.units[1].port_idx, [[0], [1, 2]])
+        self.assertAlmostEqual(net.units[0].delay, 0.5)
+        self.assertEqual(net.out_syns[0], [(1, 0), (3, 0)])
+        with self.assertRaises(ValueError):
+            net.connect_arrays(pre, post, {'type' : synapse_types.static}, 
+                               1., 0.15)
+        with self.assertRaises(ValueError):
+            net.connect_arrays(pre, post, {'type' : synapse_types.static}, 
+                               [1., 2.], 0.1)
+
+
+class test_flat_index(unittest.TestCase):
+    """ The input index arrays built by network.flatten. """
+
+    def test_inputs(self):
+        """ acts_idx gathers the delayed inputs of each unit. """
+        net = network({'min_delay' : 0.1, 'min_buff_size' : 4})
+        # a vectorizable function, and one that must be called per time value
+        src = net.create(2, {'type' : unit_types.source, 'init_val' : 0.5,
+                             'function' : [lambda t: np.sin(t), 
+                                           lambda t: max(0., t+0.3)]})
+        sigs = net.create(3, {'type' : unit_types.sigmoidal, 'init_val' : 0.1,
+                        'slope' : 1., 'thresh' : 0., 'tau' : 1.})
+        pend = net.create(1, {'type' : plant_models.pendulum, 'length' : 1.,
+                              'mass' : 1., 'mu' : 1., 'init_angle' : 0.3,
+                              'init_ang_vel' : 0.})
+        net.connect(src+sigs, sigs, {'rule' : 'all_to_all', 'delay' : 
+                    {'distribution' : 'uniform', 'low' : 0.1, 'high' : 0.4}},
+                    {'type' : synapse_types.static, 'init_w' : 0.5})
+        net.set_plant_outputs(pend, sigs[:1], {'port_map' : [[(0,0)]],
+                              'delays' : 0.2}, 
+                              {'type' : synapse_types.static, 'init_w' : 1.})
+        net.units[src[0]].set_function(lambda t: np.sin(t), vectorized=True)
+        # a function with side effects is only called once per time value
+        calls = []
+        src += net.create(1, {'type' : unit_types.source, 'init_val' : 0.,
+                              'function' : lambda t: calls.append(t) or 0.})
+        net.flatten()
+        self.assertTrue(np.allclose(net.acts[0], np.sin(net.ts)))
+        self.assertTrue(np.allclose(net.acts[1], np.maximum(0., net.ts+0.3)))
+        self.assertEqual(calls, net.ts.tolist())
+        net.acts[:] = np.random.random(net.acts.shape)
+        mbs = net.min_buff_size
+        for uid in sigs:
+            gathered = net.acts_win[net.acts_idx[uid]]
+            for k, syn in enumerate(net.syns[uid]):
+                if hasattr(syn, 'plant_out'):
+                    row = net.p_st_var_idx[syn.plant_id][syn.plant_out]
+                else:
+                    row = net.first_idx[syn.preID]
+                steps = int(round(net.delays[uid][k]/net.min_delay)) * mbs
+                start = net.ts_buff_size - steps - 1
+                self.assertTrue(np.array_equal(gathered[k], 
+                                net.acts[row, start:start+mbs]))
+
+
+class test_net_store(unittest.TestCase):
+    """ Saving and loading networks with tools.net_store. """
+
+    def continue_run(self, net, flat=True, run_time=0.3):
+        """ Compares a simulation with one that is saved and loaded halfway. """
+        import tempfile
+        from tools.net_store import save_network, load_network
+        run = (lambda n, T: n.flat_run(T)) if flat else (lambda n, T: n.run(T))
+        run(net, run_time)
+        with tempfile.TemporaryDirectory() as path:
+            save_network(net, path)
+            funs = {u.ID : u.get_act for u in net.units 
+                    if u.type == unit_types.source}
+            net2 = load_network(path, funs)
+            np.random.seed(10) # for the solvers of non-flat networks
+            times1, acts1, plants1 = run(net, run_time)
+            np.random.seed(10)
+            times2, acts2, plants2 = run(net2, run_time)
+        self.assertTrue(np.array_equal(times1, times2))
+        self.assertTrue(np.array_equal(np.array(acts1), np.array(acts2)))
+        for p1, p2 in zip(plants1, plants2):
+            self.assertTrue(np.array_equal(p1, p2))
+        w1 = [syn.w for syn_list in net.syns for syn in syn_list]
+        w2 = [syn.w for syn_list in net2.syns for syn in syn_list]
+        self.assertTrue(np.array_equal(w1, w2))
+        return net2
+
+    def test_flat_pop_updates(self):
+        """ Loaded flat networks with population updates continue exactly. """
+        net = rga_net(synapse_types.gated_normal_rga_diff, True)
+        net.flatten()
+        net2 = self.continue_run(net)
+        self.assertEqual(len(net2.pop_updates), len(net.pop_updates))
+        self.assertEqual(len(net2.pop_syn_updates), len(net.pop_syn_updates))
+        net, _ = ds_net(unit_types.double_sigma, 4, True)
+        net.flatten()
+        self.continue_run(net)
+
+    def test_plants_and_noise(self):
+        """ Plants and noise streams are restored in flat and non-flat networks. """
+        net = plant_net()
+        net.flatten()
+        net2 = self.continue_run(net)
+        self.assertEqual(set(net2.noise_streams), set(net.noise_streams))
+        self.continue_run(plant_net(), flat=False)
+
+    def test_functions(self):
+        """ Source functions that can't be imported must be provided. """
+        import tempfile
+        from tools.net_store import save_network, load_network
+        net = plant_net()
+        src = net.create(1, {'type' : unit_types.source, 'init_val' : 0.,
+                             'function' : lambda t: 0.})
+        with tempfile.TemporaryDirectory() as path:
+            save_network(net, path)
+            self.assertRaises(ValueError, load_network, path)
+            net2 = load_network(path, {src[0] : lambda t: 2.})
+        self.assertEqual(net2.units[src[0]].get_act(0.), 2.)
+        self.assertTrue(net2.units[0].get_act is np.sin)
+
+    def test_ei_network(self):
+        """ Weight-tracking units of ei_network read the weights of loaded synapses. """
+        import tempfile
+        from tools.ei_network import ei_network
+        from tools.net_store import save_network, load_network
+        np.random.seed(321)
+        ein = ei_network(['L'])
+        ein.build()
+        with tempfile.TemporaryDirectory() as path:
+            save_network(ein.net, path)
+            net2 = load_network(path, unset_ok=True)
+        for uid in ein.layers['L'].w_track:
+            syn = net2.units[uid].get_act.__self__
+            self.assertTrue(any(syn is s for s in net2.syns[syn.postID]))
+            self.assertEqual(net2.units[uid].get_act(0.), ein.net.units[uid].get_act(0.))
+            syn.w = 7.
+            self.assertEqual(net2.units[uid].get_act(0.), 7.)
+
+class test_build_cache(unittest.TestCase):
+    """ Caching networks created by configuration-driven builders. """
+
+    def builder(self, cfg, n_src=1):
+        """ A network of sigmoidal units driven by sinusoidal sources. """
+        self.n_builds += 1
+        net = network({'min_delay' : 0.05, 'min_buff_size' : 4})
+        srcs = net.create(n_src, {'type' : unit_types.source, 'init_val' : 0.,
+                                  'function' : np.sin})
+        sigs = net.create(cfg['N'], {'type' : unit_types.sigmoidal, 'init_val' : 0.1,
+                          'slope' : 1., 'thresh' : 0., 'tau' : cfg['tau']})
+        net.connect(srcs+sigs, sigs, {'rule' : 'all_to_all', 'delay' : 0.1},
+                    {'type' : synapse_types.static, 'init_w' : cfg['w']})
+        return net, {'srcs' : srcs, 'sigs' : sigs}
+
+    def patcher(self, net, extras, cfg):
+        """ Writes the 'tau' and 'w' values of cfg into the network. """
+        from tools.build_cache import patch_units, patch_syns
+        sigs = extras[0]['sigs']
+        patch_units(net, sigs, {'tau' : cfg['tau']})
+        patch_syns(net, [syn for uid in sigs for syn in net.syns[uid]], {'w' : cfg['w']})
+
+    def test_cache(self):
+        """ Hits, misses, and patched parameters. """
+        import tempfile
+        from tools.build_cache import build_cache
+        self.n_builds = 0
+        cfg = {'N' : 3, 'tau' : 0.1, 'w' : 0.5}
+        with tempfile.TemporaryDirectory() as path:
+            cache = build_cache(self.builder, path, patch_keys=['tau', 'w'],
+                                patcher=self.patcher)
+            net1, pops1 = cache.get(cfg)
+            net2, pops2 = cache.get(cfg)
+            self.assertEqual((cache.misses, cache.hits, self.n_builds), (1, 1, 1))
+            self.assertEqual(pops1, pops2)
+            self.assertTrue(np.array_equal(net1.flat_run(1.)[1], net2.flat_run(1.)[1]))
+            # patched parameters
+            cfg2 = {'N' : 3, 'tau' : 0.3, 'w' : -0.2}
+            net3, _ = cache.get(cfg2)
+            self.assertEqual(self.n_builds, 1)
+            net4, _ = self.builder(cfg2)
+            self.assertTrue(np.array_equal(net3.flat_run(1.)[1], net4.flat_run(1.)[1]))
+            # structural changes
+            cache.get({'N' : 4, 'tau' : 0.1, 'w' : 0.5})
+            cache.get(cfg, n_src=2)
+            self.assertEqual((cache.misses, cache.hits), (3, 2))
+
+    def lin_builder(self, cfg):
+        """ A network of linear units integrated by a linear_propagator. """
+        net = network({'min_delay' : 0.05, 'min_buff_size' : 4, 'exact_linear' : True})
+        srcs = net.create(1, {'type' : unit_types.source, 'init_val' : 0.,
+                              'function' : np.sin})
+        lins = net.create(3, {'type' : unit_types.linear, 'init_val' : 0.1,
+                              'tau' : cfg['tau']})
+        net.connect(srcs+lins, lins, {'rule' : 'all_to_all', 'delay' : 0.1},
+                    {'type' : synapse_types.static, 'init_w' : 0.5})
+        return net, {'lins' : lins}
+
+    def test_exact_linear(self):
+        """ Patched time constants reach the linear_propagator. """
+        import tempfile
+        from tools.build_cache import build_cache, patch_units
+        patcher = lambda net, extras, cfg: patch_units(net, extras[0]['lins'],
+                                                       {'tau' : cfg['tau']})
+        with tempfile.TemporaryDirectory() as path:
+            cache = build_cache(self.lin_builder, path, patch_keys=['tau'],
+                                patcher=patcher)
+            cache.get({'tau' : 0.05})
+            net1, _ = cache.get({'tau' : 0.5})
+            self.assertEqual(cache.hits, 1)
+            self.assertEqual(sum(len(p.units) for p in net1.linear_props), 3)
+            net2, _ = self.lin_builder({'tau' : 0.5})
+            self.assertTrue(np.allclose(net1.flat_run(1.)[1], net2.flat_run(1.)[1]))
+
+
+    def test_function_keys(self):
+        """ Configurations with functions that differ have different keys. """
+        from tools.build_cache import build_cache
+        cache = build_cache(self.builder, '.')
+        key = lambda f: cache.key({'N' : 3, 'f' : f})
+        self.assertNotEqual(key(lambda t: np.sin(t)), key(lambda t: np.cos(t)))
+        self.assertNotEqual(key(lambda t: 1.), key(lambda t: 2.))
+        self.assertEqual(key(lambda t: 1.), key(lambda t: 1.))
+        # captured values
+        make = lambda a: (lambda t: a * t)
+        self.assertNotEqual(key(make(1.)), key(make(2.)))
+        self.assertEqual(key(make(1.)), key(make(1.)))
+        self.assertNotEqual(key(lambda t, a=1.: a * t), key(lambda t, a=2.: a * t))
+        self.assertEqual(key(np.sin), key(np.sin))
+        # captured values that can't be hashed
+        net = network({'min_delay' : 0.05, 'min_buff_size' : 4})
+        self.assertRaises(TypeError, key, lambda t: net.sim_time + t)
+
+class test_checkpoint(unittest.TestCase):
+    """ Restoring the dynamic state of networks. """
+
+    def resume(self, net, restore, flat=True, run_time=0.3):
+        """ Compares a simulation with the one obtained after restoring its state.
+
+            'restore' is a function that receives the network and returns a
+            function that restores the network's current state.
+        """
+        run = (lambda T: net.flat_run(T)) if flat else (lambda T: net.run(T))
+        run(run_time)
+        reset = restore(net)
+        times1, acts1, plants1 = run(run_time)
+        w1 = [syn.w for syn_list in net.syns for syn in syn_list]
+        reset()
+        times2, acts2, plants2 = run(run_time)
+        w2 = [syn.w for syn_list in net.syns for syn in syn_list]
+        self.assertTrue(np.array_equal(times1, times2))
+        self.assertTrue(np.array_equal(np.array(acts1), np.array(acts2)))
+        for p1, p2 in zip(plants1, plants2):
+            self.assertTrue(np.array_equal(p1, p2))
+        self.assertEqual(w1, w2)
+
+    def test_dynamic_state(self):
+        """ set_dynamic_state restores requirements, synapses, plants, and noise. """
+        def restore(net):
+            state = net.dynamic_state()
+            return lambda: net.set_dynamic_state(state)
+        net = rga_net(synapse_types.gated_normal_rga_diff, True)
+        net.flatten()
+        self.resume(net, restore)
+        net = rga_net(synapse_types.gated_normal_rga_diff, False)
+        self.resume(net, restore, flat=False)
+        for flat in [True, False]:
+            net = plant_net()
+            if flat:
+                net.flatten()
+            self.resume(net, restore, flat=flat)
+
+    def test_files(self):
+        """ Checkpoints on disk, and their structural validation. """
+        import tempfile
+        from tools.net_store import save_checkpoint, load_checkpoint
+        with tempfile.TemporaryDirectory() as path:
+            def restore(net):
+                save_checkpoint(net, path)
+                return lambda: load_checkpoint(net, path)
+            net, _ = ds_net(unit_types.double_sigma, 4, True)
+            net.flatten()
+            self.resume(net, restore)
+            net = plant_net()
+            net.flatten()
+            self.resume(net, restore)
+            other = plant_net()
+            self.assertRaises(ValueError, load_checkpoint, other, path)
+            other, _ = ds_net(unit_types.double_sigma, 4, True)
+            other.flatten()
+            self.assertRaises(ValueError, load_checkpoint, other, path)
+
+    def test_snapshot_fork(self):
+        """ Snapshots reuse their arrays, and forked branches match restored runs. """
+        import os
+        net = rga_net(synapse_types.gated_normal_rga_diff, True)
+        net.flatten()
+        net.flat_run(0.2)
+        snap = net.snapshot()
+        acts = snap['acts']
+        self.assertTrue(net.snapshot(into=snap)['acts'] is acts)
+        def restore(n):
+            n.snapshot(into=snap)
+            return lambda: n.restore(snap)
+        self.resume(net, restore)
+        # numpy's global generator is only restored on request for flat networks
+        net.snapshot(into=snap)
+        draws = [np.random.random() for _ in range(2)]
+        net.restore(snap)
+        self.assertNotEqual(np.random.random(), draws[0])
+        net.restore(snap, global_rng=True)
+        self.assertEqual(np.random.random(), draws[0])
+        net2 = plant_net()
+        snap2 = net2.snapshot()
+        draw = np.random.random()
+        net2.restore(snap2)
+        self.assertEqual(np.random.random(), draw)
+        if not hasattr(os, 'fork'):
+            return
+        net.restore(snap)
+        branch = lambda n, T: n.flat_run(T)[1]
+        durations = [0.2, 0.3]
+        forked = net.fork(branch, durations, n_procs=1)
+        self.assertTrue(np.array_equal(net.acts, acts)) # the parent didn't run
+        for T, acts_f in zip(durations, forked):
+            net.restore(snap)
+            self.assertTrue(np.array_equal(branch(net, T), acts_f))
+        def fail(n, arg):
+            raise KeyError(arg)
+        self.assertRaises(KeyError, net.fork, fail, ['a'])
+
+class test_profiling(unittest.TestCase):
+    """ Timing the parts of the simulation steps. """
+
+    def test_profiled_runs(self):
+        """ Profiled simulations have the same results as unprofiled ones. """
+        for flat in [True, False]:
+            results = []
+            for profile in [False, True]:
+                np.random.seed(42)
+                net = rga_net(synapse_types.gated_normal_rga_diff, flat)
+                if flat:
+                    net.flatten()
+                run = net.flat_run if flat else net.run
+                if profile:
+                    prof = net.start_profiling()
+                times, acts, _ = run(0.2)
+                results.append((times, np.array(acts),
+                                [syn.w for syn_list in net.syns for syn in syn_list]))
+            self.assertTrue(np.array_equal(results[0][0], results[1][0]))
+            self.assertTrue(np.array_equal(results[0][1], results[1][1]))
+            self.assertEqual(results[0][2], results[1][2])
+            self.assertTrue(net.stop_profiling() is prof)
+            self.assertTrue(net.profiler is None)
+            rep = prof.as_dict()
+            self.assertEqual(rep['steps'], len(times))
+            kinds = {(e['kind'], e['name']) for e in rep['entries']}
+            self.assertTrue(('phase', 'store') in kinds)
+            self.assertTrue(('phase', 'units') in kinds)
+            if flat:
+                for key in [('phase', 'synapses'), ('phase', 'requirements'),
+                            ('synapse', 'static'), ('pop', 'rga_syn_pop')]:
+                    self.assertTrue(key in kinds, str(key))
+                phases = [e for e in rep['entries'] if e['kind'] == 'phase']
+                self.assertAlmostEqual(sum([e['share'] for e in phases]), 1.)
+            self.assertTrue(isinstance(prof.table(), str))
+
+class test_benchmarks(unittest.TestCase):
+    """ The benchmark suite in tools/benchmarks. """
+
+    def test_measure_and_history(self):
+        """ Measurements of a workload, and comparisons in the history file. """
+        import os, tempfile
+        from tools import benchmarks
+        res = benchmarks.measure('hello_world', sim_time=2., repeats=2)
+        self.assertEqual(res['steps'], 20)
+        self.assertAlmostEqual(res['sim_s'], 2.)
+        self.assertAlmostEqual(res['sim_per_wall'], res['steps_per_s'] * 0.1)
+        self.assertEqual((res['units'], res['syns']), (11, 30))
+        self.assertRaises(ValueError, benchmarks.measure, 'no_such_workload')
+        with tempfile.TemporaryDirectory() as path:
+            hist = os.path.join(path, 'hist.json')
+            self.assertEqual(benchmarks.load_history(hist), [])
+            old = benchmarks.make_record({'hello_world' : res})
+            slow = dict(res, steps_per_s=res['steps_per_s'] / 2.)
+            benchmarks.append_history(old, hist)
+            benchmarks.append_history(benchmarks.make_record({'hello_world' : slow}), hist)
+            history = benchmarks.load_history(hist)
+            self.assertEqual(len(history), 2)
+            rows = benchmarks.compare(history[0], history[1])
+            self.assertEqual(rows[0]['status'], 'slower')
+            self.assertAlmostEqual(rows[0]['ratio'], 0.5)
+            self.assertEqual(benchmarks.compare(history[0], history[0])[0]['status'], 'same')
+
+class test_differential(unittest.TestCase):
+    """ Differential testing of the simulation engines. """
+
+    def test_models(self):
+        """ Test networks for unit and synapse models pass the comparisons. """
+        from tools.differential import coverage
+        rows = coverage('units', ['sigmoidal', 'noisy_sigmoidal', 'sig_ssrdc', 'sds_n'])
+        self.assertEqual([r['status'] for r in rows], ['passed'] * 4)
+        noisy = {r['name'] : r for r in rows}['noisy_sigmoidal']['result']['engines']
+        self.assertTrue(noisy['run']['skipped'] is not None)
+        self.assertTrue(noisy['flat_pops']['skipped'] is None)
+        rows = coverage('synapses', ['oja', 'bcm', 'inp_corr'])
+        self.assertEqual([r['status'] for r in rows], ['passed'] * 3)
+        self.assertRaises(ValueError, coverage, 'plants')
+
+    def test_engines(self):
+        """ Population updates in rga networks, and detection of deviations. """
+        from tools.differential import differential_test, register_engine, ENGINES
+        builder = lambda seed: rga_net(
+                               synapse_types.gated_normal_rga_diff, True)
+        res = differential_test(builder, 0.3, engines=['flat_pops'])
+        self.assertTrue(res['passed'])
+        def perturbed(net, sim_time):
+            times, acts, plants = ENGINES['flat'][0](net, sim_time)
+            acts = np.array(acts)
+            acts[1, -1] += 1e-6
+            return times, acts, plants
+        register_engine('perturbed', perturbed)
+        try:
+            res = differential_test(builder, 0.3, engines=['perturbed'])
+            self.assertFalse(res['passed'])
+            dev = res['engines']['perturbed']['deviations']
+            self.assertAlmostEqual(dev['act_max'][1], 1e-6)
+            self.assertEqual(np.count_nonzero(dev['act_max']), 1)
+            res = differential_test(builder, 0.3, engines=['perturbed'],
+                                    tolerances={'perturbed' : {'act_max' : 1e-5,
+                                                               'act_rms' : 1e-5}})
+            self.assertTrue(res['passed'])
+        finally:
+            del ENGINES['perturbed']
+
+
+class test_performance_report(unittest.TestCase):
+    """ The report of execution paths in network.performance_report. """
+
+    def test_report(self):
+        """ Paths of an rga network with and without population updates. """
+        for pops in [True, False]:
+            np.random.seed(42)
+            net = rga_net(synapse_types.gated_normal_rga_diff, True)
+            net.use_pop_updates = pops
+            net.flatten()
+            times1, acts1, _ = net.flat_run(0.1)
+            rep = net.performance_report(steps=5)
+            times2, acts2, _ = net.flat_run(0.1)
+            # the report doesn't alter the simulation
+            np.random.seed(42)
+            net2 = rga_net(synapse_types.gated_normal_rga_diff, True)
+            net2.use_pop_updates = pops
+            net2.flatten()
+            net2.flat_run(0.1)
+            times3, acts3, _ = net2.flat_run(0.1)
+            self.assertTrue(np.array_equal(times2, times3))
+            self.assertTrue(np.array_equal(np.array(acts2), np.array(acts3)))
+            self.assertEqual(rep['steps'], 5)
+            entries = {(e['kind'], e['name'], e['path']) : e for e in rep['entries']}
+            syn = ('synapse', 'gated_normal_rga_diff', 'vectorized' if pops else 'fallback')
+            self.assertTrue(syn in entries)
+            self.assertEqual(entries[syn]['count'], 15)
+            self.assertTrue(('synapse', 'static', 'fallback') in entries)
+            self.assertTrue(('unit', 'gated_rga_inpsel_adapt_sig', 'fallback') in entries)
+            req = ('requirement', 'l1_norm_factor_mp', 'vectorized' if pops else 'fallback')
+            self.assertTrue(req in entries)
+            if not pops:
+                self.assertTrue('pop_updates=False' in entries[syn]['reason'])
+            for e in rep['entries']:
+                self.assertTrue(len(e['reason']) > 0)
+                self.assertTrue(e['share'] >= 0.)
+            self.assertTrue(sum([e['share'] for e in rep['entries']]) <= 1.)
+            self.assertTrue(isinstance(net.performance_report(steps=0, text=True), str))
+
+class test_run_callbacks(unittest.TestCase):
+    """ Progress callbacks and early stopping in run and flat_run. """
+
+    def create_net(self):
+        """ Sigmoidal units driven by a constant input, and a diverging unit. """
+        net = network({'min_delay' : 0.01, 'min_buff_size' : 4})
+        src = net.create(1, {'type' : unit_types.source, 'init_val' : 0.5,
+                             'function' : lambda t: 0.5})
+        sig = net.create(3, {'type' : unit_types.sigmoidal, 'init_val' : 0.1,
+                             'slope' : 2., 'thresh' : 0.3, 'tau' : 0.05})
+        net.connect(src, sig, {'rule' : 'all_to_all', 'delay' : 0.01},
+                    {'type' : synapse_types.static, 'init_w' : 1.})
+        return net, sig
+
+    def test_callbacks(self):
+        """ Callbacks see the progress, and can stop the simulations. """
+        for flat in [True, False]:
+            results = []
+            for use_cb in [False, True]:
+                net, sig = self.create_net()
+                if flat: net.flatten()
+                run = net.flat_run if flat else net.run
+                calls = []
+                def callback(progress):
+                    calls.append((progress.step, progress.sim_time, progress.acts))
+                    self.assertEqual(progress.n_steps, 250)
+                    self.assertTrue(progress.steps_per_s > 0.)
+                    self.assertTrue(progress.eta >= 0.)
+                results.append(run(2.5, callback if use_cb else None, every=100))
+            # a callback that doesn't stop the run doesn't change the results
+            self.assertTrue(np.array_equal(results[0][0], results[1][0]))
+            self.assertTrue(np.array_equal(np.array(results[0][1]), np.array(results[1][1])))
+            self.assertEqual([c[0] for c in calls], [100, 200, 250])
+            self.assertAlmostEqual(calls[0][1], 1.)
+            self.assertTrue(np.allclose(calls[-1][2][sig], 
+                            [net.units[i].get_act(net.sim_time) for i in sig]))
+            # stopping when the activities converge
+            net, sig = self.create_net()
+            if flat: net.flatten()
+            run = net.flat_run if flat else net.run
+            progs = []
+            cb = combine_callbacks(lambda p: progs.append(p), divergence_stopper(),
+                                   convergence_stopper(tol=1e-4, checks=2))
+            times, acts, _ = run(100., cb, every=50)
+            prog = progs[-1]
+            self.assertTrue(prog.stopped)
+            self.assertTrue('converged' in prog.reason)
+            self.assertTrue(len(times) < 10000)
+            self.assertEqual(len(times), prog.step)
+            self.assertEqual(len(acts[sig[0]]), prog.step)
+            self.assertAlmostEqual(net.sim_time, prog.sim_time)
+            # stopping when activities are too large, or not finite
+            times, _, _ = run(1., combine_callbacks(lambda p: progs.append(p),
+                                                    divergence_stopper(0.5)), every=10)
+            self.assertEqual(len(times), 10)
+            self.assertTrue('larger than' in progs[-1].reason)
+            if flat:
+                net.acts[net.first_idx[sig[0]], -1] = np.nan
+                times, _, _ = run(1., combine_callbacks(lambda p: progs.append(p),
+                                                        divergence_stopper()), every=10)
+                self.assertEqual(len(times), 10)
+                self.assertTrue('non-finite' in progs[-1].reason)
+
+    def test_presentations(self):
+        """ One run_progress covers all the presentations of ei_net and ei_network. """
+        from tools.ei_network import ei_network
+        # calls to flat_run sharing a progress object
+        net, sig = self.create_net()
+        net.flatten()
+        prog = run_progress(net, 45)
+        calls = []
+        for _ in range(3):
+            net.flat_run(0.15, lambda p: calls.append((p.step, p.n_steps)), every=10,
+                         progress=prog)
+        self.assertEqual(calls, [(s, 45) for s in [10, 15, 20, 30, 40, 45]])
+        # convergence over presentations shorter than every*checks steps
+        pat = lambda pres, rows, cols: np.full(rows*cols, 0.5)
+        def inp_fun(prev, cur, t0, pres_time, units):
+            for u, v in zip(units, cur):
+                u.set_function(lambda t, v=v: v)
+        for flat in [True, False]:
+            np.random.seed(7)
+            xnet = ei_net()
+            for geom, side in [('e_geom', 2), ('i_geom', 1), ('x_geom', 2)]:
+                xnet.set_param(geom, 'rows', side)
+                xnet.set_param(geom, 'columns', side)
+            xnet.build()
+            calls = []
+            cb = combine_callbacks(lambda p: calls.append((p.step, p.n_steps)),
+                                   convergence_stopper(tol=1e-3, checks=3))
+            xnet.run(20, 0.1, pat, inp_fun, flat=flat, callback=cb, every=10)
+            self.assertTrue('converged' in xnet.stop_reason)
+            self.assertEqual([c[0] for c in calls], list(range(10, 10*len(calls)+1, 10)))
+            self.assertTrue(all(c[1] == 400 for c in calls))
+            self.assertTrue(len(xnet.all_times) < 400)
+        # ei_network
+        np.random.seed(7)
+        ein = ei_network(['L'])
+        for geom, side in [('e_geom', 2), ('i_geom', 1), ('x_geom', 2)]:
+            ein.layers['L'].set_param(geom, 'rows', side)
+            ein.layers['L'].set_param(geom, 'columns', side)
+        ein.build()
+        ein.net.flatten()
+        calls = []
+        ein.run(3, 0.1, flat=True, callback=lambda p: calls.append((p.step, p.n_steps)),
+                every=15)
+        self.assertEqual(calls, [(s, 60) for s in [15, 20, 30, 40, 45, 60]])
+        self.assertTrue(ein.stop_reason is None)
+
+class test_stream_stats(unittest.TestCase):
+    """ Statistics updated during simulations, from tools/stream_stats. """
+
+    def create_net(self, flat):
+        """ Sigmoidal units driven by sinusoidal sources. """
+        net = network({'min_delay' : 0.01, 'min_buff_size' : 4})
+        src = net.create(2, {'type' : unit_types.source, 'init_val' : 0.5,
+                             'function' : lambda t: 0.5})
+        net.units[src[0]].set_function(lambda t: 0.5 + 0.4*np.sin(2.*np.pi*5.*t))
+        net.units[src[1]].set_function(lambda t: 0.5 + 0.4*np.cos(2.*np.pi*2.*t))
+        sig = net.create(4, {'type' : unit_types.sigmoidal, 'init_val' : 0.1,
+                             'slope' : [1., 2., 3., 4.], 'thresh' : 0.3, 'tau' : 0.05})
+        net.connect([src[0]], sig[:2], {'rule' : 'all_to_all', 'delay' : 0.01},
+                    {'type' : synapse_types.static, 'init_w' : 1.})
+        net.connect([src[1]], sig[2:], {'rule' : 'all_to_all', 'delay' : 0.01},
+                    {'type' : synapse_types.static, 'init_w' : 1.})
+        if flat:
+            net.flatten()
+        return net, sig
+
+    def add_stats(self, net, sig):
+        from tools.stream_stats import (running_moments, histogram, correlation,
+                                        windowed_mean, spectrum)
+        return {'mom' : net.add_stats(running_moments(sig)),
+                'pool' : net.add_stats(running_moments(sig, pool=True)),
+                'hist' : net.add_stats(histogram(sig, (0., 1., 10), window=50)),
+                'corr' : net.add_stats(correlation(sig)),
+                'win' : net.add_stats(windowed_mean(sig, 20)),
+                'spec' : net.add_stats(spectrum(sig, nfft=64))}
+
+    def test_stats(self):
+        """ Streaming statistics equal those computed from the traces. """
+        from scipy.signal import welch
+        for flat in [True, False]:
+            net, sig = self.create_net(flat)
+            st = self.add_stats(net, sig)
+            run = net.flat_run if flat else net.run
+            times, acts, _ = run(3.)
+            x = np.array(acts)[sig] # one row per unit
+            if flat:
+                self.assertTrue(np.array_equal(net.get_acts(net.sim_time), 
+                    [net.get_act(uid, net.sim_time) for uid in range(net.n_units)]))
+            self.assertEqual(st['mom'].n, len(times))
+            self.assertTrue(np.allclose(st['mom'].mean, x.mean(axis=1)))
+            self.assertTrue(np.allclose(st['mom'].var, x.var(axis=1)))
+            self.assertTrue(np.allclose(st['mom'].max, x.max(axis=1)))
+            self.assertTrue(np.allclose(st['mom'].min, x.min(axis=1)))
+            self.assertAlmostEqual(st['pool'].mean, x.mean())
+            self.assertAlmostEqual(st['pool'].var, x.var())
+            counts, _ = np.histogram(x, np.linspace(0., 1., 11))
+            self.assertTrue(np.array_equal(st['hist'].counts, counts))
+            self.assertEqual(len(st['hist'].frames), 6)
+            self.assertEqual(st['hist'].frames[1].sum(), 50 * len(sig))
+            self.assertAlmostEqual(st['hist'].frame_times[1], times[50])
+            self.assertTrue(np.allclose(st['corr'].corr, np.corrcoef(x)))
+            w_times, w_vals = st['win'].traces()
+            self.assertTrue(np.allclose(w_times, times[::20]))
+            self.assertTrue(np.allclose(w_vals, x.reshape(len(sig), 15, 20).mean(axis=2)))
+            freqs, psd = welch(x, fs=1./net.min_delay, window='hann', nperseg=64,
+                               noverlap=32, detrend='constant', axis=1)
+            self.assertTrue(np.allclose(st['spec'].freqs, freqs))
+            self.assertTrue(np.allclose(st['spec'].power, psd))
+            peak = st['spec'].freqs[np.argmax(st['spec'].power, axis=1)]
+            self.assertTrue(np.all(np.abs(peak[:2] - 5.) < 1.6))
+            self.assertTrue(np.all(np.abs(peak[2:] - 2.) < 1.6))
+            # without storing the traces the statistics are the same
+            net2, _ = self.create_net(flat)
+            st2 = self.add_stats(net2, sig)
+            times2, acts2, plants2 = (net2.flat_run if flat else net2.run)(3., store=False)
+            self.assertTrue(np.array_equal(times, times2))
+            self.assertEqual((acts2, plants2), ([], []))
+            self.assertTrue(np.array_equal(st['mom'].m2, st2['mom'].m2))
+            self.assertTrue(np.array_equal(st['spec'].power, st2['spec'].power))
+            net2.remove_stats(st2['mom'])
+            self.assertEqual(len(net2.stream_stats), 5)
+            net2.remove_stats()
+            self.assertEqual(len(net2.stream_stats), 0)
+
+class test_rk_integrators(unittest.TestCase):
+    """ Runge-Kutta integration in flat networks. """
+
+    def test_accuracy(self):
+        """ Higher order methods are more accurate with the same substeps. """
+        ref = sig_net('rk4', 100)
+        err = {m : np.abs(sig_net(m, 4) - ref).max() for m in ['euler', 'heun', 'ssprk3', 'rk4']}
+        self.assertTrue(err['heun'] < err['euler'] / 10.)
+        self.assertTrue(err['rk4'] < err['heun'] / 2.)
+        self.assertTrue(err['ssprk3'] < err['heun'] / 2.)
+        # inputs are interpolated linearly, so the error is of second order
+        self.assertTrue(np.abs(sig_net('rk4', 8) - ref).max() < err['rk4'] / 3.)
+        # Heun with 2 substeps is better than Euler with 8
+        self.assertTrue(np.abs(sig_net('heun', 2) - ref).max() <
+                        np.abs(sig_net('euler', 8) - ref).max())
+        # odeint units use the method in the flat_integ network parameter
+        self.assertTrue(np.array_equal(sig_net(None, 4, 'rk4'), sig_net('rk4', 4)))
+        self.assertRaises(ValueError, network, {'min_delay' : 0.01, 'min_buff_size' : 4,
+                                                'flat_integ' : 'rk5'})
+
+    def test_multidim(self):
+        """ Runge-Kutta integration of a multidimensional unit. """
+        errors = {}
+        for meth in ['euler', 'rk4']:
+            net = network({'min_delay' : 0.01, 'min_buff_size' : 4})
+            if meth == 'euler':
+                params = {'integ_meth' : 'odeint'}
+            else:
+                params = {'integ_meth' : meth}
+            params.update({'type' : unit_types.test_oscillator, 'init_val' : [np.array([1., 0.])],
+                           'tau' : 0.1, 'mu' : 0., 'sigma' : 0.})
+            osc = net.create(1, params)
+            net.flatten()
+            net.flat_run(1.)
+            t = net.ts[-1]
+            y = net.acts[net.first_idx[osc[0]]:net.first_idx[osc[0]]+2, -1]
+            errors[meth] = np.abs(y - [np.cos(10.*t), -np.sin(10.*t)]).max()
+        self.assertTrue(errors['rk4'] < 1e-6)
+        self.assertTrue(errors['euler'] > 1e-2)
+
+    def test_substep_times(self):
+        """ Stages see the times of their half substeps through unit.times. """
+        import types
+        def dt_fun(self, y, s): # a linear unit driven by a sinusoid of the time
+            t = self.times[s - self.min_buff_size]
+            return (np.sin(2.*np.pi*4.*t) - y) * self.rtau
+        finals = {}
+        for meth, mbs in [('euler', 100), ('rk4', 100), ('rk4', 3), ('heun', 3)]:
+            net = network({'min_delay' : 0.01, 'min_buff_size' : mbs})
+            lin = net.create(1, {'type' : unit_types.linear, 'init_val' : 0.,
+                                 'tau' : 0.05, 'integ_meth' : meth})
+            net.units[lin[0]].dt_fun = types.MethodType(dt_fun, net.units[lin[0]])
+            net.flatten()
+            net.flat_run(0.5)
+            finals[(meth, mbs)] = net.acts[net.first_idx[lin[0]], -1]
+        ref = finals[('rk4', 100)]
+        self.assertTrue(abs(finals[('euler', 100)] - ref) < 1e-2)
+        self.assertTrue(abs(finals[('rk4', 3)] - ref) < 1e-6)
+        self.assertTrue(abs(finals[('heun', 3)] - ref) < 1e-3)
+
+    def test_double_sigma(self):
+        """ Runge-Kutta integration of units whose dt_fun reads ds_inp_sum. """
+        ssrdc = {'tau_scale' : .1, 'tau_relax' : .5, 'Kp' : .5, 'sort_rdc' : True}
+        for unit_type, n_br, extra in [(unit_types.double_sigma, 4, {}),
+                                       (unit_types.ds_n_sharp, 3, {}),
+                                       (unit_types.ds_ssrdc_sharp, 3, ssrdc)]:
+            with self.subTest(unit_type=unit_type.name):
+                acts = {}
+                for pop, mbs in [(True, 5), (False, 5), (False, 10), (False, 40)]:
+                    net, units = ds_net(unit_type, n_br, pop, extra=dict(extra,
+                                        integ_meth='rk4'), mbs=mbs)
+                    net.flatten()
+                    acts[(pop, mbs)] = np.array(net.flat_run(0.5)[1])[units]
+                # ds_branch_pop and the units' own branch sums give the same results
+                self.assertTrue(np.abs(acts[(True, 5)] - acts[(False, 5)]).max() < 1e-10)
+                ref = acts[(False, 40)]
+                self.assertTrue(np.abs(acts[(False, 10)] - ref).max() <
+                                np.abs(acts[(False, 5)] - ref).max() / 4.)
+
+    def test_end_inputs(self):
+        """ The inputs at the end of the step are read from acts, as in exact_linear. """
+        def lin_net(exact):
+            net = network({'min_delay' : 0.01, 'min_buff_size' : 4, 'exact_linear' : exact})
+            src = net.create(1, {'type' : unit_types.source, 'init_val' : 0.5,
+                                 'function' : lambda t: np.sin(2.*np.pi*7.*t)})
+            params = {'type' : unit_types.linear, 'init_val' : 0.1, 'tau' : 0.02}
+            if not exact:
+                params['integ_meth'] = 'rk4'
+            lin = net.create(2, params)
+            net.connect(src, lin, {'rule' : 'all_to_all', 'delay' : 0.01},
+                        {'type' : synapse_types.static, 'init_w' : 1.})
+            net.connect(lin, lin, {'rule' : 'one_to_one', 'delay' : 0.02},
+                        {'type' : synapse_types.static, 'init_w' : -0.5})
+            net.flatten()
+            return np.array(net.flat_run(1.)[1])[lin], len(net.linear_props)
+        exact, n_props = lin_net(True)
+        rk4, n_props_rk = lin_net(False)
+        self.assertEqual((n_props, n_props_rk), (1, 0))
+        self.assertTrue(np.abs(exact - rk4).max() < 1e-5)
+
+class test_exp_leak(unittest.TestCase):
+    """ Exponential Euler integration of the leak in flat networks. """
+
+    def test_stability(self):
+        """ Substeps longer than the time constant remain stable. """
+        ref = sig_net('rk4', 200, tau=0.002)
+        with np.errstate(all='ignore'):
+            euler = sig_net('euler', 2, tau=0.002)
+        self.assertFalse(np.abs(euler - ref).max() < 1.)
+        self.assertTrue(np.abs(sig_net('exp_leak', 2, tau=0.002) - ref).max() < 0.1)
+        # odeint units use exp_leak when it is the flat_integ network parameter
+        self.assertTrue(np.array_equal(sig_net(None, 2, 'exp_leak', tau=0.002),
+                                       sig_net('exp_leak', 2, tau=0.002)))
+
+    def test_exact_decay(self):
+        """ A linear unit with constant input follows the exact solution. """
+        net = network({'min_delay' : 0.01, 'min_buff_size' : 2})
+        src = net.create(1, {'type' : unit_types.source, 'init_val' : 1.,
+                             'function' : lambda t: 1.})
+        lin = net.create(1, {'type' : unit_types.linear, 'init_val' : 0.,
+                             'tau' : 0.003, 'integ_meth' : 'exp_leak'})
+        net.connect(src, lin, {'rule' : 'all_to_all', 'delay' : 0.01},
+                    {'type' : synapse_types.static, 'init_w' : 1.})
+        net.flatten()
+        net.flat_run(0.02)
+        t = net.ts[-1]
+        y = net.acts[net.first_idx[lin[0]], -1]
+        self.assertAlmostEqual(y, 1. - np.exp(-t/0.003), places=10)
+
+    def test_no_leak_rate(self):
+        """ Units that don't declare a leak rate can't use exp_leak. """
+        net = network({'min_delay' : 0.01, 'min_buff_size' : 4})
+        net.create(1, {'type' : unit_types.test_oscillator, 'init_val' : [np.array([1., 0.])],
+                       'tau' : 0.1, 'mu' : 0., 'sigma' : 0., 'integ_meth' : 'exp_leak'})
+        self.assertRaises(AssertionError, net.flatten)
+        # with flat_integ these units fall back to forward Euler
+        net = network({'min_delay' : 0.01, 'min_buff_size' : 4, 'flat_integ' : 'exp_leak'})
+        osc = net.create(1, {'type' : unit_types.test_oscillator, 'init_val' : [np.array([1., 0.])],
+                             'tau' : 0.1, 'mu' : 0., 'sigma' : 0., 'integ_meth' : 'odeint'})
+        net.flatten()
+        self.assertEqual(net.units[osc[0]].flat_update.__name__, 'flat_euler_update_md')
+
+class test_exact_linear(unittest.TestCase):
+    """ Exact propagation of linear units with linear_propagator. """
+
+    def lin_net(self, mbs, exact, extra=False):
+        """ Returns a flat network with recurrently connected linear units. """
+        net = network({'min_delay' : 0.01, 'min_buff_size' : mbs, 'exact_linear' : exact,
+                       'seed' : 7})
+        src = net.create(1, {'type' : unit_types.source, 'init_val' : 0.,
+                             'function' : lambda t: np.sin(2.*np.pi*2.*t)})
+        lin = net.create(10, {'type' : unit_types.linear, 'init_val' : 0., 'tau' : 0.005,
+                              'tau_fast' : 0.05, 'tau_slow' : 0.5})
+        net.connect(src, lin, {'rule' : 'all_to_all', 'delay' : 0.01},
+                    {'type' : synapse_types.static, 'init_w' : 1.})
+        net.connect(lin, lin, {'rule' : 'all_to_all', 'delay' : 0.02},
+                    {'type' : synapse_types.static, 'init_w' : -0.1})
+        if extra: # units that the propagator can't handle, and noisy units
+            plas = net.create(2, {'type' : unit_types.linear, 'init_val' : 0.5, 'tau' : 0.01,
+                                  'tau_fast' : 0.05, 'tau_slow' : 0.5})
+            net.connect(lin[:3], plas, {'rule' : 'all_to_all', 'delay' : 0.01},
+                        {'type' : synapse_types.bcm, 'init_w' : 0.1, 'lrate' : 0.1})
+            noisy = net.create(3, {'type' : unit_types.noisy_linear, 'init_val' : 0.,
+                                   'tau' : 0.01, 'lambda' : 1., 'mu' : 0.5, 'sigma' : 0.2})
+            net.connect(plas, noisy, {'rule' : 'all_to_all', 'delay' : 0.03},
+                        {'type' : synapse_types.static, 'init_w' : 0.5})
+        net.flatten()
+        return net
+
+    def final_error(self, mbs, exact, ref):
+        """ Largest difference with 'ref' in the activities after 1 second. """
+        net = self.lin_net(mbs, exact)
+        net.flat_run(1.)
+        return np.abs(net.acts[net.first_idx[1:], -1] - ref).max()
+
+    def test_accuracy(self):
+        """ Exact propagation converges faster than forward Euler. """
+        net = self.lin_net(400, True)
+        net.flat_run(1.)
+        ref = net.acts[net.first_idx[1:], -1].copy()
+        err10 = self.final_error(10, True, ref)
+        self.assertTrue(self.final_error(50, True, ref) < err10 / 10.)
+        self.assertTrue(err10 < self.final_error(50, False, ref))
+
+    def test_noise(self):
+        """ The stationary variance of noisy units is exact with coarse substeps. """
+        variances = {}
+        for exact in [False, True]:
+            net = network({'min_delay' : 0.01, 'min_buff_size' : 2, 'exact_linear' : exact,
+                           'seed' : 3})
+            units = net.create(2000, {'type' : unit_types.noisy_linear, 'init_val' : 0.,
+                                      'tau' : 0.004, 'lambda' : 1., 'mu' : 0., 'sigma' : 2.,
+                                      'integ_meth' : 'euler_maru'})
+            net.flatten()
+            net.flat_run(0.2)
+            variances[exact] = net.acts[net.first_idx[units[0]]:, -1].var()
+        expected = 4. * 0.004 / 2. # sigma^2 / (2*a)
+        self.assertTrue(abs(variances[True] - expected) < 0.1 * expected)
+        self.assertTrue(abs(variances[False] - expected) > expected)
+
+    def test_selection(self):
+        """ Only eligible units are propagated, and the network can be stored. """
+        import tempfile
+        from tools.net_store import save_network, load_network
+        net = self.lin_net(4, True, extra=True)
+        self.assertEqual(len(net.linear_props), 1)
+        prop_ids = [u.ID for u in net.linear_props[0].units]
+        self.assertEqual(prop_ids, list(range(1, 11)) + [13, 14, 15])
+        self.assertEqual([u.ID for u in net.integ_units], [11, 12])
+        self.assertEqual(self.lin_net(4, False).linear_props, [])
+        rep = net.performance_report(steps=2)
+        self.assertTrue(any([e['name'] == 'linear_propagator' and e['path'] == 'vectorized'
+                             for e in rep['entries']]))
+        net.flat_run(0.2)
+        with tempfile.TemporaryDirectory() as path:
+            save_network(net, path)
+            net2 = load_network(path, {0 : net.units[0].get_act})
+            _, acts1, _ = net.flat_run(0.2)
+            _, acts2, _ = net2.flat_run(0.2)
+        self.assertTrue(np.array_equal(np.array(acts1), np.array(acts2)))
+
+class test_autotune(unittest.TestCase):
+    """ Choosing simulation settings with tools.autotune. """
+
+    @staticmethod
+    def builder(params):
+        """ Recurrent sigmoidal units driven by a sinusoid. """
+        net = network(dict({'min_delay' : 0.01, 'min_buff_size' : 10}, **params))
+        src = net.create(1, {'type' : unit_types.source, 'init_val' : 0.5,
+                             'function' : lambda t: 0.5 + 0.4*np.sin(2.*np.pi*3.*t)})
+        sig = net.create(4, {'type' : unit_types.sigmoidal, 'init_val' : 0.1, 'slope' : 3.,
+                             'thresh' : 0.3, 'tau' : 0.02})
+        net.connect(src, sig, {'rule' : 'all_to_all', 'delay' : 0.01},
+                    {'type' : synapse_types.static, 'init_w' : 1.})
+        net.connect(sig, sig, {'rule' : 'all_to_all', 'delay' : 0.02},
+                    {'type' : synapse_types.static, 'init_w' : -0.2})
+        return net
+
+    def test_autotune(self):
+        """ The recommendation is the cheapest candidate within the tolerance. """
+        from tools.autotune import autotune, candidate_grid, report
+        cands = candidate_grid(min_buff_sizes=(2, 4), flat_integs=('euler', 'rk4'))
+        cands.append({'min_buff_size' : 2, 'flat_integ' : 'rk5'}) # invalid
+        res = autotune(self.builder, 0.3, tol=1e-3, candidates=cands, repeats=1)
+        self.assertEqual(len(res['candidates']), 5)
+        bad = [e for e in res['candidates'] if e['error'] is not None]
+        self.assertEqual(len(bad), 1)
+        self.assertFalse(bad[0]['ok'])
+        errs = {(e['params']['min_buff_size'], e['params']['flat_integ']) : e['max_err']
+                for e in res['candidates'] if e['error'] is None}
+        self.assertTrue(errs[(4, 'rk4')] < 1e-4 and errs[(2, 'euler')] > 1e-2)
+        self.assertTrue(errs[(4, 'euler')] < errs[(2, 'euler')])
+        ok = [e for e in res['candidates'] if e['ok']]
+        self.assertTrue(len(ok) > 0)
+        self.assertEqual(res['recommended'], ok[0]['params'])
+        self.assertTrue(all([ok[0]['wall_s'] <= e['wall_s'] for e in ok]))
+        self.assertAlmostEqual(res['speedup'], res['baseline']['wall_s'] / ok[0]['wall_s'])
+        self.assertTrue('Recommended' in report(res))
+        # no candidate within an impossible tolerance
+        res = autotune(self.builder, 0.1, tol=0., candidates=cands[:1], repeats=1)
+        self.assertIsNone(res['recommended'])
+        self.assertIsNone(res['speedup'])
+
 if __name__=='__main__':
     unittest.main()
@@ -0,0 +1,254 @@
+"""
+autotune.py
+Choosing the simulation settings of a flat network by trading accuracy for cost.
+
+The size of the substeps (min_buff_size), the integration method of the flat
+network (flat_integ), the exact propagation of linear units (exact_linear),
+and the simulation step (min_delay) change both the accuracy and the speed of a
+simulation. The autotune function simulates a short probe of a network under
+candidate settings, measures the deviation of each candidate from a
+high-resolution reference, and recommends the cheapest candidate whose
+deviation is within a tolerance, together with its estimated speedup.
+
+Those settings are fixed when the units are created, so the network is given as
+a builder function, as in tools.benchmarks and tools.differential. The builder
+receives a dictionary with the network parameters of a candidate, and should
+pass them to the network constructor, e.g.:
+
+    def builder(params):
+        net = network(dict({'min_delay' : 0.01, 'min_buff_size' : 10}, **params))
+        ... # create and connect the units
+        return net
+
+    result = autotune(builder, probe_time=1., tol=1e-3)
+    print(report(result))
+
+Deviations are measured on the unit activities at the end of each simulation
+step. The noise of stochastic units changes with min_buff_size, so their
+deviations don't decrease with finer substeps; a builder for tuning should set
+their noise to zero.
+"""
+
+import numpy as np
+import itertools
+import time
+
+SEED = 20240101 # numpy and network seed used before building each network
+# settings of the high-resolution reference
+REFERENCE = {'min_buff_size' : 64, 'flat_integ' : 'rk4'}
+
+
+def candidate_grid(min_buff_sizes=(2, 4, 8, 16), flat_integs=('euler', 'heun', 'rk4',
+                   'exp_leak'), min_delays=(None,), exact_linear=(False,)):
+    """ Returns a list with all combinations of the given network parameters.
+
+        Args:
+            min_buff_sizes: values of min_buff_size.
+            flat_integs: values of flat_integ (see the network constructor).
+            min_delays: values of min_delay. None keeps the builder's value.
+            exact_linear: values of exact_linear.
+        Returns:
+            A list of dictionaries with network parameters.
+    """
+    grid = []
+    for mbs, integ, md, el in itertools.product(min_buff_sizes, flat_integs,
+                                                 min_delays, exact_linear):
+        params = {'min_buff_size' : mbs, 'flat_integ' : integ}
+        if md is not None:
+            params['min_delay'] = md
+        if el:
+            params['exact_linear'] = True
+        grid.append(params)
+    return grid
+
+
+def probe(builder, params, probe_time, ids=None, repeats=1, seed=SEED):
+    """ Builds a network with the given parameters, and simulates it.
+
+        The network is simulated once recording the activities at the end of
+        each step, and 'repeats' times without recording to measure its cost.
+        All the simulations start from the same state (see network.snapshot).
+
+        Args:
+            builder: function builder(params) that returns a non-flat network.
+            params: dictionary with network parameters for the builder. When it
+                    has no 'seed' entry, 'seed' is added.
+            probe_time: simulation time.
+            ids: IDs of the units whose activities are recorded. If None, all
+                 the units with buffers (e.g. not sources) are used.
+            repeats: number of timed simulations. The fastest one is reported.
+            seed: seed of numpy's global generator before building, and of the
+                  network's noise streams.
+        Returns:
+            A dictionary with the entries:
+            'params' : the 'params' argument.
+            'times' : array with the time at the end of each step.
+            'acts' : 2D array, with the activity of ids[i] at times[j] in acts[j,i].
+            'wall_s' : wall-clock seconds of the fastest timed simulation.
+            'steps' : number of simulation steps.
+            'ids' : the IDs of the recorded units.
+    """
+    params = dict(params)
+    params.setdefault('seed', seed)
+    np.random.seed(seed)
+    net = builder(params)
+    net.flatten()
+    if ids is None:
+        ids = [uid for uid in range(net.n_units) if net.has_buffer[uid]]
+    rows = [net.first_idx[uid] for uid in ids]
+    times, acts = [], []
+    def record(progress):
+        times.append(progress.sim_time)
+        acts.append(net.acts[rows, -1].copy())
+    snap = net.snapshot()
+    with np.errstate(all='ignore'):
+        net.flat_run(probe_time, callback=record, every=1, store=False)
+        wall_s = np.inf
+        for _ in range(repeats):
+            net.restore(snap)
+            start = time.perf_counter()
+            net.flat_run(probe_time, store=False)
+            wall_s = min(wall_s, time.perf_counter() - start)
+    return {'params' : params, 'times' : np.array(times), 'acts' : np.array(acts),
+            'wall_s' : wall_s, 'steps' : len(times), 'ids' : list(ids)}
+
+
+def deviation(ref, res):
+    """ Deviation of the activities in a probe result from those of a reference.
+
+        The reference activities are linearly interpolated at the times of
+        'res', so both can have different values of min_delay.
+
+        Args:
+            ref, res: dictionaries returned by probe.
+        Returns:
+            A tuple (maximum absolute deviation, RMS deviation). Both are
+            infinite if 'res' has values that are not finite.
+        Raises:
+            ValueError if the probes recorded different units.
+    """
+    if ref['ids'] != res['ids']:
+        raise ValueError('The probes recorded different units')
+    if res['acts'].size == 0:
+        return 0., 0.
+    if not np.isfinite(res['acts']).all():
+        return np.inf, np.inf
+    ref_acts = np.array([np.interp(res['times'], ref['times'], col)
+                         for col in ref['acts'].T]).T
+    diff = res['acts'] - ref_acts
+    return np.abs(diff).max(), np.sqrt((diff**2).mean())
+
+
+def autotune(builder, probe_time, tol=1e-3, candidates=None, baseline=None,
+             reference=None, ids=None, metric='max', repeats=3, seed=SEED):
+    """ Recommends the cheapest simulation settings within an error tolerance.
+
+        Args:
+            builder: function builder(params) that returns a non-flat network,
+                     where 'params' is a dictionary with network parameters,
+                     such as min_buff_size, flat_integ, exact_linear, min_delay,
+                     and seed. Seeding numpy's generator must make it build the
+                     same network each time.
+            probe_time: simulation time of each probe.
+            tol: largest deviation from the reference accepted.
+            candidates: list of dictionaries with network parameters. If None,
+                        candidate_grid() is used.
+            baseline: network parameters used to estimate the speedup. The
+                      default {} uses the builder's own values.
+            reference: network parameters of the high-resolution reference. If
+                       None, REFERENCE is used, with the smallest min_delay of
+                       the candidates.
+            ids: IDs of the units compared (see probe).
+            metric: 'max' or 'rms', the deviation compared with 'tol'.
+            repeats: number of timed simulations of each probe.
+            seed: random seed (see probe).
+        Returns:
+            A dictionary with the entries:
+            'recommended' : network parameters of the cheapest candidate within
+                            the tolerance, or None if no candidate is.
+            'speedup' : wall time of the baseline divided by that of the
+                        recommended candidate (None without recommendation).
+            'reference', 'baseline' : entries (see below) for those settings.
+            'candidates' : list of entries for the candidates, sorted by cost.
+            'tol', 'metric', 'probe_time' : the arguments.
+            Each entry is a dictionary with the keys 'params', 'wall_s', 'steps',
+            'max_err', 'rms_err', 'ok' (deviation within tolerance), and 'error'
+            (None, or the message of an exception raised building or simulating).
+        Raises:
+            ValueError if 'metric' is not 'max' or 'rms'.
+    """
+    if metric not in ['max', 'rms']:
+        raise ValueError("The metric should be either 'max' or 'rms'")
+    if candidates is None:
+        candidates = candidate_grid()
+    if reference is None:
+        reference = dict(REFERENCE)
+        delays = [c['min_delay'] for c in candidates if 'min_delay' in c]
+        if len(delays) > 0:
+            reference['min_delay'] = min(delays)
+    baseline = {} if baseline is None else baseline
+    ref = probe(builder, reference, probe_time, ids, repeats, seed)
+    ids = ref['ids']
+
+    def evaluate(params):
+        """ Returns the entry for one setting. """
+        try:
+            res = probe(builder, params, probe_time, ids, repeats, seed)
+        except (ValueError, AssertionError, NotImplementedError) as e:
+            return {'params' : dict(params), 'wall_s' : np.inf, 'steps' : 0,
+                    'max_err' : np.inf, 'rms_err' : np.inf, 'ok' : False, 'error' : str(e)}
+        max_err, rms_err = deviation(ref, res)
+        err = max_err if metric == 'max' else rms_err
+        return {'params' : res['params'], 'wall_s' : res['wall_s'], 'steps' : res['steps'],
+                'max_err' : max_err, 'rms_err' : rms_err, 'ok' : err <= tol, 'error' : None}
+
+    entries = [evaluate(params) for params in candidates]
+    entries.sort(key=lambda e: e['wall_s'])
+    base = evaluate(baseline)
+    ok = [e for e in entries if e['ok']]
+    best = ok[0] if len(ok) > 0 else None
+    ref_entry = {'params' : ref['params'], 'wall_s' : ref['wall_s'], 'steps' : ref['steps'],
+                 'max_err' : 0., 'rms_err' : 0., 'ok' : True, 'error' : None}
+    return {'recommended' : None if best is None else best['params'],
+            'speedup' : None if best is None else base['wall_s'] / best['wall_s'],
+            'reference' : ref_entry, 'baseline' : base, 'candidates' : entries,
+            'tol' : tol, 'metric' : metric, 'probe_time' : probe_time}
+
+
+def settings_name(params):
+    """ A short description of the tuned network parameters in a dictionary. """
+    keys = [('min_delay', 'dt'), ('min_buff_size', 'mbs'), ('flat_integ', ''),
+            ('exact_linear', 'exact_linear')]
+    out = []
+    for key, short in keys:
+        if key in params:
+            val = params[key]
+            if key == 'exact_linear':
+                out.append('exact_linear' if val else '')
+            else:
+                out.append((short + '=' if short else '') + str(val))
+    name = ' '.join([s for s in out if s])
+    return name if name else '(builder defaults)'
+
+
+def report(result):
+    """ Returns a string with a table describing the result of autotune. """
+    lines = ['%-34s %10s %10s %10s %5s' % ('settings', 'wall (s)', 'max err',
+             'rms err', 'ok')]
+    def line(e, mark=''):
+        return '%-34s %10.4g %10.3g %10.3g %5s%s' % (settings_name(e['params'])[:34],
+               e['wall_s'], e['max_err'], e['rms_err'], 'yes' if e['ok'] else 'no',
+               mark if e['error'] is None else '  ' + e['error'][:60])
+    lines.append(line(result['reference'], '  reference'))
+    lines.append(line(result['baseline'], '  baseline'))
+    for e in result['candidates']:
+        lines.append(line(e, '  <--' if e['ok'] and e['params'] == result['recommended']
+                          else ''))
+    if result['recommended'] is None:
+        lines.append('No candidate has a %s deviation below %g.' % (result['metric'],
+                     result['tol']))
+    else:
+        lines.append('Recommended: %s, with a %s deviation below %g. Estimated speedup '
+                     'over the baseline: %.3g' % (settings_name(result['recommended']),
+                     result['metric'], result['tol'], result['speedup']))
+    return '\n'.join(lines)
@@ -0,0 +1,394 @@
+"""
+benchmarks.py
+A benchmark suite with reference draculab networks.
+
+Each workload is a function that builds a network, paired with a simulation
+time. A benchmark builds the network, flattens it, and runs it with flat_run,
+reporting the build time, the number of simulated seconds per wall-clock second,
+the number of simulation steps per second, and the peak memory of the process.
+By default each workload runs in a separate Python process, so its peak memory
+is not affected by the other workloads.
+
+Results are appended to a JSON history file, together with the git commit of
+the source code, so the throughput can be compared across commits.
+
+Usage from the draculab directory:
+    python -m tools.benchmarks                   # all workloads
+    python -m tools.benchmarks -w spinal noisy_pop --repeats 3
+    python -m tools.benchmarks --quick --compare # short runs, compare with last entry
+"""
+
+from draculab import unit_types, synapse_types
+from network import network
+import numpy as np
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # draculab directory
+SEED = 123456 # random seed used before building each network
+HISTORY = os.path.join(ROOT, 'benchmarks.json') # default history file
+
+# configuration of the spinal network (def_cfg50 in notebook/spinal/v3afxB_test2)
+SPINAL_CFG = {'b_e':4.00, 'M__C_lrate':20.26, 'sig1':0.49, 'SPF_w':1.50, 'M__C_w_sum':3.00,
+              'AL_thresh':0.30, 'g_e_factor':2.00, 'integ_amp':1.87, 'integ_decay':1.33,
+              'dely_diff':0.45, 'adapt_amp':5.00, 'C_tau_slow':49.90, 'SF_slope_factor':8.00,
+              'sig2':0.53, 'dely_low':0.77}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Workloads
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def hello_world_net():
+    """ The network of tutorial/hello_world: 10 sigmoidals with Oja synapses. """
+    net = network({'min_delay': 0.1, 'min_buff_size': 10})
+    sig_units = net.create(10, {'type': unit_types.sigmoidal, 'init_val': 0.5,
+                                'slope': 1, 'thresh': 0., 'tau': 0.2, 'tau_fast': 0.1})
+    inp_unit = net.create(1, {'type': unit_types.source, 'init_val': 1.,
+                              'function': np.cos})
+    net.connect(sig_units, sig_units, {'rule': 'fixed_outdegree', 'outdegree': 2,
+                'delay': 0.2}, {'type': synapse_types.oja, 'lrate': 0.1,
+                'init_w': {'distribution': 'uniform', 'low': 0.1, 'high': 1.}})
+    net.connect(inp_unit, sig_units, {'rule': 'all_to_all', 'delay': 0.1},
+                {'type': synapse_types.static, 'init_w': 0.5})
+    return net
+
+
+def tutorial_net():
+    """ The last network of tutorial/tutorial1: sources, sigmoidals, and targets. """
+    net = network({'min_delay' : 0.005, 'min_buff_size' : 10})
+    n_sigs = 10
+    sig_ids = net.create(n_sigs, {'type' : unit_types.sigmoidal, 'init_val' : 0.5,
+                         'thresh' : .1, 'tau' : 0.02,
+                         'slope' : np.random.uniform(0.5, 2., n_sigs)})
+    inp_ids = net.create(2, {'type' : unit_types.source, 'init_val' : 1.,
+                             'function' : np.cos})
+    target_ids = net.create(5, {'type' : unit_types.sigmoidal, 'init_val' : 0.5,
+                            'thresh' : .1, 'slope' : 1., 'tau' : 0.02})
+    net.connect(inp_ids, sig_ids, {'rule' : 'all_to_all', 'delay' : {'distribution':
+                'uniform', 'low': 0.01, 'high':0.1}}, {'type': synapse_types.static,
+                'init_w' : {'distribution' : 'uniform', 'low' : 0.1, 'high' : 1.}})
+    net.connect(sig_ids, target_ids, {'rule' : 'fixed_indegree', 'indegree' : 4,
+                'delay' : 0.02}, {'type': synapse_types.static, 'init_w' : 0.5})
+    return net
+
+
+def ei_network_net(side=16):
+    """ A single ei_network layer with side x side excitatory units.
+
+        The inhibitory grid has (side/2) x (side/2) units, as in the defaults.
+    """
+    from tools.ei_network import ei_network
+    ei = ei_network(['L'])
+    layer = ei.layers['L']
+    for geom, n in [('e_geom', side), ('i_geom', max(side // 2, 1))]:
+        layer.set_param(geom, 'rows', n)
+        layer.set_param(geom, 'columns', n)
+    ei.build()
+    return ei.net
+
+
+def spinal_net():
+    """ The network of notebook/spinal/net_from_cfg, with bouncy_planar_arm_v3. """
+    spec = importlib.util.spec_from_file_location('net_from_cfg',
+                 os.path.join(ROOT, 'notebook', 'spinal', 'net_from_cfg.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.net_from_cfg(SPINAL_CFG)[0]
+
+
+def noisy_pop_net(N=200):
+    """ Noisy sigmoidal units integrated with the stochastic exponential Euler method.
+
+        The units receive inputs from 5 sources and from 10 other units.
+    """
+    net = network({'min_delay' : 0.005, 'min_buff_size' : 10, 'seed' : SEED})
+    pop = net.create(N, {'type' : unit_types.noisy_sigmoidal, 'init_val' : 0.5,
+                         'slope' : 2., 'thresh' : 0.5, 'tau' : 0.05, 'lambda' : 1.,
+                         'mu' : 0., 'sigma' : 0.2, 'integ_meth' : 'exp_euler'})
+    srcs = net.create(5, {'type' : unit_types.source, 'init_val' : 0.,
+                          'function' : np.sin})
+    net.connect(srcs, pop, {'rule' : 'all_to_all', 'delay' : 0.01},
+                {'type' : synapse_types.static, 'init_w' : 0.2})
+    net.connect(pop, pop, {'rule' : 'fixed_indegree', 'indegree' : 10, 'delay' :
+                {'distribution' : 'uniform', 'low' : 0.005, 'high' : 0.05}},
+                {'type' : synapse_types.static, 'init_w' : {'distribution' :
+                'uniform', 'low' : -0.2, 'high' : 0.2}})
+    return net
+
+
+def plasticity_net(N=50):
+    """ Sigmoidal units where all recurrent synapses are plastic.
+
+        The recurrent connections use the Oja, BCM, and squared Hebbian rule
+        with subtractive normalization, so most of the time is spent updating
+        synapses and their requirements.
+    """
+    net = network({'min_delay' : 0.005, 'min_buff_size' : 10})
+    pop = net.create(N, {'type' : unit_types.sigmoidal, 'init_val' : 0.5,
+                         'slope' : 3., 'thresh' : 0.5, 'tau' : 0.02, 'tau_fast' : 0.05,
+                         'tau_slow' : 1., 'tau_mid' : 0.2})
+    srcs = net.create(5, {'type' : unit_types.source, 'init_val' : 0.,
+                          'function' : np.sin, 'tau_fast' : 0.05})
+    net.connect(srcs, pop, {'rule' : 'all_to_all', 'delay' : 0.01},
+                {'type' : synapse_types.sq_hebbsnorm, 'init_w' : 0.3,
+                 'lrate' : 0.1, 'omega' : 1.})
+    w_dist = {'distribution' : 'uniform', 'low' : 0.05, 'high' : 0.2}
+    for syn_spec in [{'type' : synapse_types.oja, 'lrate' : 0.1},
+                     {'type' : synapse_types.bcm, 'lrate' : 0.1},
+                     {'type' : synapse_types.cov, 'lrate' : 0.05}]:
+        syn_spec['init_w'] = w_dist
+        net.connect(pop, pop, {'rule' : 'fixed_indegree', 'indegree' : 10,
+                    'delay' : 0.01}, syn_spec)
+    return net
+
+
+# WORKLOADS[name] = (builder, simulation time in seconds)
+WORKLOADS = {'hello_world' : (hello_world_net, 100.),
+             'tutorial1' : (tutorial_net, 10.),
+             'ei_network' : (ei_network_net, 2.),
+             'spinal' : (spinal_net, 2.),
+             'noisy_pop' : (noisy_pop_net, 5.),
+             'plasticity' : (plasticity_net, 5.)}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Measurements
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def peak_memory():
+    """ Returns the peak resident memory of this process in MB, or None. """
+    try:
+        import resource
+    except ImportError: # not available in Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes in macOS, and in kilobytes in Linux
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def measure(name, sim_time=None, repeats=1):
+    """ Builds and runs one workload in this process.
+
+        Args:
+            name: a key of WORKLOADS.
+            sim_time: simulation time of each run. If None, the time in
+                      WORKLOADS is used.
+            repeats: number of consecutive runs. The fastest one is reported.
+        Returns:
+            A dictionary with the entries:
+            'build_s' : seconds to create the network.
+            'flatten_s' : seconds to flatten the network.
+            'sim_s' : simulated seconds in each run.
+            'wall_s' : wall-clock seconds of the fastest run.
+            'steps' : number of simulation steps in each run.
+            'steps_per_s' : simulation steps per wall-clock second.
+            'sim_per_wall' : simulated seconds per wall-clock second.
+            'peak_mem_mb' : peak resident memory of the process (MB).
+            'units', 'syns', 'plants' : size of the network.
+        Raises:
+            ValueError if the workload does not exist.
+    """
+    if name not in WORKLOADS:
+        raise ValueError('Unknown workload ' + str(name) + '. Available workloads: ' +
+                         ', '.join(WORKLOADS.keys()))
+    builder, default_time = WORKLOADS[name]
+    sim_time = default_time if sim_time is None else sim_time
+    np.random.seed(SEED)
+    start = time.perf_counter()
+    net = builder()
+    build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    net.flatten()
+    flatten_s = time.perf_counter() - start
+    wall_s = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        times = net.flat_run(sim_time)[0]
+        wall_s = min(wall_s, time.perf_counter() - start)
+    steps = len(times)
+    return {'build_s' : build_s, 'flatten_s' : flatten_s, 'sim_s' : steps * net.min_delay,
+            'wall_s' : wall_s, 'steps' : steps, 'steps_per_s' : steps / wall_s,
+            'sim_per_wall' : steps * net.min_delay / wall_s,
+            'peak_mem_mb' : peak_memory(), 'units' : len(net.units),
+            'syns' : sum([len(s) for s in net.syns]), 'plants' : len(net.plants)}
+
+
+def measure_isolated(name, sim_time=None, repeats=1):
+    """ Runs measure(name, sim_time, repeats) in a new Python process.
+
+        The peak memory is then the one of a process that only builds and runs
+        this workload.
+
+        Raises:
+            RuntimeError if the process fails.
+    """
+    cmd = [sys.executable, '-m', 'tools.benchmarks', '--worker', name,
+           '--repeats', str(repeats)]
+    if sim_time is not None:
+        cmd += ['--time', repr(sim_time)]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env.setdefault('MPLBACKEND', 'Agg')
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    lines = proc.stdout.strip().split('\n')
+    if proc.returncode != 0 or not lines[-1].startswith('{'):
+        raise RuntimeError('Workload ' + name + ' failed:\n' + proc.stderr[-2000:])
+    return json.loads(lines[-1]) # builders may print, so the result is the last line
+
+
+def run_suite(names=None, quick=False, repeats=1, isolate=True):
+    """ Measures several workloads.
+
+        Args:
+            names: list with keys of WORKLOADS. If None, all workloads are used.
+            quick: if True, the simulation times are 1/10 of the default ones.
+            repeats: number of runs for each workload (see measure).
+            isolate: whether to run each workload in a separate process.
+        Returns:
+            A dictionary with the result of measure for each workload name.
+    """
+    names = list(WORKLOADS.keys()) if names is None else names
+    results = {}
+    for name in names:
+        if name not in WORKLOADS:
+            raise ValueError('Unknown workload ' + str(name))
+        sim_time = WORKLOADS[name][1] / 10. if quick else None
+        if isolate:
+            results[name] = measure_isolated(name, sim_time, repeats)
+        else:
+            results[name] = measure(name, sim_time, repeats)
+    return results
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# History
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def git_commit():
+    """ Returns (commit hash, whether there are uncommitted changes), or (None, None). """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                 universal_newlines=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                 cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                 universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, len(status) > 0
+
+
+def make_record(results, quick=False, label=None):
+    """ Returns a history entry with the results and a description of the environment. """
+    commit, dirty = git_commit()
+    return {'date' : datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit' : commit, 'dirty' : dirty, 'label' : label, 'quick' : quick,
+            'host' : platform.node(), 'python' : platform.python_version(),
+            'numpy' : np.__version__, 'results' : results}
+
+
+def load_history(path=HISTORY):
+    """ Returns the list of entries in a history file, or [] if it doesn't exist. """
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def append_history(record, path=HISTORY):
+    """ Appends an entry to a history file, creating it if necessary. """
+    history = load_history(path)
+    history.append(record)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp, path) # the history is never left half-written
+
+
+def compare(old, new, tolerance=0.1):
+    """ Compares the throughput of two history entries.
+
+        Args:
+            old, new: history entries (see make_record).
+            tolerance: relative change in steps_per_s considered significant.
+        Returns:
+            A list with a dictionary for each workload present in both entries,
+            with the entries 'name', 'old' and 'new' (steps_per_s), 'ratio'
+            (new/old), and 'status', which is 'slower', 'faster', or 'same'.
+    """
+    rows = []
+    for name, res in new['results'].items():
+        if name not in old['results']:
+            continue
+        ratio = res['steps_per_s'] / old['results'][name]['steps_per_s']
+        status = 'same'
+        if ratio < 1. - tolerance:
+            status = 'slower'
+        elif ratio > 1. + tolerance:
+            status = 'faster'
+        rows.append({'name' : name, 'old' : old['results'][name]['steps_per_s'],
+                     'new' : res['steps_per_s'], 'ratio' : ratio, 'status' : status})
+    return rows
+
+
+def report(results):
+    """ Returns a string with a table of the results of run_suite. """
+    lines = ['%-12s %7s %8s %8s %9s %10s %11s %9s' % ('workload', 'units', 'syns',
+             'build[s]', 'flat[s]', 'steps/s', 'sim/wall', 'mem[MB]')]
+    for name, r in results.items():
+        mem = r['peak_mem_mb']
+        lines.append('%-12s %7d %8d %8.2f %9.2f %10.1f %11.4f %9s' % (name, r['units'],
+                     r['syns'], r['build_s'], r['flatten_s'], r['steps_per_s'],
+                     r['sim_per_wall'], '-' if mem is None else '%.1f' % mem))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='draculab benchmark suite')
+    parser.add_argument('-w', '--workloads', nargs='+', choices=list(WORKLOADS.keys()),
+                        help='workloads to run (default: all)')
+    parser.add_argument('--quick', action='store_true', help='1/10 of the simulation times')
+    parser.add_argument('--repeats', type=int, default=1, help='runs per workload')
+    parser.add_argument('--history', default=HISTORY, help='JSON history file')
+    parser.add_argument('--no-save', action='store_true', help="don't modify the history")
+    parser.add_argument('--compare', action='store_true',
+                        help='compare with the last entry of the history')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--label', help='a note stored with the results')
+    parser.add_argument('--in-process', action='store_true',
+                        help='run all workloads in this process')
+    parser.add_argument('--worker', help=argparse.SUPPRESS) # used by measure_isolated
+    parser.add_argument('--time', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        print(json.dumps(measure(args.worker, args.time, args.repeats)))
+        return
+    results = run_suite(args.workloads, args.quick, args.repeats, not args.in_process)
+    print(report(results))
+    record = make_record(results, args.quick, args.label)
+    if args.compare:
+        previous = [h for h in load_history(args.history) if h['quick'] == args.quick]
+        if len(previous) == 0:
+            print('No previous results to compare with')
+        else:
+            print('\nComparison with commit ' + str(previous[-1]['commit']) +
+                  ' (' + previous[-1]['date'] + ')')
+            for row in compare(previous[-1], record, args.tolerance):
+                print('%-12s %10.1f -> %10.1f steps/s  (x%.3f) %s' % (row['name'],
+                      row['old'], row['new'], row['ratio'], row['status']))
+    if not args.no_save:
+        append_history(record, args.history)
+
+
+if __name__ == '__main__':
+    main()
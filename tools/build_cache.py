@@ -0,0 +1,298 @@
+"""
+build_cache.py
+A disk cache for functions that build draculab networks from a configuration
+dictionary, such as net_from_cfg or rl5E_net in notebook/spinal.
+
+Hyperparameter searches call these builders once for each evaluation, although
+many configurations only differ in parameters that don't change the structure
+of the network (e.g. time constants or initial weights). The build_cache stores
+each flattened network with tools.net_store, using a hash of the configuration,
+of the builder's source code, and of the draculab source code as its key.
+Parameters that can be written into an existing network ('patch_keys') are left
+out of the hash, and are applied to the loaded network by a 'patcher' function.
+"""
+
+from tools.net_store import save_network, load_network
+from requirements.requirements import add_exp_euler_vars
+import numpy as np
+import network as network_module
+import enum
+import glob
+import hashlib
+import inspect
+import json
+import os
+import shutil
+
+_code_version = None # hash of the draculab sources, computed by code_version
+
+
+def code_version():
+    """ Returns a hash of the draculab source code.
+
+        The source files of the network, units, synapses, plants, and
+        requirements are hashed. When any of them changes the cached networks
+        are no longer used.
+    """
+    global _code_version
+    if _code_version is None:
+        root = os.path.dirname(os.path.abspath(network_module.__file__))
+        files = [os.path.join(root, f) for f in ['draculab.py', 'network.py',
+                 'cython_utils.pyx', os.path.join('tools', 'net_store.py')]]
+        for pkg in ['units', 'synapses', 'plants', 'requirements']:
+            files += glob.glob(os.path.join(root, pkg, '*.py'))
+        h = hashlib.sha256()
+        for name in sorted(files):
+            if os.path.isfile(name):
+                h.update(os.path.relpath(name, root).encode())
+                with open(name, 'rb') as f:
+                    h.update(f.read())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def canonical(value):
+    """ Returns a JSON-compatible version of a configuration value.
+
+        Dictionaries are sorted by key, and numpy values, Enums, and functions
+        are replaced by lists that identify them. Python functions (including
+        lambdas) are identified by their name, their compiled code, and the
+        values of their defaults and closure variables, so lambdas with
+        different bodies or captured values have different keys. The values
+        of the global names they use are not included.
+
+        Raises:
+            TypeError if the value has an unsupported type, or if it is a
+            function whose defaults or closure variables have one.
+    """
+    if value is None or type(value) in (bool, int, str):
+        return value
+    if type(value) is float:
+        return repr(value) # exact, and with the same text for the same float
+    if isinstance(value, np.generic):
+        return canonical(value.item())
+    if isinstance(value, dict):
+        items = [[canonical(k), canonical(v)] for k, v in value.items()]
+        return ['dict', sorted(items, key=lambda kv: json.dumps(kv[0]))]
+    if isinstance(value, (list, tuple)):
+        return [type(value).__name__, [canonical(v) for v in value]]
+    if isinstance(value, (set, frozenset)):
+        return ['set', sorted([canonical(v) for v in value], key=json.dumps)]
+    if isinstance(value, np.ndarray):
+        return ['array', value.dtype.str, list(value.shape),
+                canonical(value.reshape(-1).tolist())]
+    if isinstance(value, enum.Enum):
+        return ['enum', type(value).__name__, value.name]
+    if inspect.isfunction(value):
+        try:
+            return ['function', value.__module__, value.__qualname__,
+                    code_key(value.__code__), canonical(value.__defaults__),
+                    canonical(value.__kwdefaults__),
+                    [canonical(c.cell_contents) for c in value.__closure__ or ()]]
+        except (TypeError, ValueError) as e:
+            raise TypeError('The function ' + value.__qualname__ + ' in the ' +
+                  'configuration can not be hashed (' + str(e) + '). Put it in ' +
+                  'patch_keys, or set it with the functions argument of build_cache.')
+    if callable(value):
+        return ['function', getattr(value, '__module__', None),
+                getattr(value, '__qualname__', repr(value))]
+    raise TypeError('Configurations can not contain values of type ' +
+                    type(value).__name__)
+
+
+def code_key(code):
+    """ Returns a JSON-compatible version of a code object, used by canonical. """
+    consts = []
+    for c in code.co_consts:
+        if inspect.iscode(c): # e.g. a lambda inside the function
+            consts.append(code_key(c))
+        elif type(c) is bytes:
+            consts.append(['bytes', c.hex()])
+        elif c is Ellipsis:
+            consts.append(['Ellipsis'])
+        else:
+            consts.append(canonical(c))
+    return ['code', code.co_code.hex(), consts, list(code.co_names)]
+
+
+def patch_units(net, ids, params):
+    """ Set the parameters of some units in a network.
+
+        Besides setting the attributes, this updates the values that units
+        obtain from them in their constructors: 'rtau' when 'tau' is set, and
+        the variables of the exp_euler integration method. Any other derived
+        values must be updated by the caller.
+
+        Args:
+            net: a draculab network.
+            ids: a list with the IDs of the units to modify.
+            params: a dictionary. Each key is the name of an attribute. Each
+                    value is either a list with one value for each unit in 'ids',
+                    or a single value used for all the units.
+        Raises:
+            ValueError if some unit does not have the attribute, or if a list
+            of values has the wrong length.
+    """
+    for name, val in params.items():
+        vals = _expand(name, val, len(ids))
+        for uid, v in zip(ids, vals):
+            u = net.units[uid]
+            if not hasattr(u, name):
+                raise ValueError('Unit ' + str(uid) + ' has no ' + name + ' attribute')
+            setattr(u, name, v)
+            if name == 'tau' and hasattr(u, 'rtau'):
+                u.rtau = 1. / u.tau
+    for uid in ids:
+        u = net.units[uid]
+        if hasattr(u, 'eAt') and hasattr(u, 'times'):
+            add_exp_euler_vars(u)
+
+
+def patch_syns(net, syns, params):
+    """ Set the parameters of some synapses in a network.
+
+        Args:
+            net: a draculab network.
+            syns: a list of synapse objects from the network.
+            params: a dictionary. Each key is the name of an attribute, such as
+                    'w' or 'alpha'. Each value is either a list with one value
+                    for each synapse in 'syns', or a single value used for all
+                    synapses.
+        Raises:
+            ValueError if some synapse does not have the attribute, or if a list
+            of values has the wrong length.
+    """
+    for name, val in params.items():
+        vals = _expand(name, val, len(syns))
+        for syn, v in zip(syns, vals):
+            if not hasattr(syn, name):
+                raise ValueError('Synapse from unit ' + str(syn.preID) + ' to unit ' +
+                                 str(syn.postID) + ' has no ' + name + ' attribute')
+            setattr(syn, name, v)
+
+
+def _expand(name, val, n):
+    """ Returns a list with n values for the parameter 'name'. """
+    if isinstance(val, (list, np.ndarray)):
+        if len(val) != n:
+            raise ValueError('The ' + name + ' parameter has ' + str(len(val)) +
+                             ' values for ' + str(n) + ' elements')
+        return list(val)
+    return [val] * n
+
+
+class build_cache():
+    """ A disk cache for functions that build networks from a configuration.
+
+        Usage example:
+        >>> cache = build_cache(net_from_cfg, '/tmp/nets', patch_keys=['b_e'],
+                                patcher=set_b_e, functions=set_sources)
+        >>> net, pops_dict, *rest = cache.get(cfg, t_pres=30.)
+
+        The first call to get with a configuration runs the builder, flattens
+        the network, and stores it. Later calls with the same configuration
+        (except for the values of patch_keys) load the stored network instead.
+    """
+    def __init__(self, builder, path, patch_keys=(), patcher=None, functions=None):
+        """ The build_cache constructor.
+
+            Args:
+                builder: a function builder(cfg, **kwargs) that returns a network,
+                         or a tuple whose first element is a network. The other
+                         elements of the tuple (e.g. lists of unit IDs) are stored
+                         with the network (see the 'extras' of save_network).
+                         When the builder uses random numbers, all calls with the
+                         same configuration return the network of the first call,
+                         and loading it does not advance numpy's random state.
+                path: directory where the networks are stored.
+                patch_keys: keys of the configuration that are not included in
+                            the hash because 'patcher' can set them.
+                patcher: a function patcher(net, extras, cfg) that writes the
+                         values of the patch_keys entries of 'cfg' into a loaded
+                         network. 'extras' is the tuple with the other values
+                         returned by the builder. patch_units and patch_syns can
+                         be used for this. The patcher is called before the
+                         population update objects are created.
+                functions: a function functions(net, extras, cfg) that is called
+                           after a network is loaded, to set the functions of the
+                           source units that could not be stored (e.g. lambdas)
+                           with source.set_function.
+            Raises:
+                ValueError
+        """
+        if len(patch_keys) > 0 and patcher is None:
+            raise ValueError('build_cache needs a patcher to use patch_keys')
+        self.builder = builder
+        self.path = path
+        self.patch_keys = set(patch_keys)
+        self.patcher = patcher
+        self.functions = functions
+        self.hits = 0 # number of networks loaded from the cache
+        self.misses = 0 # number of networks created with the builder
+        try:
+            self.builder_src = inspect.getsource(builder)
+        except (OSError, TypeError):
+            self.builder_src = ''
+
+    def key(self, cfg, kwargs={}):
+        """ Returns the hash that identifies a configuration in the cache.
+
+            Args:
+                cfg: configuration dictionary for the builder.
+                kwargs: other keyword arguments of the builder.
+            Returns:
+                A string with a hexadecimal SHA-256 hash.
+        """
+        fixed = {k : v for k, v in cfg.items() if k not in self.patch_keys}
+        desc = [canonical(fixed), canonical(kwargs),
+                getattr(self.builder, '__module__', None),
+                getattr(self.builder, '__qualname__', None),
+                self.builder_src, code_version()]
+        return hashlib.sha256(json.dumps(desc).encode()).hexdigest()
+
+    def get(self, cfg, **kwargs):
+        """ Returns what builder(cfg, **kwargs) would, using the cache if possible.
+
+            The returned network is always flat.
+
+            Args:
+                cfg: configuration dictionary for the builder.
+                kwargs: other keyword arguments for the builder.
+            Returns:
+                A network, or a tuple whose first element is a network, as the
+                builder.
+        """
+        entry = os.path.join(self.path, self.key(cfg, kwargs))
+        if os.path.isfile(os.path.join(entry, 'skeleton.pkl')):
+            self.hits += 1
+            patch = None
+            if self.patcher is not None:
+                patch = lambda net, ext: self.patcher(net, tuple(ext['values']), cfg)
+            net, ext = load_network(entry, patch=patch, extras=True, unset_ok=True)
+            if self.functions is not None:
+                self.functions(net, tuple(ext['values']), cfg)
+            return (net,) + tuple(ext['values']) if ext['tuple'] else net
+        self.misses += 1
+        result = self.builder(cfg, **kwargs)
+        is_tuple = type(result) is tuple
+        net = result[0] if is_tuple else result
+        if not net.flat:
+            net.flatten()
+        # storing in a temporary directory, which is then renamed, so other
+        # processes using the same cache never see incomplete entries
+        os.makedirs(self.path, exist_ok=True)
+        tmp = entry + '.tmp' + str(os.getpid())
+        save_network(net, tmp, extras={'tuple' : is_tuple, 
+                                       'values' : list(result[1:]) if is_tuple else []})
+        try:
+            os.rename(tmp, entry)
+        except OSError: # another process stored the same entry
+            shutil.rmtree(tmp, ignore_errors=True)
+        return result
+
+    def clear(self):
+        """ Removes all the networks stored in the cache directory. """
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if os.path.isfile(os.path.join(self.path, name, 'skeleton.pkl')):
+                    shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
@@ -0,0 +1,534 @@
+"""
+differential.py
+Differential testing of the simulation engines of draculab.
+
+A network is built once for each engine with the same random seeds, simulated
+with every engine, and the results of each engine are compared with those of a
+reference engine. The comparison reports, for each unit, the maximum and RMS
+deviation of its activity, and the maximum deviations of the synaptic weights
+and of the plant state variables. Deviations larger than the tolerances of the
+engine make the test fail.
+
+The engines are in the ENGINES dictionary:
+    'run' : network.run, without flattening.
+    'flat' : network.flat_run, with population updates disabled. This is the
+             per-object reference of the flat path.
+    'flat_pops' : network.flat_run, with population updates (e.g. w_norm_pop,
+                  rga_syn_pop, ds_branch_pop) where the network allows them.
+New engines are added with register_engine.
+
+The 'run' engine integrates with different input interpolation than flat_run,
+so its default tolerances are loose, and it is not compared for networks with
+stochastic units, whose noise comes from different random generators.
+
+unit_model_net and synapse_model_net create small test networks for any model
+in unit_types or synapse_types. Their parameters are found by trial: a model
+starts with the parameters in UNIT_BASE (or SYN_BASE), and every missing
+parameter reported by a KeyError is taken from PARAM_DEFAULTS. The coverage
+function runs the differential test for all models, reporting the models that
+could not be built together with the reason.
+"""
+
+from draculab import unit_types, synapse_types
+from network import network
+from tools.net_store import structure_hash
+import numpy as np
+
+SEED = 20240101 # numpy and network seed used before building each network
+
+# tolerances for engines that should reproduce the reference up to rounding
+TIGHT = {'act_max' : 1e-8, 'act_rms' : 1e-9, 'w_max' : 1e-8, 'plant_max' : 1e-8}
+# tolerances for engines with a different integration of the inputs
+LOOSE = {'act_max' : 2e-2, 'act_rms' : 1e-2, 'w_max' : 2e-2, 'plant_max' : 2e-2}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Engines
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def run_engine(net, sim_time):
+    """ Simulates with network.run. """
+    return net.run(sim_time)
+
+
+def flat_engine(net, sim_time):
+    """ Simulates with network.flat_run, without population updates. """
+    net.use_pop_updates = False
+    net.flatten()
+    return net.flat_run(sim_time)
+
+
+def flat_pops_engine(net, sim_time):
+    """ Simulates with network.flat_run, using population updates. """
+    net.use_pop_updates = True
+    net.flatten()
+    return net.flat_run(sim_time)
+
+
+# ENGINES[name] = (function(net, sim_time) returning the output of run,
+#                  default tolerances, whether it uses the flat noise streams)
+ENGINES = {'run' : (run_engine, LOOSE, False),
+           'flat' : (flat_engine, TIGHT, True),
+           'flat_pops' : (flat_pops_engine, TIGHT, True)}
+
+
+def register_engine(name, function, tolerances=TIGHT, flat_noise=True):
+    """ Adds an engine to the ENGINES dictionary.
+
+        Args:
+            name: a string to identify the engine.
+            function: function(net, sim_time) that simulates the freshly built,
+                      non-flat network 'net' for sim_time seconds, and returns
+                      a tuple (times, unit activities, plant states) as in
+                      network.run.
+            tolerances: default tolerances (see TIGHT).
+            flat_noise: whether the noise of stochastic units comes from the
+                        network's noise streams, as in flat_run. Engines where
+                        this is False are not compared for stochastic networks.
+    """
+    ENGINES[name] = (function, tolerances, flat_noise)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Comparisons
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def build(builder, seed=SEED):
+    """ Returns builder(seed), after seeding numpy's global generator. """
+    np.random.seed(seed)
+    return builder(seed)
+
+
+def is_stochastic(net):
+    """ Whether some unit in the network uses a noise stream. """
+    return any([hasattr(u, 'noise_stream') for u in net.units])
+
+
+def simulate(builder, engine, sim_time, seed=SEED):
+    """ Builds a network and simulates it with one engine.
+
+        Args:
+            builder: function builder(seed) that returns a non-flat network
+                     whose noise streams use 'seed' (see unit_model_net).
+            engine: a key of ENGINES.
+            sim_time: simulation time.
+            seed: random seed used for building.
+        Returns:
+            A dictionary with the entries:
+            'times' : array with the simulation times.
+            'acts' : 2D array with the activity of unit i at step j in acts[i,j].
+            'w' : array with the final weights of all synapses, in the order of
+                  network.syns.
+            'plants' : list with the state variables array of each plant.
+            'structure' : the structure_hash of the network before simulating.
+            'stochastic' : whether some unit uses a noise stream.
+    """
+    net = build(builder, seed)
+    structure = structure_hash(net)
+    times, acts, plants = ENGINES[engine][0](net, sim_time)
+    return {'times' : np.array(times), 'acts' : np.array(acts),
+            'w' : np.array([syn.w for syn_list in net.syns for syn in syn_list]),
+            'plants' : [np.array(p) for p in plants], 'structure' : structure,
+            'stochastic' : is_stochastic(net)}
+
+
+def deviations(ref, res):
+    """ Compares two results of simulate.
+
+        Returns:
+            A dictionary with the entries:
+            'act_max' : array with the maximum absolute deviation of each unit.
+            'act_rms' : array with the RMS deviation of each unit.
+            'w_max' : maximum absolute deviation of the synaptic weights.
+            'plant_max' : list with the maximum deviation of each plant's state.
+        Raises:
+            ValueError if the results have different shapes.
+    """
+    if ref['acts'].shape != res['acts'].shape or ref['w'].shape != res['w'].shape:
+        raise ValueError('Simulation results with different shapes')
+    if not np.array_equal(ref['times'], res['times']):
+        raise ValueError('Simulation results at different times')
+    diff = res['acts'] - ref['acts']
+    n = max(diff.shape[1], 1)
+    return {'act_max' : np.abs(diff).max(axis=1) if diff.size else np.zeros(len(diff)),
+            'act_rms' : np.sqrt((diff**2).sum(axis=1) / n),
+            'w_max' : np.abs(res['w'] - ref['w']).max() if res['w'].size else 0.,
+            'plant_max' : [np.abs(p1 - p2).max() if p1.size else 0. for p1, p2
+                           in zip(ref['plants'], res['plants'])]}
+
+
+def violations(dev, tol):
+    """ Returns a list of strings describing the deviations above the tolerances. """
+    out = []
+    for key in ['act_max', 'act_rms']:
+        bad = np.flatnonzero(~(dev[key] <= tol[key])) # NaN values are violations
+        if len(bad) > 0:
+            out.append('%s of unit(s) %s exceeds %g (largest %g)' % (key,
+                       bad.tolist()[:10], tol[key], np.nanmax(dev[key])))
+    if not dev['w_max'] <= tol['w_max']:
+        out.append('w_max %g exceeds %g' % (dev['w_max'], tol['w_max']))
+    for pid, p in enumerate(dev['plant_max']):
+        if not p <= tol['plant_max']:
+            out.append('plant_max of plant %d, %g, exceeds %g' % (pid, p, tol['plant_max']))
+    return out
+
+
+def differential_test(builder, sim_time=0.5, engines=None, reference='flat',
+                      tolerances=None, seed=SEED):
+    """ Simulates a network with several engines and compares them with a reference.
+
+        Args:
+            builder: function builder(seed) that returns a non-flat network.
+                     Seeding numpy's generator with 'seed' must make it build
+                     the same network each time.
+            sim_time: simulation time.
+            engines: list of keys of ENGINES. If None, all engines are used.
+            reference: key of the engine whose results are the reference.
+            tolerances: dictionary. tolerances[engine] is a dictionary that
+                        replaces some entries of the engine's default
+                        tolerances (see TIGHT).
+            seed: random seed.
+        Returns:
+            A dictionary with the entries:
+            'passed' : True if no engine had violations.
+            'engines' : a dictionary with an entry for each engine, which is a
+                        dictionary with the entries 'deviations' (from the
+                        'deviations' function), 'violations' (list of strings),
+                        'passed', and 'skipped' (None, or the reason why the
+                        engine was not compared).
+        Raises:
+            ValueError if the builder is not deterministic, or an engine
+            doesn't exist.
+    """
+    engines = list(ENGINES.keys()) if engines is None else list(engines)
+    for name in engines + [reference]:
+        if name not in ENGINES:
+            raise ValueError('Unknown engine ' + str(name))
+    tolerances = {} if tolerances is None else tolerances
+    ref = simulate(builder, reference, sim_time, seed)
+    out = {'passed' : True, 'engines' : {}}
+    for name in engines:
+        if name == reference:
+            continue
+        function, tol, flat_noise = ENGINES[name]
+        entry = {'deviations' : None, 'violations' : [], 'passed' : True, 'skipped' : None}
+        out['engines'][name] = entry
+        if ref['stochastic'] and flat_noise != ENGINES[reference][2]:
+            entry['skipped'] = ('stochastic units draw noise from different ' +
+                                'generators in ' + name + ' and ' + reference)
+            continue
+        res = simulate(builder, name, sim_time, seed)
+        if res['structure'] != ref['structure']:
+            raise ValueError('The builder created different networks with the same seed')
+        tol = dict(tol, **tolerances.get(name, {}))
+        entry['deviations'] = deviations(ref, res)
+        entry['violations'] = violations(entry['deviations'], tol)
+        entry['passed'] = len(entry['violations']) == 0
+        out['passed'] = out['passed'] and entry['passed']
+    return out
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Test networks for the models in unit_types and synapse_types
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# parameters given to all tested units. The Euler method is used when the
+# model allows it, so the integration is the same with run and flat_run.
+UNIT_BASE = {'init_val' : 0.5, 'tau' : 0.05, 'slope' : 2., 'thresh' : 0.3,
+             'tau_fast' : 0.04, 'tau_mid' : 0.1, 'tau_slow' : 1., 'mu' : 0.,
+             'sigma' : 0.1, 'lambda' : 1., 'custom_inp_del' : 2,
+             'custom_inp_del2' : 3, 'integ_meth' : 'euler'}
+# parameters added when a unit model needs several input ports
+PORT_PARAMS = {'n_ports' : 4, 'rdc_port' : 1, 'sharpen_port' : 3, 'sda_port' : 0,
+               'acc_slow_port' : 1, 'acc_mid_port' : 1, 'hr_port' : 1,
+               'inp_deriv_ports' : [0, 1], 'xd_inp_deriv_p' : [0, 1],
+               'del_inp_ports' : [0, 1]}
+# parameters given to all postsynaptic units when testing synapses, so they
+# have the attributes that synaptic requirements expect
+POST_BASE = dict(UNIT_BASE, des_out_w_abs_sum=1., xtra_inp_del=1, inp_del_steps=2,
+                 del_steps=2)
+# parameters given to all tested synapses
+SYN_BASE = {'lrate' : 0.1}
+# range of the initial weights for particular synapse models
+SYN_W_RANGE = {'anticov_inh' : (-0.5, -0.1)}
+# values for parameters that a model requires (found through KeyError)
+PARAM_DEFAULTS = {'c' : 2., 'phi' : .2, 'tau_thr' : .01, 'tau_fix' : .1, 'thr_fix' : .2,
+    'branch_params' : {'branch_w' : [.3, .5, .2], 'slopes' : 2., 'threshs' : .2},
+    'des_out_w_abs_sum' : 1., 'w_sum' : 1., 'tau_u' : .5, 'integ_amp' : .5, 'N' : 3,
+    'tau_c' : .5, 'refr_per' : .1, 'omega' : 1., 'lrate' : .1, 'inp_del_steps' : 2,
+    'beta' : .5, 'adapt_amp' : .5, 'tau_scale' : .1, 'del_mod_min' : 1, 'del_mod_max' : 3,
+    'Kp' : .1, 'sw_thresh' : .5, 'sw_len' : .1, 'w_max' : 1., 'theta' : .1, 'tau_s' : .1,
+    'tau_e' : .1, 'tau_t' : .1, 'gain' : 1., 'eps' : .01, 'delta' : .1, 'b' : .1, 'g' : 1.,
+    'k' : 1., 'gamma' : .5, 'eta' : .1, 'des_act' : .4, 'integ_decay' : .5, 'F' : 1.,
+    'A' : 1., 'bias_lrate' : .01, 'normalize' : True, 'switch' : 1., 's_wid' : .1,
+    'L_wid' : .1, 'R_wid' : .1, 'p1_inp' : 0., 'out_norm_type' : 0, 'sort_rdc' : False,
+    'use_rdc' : False, 'wrap' : False, 'trans_t' : .1, 't_trans' : .1, 'thr' : .5,
+    'th2' : .5, 'sl2' : 1., 'y_min' : 0., 'r_thr' : .5, 'rst_thr' : .5, 't_bin' : .1,
+    'neg_act' : False, 'pnc' : .5, 'td_lrate' : .1, 'td_gamma' : .5, 'tau_relax' : .5,
+    'del_steps' : 2, 'xtra_inp_del' : 1, 'delay' : .02, 'HYP' : 1., 'OD' : 1.,
+    'center' : .5, 'function' : np.tanh, 'max_w' : 1., 'min_w' : 0., 'tau_x' : .1,
+    'tau_y' : .1, 'w_tau' : 1., 'de_rate' : .01, 'dr_amp' : .01, 'sig1' : .1, 'sig2' : .1,
+    'alpha' : .5, 'l1_norm_factor' : 1., 'w_thresh' : .1, 'w_decay' : .01,
+    'input_type' : 'pred', 'post_delay' : 2, 'wshift' : .1, 'extra_steps' : 1,
+    'del_mod_tau' : .1, 'tau_norml' : .1}
+# parameter changes for particular models
+UNIT_OVERRIDES = {'noisy_linear' : {'integ_meth' : 'exp_euler'},
+                  'noisy_sigmoidal' : {'integ_meth' : 'exp_euler'}}
+# tolerances for particular models, as in the 'tolerances' of differential_test
+APPROX_POPS = {'act_max' : 1e-3, 'act_rms' : 1e-3, 'w_max' : 1e-3}
+MODEL_TOLERANCES = {
+    # exp_scale_pop runs after all requirements of the same priority, whose
+    # relative order in the per-unit path is arbitrary (see test_pop_updates)
+    'exp_dist_sig' : {'flat_pops' : APPROX_POPS},
+    'sig_ssrdc' : {'flat_pops' : APPROX_POPS},
+    'sig_ssrdc_sharp' : {'flat_pops' : APPROX_POPS},
+    'ds_ssrdc_sharp' : {'flat_pops' : APPROX_POPS},
+    'sds_n_ssrdc_sharp' : {'flat_pops' : APPROX_POPS},
+    # thresholded output; run and flat_run may switch at different steps
+    'binary' : {'run' : {'act_max' : 1., 'act_rms' : 0.1}}}
+# postsynaptic unit models tried, in this order, when testing a synapse model
+POST_TYPES = [unit_types.sigmoidal, unit_types.gated_rga_inpsel_adapt_sig,
+              unit_types.rga_sig, unit_types.gated_rga_sig, unit_types.m_sig]
+
+
+def source_fun(k):
+    """ Returns the function of the k-th source unit in the test networks. """
+    return lambda t: 0.5 + 0.4 * np.sin((1. + 0.5 * k) * t + k)
+
+
+def _network(seed, n_src, src_taus=True):
+    """ A network with n_src sinusoidal source units. """
+    net = network({'min_delay' : 0.01, 'min_buff_size' : 5, 'seed' : seed})
+    src_pars = {'type' : unit_types.source, 'init_val' : 0.5, 'function' : source_fun(0)}
+    if src_taus:
+        src_pars.update({'tau_fast' : 0.04, 'tau_mid' : 0.1, 'tau_slow' : 1.})
+    srcs = net.create(n_src, src_pars)
+    for k, s in enumerate(srcs):
+        net.units[s].set_function(source_fun(k))
+    return net, srcs
+
+
+def _create(net, n, params):
+    """ Creates n units, giving list-valued parameters to each unit. """
+    pars = {k : ([v] * n if type(v) is list else v) for k, v in params.items()}
+    return net.create(n, pars)
+
+
+def _ports(unit, n_conns):
+    """ Input ports for n_conns connections to a unit, cycling over its ports. """
+    n_ports = unit.n_ports if unit.multiport else 1
+    return [k % n_ports for k in range(n_conns)]
+
+
+def unit_model_net(utype, params, N=3, n_src=3):
+    """ Returns a builder for a network that tests a unit model.
+
+        The network has n_src source units and N units of the tested model.
+        Sources and tested units project to all the tested units with static
+        synapses, distributed among the input ports of multiport units.
+
+        Args:
+            utype: a unit_types value.
+            params: parameter dictionary for the tested units, without 'type'.
+        Returns:
+            A function builder(seed) that creates the network.
+    """
+    def builder(seed):
+        net, srcs = _network(seed, n_src)
+        ids = _create(net, N, dict(params, type=utype))
+        n_conns = (n_src + N) * N
+        w = list(np.random.uniform(-0.2, 0.5, n_conns))
+        net.connect(srcs + ids, ids, {'rule' : 'all_to_all', 'delay' : 0.02},
+                    {'type' : synapse_types.static, 'init_w' : w,
+                     'inp_ports' : _ports(net.units[ids[0]], n_conns)})
+        return net
+    return builder
+
+
+def synapse_model_net(stype, params, post_type, post_params, N=3, n_src=3):
+    """ Returns a builder for a network that tests a synapse model.
+
+        The network has n_src source units and N units of model post_type.
+        Sources and postsynaptic units project to all postsynaptic units with
+        the tested synapses.
+
+        Args:
+            stype: a synapse_types value.
+            params: parameter dictionary for the synapses, without 'type'.
+            post_type: unit_types value of the postsynaptic units.
+            post_params: parameter dictionary for the postsynaptic units.
+        Returns:
+            A function builder(seed) that creates the network.
+    """
+    def builder(seed):
+        net, srcs = _network(seed, n_src)
+        ids = _create(net, N, dict(post_params, type=post_type))
+        n_conns = (n_src + N) * N
+        syn_spec = dict(params, type=stype, inp_ports=_ports(net.units[ids[0]], n_conns))
+        syn_spec['init_w'] = list(np.random.uniform(*SYN_W_RANGE.get(stype.name,
+                                  (0.1, 0.5)), n_conns))
+        net.connect(srcs + ids, ids, {'rule' : 'all_to_all', 'delay' : 0.02}, syn_spec)
+        return net
+    return builder
+
+
+def find_params(make_builder, params, sim_time=0.05, max_tries=40):
+    """ Finds parameters for a test network by trial.
+
+        The network is built and simulated with network.run and flat_run.
+        Parameters missing from 'params' (reported by KeyError) are taken from
+        PARAM_DEFAULTS. When an error message mentions ports the PORT_PARAMS
+        are added, and when the model can't use the Euler method 'integ_meth'
+        is removed.
+
+        Args:
+            make_builder: function make_builder(params) returning a builder.
+            params: initial parameter dictionary. It is not modified.
+            sim_time: time of the trial simulations.
+            max_tries: maximum number of trials.
+        Returns:
+            A pair (params, None) if the network could be simulated, or
+            (None, reason) where 'reason' is a string.
+    """
+    params = dict(params)
+    for _ in range(max_tries):
+        try:
+            for engine in ['run', 'flat']:
+                ENGINES[engine][0](build(make_builder(params)), sim_time)
+            return params, None
+        except KeyError as e:
+            key = e.args[0] if len(e.args) > 0 else None
+            if key in PARAM_DEFAULTS and key not in params:
+                params[key] = PARAM_DEFAULTS[key]
+                continue
+            if key in PORT_PARAMS and 'n_ports' not in params:
+                params.update(PORT_PARAMS)
+                continue
+            return None, 'KeyError: ' + str(key)
+        except Exception as e:
+            msg = str(e)
+            if 'branch_w' in msg and 'branch_params' in params and 'n_ports' in params:
+                # double sigma units with one branch per port, except for
+                # 'minus k' ports used for other purposes
+                n_br = params['n_ports'] - (2 if 'minus 2' in msg else 1 if 'minus 1' in msg else 0)
+                if len(params['branch_params']['branch_w']) != n_br:
+                    params['branch_params'] = dict(params['branch_params'],
+                                                   branch_w=[1./n_br] * n_br)
+                    continue
+            if 'port' in msg.lower() and 'n_ports' not in params:
+                params.update(PORT_PARAMS)
+                continue
+            if 'euler' in msg.lower() and params.get('integ_meth') == 'euler':
+                del params['integ_meth']
+                continue
+            return None, type(e).__name__ + ': ' + msg.split('\n')[0][:120]
+    return None, 'parameters not found in ' + str(max_tries) + ' tries'
+
+
+def unit_model_builder(utype):
+    """ Returns (builder, None) to test a unit model, or (None, reason). """
+    start = dict(UNIT_BASE, **UNIT_OVERRIDES.get(utype.name, {}))
+    params, reason = find_params(lambda p: unit_model_net(utype, p), start)
+    if params is None:
+        return None, reason
+    return unit_model_net(utype, params), None
+
+
+def synapse_model_builder(stype):
+    """ Returns (builder, None) to test a synapse model, or (None, reason).
+
+        The postsynaptic unit models in POST_TYPES are tried in order.
+    """
+    reasons = []
+    for post_type in POST_TYPES:
+        post_params, reason = find_params(lambda p: unit_model_net(post_type, p),
+                                          POST_BASE)
+        if post_params is None:
+            continue
+        params, reason = find_params(lambda p: synapse_model_net(stype, p, post_type,
+                                     post_params), SYN_BASE)
+        if params is not None:
+            return synapse_model_net(stype, params, post_type, post_params), None
+        reasons.append(post_type.name + ' -> ' + reason)
+    return None, '; '.join(reasons)
+
+
+def coverage(kind='units', names=None, sim_time=0.3, engines=None, reference='flat',
+             tolerances=None):
+    """ Runs the differential test for the models in unit_types or synapse_types.
+
+        Args:
+            kind: 'units' or 'synapses'.
+            names: list with the names of the models to test. If None, all models
+                   are tested (except the source unit).
+            sim_time, engines, reference: as in differential_test.
+            tolerances: as in differential_test. Its entries replace those in
+                        MODEL_TOLERANCES.
+        Returns:
+            A list with a dictionary for each model, with the entries 'name',
+            'status' ('passed', 'failed', or 'not built'), 'reason' (why the
+            network could not be built, or None), and 'result' (the output of
+            differential_test, or None).
+        Raises:
+            ValueError if 'kind' is not valid.
+    """
+    if kind == 'units':
+        models = [u for u in unit_types if u is not unit_types.source]
+        make = unit_model_builder
+    elif kind == 'synapses':
+        models = list(synapse_types)
+        make = synapse_model_builder
+    else:
+        raise ValueError('kind should be "units" or "synapses"')
+    if names is not None:
+        models = [m for m in models if m.name in names]
+    rows = []
+    for model in models:
+        builder, reason = make(model)
+        row = {'name' : model.name, 'status' : 'not built', 'reason' : reason,
+               'result' : None}
+        if builder is not None:
+            tol = dict(MODEL_TOLERANCES.get(model.name, {}))
+            tol.update({} if tolerances is None else tolerances)
+            try:
+                row['result'] = differential_test(builder, sim_time, engines,
+                                                  reference, tol)
+                row['status'] = 'passed' if row['result']['passed'] else 'failed'
+            except Exception as e:
+                row['status'] = 'failed'
+                row['reason'] = type(e).__name__ + ': ' + str(e).split('\n')[0][:120]
+        rows.append(row)
+    return rows
+
+
+def report(rows):
+    """ Returns a string with a table of the results of coverage. """
+    lines = []
+    for row in rows:
+        line = '%-28s %-10s' % (row['name'], row['status'])
+        if row['result'] is not None:
+            for name, entry in row['result']['engines'].items():
+                if entry['skipped'] is not None:
+                    line += ' %s: skipped' % name
+                else:
+                    line += ' %s: %.2e' % (name, entry['deviations']['act_max'].max()
+                                           if entry['deviations']['act_max'].size else 0.)
+            for name, entry in row['result']['engines'].items():
+                for v in entry['violations']:
+                    line += '\n    ' + name + ': ' + v
+        if row['reason'] is not None:
+            line += ' ' + row['reason']
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import sys
+    kinds = sys.argv[1:] if len(sys.argv) > 1 else ['units', 'synapses']
+    for kind in kinds:
+        rows = coverage(kind)
+        print(report(rows))
+        counts = {s : sum([r['status'] == s for r in rows]) for s in
+                  ['passed', 'failed', 'not built']}
+        print('%s: %d passed, %d failed, %d not built\n' % (kind, counts['passed'],
+              counts['failed'], counts['not built']))
@@ -467,7 +467,8 @@ class ei_net():
             unit.set_function( self.make_inp_fun(pre, cur, init_time, t_tran) )
 
 
-    def run(self, n_pres,  pres_time, set_inp_pat=None, set_inp_fun=None, flat=False):
+    def run(self, n_pres,  pres_time, set_inp_pat=None, set_inp_fun=None, flat=False,
+            callback=None, every=100):
         """ Run a simulation, presenting n_pres patterns, each lasting pres_time. 
 
             n_pres : number of pattern presentations to simulate.
@@ -495,6 +496,13 @@ class ei_net():
                 # pres_time : duration of the presentation.
                 # inp_units : a list with the input units (e.g. "x").
             flat : A  binary value indicating whether to use flat_run instead of run
+            callback : an optional function passed to network.run or network.flat_run, where it
+                       is called every 'every' simulation steps with a run_progress object. If it
+                       returns a true value, the simulation stops, and the remaining presentations
+                       are skipped. The returned value is stored in self.stop_reason.
+                       All presentations share one run_progress object, so its step count,
+                       estimated time, and data cover the whole simulation.
+            every : number of simulation steps between calls to the callback.
 
             If the set_inp_pat or set_inp_fun arguments are not provided, the class defaults are used.
 
@@ -505,12 +513,18 @@ class ei_net():
             Updates:
                 self.all_times: 1-D numpy array with the times for each data point in all_activs.
                 self.all_activs: 2-D numpy array with the activity of all units at each point in all_times. 
+                self.stop_reason: the value returned by the callback that stopped the simulation, or None.
         """
         # store a record of this simulation
         self.history.append('run(n_pres=%d, pres_time=%f, ...)' % (n_pres, pres_time)) 
         # initialize storage of results
         self.all_times = []
         self.all_activs = []
+        self.stop_reason = None
+        if callback is not None: # a single progress object for all presentations
+            progress = run_progress(self.net, n_pres * int(pres_time/self.net.min_delay))
+        else:
+            progress = None
         # initialize other variables
         if not set_inp_pat:
             set_inp_pat = self.default_inp_pat
@@ -539,11 +553,15 @@ class ei_net():
             #    self.net.units[i].set_function(self.make_sin_pulse(t, t+pres_time, inp_time, inp_vec[i-self.x[0]]))
         
             if flat:
-                times, activs, plants = self.net.flat_run(pres_time)
+                times, activs, plants = self.net.flat_run(pres_time, callback, every, progress=progress)
             else:
-                times, activs, plants = self.net.run(pres_time)
+                times, activs, plants = self.net.run(pres_time, callback, every, progress=progress)
             self.all_times.append(times)
             self.all_activs.append(activs)
+            if progress is not None and progress.stopped:
+                self.stop_reason = progress.reason
+                print('Simulation stopped at presentation %d: %s' % (pres, str(self.stop_reason)))
+                break
             if self.net_number: #!= None:
                 print('Presentation %s took %s seconds at network %d.' % 
                       (pres, time.time() - pres_start, self.net_number), end='\n')
@@ -599,7 +599,8 @@ class ei_network():
             unit.set_function( self.make_inp_fun(pre, cur, init_time, t_tran) )
 
  
-    def run(self, n_pres,  pres_time, set_inp_pat=None, set_inp_fun=None, flat=False):
+    def run(self, n_pres,  pres_time, set_inp_pat=None, set_inp_fun=None, flat=False,
+            callback=None, every=100):
         """ Run a simulation, presenting n_pres patterns, each lasting pres_time. 
 
             Args:
@@ -642,6 +643,13 @@ class ei_network():
                             # pres_time : duration of the presentation.
                             # inp_units : a list with the input units (e.g. "x").
                 flat : A  binary value indicating whether to use flat_run instead of run
+                callback : an optional function passed to network.run or network.flat_run, where it
+                           is called every 'every' simulation steps with a run_progress object. If it
+                           returns a true value, the simulation stops, and the remaining presentations
+                           are skipped. The returned value is stored in self.stop_reason.
+                           All presentations share one run_progress object, so its step count,
+                           estimated time, and data cover the whole simulation.
+                every : number of simulation steps between calls to the callback.
 
                 If the set_inp_pat or set_inp_fun arguments are not provided for a layer that has an input 
                 population (x), the class defaults are used.
@@ -649,6 +657,7 @@ class ei_network():
             Updates:
                 self.all_times: 1-D numpy array with the times for each data point in all_activs.
                 self.all_activs: 2-D numpy array with the activity of all units at each point in all_times. 
+                self.stop_reason: the value returned by the callback that stopped the simulation, or None.
         """
         # set_inp_pat has the net_number argument for multiprocess simulations because in this case
         # it is hard to keep a record of the input ID's at the mp_net_runner object. Thus, ei_network.run
@@ -661,6 +670,11 @@ class ei_network():
         # initialize input patterns and storage of results 
         run_activs = []  # will contain all the input activities for this call to run()
         start_time = time.time() # to keep track of how long the simulation lasts
+        self.stop_reason = None
+        if callback is not None: # a single progress object for all presentations
+            progress = run_progress(self.net, n_pres * int(pres_time/self.net.min_delay))
+        else:
+            progress = None
         prev_pat = {} # dictionary to store the previous input patterns
         inp_pat = {} # dictionary to store the current input patterns
 
@@ -728,13 +742,18 @@ class ei_network():
             # Simulating
             if flat:
                 #self.net.link_unit_buffers()
-                times, activs, plants = self.net.flat_run(pres_time)
+                times, activs, plants = self.net.flat_run(pres_time, callback, every, progress=progress)
             else:
-                times, activs, plants = self.net.run(pres_time)
+                times, activs, plants = self.net.run(pres_time, callback, every, progress=progress)
             #self.all_times.append(times) # deprecated...
             #self.all_activs.append(activs)
             self.all_times = np.append(self.all_times, times)
             run_activs.append(activs)
+            if progress is not None and progress.stopped:
+                self.stop_reason = progress.reason
+                n_pres = pres - self.present + 1 # presentations simulated
+                print('\nSimulation stopped: ' + str(self.stop_reason) + num_str)
+                break
             #print('Presentation %s took %s seconds ' % (pres, time.time() - 
                    #pres_start) + num_str, end='\r')
                    #pres_start) + num_str, end='\x1b[1K\r')
@@ -0,0 +1,778 @@
+"""
+net_store.py
+Functions to save a draculab network to disk, and to load it back without
+creating and connecting its units again.
+
+A stored network is a directory with two files:
+    skeleton.pkl : a pickle that only contains Python builtins (lists, tuples,
+                   dictionaries, strings, and numbers). It describes the
+                   classes and attributes of the network, units, synapses and
+                   plants. Objects are replaced by small tagged dictionaries.
+    arrays.bin : the raw bytes of all the numpy arrays, each one starting at a
+                 64-byte boundary. When the network is loaded this file is
+                 memory-mapped in copy-on-write mode, and the arrays of the
+                 network (e.g. acts, ts, and the flat input index) become views
+                 of the map. Thus, large networks are loaded without reading
+                 their arrays, and the file on disk is never modified.
+
+The skeleton is read with an unpickler that refuses to import anything, so
+loading a stored network only creates instances of the network, unit, synapse
+and plant classes that are found in the draculab packages.
+
+save_checkpoint and load_checkpoint use the same files to store only the
+dynamic state of a network (see network.dynamic_state), which can be restored
+into a network with the same structure.
+
+Source functions that are defined at the module level are stored by name.
+Functions that can't be imported by name (e.g. lambdas) must be provided when
+the network is loaded (see load_network).
+"""
+
+from draculab import unit_types, synapse_types, plant_models, syn_reqs  # names of models and requirements
+from network import network, noise_stream
+from units.units import unit
+from synapses.synapses import synapse
+from plants.plants import plant
+import numpy as np
+import contextlib
+import importlib
+import gc
+import hashlib
+import operator
+import pickle
+import types
+import os
+
+FORMAT_VERSION = 1 # version of the storage format
+ALIGN = 64 # arrays are placed in arrays.bin at multiples of this many bytes
+ENUMS = {e.__name__ : e for e in [unit_types, synapse_types, plant_models, syn_reqs]}
+# network attributes that are not stored, because load_network creates them again
+NET_SKIP = {'units', 'plants', 'syns', 'act', 'pop_updates', 'pop_inp_updates',
+            'pop_syn_updates', 'upd_syns', 'seed_seq', 'noise_streams', 'acts_idx',
+            'acts_win', 'all_syns', 'in_starts', 'syn_post', 'syn_pos', 'out_order',
+            'out_starts', 'syn_w', 'syn_w_time', 'profiler', 'stream_stats',
+            'linear_props', 'integ_units'}
+# unit attributes that are views of network arrays in flat networks
+FLAT_UNIT_SKIP = {'net', 'buffer', 'times', 'act_buff', 'acts', 'acts_win',
+                  'acts_idx', 'step_inps'}
+# plant attributes rebuilt after loading
+PLANT_SKIP = {'net', 'inputs', 'inp_syns'}
+FLAT_PLANT_SKIP = PLANT_SKIP | {'buffer', 'times'}
+_MISSING = object() # marks synapse attributes that only some synapses of a class have
+
+
+class _skeleton_unpickler(pickle.Unpickler):
+    """ An unpickler that only accepts builtin containers and scalars. """
+    safe = {'complex', 'set', 'frozenset', 'slice', 'range'}
+
+    def find_class(self, module, name):
+        if module == 'builtins' and name in self.safe:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError('The skeleton of a stored network ' +
+                                     'can not contain ' + module + '.' + name)
+
+
+class _unset_function():
+    """ Placeholder for a function that could not be stored. """
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args):
+        raise ValueError('The function ' + self.name + ' was not stored, so it ' +
+                         'must be set again (e.g. with source.set_function)')
+
+
+class _encoder():
+    """ Converts the objects of a network into builtins and arrays. """
+    def __init__(self, net):
+        self.net = net
+        self.arrays = [] # arrays to be written in arrays.bin
+        self.arr_ids = {} # arr_ids[id(array)] = index in self.arrays
+        # tags for the objects that are referenced rather than stored
+        self.refs = {id(net) : {'@':'net'}}
+        for u in net.units:
+            self.refs[id(u)] = {'@':'unit', 'i':u.ID}
+        for p in net.plants:
+            self.refs[id(p)] = {'@':'plant', 'i':p.ID}
+            for port, syn_list in enumerate(p.inp_syns):
+                for k, syn in enumerate(syn_list):
+                    self.refs[id(syn)] = {'@':'psyn', 'i':p.ID, 'p':port, 'l':k}
+        self.syn_refs = None # references to the synapses in net.syns, created if needed
+        self.streams = {id(s) : key for key, s in net.noise_streams.items()}
+
+    def array(self, arr):
+        """ Returns the index of a numeric array in self.arrays. """
+        if id(arr) not in self.arr_ids:
+            self.arr_ids[id(arr)] = len(self.arrays)
+            self.arrays.append(arr)
+        return self.arr_ids[id(arr)]
+
+    def ragged(self, v):
+        """ Encodes a list of lists of floats, or of integer tuples, with 2 arrays.
+
+            Returns None if 'v' does not have that structure. This is used for
+            the long per-synapse lists of the network (e.g. delays, out_syns).
+        """
+        if len(v) == 0 or not all([type(l) is list for l in v]):
+            return None
+        flat = [x for l in v for x in l]
+        if len(flat) == 0:
+            return None
+        if all([type(x) is float for x in flat]):
+            vals = np.array(flat, dtype=float)
+            width = 0
+        elif all([type(x) is tuple and len(x) == len(flat[0]) for x in flat]) and \
+             all([type(y) is int for x in flat for y in x]) and len(flat[0]) > 0:
+            vals = np.array(flat, dtype=np.int64)
+            width = len(flat[0])
+        else:
+            return None
+        counts = np.array([len(l) for l in v], dtype=np.int64)
+        return {'@':'ragged', 'n':self.array(counts), 'v':self.array(vals), 'w':width}
+
+    def ref(self, v):
+        """ Returns the reference to a network, unit, plant, or synapse, or None. """
+        if id(v) in self.refs:
+            return self.refs[id(v)]
+        if isinstance(v, synapse):
+            if self.syn_refs is None:
+                self.syn_refs = {id(syn) : {'@':'syn', 'p':post, 'l':loc}
+                                 for post, syn_list in enumerate(self.net.syns)
+                                 for loc, syn in enumerate(syn_list)}
+            return self.syn_refs.get(id(v))
+        return None
+
+    def encode(self, v, where):
+        """ Returns a version of 'v' that only contains builtins.
+
+            Args:
+                v: the value to encode.
+                where: a string describing the location of 'v', used in errors.
+            Raises:
+                TypeError if 'v' has a type that can't be stored.
+        """
+        if v is None or type(v) in (bool, int, float, str, complex, bytes):
+            return v
+        if isinstance(v, np.generic):
+            return v.item()
+        ref = self.ref(v)
+        if ref is not None:
+            return ref
+        if isinstance(v, np.ndarray):
+            if v.dtype.hasobject:
+                return {'@':'oarray', 's':v.shape,
+                        'v':[self.encode(x, where) for x in v.reshape(-1).tolist()]}
+            return {'@':'array', 'i':self.array(v)}
+        if type(v) is list:
+            rag = self.ragged(v)
+            if rag is not None:
+                return rag
+            return [self.encode(x, where) for x in v]
+        if type(v) is tuple:
+            return tuple([self.encode(x, where) for x in v])
+        if type(v) in (set, frozenset):
+            return {'@':type(v).__name__, 'v':[self.encode(x, where) for x in v]}
+        if type(v) is dict:
+            return {'@':'dict', 'k':[self.encode(k, where) for k in v.keys()],
+                    'v':[self.encode(x, where) for x in v.values()]}
+        if type(v) is slice:
+            return {'@':'slice', 'v':(v.start, v.stop, v.step)}
+        if type(v).__name__ in ENUMS and type(v) is ENUMS[type(v).__name__]:
+            return {'@':'enum', 'c':type(v).__name__, 'n':v.name}
+        if isinstance(v, type) and issubclass(v, np.generic):
+            return {'@':'dtype', 'n':np.dtype(v).str}
+        if isinstance(v, noise_stream) and id(v) in self.streams:
+            return {'@':'noise', 'k':self.streams[id(v)]}
+        if isinstance(v, types.MethodType):
+            owner = v.__self__
+            name = v.__func__.__name__
+            ref = self.ref(owner)
+            if ref is None or getattr(type(owner), name, None) is not v.__func__:
+                raise TypeError('Can not store the method ' + v.__qualname__ +
+                                ' found in ' + where)
+            return {'@':'method', 'o':ref, 'n':name}
+        if isinstance(v, types.FunctionType):
+            found = _find_function(v.__module__, v.__qualname__) is v
+            if not (found or where.endswith('.get_act') or where.startswith('extras')):
+                raise TypeError('Can not store the function ' + v.__qualname__ +
+                                ' found in ' + where + ', because it can not be ' +
+                                'imported by name')
+            return {'@':'function', 'm':v.__module__, 'q':v.__qualname__, 'r':found}
+        if isinstance(v, (np.ufunc, types.BuiltinFunctionType)):
+            # numpy ufuncs, and functions of extension modules such as math
+            mod = 'numpy' if isinstance(v, np.ufunc) else v.__module__
+            if mod is not None and _find_function(mod, v.__name__) is v:
+                return {'@':'function', 'm':mod, 'q':v.__name__, 'r':True}
+        if type(v).__module__.split('.')[0] in ['units', 'synapses', 'plants']:
+            # auxiliary objects, such as the muscles of some plants
+            return dict(self.record(v, set(), where), **{'@':'object'})
+        raise TypeError('Can not store the ' + type(v).__name__ + ' object found in '
+                        + where)
+
+    def record(self, obj, skip, where):
+        """ Returns the class and encoded attributes of a unit, plant, or synapse. """
+        d = {k : self.encode(v, where + '.' + k)
+             for k, v in obj.__dict__.items() if k not in skip}
+        return {'c':(type(obj).__module__, type(obj).__qualname__), 'd':d}
+
+    def same(self, vals):
+        """ True if all values in the list are the same object, or equal sets. """
+        v0 = vals[0]
+        if all([x is v0 for x in vals]):
+            return True
+        if type(v0) in (set, frozenset):
+            return all([x == v0 for x in vals])
+        return False
+
+    def columns(self, syns, where):
+        """ Stores the attributes of many synapses of the same class by columns.
+
+            Columns with numbers are stored as arrays. Other columns are stored
+            as lists, or as a single value when all synapses have the same one.
+        """
+        keys = dict.fromkeys(syns[0].__dict__)
+        first = syns[0].__dict__.keys()
+        uniform = True # whether all synapses have the same attributes
+        for syn in syns:
+            if syn.__dict__.keys() != first:
+                keys.update(dict.fromkeys(syn.__dict__))
+                uniform = False
+        missing = {'@':'missing'}
+        if uniform:
+            rows = map(operator.attrgetter(*keys), syns)
+            columns = zip(*rows) if len(keys) > 1 else [list(rows)]
+        else:
+            columns = [[syn.__dict__.get(k, missing) for syn in syns] for k in keys]
+        cols = {}
+        for k, vals in zip(keys, columns):
+            kinds = set(map(type, vals))
+            if kinds <= {float, np.float64}:
+                cols[k] = {'@':'col', 'i':self.array(np.array(vals, dtype=float))}
+            elif kinds <= {int, np.int64}:
+                cols[k] = {'@':'col', 'i':self.array(np.array(vals, dtype=np.int64))}
+            elif kinds <= {bool, np.bool_}:
+                cols[k] = {'@':'col', 'i':self.array(np.array(vals, dtype=bool))}
+            elif len(kinds) == 1 and self.same(vals):
+                cols[k] = {'@':'const', 'v':self.encode(vals[0], where + '.' + k)}
+            else:
+                cols[k] = {'@':'list', 'v':[missing if x is missing else 
+                           self.encode(x, where + '.' + k) for x in vals]}
+        return cols
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """ Disables the cyclic garbage collector while a network is stored or loaded.
+
+        Creating the many small objects of a large network triggers the
+        garbage collector repeatedly, which can more than double loading times.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _find_function(module, qualname):
+    """ Returns the object with the given module and qualified name, or None. """
+    if '<locals>' in qualname or '<lambda>' in qualname:
+        return None
+    try:
+        obj = importlib.import_module(module)
+        for name in qualname.split('.'):
+            obj = getattr(obj, name)
+    except (ImportError, AttributeError):
+        return None
+    return obj
+
+
+def _find_class(module, qualname, base):
+    """ Returns a class from the draculab packages that is a subclass of 'base'.
+
+        Raises:
+            ValueError if the class is not found, or is not a subclass of 'base'.
+    """
+    if module.split('.')[0] not in ['network', 'units', 'synapses', 'plants']:
+        raise ValueError('The class ' + module + '.' + qualname +
+                         ' is not from the draculab packages')
+    cls = _find_function(module, qualname)
+    if not (isinstance(cls, type) and issubclass(cls, base)):
+        raise ValueError('The class ' + module + '.' + qualname +
+                         ' could not be found')
+    return cls
+
+
+def save_network(net, path, extras=None):
+    """ Save a network in the directory 'path'.
+
+        The network can be flat or not. The stored network includes its
+        connectivity, the state of its units, synapses and plants, the state of
+        its noise streams, and the simulation time, so a network loaded with
+        load_network continues its simulation exactly as the original would.
+
+        The population update objects of flat networks (see
+        network.init_pop_updates and network.init_linear_props) are not stored;
+        load_network creates them again.
+
+        Args:
+            net: a draculab network.
+            path: name of a directory. It is created if it doesn't exist, and
+                  stored files in it are replaced.
+            extras: a value stored along with the network, such as the lists of
+                    unit IDs returned by a network builder. It may contain
+                    builtin containers, numbers, strings, numpy arrays, the
+                    Enums of draculab, and functions. Functions that can't be
+                    imported by name are loaded as placeholders that raise
+                    ValueError when called.
+        Raises:
+            TypeError if some attribute of the network can't be stored.
+    """
+    with _gc_paused():
+        _save_network(net, path, extras)
+
+
+def _save_network(net, path, extras):
+    """ The body of save_network. """
+    enc = _encoder(net)
+    skel = {'version' : FORMAT_VERSION,
+            'class' : (type(net).__module__, type(net).__qualname__)}
+    skel['extras'] = enc.encode(extras, 'extras')
+    # the network attributes
+    skel['net'] = {k : enc.encode(v, 'network.' + k)
+                   for k, v in net.__dict__.items() if k not in NET_SKIP}
+    # the noise streams
+    skel['noise'] = [(key, s.size, s.n_draws, s.shape, s.pos,
+                      enc.encode(s.rng.bit_generator.state, 'noise stream'),
+                      enc.encode(s.block, 'noise stream'))
+                     for key, s in net.noise_streams.items()]
+    # the units
+    skel['units'] = []
+    for u in net.units:
+        skip = {'net'}
+        if net.flat:
+            skip = FLAT_UNIT_SKIP
+        elif hasattr(u, 'buffer'):
+            skip = {'net', 'act_buff', 'interpolator'}
+        skel['units'].append(enc.record(u, skip, 'unit ' + str(u.ID)))
+    # the synapses, grouped by class
+    classes = {} # classes[cls] = list with the synapses of class cls
+    cls_idx = {} # cls_idx[cls] = index of cls in classes
+    syn_cls = [] # class index of each synapse
+    for syn_list in net.syns:
+        for syn in syn_list:
+            if type(syn) not in cls_idx:
+                cls_idx[type(syn)] = len(cls_idx)
+                classes[type(syn)] = []
+            classes[type(syn)].append(syn)
+            syn_cls.append(cls_idx[type(syn)])
+    skel['syn_classes'] = [((cls.__module__, cls.__qualname__),
+                            enc.columns(syns, cls.__name__ + ' synapse'))
+                           for cls, syns in classes.items()]
+    skel['syn_cls'] = enc.array(np.array(syn_cls, dtype=np.int64))
+    skel['n_syns'] = enc.array(np.array([len(l) for l in net.syns], dtype=np.int64))
+    # presynaptic units, with -1 for synapses from plants
+    skel['syn_pre'] = enc.array(np.array([-1 if hasattr(syn, 'plant_out') else syn.preID
+                                for syn_list in net.syns for syn in syn_list], dtype=np.int64))
+    # the plants and their input synapses
+    skip = FLAT_PLANT_SKIP if net.flat else PLANT_SKIP
+    skel['plants'] = [enc.record(p, skip, 'plant ' + str(p.ID)) for p in net.plants]
+    skel['plant_syns'] = [[[enc.record(syn, set(), 'plant synapse') for syn in l]
+                           for l in p.inp_syns] for p in net.plants]
+    _write_files(path, skel, enc.arrays)
+
+
+def _write_files(path, skel, arrays):
+    """ Writes the skeleton and the arrays of a stored network or checkpoint.
+
+        The files are written with temporary names first, so an interrupted
+        call does not leave a skeleton that describes a different arrays.bin.
+    """
+    os.makedirs(path, exist_ok=True)
+    table = []
+    offset = 0
+    tmp_arr = os.path.join(path, 'arrays.bin.tmp')
+    with open(tmp_arr, 'wb') as f:
+        for arr in arrays:
+            arr = np.ascontiguousarray(arr)
+            pad = (-offset) % ALIGN
+            f.write(b'\0' * pad)
+            offset += pad
+            table.append((offset, arr.dtype.str, arr.shape))
+            f.write(arr.tobytes())
+            offset += arr.nbytes
+    skel['arrays'] = table
+    tmp_skel = os.path.join(path, 'skeleton.pkl.tmp')
+    with open(tmp_skel, 'wb') as f:
+        pickle.dump(skel, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_arr, os.path.join(path, 'arrays.bin'))
+    os.replace(tmp_skel, os.path.join(path, 'skeleton.pkl'))
+
+
+def _read_files(path):
+    """ Returns the skeleton and the list of arrays written by _write_files.
+
+        The arrays are copy-on-write views of the memory-mapped arrays.bin file.
+
+        Raises:
+            ValueError if the files have a different format version.
+    """
+    with open(os.path.join(path, 'skeleton.pkl'), 'rb') as f:
+        skel = _skeleton_unpickler(f).load()
+    if skel['version'] != FORMAT_VERSION:
+        raise ValueError('Unsupported version of the network storage format')
+    arr_file = os.path.join(path, 'arrays.bin')
+    mm = None
+    if os.path.getsize(arr_file) > 0:
+        mm = np.memmap(arr_file, dtype=np.uint8, mode='c')
+    arrays = [np.ndarray(shape=shape, dtype=np.dtype(dt), buffer=mm, offset=off)
+              if np.prod(shape) > 0 else np.zeros(shape, dtype=np.dtype(dt))
+              for off, dt, shape in skel['arrays']]
+    return skel, arrays
+
+
+class _decoder():
+    """ Converts the output of _encoder back into objects. """
+    def __init__(self, net, arrays, functions, unset_ok):
+        self.net = net
+        self.arrays = arrays
+        self.functions = functions
+        self.unset_ok = unset_ok
+        self.owner = None # ID of the unit being decoded
+        self.key = None # name of the attribute being decoded
+
+    def ref(self, tag):
+        """ Returns the object for a reference tag. """
+        kind = tag['@']
+        if kind == 'net':
+            return self.net
+        if kind == 'unit':
+            return self.net.units[tag['i']]
+        if kind == 'plant':
+            return self.net.plants[tag['i']]
+        if kind == 'syn':
+            return self.net.syns[tag['p']][tag['l']]
+        return self.net.plants[tag['i']].inp_syns[tag['p']][tag['l']] # psyn
+
+    def decode(self, v):
+        """ Inverse of _encoder.encode. """
+        if type(v) is list:
+            return [self.decode(x) for x in v]
+        if type(v) is tuple:
+            return tuple([self.decode(x) for x in v])
+        if type(v) is not dict:
+            return v
+        kind = v['@']
+        if kind == 'array':
+            return self.arrays[v['i']]
+        if kind == 'ragged':
+            counts = self.arrays[v['n']]
+            if v['w'] == 0:
+                vals = self.arrays[v['v']].tolist()
+            else:
+                vals = list(map(tuple, self.arrays[v['v']].tolist()))
+            ends = np.cumsum(counts).tolist()
+            return [vals[e-n:e] for n, e in zip(counts.tolist(), ends)]
+        if kind in ['net', 'unit', 'plant', 'syn', 'psyn']:
+            return self.ref(v)
+        if kind == 'dict':
+            return dict(zip(self.decode(v['k']), self.decode(v['v'])))
+        if kind == 'set':
+            return set(self.decode(v['v']))
+        if kind == 'frozenset':
+            return frozenset(self.decode(v['v']))
+        if kind == 'enum':
+            return ENUMS[v['c']][v['n']]
+        if kind == 'method':
+            owner = self.ref(v['o'])
+            return types.MethodType(getattr(type(owner), v['n']), owner)
+        if kind == 'function':
+            if v['r']:
+                return _find_function(v['m'], v['q'])
+            if self.key == 'get_act' and self.owner in self.functions:
+                return self.functions[self.owner]
+            if self.unset_ok or self.owner is None: # owner is None for the extras
+                return _unset_function(v['q'])
+            raise ValueError('The function ' + v['q'] + ' of unit ' + str(self.owner)
+                             + ' must be provided in the functions argument')
+        if kind == 'noise':
+            return self.net.noise_streams[tuple(v['k'])]
+        if kind == 'missing':
+            return _MISSING
+        if kind == 'dtype':
+            return np.dtype(v['n']).type
+        if kind == 'slice':
+            return slice(*v['v'])
+        if kind == 'object':
+            obj = _find_class(*v['c'], object)
+            obj = obj.__new__(obj)
+            self.fill(obj, v['d'])
+            return obj
+        if kind == 'oarray':
+            return np.array(self.decode(v['v']), dtype=object).reshape(v['s'])
+        raise ValueError('Unknown tag ' + str(kind) + ' in the stored network')
+
+    def fill(self, obj, d):
+        """ Decodes the attribute dictionary 'd' into the object 'obj'. """
+        for k, x in d.items():
+            self.key = k
+            obj.__dict__[k] = self.decode(x)
+        self.key = None
+
+    def fill_columns(self, syns, cols):
+        """ Decodes the columns of _encoder.columns into a list of synapses. """
+        n = len(syns)
+        keys = list(cols)
+        vals = []
+        has_missing = False
+        for k in keys:
+            col = cols[k]
+            if col['@'] == 'col':
+                vals.append(self.arrays[col['i']].tolist())
+            elif col['@'] == 'const':
+                val = self.decode(col['v'])
+                if type(val) in (set, list, dict): # each synapse gets its own copy
+                    vals.append([type(val)(val) for _ in range(n)])
+                else:
+                    vals.append([val] * n)
+            else:
+                vals.append([self.decode(x) for x in col['v']])
+                has_missing = has_missing or any([x is _MISSING for x in vals[-1]])
+        for syn, row in zip(syns, zip(*vals)):
+            syn.__dict__.update(zip(keys, row))
+        if has_missing:
+            for syn in syns:
+                for k in [k for k, x in syn.__dict__.items() if x is _MISSING]:
+                    del syn.__dict__[k]
+
+
+def load_network(path, functions=None, patch=None, extras=False, unset_ok=False):
+    """ Load a network stored with save_network.
+
+        The loaded network is ready to run, or to continue its simulation if it
+        was stored after running. The units and synapses are not created or
+        connected again; their attributes are restored directly. The arrays of
+        the network are copy-on-write views of the memory-mapped arrays.bin file,
+        so changes to the loaded network are never written back to disk.
+
+        Args:
+            path: directory where the network was stored.
+            functions: a dictionary whose keys are unit IDs, and whose values are
+                       functions. This is used to provide the functions of source
+                       units that could not be stored by name (e.g. lambdas).
+            patch: a function patch(net, extras) that is called once the
+                   attributes of the network have been restored, and before the
+                   population update objects are created. It can be used to
+                   change the parameters of units and synapses (see
+                   tools.build_cache). 'extras' is the value given to
+                   save_network.
+            extras: if True, the 'extras' value given to save_network is also
+                    returned.
+            unset_ok: if True, the source functions that could not be stored and
+                      are not in 'functions' are replaced by placeholders that
+                      raise ValueError when called. They should be set afterwards
+                      with source.set_function.
+        Returns:
+            A draculab network, or a (network, extras) tuple if extras is True.
+        Raises:
+            ValueError if the stored network can't be reconstructed.
+    """
+    with _gc_paused():
+        net, extras_val = _load_network(path, functions, patch, unset_ok)
+    if extras:
+        return net, extras_val
+    return net
+
+
+def _load_network(path, functions, patch, unset_ok):
+    """ The body of load_network. Returns the network and the extras. """
+    if functions is None:
+        functions = {}
+    skel, arrays = _read_files(path)
+    # creating the objects without calling their constructors
+    net = _find_class(*skel['class'], network).__new__(_find_class(*skel['class'],
+                                                                   network))
+    net.units = [_find_class(*rec['c'], unit).__new__(_find_class(*rec['c'], unit))
+                 for rec in skel['units']]
+    net.plants = [_find_class(*rec['c'], plant).__new__(_find_class(*rec['c'], plant))
+                  for rec in skel['plants']]
+    for p, syns in zip(net.plants, skel['plant_syns']):
+        p.inp_syns = [[_find_class(*rec['c'], synapse).__new__(
+                       _find_class(*rec['c'], synapse)) for rec in l] for l in syns]
+    dec = _decoder(net, arrays, functions, unset_ok)
+    extras = dec.decode(skel['extras'])
+    syn_cls = arrays[skel['syn_cls']].tolist()
+    n_syns = arrays[skel['n_syns']].tolist()
+    cls_list = [_find_class(*c, synapse) for c, _ in skel['syn_classes']]
+    counts = np.bincount(syn_cls, minlength=len(cls_list)).tolist()
+    pools = [[cls.__new__(cls) for _ in range(n)] for cls, n in zip(cls_list, counts)]
+    # placing the synapses of each class in their positions
+    if len(pools) == 1:
+        all_syns = pools[0]
+    else:
+        all_syns = np.empty(len(syn_cls), dtype=object)
+        if len(syn_cls) > 0:
+            all_syns[np.argsort(syn_cls, kind='stable')] = [s for pool in pools 
+                                                            for s in pool]
+        all_syns = all_syns.tolist()
+    ends = np.cumsum(n_syns).tolist()
+    net.syns = [all_syns[e-n:e] for n, e in zip(n_syns, ends)]
+    # restoring the attributes
+    dec.fill(net, skel['net'])
+    net.seed_seq = np.random.SeedSequence(net.seed)
+    net.noise_streams = {}
+    for key, size, n_draws, shape, pos, state, block in skel['noise']:
+        key = tuple(key)
+        stream = noise_stream(np.random.SeedSequence(net.seed, spawn_key=key), size)
+        stream.n_draws, stream.shape, stream.pos = n_draws, tuple(shape), pos
+        stream.rng.bit_generator.state = dec.decode(state)
+        stream.block = dec.decode(block)
+        net.noise_streams[key] = stream
+    for uid, (u, rec) in enumerate(zip(net.units, skel['units'])):
+        dec.owner = uid
+        dec.fill(u, rec['d'])
+    dec.owner = None
+    for pool, (_, cols) in zip(pools, skel['syn_classes']):
+        dec.fill_columns(pool, cols)
+    for p, rec, syns in zip(net.plants, skel['plants'], skel['plant_syns']):
+        dec.fill(p, rec['d'])
+        p.net = net
+        for syn_list, recs in zip(p.inp_syns, syns):
+            for syn, syn_rec in zip(syn_list, recs):
+                dec.fill(syn, syn_rec['d'])
+        p.inputs = [[net.units[syn.preID].get_act for syn in l] for l in p.inp_syns]
+    # the functions that provide the inputs of the units
+    syn_pre = arrays[skel['syn_pre']]
+    get_acts = [u.get_act for u in net.units] + [None] # index -1 is for plants
+    acts = [get_acts[pre] for pre in syn_pre.tolist()]
+    net.act = [acts[e-n:e] for n, e in zip(n_syns, ends)]
+    net.pop_updates = []
+    net.pop_inp_updates = []
+    net.pop_syn_updates = []
+    net.syn_index_ready = False
+    if net.flat:
+        for u in net.units:
+            u.net = net
+        net.acts_idx = [net.inp_base[net.inp_starts[uid]:net.inp_starts[uid+1]]
+                        if net.has_buffer[uid] else [] for uid in range(net.n_units)]
+        net.link_unit_buffers()
+        net.link_plant_buffers()
+        net.upd_syns = list(all_syns)
+    else:
+        for u in net.units:
+            u.net = net
+            if hasattr(u, 'buffer'):
+                u.act_buff = u.buffer[0,:] if u.multidim else u.buffer.view()
+                if u.using_interp1d:
+                    u.upd_interpolator()
+    if patch is not None:
+        patch(net, extras)
+    if net.flat: # after the patch, because the propagator copies the unit parameters
+        net.init_linear_props()
+    if net.flat and net.use_pop_updates:
+        # the population objects are created again, keeping the values of
+        # the requirements they update
+        saved = [{req.name : getattr(u, req.name) for req in u.syn_needs
+                  if hasattr(u, req.name)} for u in net.units]
+        net.init_pop_updates()
+        for u, vals in zip(net.units, saved):
+            for name, val in vals.items():
+                cur = getattr(u, name)
+                if isinstance(cur, np.ndarray) and cur is not val:
+                    cur[...] = val
+                else:
+                    setattr(u, name, val)
+    plant_syns = np.flatnonzero(syn_pre < 0) # synapses from plants
+    posts = np.searchsorted(ends, plant_syns, side='right')
+    for k, post in zip(plant_syns.tolist(), posts.tolist()):
+        syn = all_syns[k]
+        net.act[post][k - ends[post] + n_syns[post]] = \
+            net.plants[syn.plant_id].get_state_var_fun(syn.plant_out)
+    return net, extras
+
+
+def structure_hash(net):
+    """ Returns a hash that identifies the structure of a network.
+
+        The hash covers the classes of the units, synapses and plants, the
+        presynaptic unit and the delay of each synapse, the noise streams, and
+        the shape of the activity buffers. Networks whose states can be
+        exchanged with network.set_dynamic_state have the same hash.
+
+        Returns:
+            A string with a hexadecimal SHA-256 hash.
+    """
+    name = lambda obj: type(obj).__module__ + '.' + type(obj).__qualname__
+    if not net.syn_index_ready:
+        net.init_syn_index()
+    syns = net.all_syns
+    types = list(map(type, syns))
+    cls_idx = {cls : k for k, cls in enumerate(dict.fromkeys(types))}
+    syn_cls = list(map(cls_idx.__getitem__, types))
+    syn_pre = list(map(operator.attrgetter('preID'), syns))
+    syn_del = list(map(operator.attrgetter('delay_steps'), syns))
+    desc = [net.flat, [name(u) for u in net.units], [name(p) for p in net.plants],
+            [cls.__module__ + '.' + cls.__qualname__ for cls in cls_idx],
+            [len(l) for l in net.syns],
+            [[[(name(s), s.preID, s.delay_steps) for s in l] for l in p.inp_syns]
+             for p in net.plants], sorted(net.noise_streams),
+            net.acts.shape if net.flat else None]
+    h = hashlib.sha256(repr(desc).encode())
+    for vals in [syn_cls, syn_pre, syn_del]:
+        h.update(np.array(vals, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def save_checkpoint(net, path):
+    """ Save the dynamic state of a network in the directory 'path'.
+
+        A checkpoint contains the values returned by network.dynamic_state: the
+        activity buffers, all the numeric attributes of units, synapses, plants
+        and population updates, and the state of the random generators. It does
+        not contain the structure of the network, so it is much faster to write
+        than save_network, and it can only be restored with load_checkpoint into
+        a network with the same structure (e.g. the same network, a network
+        created again with the same code, or one loaded with load_network).
+
+        The files have the same format as those of save_network: the arrays are
+        written contiguously in arrays.bin, which load_checkpoint memory-maps.
+
+        Args:
+            net: a draculab network.
+            path: name of a directory. It is created if it doesn't exist, and
+                  stored files in it are replaced.
+    """
+    with _gc_paused():
+        state = net.dynamic_state()
+        enc = _encoder(net)
+        skel = {'version' : FORMAT_VERSION,
+                'checkpoint' : structure_hash(net),
+                'state' : enc.encode(state, 'checkpoint')}
+        _write_files(path, skel, enc.arrays)
+
+
+def load_checkpoint(net, path):
+    """ Restore in a network the dynamic state stored with save_checkpoint.
+
+        The arrays of the network are modified in place (see
+        network.set_dynamic_state), so afterwards the network continues its
+        simulation exactly as the network that was saved.
+
+        Args:
+            net: a draculab network with the same structure as the saved one.
+            path: directory where the checkpoint was stored.
+        Raises:
+            ValueError if 'path' does not contain a checkpoint, or if the
+            checkpoint was saved from a network with a different structure.
+    """
+    with _gc_paused():
+        skel, arrays = _read_files(path)
+        if 'checkpoint' not in skel:
+            raise ValueError(path + ' does not contain a checkpoint')
+        if skel['checkpoint'] != structure_hash(net):
+            raise ValueError('The checkpoint was saved from a network with a ' +
+                             'different structure')
+        state = _decoder(net, arrays, {}, False).decode(skel['state'])
+        net.set_dynamic_state(state)
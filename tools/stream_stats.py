@@ -0,0 +1,374 @@
+"""
+stream_stats.py
+Statistics of unit activities that are updated during a simulation.
+
+Many analyses only need the mean and variance of the activities, their
+histograms, correlations, or spectra. The classes in this module compute these
+values step by step, so the simulation doesn't need to store the full traces of
+the units.
+
+A statistic is attached to a network with network.add_stats. After that, each
+call to network.run or network.flat_run updates it at every simulation step with
+the activities of its units at the beginning of the step (the same values stored
+in the traces returned by run). With the argument store=False, run and flat_run
+don't keep the traces.
+
+Usage example:
+>>> mom = net.add_stats(running_moments(exc_ids))
+>>> hist = net.add_stats(histogram(exc_ids, (0., 1., 20), window=100))
+>>> times, _, _ = net.flat_run(100., store=False)
+>>> mom.mean, mom.std, hist.frames
+"""
+
+import numpy as np
+
+
+class stream_stat():
+    """ The parent class of the statistics updated during simulations.
+
+        Children classes implement reset and update.
+    """
+    def __init__(self, ids):
+        """ The stream_stat constructor.
+
+            Args:
+                ids: a list with the IDs of the units included in the statistic.
+        """
+        self.ids = np.array(ids, dtype=int)
+        self.dt = None # time between updates, set by attach
+        self.reset()
+
+    def attach(self, net):
+        """ Prepares the statistic to be updated by the network 'net'.
+
+            Raises:
+                ValueError if some ID does not correspond to a unit of 'net'.
+        """
+        if len(self.ids) > 0 and (self.ids.min() < 0 or self.ids.max() >= net.n_units):
+            raise ValueError('Statistics received IDs of units not in the network')
+        self.dt = net.min_delay
+
+    def reset(self):
+        """ Removes all the values accumulated so far. """
+        raise NotImplementedError('reset not implemented for ' + type(self).__name__)
+
+    def update(self, acts, time):
+        """ Includes one simulation step in the statistic.
+
+            Args:
+                acts: a 1-D numpy array with the activities of all units.
+                time: the simulation time of the activities.
+        """
+        raise NotImplementedError('update not implemented for ' + type(self).__name__)
+
+
+class running_moments(stream_stat):
+    """ Running mean, variance, minimum, and maximum of the activities.
+
+        With pool=False the moments of each unit are computed across time. With
+        pool=True all the activities of the units at all steps are pooled in a
+        single sample. The variance is updated with Welford's algorithm.
+
+        Attributes:
+            n: number of values included (steps, or steps times units).
+            mean, var, std, min, max: arrays with one value for each unit, or
+                                      scalars if pool=True.
+    """
+    def __init__(self, ids, pool=False):
+        """ The running_moments constructor.
+
+            Args:
+                ids: a list with the IDs of the units included in the statistic.
+                pool: whether to pool the activities of all units.
+        """
+        self.pool = pool
+        stream_stat.__init__(self, ids)
+
+    def reset(self):
+        """ Removes all the values accumulated so far. """
+        shape = () if self.pool else (len(self.ids),)
+        self.n = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape) # sum of squared deviations from the mean
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+    def update(self, acts, time):
+        """ Includes one simulation step in the moments. """
+        x = acts[self.ids]
+        if self.pool: # combining the moments of the step with the previous ones
+            k = len(x)
+            if k == 0:
+                return
+            x_mean = x.mean()
+            delta = x_mean - self.mean
+            n = self.n + k
+            self.mean = self.mean + delta * k / n
+            self.m2 = self.m2 + ((x - x_mean)**2).sum() + delta**2 * self.n * k / n
+            self.n = n
+            self.min = min(self.min, x.min())
+            self.max = max(self.max, x.max())
+        else:
+            self.n += 1
+            delta = x - self.mean
+            self.mean += delta / self.n
+            self.m2 += delta * (x - self.mean)
+            np.minimum(self.min, x, out=self.min)
+            np.maximum(self.max, x, out=self.max)
+
+    @property
+    def var(self):
+        """ Population variance of the values included so far. """
+        return self.m2 / self.n if self.n > 0 else np.full(np.shape(self.m2), np.nan)
+
+    @property
+    def std(self):
+        """ Population standard deviation of the values included so far. """
+        return np.sqrt(self.var)
+
+
+class histogram(stream_stat):
+    """ Histograms of the activities with fixed bins.
+
+        The activities of all units at all steps are counted in 'counts'. When
+        'window' is given, the counts of each group of 'window' steps are also
+        stored as a frame, which gives a histogram that changes in time (as the
+        one in the hist_anim method of ei_net).
+
+        Attributes:
+            edges: array with the edges of the bins.
+            counts: array with the number of activities in each bin.
+            below, above: number of activities outside the range of the bins.
+            frames: list with the counts of each completed window.
+            frame_times: list with the simulation time when each window began.
+    """
+    def __init__(self, ids, bins, window=None):
+        """ The histogram constructor.
+
+            Args:
+                ids: a list with the IDs of the units included in the statistic.
+                bins: an increasing array with the edges of the bins, or a tuple
+                      (low, high, n_bins) for n_bins equal bins.
+                window: number of steps in each frame, or None for no frames.
+            Raises:
+                ValueError if the edges are not increasing.
+        """
+        if type(bins) is tuple:
+            bins = np.linspace(bins[0], bins[1], bins[2] + 1)
+        self.edges = np.array(bins, dtype=float)
+        if len(self.edges) < 2 or np.any(np.diff(self.edges) <= 0.):
+            raise ValueError('The edges of the histogram bins must be increasing')
+        self.window = window
+        stream_stat.__init__(self, ids)
+
+    def reset(self):
+        """ Removes all the values accumulated so far. """
+        n_bins = len(self.edges) - 1
+        self.counts = np.zeros(n_bins, dtype=int)
+        self.below = 0
+        self.above = 0
+        self.frames = []
+        self.frame_times = []
+        self.frame = np.zeros(n_bins, dtype=int) # counts of the current window
+        self.frame_steps = 0
+
+    def update(self, acts, time):
+        """ Counts the activities of one simulation step. """
+        x = acts[self.ids]
+        n_bins = len(self.edges) - 1
+        # bin i has edges[i] <= x < edges[i+1], and the last bin includes its upper edge
+        idx = np.searchsorted(self.edges, x, side='right') - 1
+        idx[x == self.edges[-1]] = n_bins - 1
+        self.below += int(np.count_nonzero(idx < 0))
+        self.above += int(np.count_nonzero(idx >= n_bins))
+        step_counts = np.bincount(idx[(idx >= 0) & (idx < n_bins)], minlength=n_bins)
+        self.counts += step_counts
+        if self.window is not None:
+            if self.frame_steps == 0:
+                self.frame_times.append(time)
+            self.frame += step_counts
+            self.frame_steps += 1
+            if self.frame_steps == self.window:
+                self.frames.append(self.frame)
+                self.frame = np.zeros(n_bins, dtype=int)
+                self.frame_steps = 0
+
+    @property
+    def density(self):
+        """ The counts normalized so the histogram integrates to 1. """
+        total = self.counts.sum()
+        if total == 0:
+            return np.zeros(len(self.counts))
+        return self.counts / (total * np.diff(self.edges))
+
+
+class correlation(stream_stat):
+    """ Running covariance and correlation matrices for a group of units.
+
+        Attributes:
+            n: number of steps included.
+            mean: array with the mean activity of each unit.
+            cov: covariance matrix of the activities.
+            corr: correlation matrix. Entries of units with no variance are nan.
+    """
+    def reset(self):
+        """ Removes all the values accumulated so far. """
+        k = len(self.ids)
+        self.n = 0
+        self.mean = np.zeros(k)
+        self.comoment = np.zeros((k, k)) # sum of products of deviations
+
+    def update(self, acts, time):
+        """ Includes one simulation step in the covariances. """
+        x = acts[self.ids]
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.comoment += np.outer(delta, x - self.mean)
+
+    @property
+    def cov(self):
+        """ Population covariance matrix of the activities. """
+        if self.n == 0:
+            return np.full(self.comoment.shape, np.nan)
+        return self.comoment / self.n
+
+    @property
+    def corr(self):
+        """ Correlation matrix of the activities. """
+        cov = self.cov
+        sd = np.sqrt(np.diag(cov))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return cov / np.outer(sd, sd)
+
+
+class windowed_mean(stream_stat):
+    """ Averages of the activities in consecutive windows of steps.
+
+        This produces decimated traces: one value per unit for each window of
+        'window' steps.
+
+        Attributes:
+            times: list with the simulation time when each window began.
+            values: list with an array of unit averages for each window.
+    """
+    def __init__(self, ids, window):
+        """ The windowed_mean constructor.
+
+            Args:
+                ids: a list with the IDs of the units included in the statistic.
+                window: number of steps averaged in each value.
+            Raises:
+                ValueError if window is smaller than 1.
+        """
+        if window < 1:
+            raise ValueError('windowed_mean requires a window of at least one step')
+        self.window = window
+        stream_stat.__init__(self, ids)
+
+    def reset(self):
+        """ Removes all the values accumulated so far. """
+        self.times = []
+        self.values = []
+        self.acc = np.zeros(len(self.ids)) # sum over the current window
+        self.acc_steps = 0
+
+    def update(self, acts, time):
+        """ Adds the activities of one simulation step to the current window. """
+        if self.acc_steps == 0:
+            self.times.append(time)
+        self.acc += acts[self.ids]
+        self.acc_steps += 1
+        if self.acc_steps == self.window:
+            self.values.append(self.acc / self.window)
+            self.acc = np.zeros(len(self.ids))
+            self.acc_steps = 0
+
+    def traces(self):
+        """ Returns the decimated traces.
+
+            Returns:
+                A 2-tuple (times, values), where 'times' is an array with the
+                start of each completed window, and values[i,j] is the average
+                activity of unit ids[i] in window j.
+        """
+        n = len(self.values)
+        vals = np.array(self.values).T if n > 0 else np.zeros((len(self.ids), 0))
+        return np.array(self.times[:n]), vals
+
+
+class spectrum(stream_stat):
+    """ Power spectra of decimated activities, with Welch's method.
+
+        The activities are averaged in windows of 'decimate' steps. Segments of
+        'nfft' of these averages, overlapping by half their length, are
+        multiplied by a Hann window and their periodograms are averaged.
+
+        Attributes:
+            segments: number of segments averaged.
+            freqs: array with the frequencies of the spectra.
+            power: power spectral density of each unit (one row per unit).
+    """
+    def __init__(self, ids, nfft=256, decimate=1):
+        """ The spectrum constructor.
+
+            Args:
+                ids: a list with the IDs of the units included in the statistic.
+                nfft: number of decimated samples in each segment.
+                decimate: number of steps averaged in each sample.
+            Raises:
+                ValueError if nfft is smaller than 2 or decimate is smaller than 1.
+        """
+        if nfft < 2 or decimate < 1:
+            raise ValueError('spectrum requires nfft >= 2 and decimate >= 1')
+        self.nfft = nfft
+        self.decimate = decimate
+        self.taper = np.hanning(nfft + 1)[:-1] # periodic Hann window
+        stream_stat.__init__(self, ids)
+
+    def reset(self):
+        """ Removes all the values accumulated so far. """
+        k = len(self.ids)
+        self.segments = 0
+        self.psd_sum = np.zeros((k, self.nfft // 2 + 1))
+        self.buff = np.zeros((k, self.nfft)) # decimated samples of the current segment
+        self.n_samples = 0
+        self.acc = np.zeros(k)
+        self.acc_steps = 0
+
+    def update(self, acts, time):
+        """ Includes one simulation step in the spectra. """
+        self.acc += acts[self.ids]
+        self.acc_steps += 1
+        if self.acc_steps < self.decimate:
+            return
+        self.buff[:, self.n_samples] = self.acc / self.decimate
+        self.acc[:] = 0.
+        self.acc_steps = 0
+        self.n_samples += 1
+        if self.n_samples == self.nfft:
+            seg = self.buff - self.buff.mean(axis=1, keepdims=True)
+            self.psd_sum += np.abs(np.fft.rfft(seg * self.taper, axis=1))**2
+            self.segments += 1
+            half = self.nfft // 2
+            self.buff[:, :self.nfft - half] = self.buff[:, half:]
+            self.n_samples = self.nfft - half
+
+    @property
+    def freqs(self):
+        """ Frequencies of the spectra, in cycles per time unit. """
+        if self.dt is None:
+            raise ValueError('The spectrum must be attached to a network to get its frequencies')
+        return np.fft.rfftfreq(self.nfft, self.dt * self.decimate)
+
+    @property
+    def power(self):
+        """ One-sided power spectral density of each unit. """
+        if self.segments == 0:
+            return np.full(self.psd_sum.shape, np.nan)
+        if self.dt is None:
+            raise ValueError('The spectrum must be attached to a network to get its power')
+        fs = 1. / (self.dt * self.decimate)
+        psd = self.psd_sum / (self.segments * fs * (self.taper**2).sum())
+        psd[:, 1:(self.nfft + 1) // 2] *= 2. # adding the negative frequencies
+        return psd
@@ -8,6 +8,119 @@ It implements functionality similar to that in NEST's topology module.
 
 from draculab import unit_types, synapse_types, plant_models, syn_reqs  # names of models and requirements
 import numpy as np
+from scipy.spatial import cKDTree
+
+
+class spatial_index():
+    """ A KD-tree over the coordinates of a list of units.
+
+        topology.topo_connect creates one of these for the units that are
+        filtered with masks and kernels, so filter_ids can find the units within
+        a distance of a center with a range query, and compute distances for
+        many units with array operations.
+
+        Distances are the ones used in topo_connect: Euclidean distance, or the
+        distance of topology.period_dist when there is a periodic boundary. Masks
+        and kernels are filtered with the distance over all coordinates. When
+        'dist_dim' is 'x' or 'y', the projected distances used by topo_connect for
+        connection probabilities, weights, and delays only consider that coordinate.
+    """
+    def __init__(self, net, ids, boundary=None, dist_dim='all'):
+        """ The spatial_index constructor.
+
+            Args:
+                net: the network where the units live.
+                ids: a list with the IDs of the units in the index.
+                boundary: when not None, a dictionary {'center' : c, 'extent' : e}
+                          with the rectangle of the periodic boundary, as in the
+                          conn_spec of topo_connect.
+                dist_dim: 'x', 'y', or 'all', as in the conn_spec of topo_connect.
+            Raises:
+                ValueError
+        """
+        self.ids = list(ids)
+        self.coords = np.array([net.units[uid].coordinates for uid in self.ids], 
+                               dtype=float) # used for rectangular masks
+        if self.coords.ndim != 2:
+            raise ValueError('All units in a spatial_index need coordinates of ' +
+                             'the same dimension')
+        # coordinates that count for distances
+        self.use_dim = np.ones(self.coords.shape[1], dtype=bool)
+        if dist_dim == 'x':
+            self.use_dim[1:] = False
+        elif dist_dim == 'y':
+            self.use_dim[:] = False
+            self.use_dim[1] = True
+        elif dist_dim != 'all':
+            raise ValueError('Invalid value for the dist_dim option')
+        self.proj = self.coords * self.use_dim
+        # position of each unit ID in self.ids
+        self.where = np.full(max(self.ids)+1 if len(self.ids) > 0 else 0, -1, dtype=int)
+        self.where[self.ids] = np.arange(len(self.ids))
+        self.extent = None
+        if boundary is not None:
+            self.extent = np.array(boundary['extent'], dtype=float)
+            self.lower_left = np.array(boundary['center'], dtype=float) - self.extent/2.
+            # the tree uses coordinates in [0, extent) with periodic boundaries
+            data = np.mod(self.coords - self.lower_left, self.extent)
+            data[data >= self.extent] = 0.
+            # with units outside the boundary period_dist is not a distance,
+            # so the index falls back to computing all distances
+            shift = self.coords - self.lower_left
+            if len(self.ids) > 0 and (shift.min() < 0. or np.any(shift > self.extent)):
+                self.tree = None
+            else:
+                self.tree = cKDTree(data, boxsize=self.extent)
+        else:
+            self.tree = cKDTree(self.coords) if len(self.ids) > 0 else None
+
+    def positions(self, id_list):
+        """ Returns an array with the position in self.ids of each ID in id_list.
+
+            Raises:
+                ValueError if some unit is not in the index.
+        """
+        ids = np.asarray(id_list, dtype=int)
+        if ids.size > 0 and (ids.max() >= self.where.size or ids.min() < 0 or
+                             self.where[ids].min() < 0):
+            raise ValueError('filter_ids received units that are not in the spatial index')
+        return self.where[ids]
+
+    def dists(self, center, pos, projected=False):
+        """ Returns the distances from 'center' to the units at positions 'pos'.
+
+            When 'projected' is True, only the coordinates selected by dist_dim count.
+        """
+        if projected:
+            diff = np.abs(self.proj[pos] - np.asarray(center, dtype=float)*self.use_dim)
+        else:
+            diff = np.abs(self.coords[pos] - np.asarray(center, dtype=float))
+        if self.extent is not None:
+            diff = np.minimum(diff, self.extent - diff)
+        return np.sqrt(np.sum(diff*diff, axis=1))
+
+    def within(self, center, radius, strict=False):
+        """ Returns a boolean array that is True for the units at distance <= radius.
+
+            The array has one entry for each unit in self.ids. When 'strict' is
+            True, the distance must be smaller than the radius.
+        """
+        below = np.less if strict else np.less_equal
+        inside = np.zeros(len(self.ids), dtype=bool)
+        if self.tree is None:
+            inside[:] = below(self.dists(center, np.arange(len(self.ids))), radius)
+            return inside
+        q = np.asarray(center, dtype=float)
+        if self.extent is not None:
+            q = np.mod(q - self.lower_left, self.extent)
+            q[q >= self.extent] = 0.
+        # the tree may round distances differently, so its result is a superset
+        # that is filtered with the distances of self.dists
+        cand = np.array(self.tree.query_ball_point(q, radius*(1.+1e-9) + 1e-12), 
+                        dtype=int)
+        if cand.size > 0:
+            inside[cand[below(self.dists(center, cand), radius)]] = True
+        return inside
 
 
 class topology():
@@ -298,9 +411,9 @@ class topology():
             for idx, coord in zip(from_list, self.orig_coords):
                 net.units[idx].coordinates = conn_spec['transform'](coord)
 
-        connections = []  # a list with all the connection pairs as (source,target)
-        distances = [] # the distance for the units in each entry of 'connections'
-        delays = [] # a list with the delay for each entry in 'connections'
+        pres = []  # for each unit in base_list, an array with the sources of its connections
+        posts = [] # for each unit in base_list, an array with the targets of its connections
+        dists = [] # for each unit in base_list, the distances of its connections
 
         # To handle boundary conditions, we choose an appropriate distance function, and
         # unpack some info that is needed for the case of rectangular masks.
@@ -361,75 +474,89 @@ class topology():
             filter_list = from_list 
         else:
             raise TypeError("Invalid connection_type")
+
+        # a spatial index used by filter_ids to find the units in filter_list
+        fids_dic['index'] = spatial_index(net, filter_list, 
+                              conn_spec['boundary'] if fids_dic['edge_wrap'] else None,
+                              conn_spec['dist_dim'] if 'dist_dim' in conn_spec else 'all')
         
-        # This loop fills the 'connections' and 'distances' lists
+        # the kernel function, which receives an array of distances
+        if type(conn_spec['kernel']) is float or type(conn_spec['kernel']) is int:
+            # distance-independent constant probability of connection
+            if conn_spec['kernel'] < 0. or conn_spec['kernel'] > 1.:
+                raise ValueError('kernel probability should be between 0 and 1')
+            kerfun = lambda d: np.full(d.shape, conn_spec['kernel'])
+        elif 'linear' in conn_spec['kernel']:
+            a = conn_spec['kernel']['linear']['a']
+            c = conn_spec['kernel']['linear']['c']
+            kerfun = lambda d: c  - a*d
+        elif 'gaussian' in conn_spec['kernel']:
+            p_c = conn_spec['kernel']['gaussian']['p_center']
+            s = conn_spec['kernel']['gaussian']['sigma']
+            kerfun = lambda d: p_c * np.exp( - ((d/s)**2.)) 
+        else:
+            raise NotImplementedError('Invalid kernel specification')
+        if 'number_of_connections' in conn_spec:
+            n_of_c = conn_spec['number_of_connections']
+        else:
+            n_of_c = None
+        index = fids_dic['index']
+
+        # This loop fills the 'pres', 'posts', and 'dists' lists
         for idx in base_list:
             uc = net.units[idx].coordinates # center for the sending unit, mask, and kernel
 
-            #### First we make a list with all the units in 'filter_list' inside the mask
-            masked = self.filter_ids(net, filter_list, uc, conn_spec['mask'], fids_dic)
+            #### First we make an array with all the units in 'filter_list' inside the mask
+            masked = np.array(self.filter_ids(net, filter_list, uc, conn_spec['mask'], 
+                                              fids_dic), dtype=int)
             
             #### Next we modify 'masked' to account for autapses and multapses
             if not conn_spec['allow_autapses']:  # autapses not allowed
-                if idx in masked:
-                    masked = [ e for e in masked if e != idx ]
+                masked = masked[masked != idx]
             if not conn_spec['allow_multapses']: # multapses not allowed
-                masked = list(set(masked))  # removing duplicates
+                # removing duplicates, keeping the order of first appearance
+                masked = masked[np.sort(np.unique(masked, return_index=True)[1])]
                 # This tests if enough connections can be made without duplicates
-                if 'number_of_connections' in conn_spec:
-                    if len(masked) < conn_spec['number_of_connections']:
-                        raise ValueError('number_of_connections larger than number of targets within mask')
+                if n_of_c is not None and len(masked) < n_of_c:
+                    raise ValueError('number_of_connections larger than number of targets within mask')
                      
             #### Now we use the kernel rule to select connections
             # first, make sure the number of potential targets is larger than number_of_connections
-            if 'number_of_connections' in conn_spec:
-                kerneled = self.filter_ids(net, masked, uc, conn_spec['kernel'], fids_dic)
-                if len(kerneled) < conn_spec['number_of_connections']:
+            if n_of_c is not None:
+                kerneled = self.filter_ids(net, masked.tolist(), uc, conn_spec['kernel'], fids_dic)
+                if len(kerneled) < n_of_c:
                     raise ValueError('number_of_connections is larger than number ' +
                                      'of targets with significant connection probability')
-            # second, specify the kernel function
-            if type(conn_spec['kernel']) is float or type(conn_spec['kernel']) is int:
-                # distance-independent constant probability of connection
-                if conn_spec['kernel'] < 0. or conn_spec['kernel'] > 1.:
-                    raise ValueError('kernel probability should be between 0 and 1')
-                kerfun = lambda d: conn_spec['kernel']
-            elif 'linear' in conn_spec['kernel']:
-                a = conn_spec['kernel']['linear']['a']
-                c = conn_spec['kernel']['linear']['c']
-                kerfun = lambda d: c  - a*d
-            elif 'gaussian' in conn_spec['kernel']:
-                p_c = conn_spec['kernel']['gaussian']['p_center']
-                s = conn_spec['kernel']['gaussian']['sigma']
-                kerfun = lambda d: p_c * np.exp( - ((d/s)**2.)) 
-            else:
-                raise NotImplementedError('Invalid kernel specification')
-            # third, do the sampling
-            if 'number_of_connections' in conn_spec:
-                n_of_c = conn_spec['number_of_connections']
-                np.random.shuffle(masked) # to reduce dependency on order in masked
-            else:
-                n_of_c = len(masked) + 1 # this value controls a 'break' below
-            connected = 0 # to keep track of how many connections we've appended
-            while connected < n_of_c:
-                masked_copy = masked.copy() # otherwise masked.remove would alter things
-                for f_idx in masked_copy:
-                    f_c = net.units[f_idx].coordinates
-                    d = dist(uc, f_c)
-                    if np.random.rand() < kerfun(d):
-                        if conn_spec['connection_type'] == 'divergent':
-                            connections.append( (idx, f_idx) )
-                        else:  # connection_type is 'convergent'
-                            connections.append( (f_idx, idx) )
-                        distances.append(d)
-                        connected += 1
-                        if not conn_spec['allow_multapses']:
-                            masked.remove(f_idx)
-                    if connected >= n_of_c:
-                        break
-                if  not ('number_of_connections' in conn_spec):
-                    break 
-
-        if len(connections) == 0:
+            # second, get the connection probabilities
+            d = index.dists(uc, index.positions(masked), projected=True)
+            probs = kerfun(d)
+            # third, do the sampling. 'chosen' has indexes of 'masked'
+            if n_of_c is None: # one Bernoulli trial per unit
+                chosen = np.flatnonzero(np.random.rand(len(masked)) < probs)
+            else: 
+                # Passes over the units in random order, with a Bernoulli trial for each
+                # one, until n_of_c connections are made. Without multapses, units
+                # that were chosen are not considered in the next passes.
+                chosen = np.zeros(0, dtype=int)
+                remaining = np.random.permutation(len(masked))
+                while len(chosen) < n_of_c:
+                    accepted = remaining[np.random.rand(len(remaining)) < probs[remaining]]
+                    accepted = accepted[:n_of_c - len(chosen)]
+                    chosen = np.append(chosen, accepted)
+                    if not conn_spec['allow_multapses']:
+                        remaining = remaining[~np.isin(remaining, accepted)]
+            if conn_spec['connection_type'] == 'divergent':
+                pres.append(np.full(len(chosen), idx, dtype=int))
+                posts.append(masked[chosen])
+            else:  # connection_type is 'convergent'
+                pres.append(masked[chosen])
+                posts.append(np.full(len(chosen), idx, dtype=int))
+            dists.append(d[chosen])
+
+        senders = np.concatenate(pres)
+        receivers = np.concatenate(posts)
+        distances = np.concatenate(dists)
+        if len(senders) == 0:
             from warnings import warn
             warn('Zero connections created with topo_connect', UserWarning)
             #raise AssertionError('Zero connections created with topo_connect')
@@ -443,64 +570,60 @@ class topology():
         if 'linear' in conn_spec['delays']:
             c = conn_spec['delays']['linear']['c']
             a = conn_spec['delays']['linear']['a']
-            real_dist = []
             if 'transform' in conn_spec and callable(conn_spec['transform']):
                 # If there was a coordinate transform, the distances array calculated above
                 # uses the transformed coordinates. For the purpose of calculating delays,
                 # we want to use the original coordinates.
-                for conn in connections:
-                    c0 = net.units[conn[0]].coordinates
-                    c1 = net.units[conn[1]].coordinates
-                    real_dist.append( np.sqrt( sum( (c0-c1)*(c0-c1) ) ) )
+                uids = np.unique(np.concatenate((senders, receivers)))
+                coords = np.array([net.units[uid].coordinates for uid in uids.tolist()])
+                c0 = coords[np.searchsorted(uids, senders)]
+                c1 = coords[np.searchsorted(uids, receivers)]
+                real_dist = np.sqrt(np.sum((c0-c1)*(c0-c1), axis=1))
             else:
                 real_dist = distances
-            for d in real_dist:
-                # delays must be multiples of net.min_delay
-                dely = c + a*d + 1e-7  # 1e-7 deals with a quirk of the % operator
-                mod = dely % net.min_delay
-                dely = dely - mod
-                if mod > net.min_delay/2.:  # rounding to nearest multiple above
-                    dely += net.min_delay
-                dely = max(net.min_delay, dely)
-                delays.append(dely)
+            # delays must be multiples of net.min_delay
+            delays = c + a*real_dist + 1e-7  # 1e-7 deals with a quirk of the % operator
+            mod = delays % net.min_delay
+            delays = delays - mod
+            delays[mod > net.min_delay/2.] += net.min_delay  # rounding to nearest multiple above
+            delays = np.maximum(net.min_delay, delays)
         else:
             raise ValueError('Unknown delay specification')
 
         # optional setting of weights
-        if 'weights' in conn_spec and len(connections) > 0:
+        if 'weights' in conn_spec and len(senders) > 0:
             max_w = 100. # maximum weight value we'll tolerate
-            weights = [] # a list with the weight for each entry in 'connections'
             if 'uniform' in conn_spec['weights']:
                 l = conn_spec['weights']['uniform']['low']
                 h = conn_spec['weights']['uniform']['high']
-                weights = np.random.uniform(l, h, len(connections))
+                weights = np.random.uniform(l, h, len(senders))
             elif 'linear' in conn_spec['weights']:
                 c = conn_spec['weights']['linear']['c']
                 a = conn_spec['weights']['linear']['a']
                 if c > 0:
-                    weights = list(map(lambda d: max(c - a*d, 0.), distances))
+                    weights = np.maximum(c - a*distances, 0.)
                 else:
-                    weights = list(map(lambda d: min(c + a*d, 0.), distances))
+                    weights = np.minimum(c + a*distances, 0.)
             elif 'gaussian' in conn_spec['weights']:
                 w = conn_spec['weights']['gaussian']['w_center']
                 s = conn_spec['weights']['gaussian']['sigma']
-                weights = [ w*np.exp(-((d/s)**2.)) for d in distances]
+                weights = w*np.exp(-((distances/s)**2.))
             elif 'ring_gaussian' in conn_spec['weights']:
                 w = conn_spec['weights']['ring_gaussian']['w_center']
                 s = conn_spec['weights']['ring_gaussian']['sigma']
                 r = conn_spec['weights']['ring_gaussian']['radius']
-                weights = [ w*np.exp(-(((d-r)/s)**2.)) for d in distances]
+                weights = w*np.exp(-(((distances-r)/s)**2.))
+            else:
+                raise ValueError('Unknown weights specification')
             if max(np.abs(weights)) > max_w:
                 raise ValueError('Received weights distribution produces abs values larger than ' + str(max_w))
 
             syn_spec['init_w'] = weights
 
         # creating the connections
-        if len(connections) > 0:
-            senders = [c[0] for c in connections]
-            receivers = [c[1] for c in connections]
-            conn_dict = {'rule' : 'one_to_one', 'delay' : delays}
-            net.connect(senders, receivers, conn_dict, syn_spec)
+        if len(senders) > 0:
+            conn_dict = {'rule' : 'one_to_one', 'delay' : delays.tolist()}
+            net.connect(senders.tolist(), receivers.tolist(), conn_dict, syn_spec)
 
 
  
@@ -528,6 +651,10 @@ class topology():
                              coordinates of the respective corners of the boundary rectangle.
                              'boundary' is only included when using a rectangular mask with
                              periodic boundary conditions.
+                'index' : optional spatial_index object containing the units in id_list.
+                          When included, distances are obtained from the index with
+                          array operations, and circular regions with range queries,
+                          rather than calling 'distance' for each unit.
 
         Returns:
             A list with the IDs from id_list that satisfy the criterion in spec.
@@ -535,70 +662,65 @@ class topology():
         Raises:
             ValueError
         """
-        filtered = [] # this list will have the filtered unit IDs
         min_prob = 1e-7 # minimum probability for kernel filtering
-        dist = fids_dic['distance'] # this handles edge_wrap, except for rectangular masks 
+        ids = list(id_list)
+        # functions that return arrays with one value per unit in id_list
+        if 'index' in fids_dic: # range queries and array operations
+            index = fids_dic['index']
+            pos = index.positions(ids)
+            get_dists = lambda: index.dists(center, pos)
+            within = lambda r, strict=False: index.within(center, r, strict)[pos]
+            get_coords = lambda: index.coords[pos]
+        else: # using the distance function on each unit
+            dist = fids_dic['distance'] # this handles edge_wrap, except for rectangular masks 
+            get_dists = lambda: np.array([dist(center, net.units[idx].coordinates) 
+                                          for idx in ids])
+            within = lambda r, strict=False: get_dists() < r if strict else \
+                                             get_dists() <= r
+            get_coords = lambda: np.array([net.units[idx].coordinates for idx in ids])
+        if len(ids) == 0:
+            return []
+        selected = np.zeros(len(ids), dtype=bool) # units that satisfy the criterion
 
         #------------------ kernel criteria ------------------
         if type(spec) is float or type(spec) is int: # distance-independent, constant value
             if spec >= min_prob: # if spec < min_prob, then filtered = []
-                filtered = id_list
+                selected[:] = True
         elif 'linear' in spec:
             a = spec['linear']['a']
             c = spec['linear']['c']
             if a > 0:
                 max_dist = (c - min_prob)/a 
-                for to_idx in id_list:
-                    to_c = net.units[to_idx].coordinates
-                    d = dist(center, to_c)
-                    if d < max_dist:
-                        filtered.append(to_idx)
+                selected = within(max_dist, strict=True)
             elif a < 0:
                 min_dist = (c - min_prob)/a 
-                for to_idx in id_list:
-                    to_c = net.units[to_idx].coordinates
-                    d = dist(center, to_c)
-                    if d > min_dist:
-                        filtered.append(to_idx)
+                selected = get_dists() > min_dist
             else:  # a==0
                 if c > min_prob:
-                    filtered = id_list
+                    selected[:] = True
         elif 'gaussian' in spec:
             p_c = spec['gaussian']['p_center']
             s = spec['gaussian']['sigma']
             if p_c > min_prob:
                 max_dist = s * np.sqrt(np.log(p_c/min_prob))
-                for to_idx in id_list:
-                    to_c = net.units[to_idx].coordinates
-                    d = dist(center, to_c)
-                    if d < max_dist:
-                        filtered.append(to_idx)
+                selected = within(max_dist, strict=True)
 
         #------------------ mask criteria ------------------
         elif 'circular' in spec:
-            for idx in id_list:
-                to_c = net.units[idx].coordinates
-                d = dist(center, to_c)
-                if d <= spec['circular']['radius']:
-                    filtered.append(idx)
+            selected = within(spec['circular']['radius'])
         elif 'annular' in spec:
-            for idx in id_list:
-                to_c = net.units[idx].coordinates
-                d = dist(center, to_c)
-                if ( d >= spec['annular']['inner_radius'] and 
-                     d <= spec['annular']['outer_radius'] ):
-                    filtered.append(idx)
+            selected = ( within(spec['annular']['outer_radius']) & 
+                         ~within(spec['annular']['inner_radius'], strict=True) )
         elif 'rectangular' in spec: 
             mask_ll = np.array(spec['rectangular']['lower_left'])
             mask_ur = np.array(spec['rectangular']['upper_right'])
+            coords = get_coords()
             if not fids_dic['edge_wrap']: # no periodic boundary conditions
-                for idx in id_list:
-                    to_c = net.units[idx].coordinates - center
-                    # to_c is now a vector, from 'center' to the location of unit idx.
-                    # This vector must be inside the rectangle.
-                    if ( to_c[0] >= mask_ll[0] and to_c[1] >= mask_ll[1] ):
-                        if ( to_c[0] <= mask_ur[0] and to_c[1] <= mask_ur[1] ):
-                            filtered.append(idx)
+                to_c = coords - center
+                # to_c has vectors from 'center' to the location of the units.
+                # These vectors must be inside the rectangle.
+                selected = ( (to_c[:,0] >= mask_ll[0]) & (to_c[:,1] >= mask_ll[1]) &
+                             (to_c[:,0] <= mask_ur[0]) & (to_c[:,1] <= mask_ur[1]) )
             else:  # periodic boundary conditions
                 # The algorithm to handle this case is as follows:
                 # 1) Obtain 'm', the global coordinates of the mask's center.
@@ -607,39 +729,24 @@ class topology():
                 #    dimension the shortest distance from the unit to 'm'.
                 # 4) For each unit, test if the entries in 'absdiff' are smaller than the 
                 #    corresponding extent of the rectangular mask.
-
+                extent = np.array(fids_dic['boundary']['extent'])
+                lower_left = fids_dic['boundary']['lower_left']
                 # 1) Obtain m
                 m = center + (mask_ll + mask_ur)/2.
-                # 2) Ensure m inside boundary
-                # 2.1) Put the origin in the lower left corner of the boundary rectangle
-                m = m - fids_dic['boundary']['lower_left']
-                # 2.2) Express each component of m modulo the boundary's extent
-                for dim in range(len(m)):
-                    m[dim] = m[dim] % fids_dic['boundary']['extent'][dim]
-                # 2.3) Put m in the original coordinate frame
-                m = m + fids_dic['boundary']['lower_left']
+                # 2) Express m modulo the boundary's extent, with the origin in the
+                #    lower left corner of the boundary rectangle
+                m = np.mod(m - lower_left, extent) + lower_left
                 # getting an auxiliary variable for step 4
                 half_mask_ext = (mask_ur - mask_ll)/2.
-                # 3),4)
-                for idx in id_list:
-                    to_c = net.units[idx].coordinates
-                    # 3) get absdiff
-                    absdiff = abs(to_c - m)
-                    for dim in range(len(m)):
-                        if absdiff[dim] > fids_dic['boundary']['extent'][dim]/2.:
-                            absdiff[dim] = fids_dic['boundary']['extent'][dim] - absdiff[dim]
-                    # 4) test if unit inside mask's rectangle
-                    inside = True
-                    for dim in range(len(absdiff)):
-                        if absdiff[dim] > half_mask_ext[dim]:
-                            inside = False
-                            break
-                    if inside:
-                        filtered.append(idx)
+                # 3) get absdiff
+                absdiff = np.abs(coords - m)
+                absdiff = np.where(absdiff > extent/2., extent - absdiff, absdiff)
+                # 4) test if units inside mask's rectangle
+                selected = np.all(absdiff <= half_mask_ext, axis=1)
         else:
             raise ValueError("No valid dictionary was found for the mask parameter")
 
-        return filtered
+        return [ids[k] for k in np.flatnonzero(selected)]
 
 
 
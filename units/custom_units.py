@@ -53,6 +53,10 @@ class custom_fi(unit):
         """ The derivatives function used when the network is flat. """
         return ( self.f(self.inp_sum[s]) - y ) * self.rtau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
     def set_fi(self, fun):
         """ Set the f-I curve with the given function. """
         self.f = fun
@@ -290,13 +294,12 @@ class kWTA(unit):
             if syn.type != synapse_types.static:
                 raise TypeError('Non-static connection to a kWTA unit')
         ## Make sure all outgoing connections are static with weight -1
-        for syn_list in self.net.syns:
-            for syn in syn_list:
-                if syn.preID == self.ID:
-                    if syn.type != synapse_types.static:
-                        raise TypeError('kWTA unit sends a non-static connection')
-                    if syn.w != -1.:
-                        raise ValueError('kWTA sends connection with invalid weight value')
+        for post, loc in self.net.out_syns[self.ID]:
+            syn = self.net.syns[post][loc]
+            if syn.type != synapse_types.static:
+                raise TypeError('kWTA unit sends a non-static connection')
+            if syn.w != -1.:
+                raise ValueError('kWTA sends connection with invalid weight value')
 
 
 class delta_linear(unit):
@@ -378,6 +381,10 @@ class delta_linear(unit):
         """ Returns the derivative when state is y, at time substep s. """
         return ( self.gain * self.mp_inp_sum[0][s] / self.inp_l2 + self.bias - y ) / self.tau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return 1. / self.tau
+
     def upd_error(self, time):
         """ update the error used by delta units."""
         # Reliance on mp_inputs would normally be discouraged, since it slows things
@@ -457,6 +464,10 @@ class binary_unit(unit):
         else:
             return (1. - y)/self.tau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return 1. / self.tau
+
 
 class presyn_inh_sig(unit):
     """
@@ -526,6 +537,10 @@ class presyn_inh_sig(unit):
         """ The derivative function used by flat networks. """
         return ( self.get_mp_input_sum(s) - y ) * self.rtau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
     def get_mp_input_sum(self, st):
         """ The input function of the presynaptic inhibition sigmoidal unit. 
             
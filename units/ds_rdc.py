@@ -8,6 +8,378 @@ from units.units import *
 import numpy as np
 
 
+def sort_scale(unit, time):
+    """ Returns the target scale factor of the exp_scale_sort_(mp|shrp) requirements.
+
+        The excitatory inputs at the rdc port (plus a fake autapse with zero weight
+        when the unit has no excitatory autapse) are ranked, and the scale factor
+        is the one that would bring the unit to the ideal rate corresponding to its
+        own rank. The ranking in unit.rate_rank is kept between calls; since the rates
+        change little between steps, a stable sort of the previous ranking works on
+        nearly-sorted data, which is much faster than sorting from scratch.
+
+        Args:
+            unit: a unit with the exp_scale_sort_mp or exp_scale_sort_shrp requirement.
+            time: current simulation time.
+        Returns:
+            A float with the unbounded scale factor.
+    """
+    n_exc = len(unit.exc_idx_rdc)
+    unit.sort_inp[:n_exc] = unit.mp_inputs[unit.rdc_port][unit.exc_idx_rdc]
+    unit.sort_w[:n_exc] = [syn.w for syn in unit.exc_rdc_syns]
+    if not unit.autapse: # the last entry is a fake autapse with zero weight
+        unit.sort_inp[-1] = unit.buffer[-1] # current rate
+    srt = np.argsort(unit.sort_inp[unit.rate_rank], kind='stable')
+    unit.rate_rank[:] = unit.rate_rank[srt]
+    ideal_exc_inp = np.dot(unit.sort_w[unit.rate_rank], unit.ideal_rates)
+    my_ideal_rate = unit.ideal_rates[np.flatnonzero(unit.rate_rank == unit.autapse_idx)[0]]
+    # all excitatory scale factors are equal
+    u = unit.scale_facs_rdc[unit.exc_idx_rdc[0]] * np.dot(unit.sort_inp[:n_exc], 
+                                                          unit.sort_w[:n_exc])
+    I = u - unit.get_mp_input_sum(time)     
+    return (my_ideal_rate - I) / ideal_exc_inp
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#~~~~~~ POPULATION UPDATES FOR FLAT NETWORKS ~~~~~~~~~~
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# A unit class can list in its 'pop_reqs' dictionary requirements that can be
+# updated for a whole population at once. The keys are syn_reqs, and the values
+# are classes whose constructor receives a list of units and the requirement,
+# and with an update(time) method. When a network is flattened, units sharing a
+# requirement and population class are grouped, and the upd_<req> method is
+# removed from their 'functions' list (see network.init_pop_updates).
+# Entries from parent classes are inherited. Subclasses that override an
+# upd_<req> method should map that requirement to None in their pop_reqs.
+
+class scaled_inputs_pop():
+    """
+    Parent class of exp_scale_pop and exp_scale_sort_pop.
+
+    The inputs of all units are placed in a single flat array, and their synapses are
+    indexed in network.all_syns (see network.init_syn_index), so the weights come
+    from network.get_syn_weights. Each input has an entry in the 'coef' array: its
+    scale factor at the scaled port, 1 when the input function of the unit adds it
+    without scaling, and 0 otherwise. The scale_facs (or scale_facs_rdc) attribute
+    of each unit becomes a view into 'coef', so the input sums of all units are
+    a segmented sum of coef*w*inp, and the scale factors are updated in place.
+    """
+    def init_inputs(self, units, mp):
+        """ Create the index arrays for the inputs of all units.
+
+        Args:
+            units: a list with the unit objects to update.
+            mp: if True the inputs come from mp_inputs, arranged by port, and the
+                scale factors from scale_facs_rdc. Otherwise the inputs come from
+                inp_vector, and the scale factors from scale_facs.
+
+        Units with a multiport input function that is not a linear sum of the
+        inputs are listed in self.fallback. A unit class indicates that the sum is
+        linear with a lin_inp_ports method, which returns the ports whose inputs
+        are added without scaling.
+        """
+        net = self.net
+        if not net.syn_index_ready:
+            net.init_syn_index()
+        idx = [] # synapse index in net.all_syns of each input
+        coef = []
+        exc = [] # position in idx of the scaled excitatory inputs
+        seg = [] # index in 'units' of the unit for each entry of exc
+        views = [] # (unit, start, end) of the scale factors in coef
+        self.port_pos = [] # port_pos[i][p] = position in idx of port p of unit i
+        self.fallback = [] # units whose get_mp_input_sum is called
+        self.starts = [0] # idx[starts[i]:starts[i+1]] are the inputs of unit i
+        for i, u in enumerate(units):
+            first = net.in_starts[u.ID]
+            if mp:
+                ports = u.lin_inp_ports() if hasattr(u, 'lin_inp_ports') else None
+                if ports is None:
+                    self.fallback.append(i)
+                    ports = []
+                self.port_pos.append([])
+                for p, p_idx in enumerate(u.port_idx):
+                    self.port_pos[i].append(len(idx))
+                    if p == u.rdc_port:
+                        views.append((i, len(idx), len(idx) + len(p_idx)))
+                        exc += [len(idx) + j for j in u.exc_idx_rdc]
+                        seg += [i] * len(u.exc_idx_rdc)
+                        coef += list(u.scale_facs_rdc)
+                    else:
+                        coef += [1. if p in ports else 0.] * len(p_idx)
+                    idx += [first + j for j in p_idx]
+            else:
+                n_syns = len(net.syns[u.ID])
+                views.append((i, len(idx), len(idx) + n_syns))
+                exc += [len(idx) + j for j in u.exc_idx]
+                seg += [i] * len(u.exc_idx)
+                coef += list(u.scale_facs)
+                idx += list(range(first, first + n_syns))
+            self.starts.append(len(idx))
+        self.idx = np.array(idx, dtype=int)
+        self.coef = np.array(coef, dtype=float)
+        self.exc = np.array(exc, dtype=int)
+        self.seg = np.array(seg, dtype=int)
+        self.starts = np.array(self.starts, dtype=int)
+        for i, start, end in views:
+            setattr(units[i], 'scale_facs_rdc' if mp else 'scale_facs', 
+                    self.coef[start:end])
+
+    def port_inputs(self, port_of):
+        """ Positions in idx, and unit indexes, of the inputs at one port of each unit.
+
+        Args:
+            port_of: a function that receives a unit and returns one of its ports.
+        Returns:
+            Two 1D integer arrays. The first has positions in self.idx, and the
+            second has the index in self.units of the unit for each position.
+        """
+        pos = []
+        seg = []
+        for i, u in enumerate(self.units):
+            p = port_of(u)
+            pos += [self.port_pos[i][p] + j for j in range(len(u.port_idx[p]))]
+            seg += [i] * len(u.port_idx[p])
+        return np.array(pos, dtype=int), np.array(seg, dtype=int)
+
+    def get_inputs(self, time):
+        """ Returns the weights and the inputs of all units, ordered as in self.idx. """
+        w = self.net.get_syn_weights(time)[self.idx]
+        if self.mp:
+            inp = np.concatenate([inps for u in self.units for inps in u.mp_inputs])
+        else:
+            inp = np.concatenate([u.inp_vector for u in self.units])
+        return w, inp
+
+
+class exp_scale_pop(scaled_inputs_pop):
+    """
+    Population update for the exp_scale, exp_scale_mp, and exp_scale_shrp requirements.
+
+    The inputs of all units are placed in a single flat array (see scaled_inputs_pop).
+    All sums per unit are then obtained with np.bincount or network.segment_sum, 
+    and the scale factors for all units are updated with a few array operations.
+    """
+    def __init__(self, units, req):
+        """ The class constructor.
+
+        Args:
+            units: a list with the unit objects to update. All of them must have the
+                   'req' requirement already initialized.
+            req: syn_reqs.exp_scale, syn_reqs.exp_scale_mp, or syn_reqs.exp_scale_shrp.
+        Raises:
+            ValueError.
+        """
+        if not req in [syn_reqs.exp_scale, syn_reqs.exp_scale_mp, syn_reqs.exp_scale_shrp]:
+            raise ValueError('exp_scale_pop received the wrong requirement')
+        self.units = units
+        self.req = req
+        self.net = units[0].net
+        self.mp = req is not syn_reqs.exp_scale # multiport version?
+        self.sharp = req is syn_reqs.exp_scale_shrp
+        self.n = len(units)
+        self.fix = np.array([self.net.first_idx[u.ID] for u in units], dtype=int)
+        self.c = np.array([u.c for u in units])
+        self.Kp = np.array([u.Kp for u in units])
+        self.tau_scale = np.array([u.tau_scale for u in units])
+        self.init_inputs(units, self.mp)
+        if not self.mp: # inhibitory inputs are used to obtain I
+            self.inh = np.array([self.starts[i] + j for i, u in enumerate(units)
+                                 for j in u.inh_idx], dtype=int)
+            self.inh_seg = np.array([i for i, u in enumerate(units) 
+                                     for j in u.inh_idx], dtype=int)
+        if self.sharp:
+            self.tau_relax = np.array([u.tau_relax for u in units])
+            self.sh, self.sh_seg = self.port_inputs(lambda u: u.sharpen_port)
+
+    def update(self, time):
+        """ Update the scale factors of all units. """
+        n = self.n
+        w, inp = self.get_inputs(time)
+        w_inp = w * inp
+        w = w[self.exc]
+        r = np.clip(self.net.acts[self.fix, -1], 0.005, .995) # current rates
+        exp_cdf = ( 1. - np.exp(-self.c*r) ) / ( 1. - np.exp(-self.c) )
+        error = (np.array([u.below for u in self.units]) - 
+                 np.array([u.above for u in self.units]) - 2.*exp_cdf + 1.)
+        x0 = self.coef[self.exc]
+        sums = self.net.segment_sum(self.coef * w_inp, self.starts) # scaled input sums
+        if self.mp:
+            u_sum = np.bincount(self.seg, weights=x0*w_inp[self.exc], minlength=n)
+            I = u_sum - sums
+            for i in self.fallback:
+                I[i] = u_sum[i] - self.units[i].get_mp_input_sum(time)
+        else:
+            u_sum = sums
+            I = np.bincount(self.inh_seg, weights=w_inp[self.inh], minlength=n)
+        mu_exc = np.maximum(np.bincount(self.seg, weights=inp[self.exc], minlength=n), 0.001)
+        ss_scale = (u_sum - I + self.Kp * error) / mu_exc
+        a = np.minimum(ss_scale[self.seg] / np.maximum(w, .001), 10.)
+        tau = self.tau_scale
+        if self.sharp: # relax towards 1 when the sharpen port input is below 0.5
+            off = np.bincount(self.sh_seg, weights=w_inp[self.sh], minlength=n) < 0.5
+            a[off[self.seg]] = 1.
+            tau = np.where(off, self.tau_relax, self.tau_scale)
+        # same soft weight bounding as unit.upd_exp_scale_mp
+        self.coef[self.exc] = (x0 * a) / (x0 + (a - x0) * 
+                                          np.exp(-tau[self.seg] * a * self.net.min_delay))
+
+
+class exp_scale_sort_pop(scaled_inputs_pop):
+    """
+    Population update for the exp_scale_sort_mp and exp_scale_sort_shrp requirements.
+
+    The excitatory inputs at the rdc port of each unit (plus its fake autapse) are
+    placed in one row of a 2D array, padded with a value larger than any rate.
+    The ranking of each row is kept from step to step, so it can be updated for
+    all units with a stable sort of nearly sorted rows. The rate_rank attribute
+    of each unit becomes a view of its row in the ranking array. The input sums
+    and scale factors are handled as in scaled_inputs_pop.
+    """
+    def __init__(self, units, req):
+        """ The class constructor.
+
+        Args:
+            units: a list with the unit objects to update. All of them must have the
+                   'req' requirement already initialized.
+            req: syn_reqs.exp_scale_sort_mp or syn_reqs.exp_scale_sort_shrp.
+        Raises:
+            ValueError.
+        """
+        if not req in [syn_reqs.exp_scale_sort_mp, syn_reqs.exp_scale_sort_shrp]:
+            raise ValueError('exp_scale_sort_pop received the wrong requirement')
+        self.units = units
+        self.req = req
+        self.net = units[0].net
+        self.mp = True
+        self.sharp = req is syn_reqs.exp_scale_sort_shrp
+        self.n = len(units)
+        self.n_range = np.arange(self.n)
+        sizes = [len(u.ideal_rates) for u in units]
+        max_size = max(sizes)
+        # The padding value sorts after all the inputs, and pad*0 = 0
+        self.inp = np.full((self.n, max_size), np.finfo(np.float64).max)
+        self.w = np.zeros((self.n, max_size))
+        self.ideal = np.zeros((self.n, max_size))
+        self.rank = np.tile(np.arange(max_size), (self.n, 1))
+        for i, u in enumerate(units):
+            self.ideal[i, :sizes[i]] = u.ideal_rates
+            self.rank[i, :sizes[i]] = u.rate_rank
+            u.rate_rank = self.rank[i, :sizes[i]]
+        self.init_inputs(units, True)
+        # column of each excitatory input in its row
+        self.cols = np.arange(self.seg.size) - np.searchsorted(self.seg, self.seg)
+        # units with excitatory inputs, and the position of their first one
+        self.has_exc = np.unique(self.seg)
+        self.first_exc = self.exc[np.searchsorted(self.seg, self.has_exc)]
+        self.aut_col = np.array([u.autapse_idx for u in units], dtype=int)
+        # units with a fake autapse, its column, and the row of the unit in acts
+        self.fake = np.array([i for i,u in enumerate(units) if not u.autapse], dtype=int)
+        self.fake_col = np.array([sizes[i]-1 for i in self.fake], dtype=int)
+        self.fake_fix = np.array([self.net.first_idx[units[i].ID] for i in self.fake],
+                                 dtype=int)
+        self.tau_scale = np.array([u.tau_scale for u in units])
+        if self.sharp:
+            self.tau_relax = np.array([u.tau_relax for u in units])
+            self.sh, self.sh_seg = self.port_inputs(lambda u: u.sharpen_port)
+
+    def update(self, time):
+        """ Update the scale factors of all units. """
+        w, inp = self.get_inputs(time)
+        w_inp = w * inp
+        if self.sharp: # only units with sharpen port input >= 0.5 use rdc
+            on = np.bincount(self.sh_seg, weights=w_inp[self.sh], minlength=self.n) >= 0.5
+            act = np.flatnonzero(on)
+        else:
+            act = self.n_range
+        if self.seg.size > 0:
+            self.inp[self.seg, self.cols] = inp[self.exc]
+            self.w[self.seg, self.cols] = w[self.exc]
+        self.inp[self.fake, self.fake_col] = self.net.acts[self.fake_fix, -1]
+        rank = self.rank[act]
+        srt = np.argsort(np.take_along_axis(self.inp[act], rank, axis=1), 
+                         axis=1, kind='stable')
+        rank = np.take_along_axis(rank, srt, axis=1)
+        self.rank[act] = rank
+        ideal = self.ideal[act]
+        ideal_exc_inp = (np.take_along_axis(self.w[act], rank, axis=1) * ideal).sum(axis=1)
+        my_ideal_rate = ideal[np.arange(act.size), 
+                              np.argmax(rank == self.aut_col[act, None], axis=1)]
+        # all excitatory scale factors of a unit are equal
+        x0 = np.ones(self.n)
+        x0[self.has_exc] = self.coef[self.first_exc]
+        u_sum = x0 * np.bincount(self.seg, weights=w_inp[self.exc], minlength=self.n)
+        I = u_sum - self.net.segment_sum(self.coef * w_inp, self.starts)
+        for i in self.fallback:
+            if not self.sharp or on[i]:
+                I[i] = u_sum[i] - self.units[i].get_mp_input_sum(time)
+        syn_scale = np.ones(self.n)
+        syn_scale[act] = np.minimum((my_ideal_rate - I[act]) / ideal_exc_inp, 10.)
+        if self.sharp:
+            tau = np.where(on, self.tau_scale, self.tau_relax)
+        else:
+            tau = self.tau_scale
+        # same soft weight bounding as unit.upd_exp_scale_mp
+        x = (x0 * syn_scale) / (x0 + (syn_scale - x0) * 
+                                np.exp(-tau * syn_scale * self.net.min_delay))
+        self.coef[self.exc] = x[self.seg]
+
+
+class ds_branch_pop():
+    """
+    Population update of the branch sums in units of the double sigma family.
+
+    The branch weights, slopes and thresholds of all units are concatenated in 
+    flat arrays, so the branch sigmoidals of all units are evaluated for all the 
+    substeps of a simulation step in one vectorized pass. The sums of the branches
+    of each unit are obtained with np.add.reduceat, and are placed in the 
+    'ds_inp_sum' array of the unit, used by double_sigma_base.dt_fun.
+
+    This class is the 'pop_inp_sum' attribute of double_sigma_base, and its update
+    method is called by network.flat_update after the input sums of all units have
+    been updated.
+    """
+    def __init__(self, units):
+        """ The class constructor.
+
+        Args:
+            units: a list with unit objects of the double sigma family.
+        """
+        self.units = units
+        for u in units:
+            if u.br_ports is None:
+                u.init_branches()
+            u.pop_branches = True # the unit will not calculate ds_inp_sum itself
+        n_brs = [len(u.br_w) for u in units]
+        self.starts = np.cumsum([0] + n_brs[:-1]) # index of each unit's first branch
+        self.bw = np.concatenate([u.br_w for u in units])
+        self.sl = np.concatenate([u.slopes for u in units])
+        self.th = np.concatenate([u.threshs for u in units])
+        self.phi = np.concatenate([[u.phi]*n for u,n in zip(units, n_brs)])
+        # units with somatic inputs
+        self.soma = np.array([i for i,u in enumerate(units) if u.soma], dtype=int)
+        # units with normalized branch inputs, and the index of their branches
+        self.norm_units = [u for u in units if u.normal]
+        norm = [np.arange(st, st+n) for u, st, n in zip(units, self.starts, n_brs) if u.normal]
+        self.norm = np.concatenate(norm) if len(norm) > 0 else np.array([], dtype=int)
+
+    def update(self, time):
+        """ Update the ds_inp_sum array of all units. """
+        # x[k,j] is the input sum of the j-th branch in the k-th substep
+        x = np.array([u.mp_inp_sum[p] for u in self.units for p in u.br_ports]).transpose()
+        if self.norm.size > 0:
+            y = np.array([u.lpf_slow_mp_inp_sum[p] for u in self.norm_units for p in u.br_ports])
+            y = np.sign(y) * np.maximum(np.abs(y), 1e-3) # removing near-zero values
+            x[:, self.norm] = (x[:, self.norm] - y) / y
+        br = self.bw * ( 1. / (1. + np.exp(-self.sl * (x - self.th))) - self.phi )
+        tot = np.add.reduceat(br, self.starts, axis=1)
+        if self.soma.size > 0:
+            tot[:, self.soma] += np.array([self.units[i].mp_inp_sum[self.units[i].soma_port] 
+                                           for i in self.soma]).transpose()
+        for u, col in zip(self.units, tot.transpose()):
+            u.ds_inp_sum = col
+
+
+
 class exp_dist_sigmoidal(unit): 
     """
     A unit where the synaptic weights are scaled to produce an exponential distribution.
@@ -24,6 +396,7 @@ class exp_dist_sigmoidal(unit):
     # excitatory inputs to be scaled using an 'exp_scale' factor. The exp_scale
     # factor is calculated by the upd_exp_scale function, which is called every update
     # thanks to the exp_scale synaptic requirement.
+    pop_reqs = {syn_reqs.exp_scale : exp_scale_pop} # population updates in flat networks
 
     def __init__(self, ID, params, network):
         """ The unit constructor.
@@ -73,6 +446,23 @@ class exp_dist_sigmoidal(unit):
         # there is only one state variable (the activity)
         return ( self.f(self.get_exp_sc_input_sum(t)) - y[0] ) * self.rtau
 
+    def dt_fun(self, y, s):
+        """ The derivatives function used when the network is flat. """
+        return ( self.f(self.inp_sum[s]) - y ) * self.rtau
+
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
+    def upd_flat_inp_sum(self, time):
+        """ Updates the input sums for flat networks, using the scale factors. """
+        self.step_inps = self.acts_win[self.acts_idx]
+        if self.step_inps.size == 0:  # when the unit has no inputs
+            self.inp_sum = np.zeros(self.min_buff_size)
+            return
+        w_vec = np.array([syn.w for syn in self.net.syns[self.ID]]) * self.scale_facs
+        self.inp_sum = np.matmul(w_vec, self.step_inps)
+
 
 class ssrdc_sharp_base(unit): 
     """
@@ -90,6 +480,8 @@ class ssrdc_sharp_base(unit):
     """
     # The issue of updating the scaling factors according to the inputs at the sharpen_port is 
     # handled by the unit.upd_exp_scale_shrp method, used by the exp_scale_shrp synaptic requirement.
+    pop_reqs = {syn_reqs.exp_scale_shrp : exp_scale_pop, # population updates in flat networks
+                syn_reqs.exp_scale_sort_shrp : exp_scale_sort_pop}
 
     def __init__(self, ID, params, network):
         """ The unit constructor.
@@ -152,7 +544,9 @@ class ssrdc_sharp_base(unit):
             sharpening port. When the sum of inputs at this port is smaller than 0.5 the scale factors
             return to 1 with a time constant of tau_relax.
         """
-        if np.dot(self.mp_inputs[self.sharpen_port], self.get_mp_weights(time)[self.sharpen_port]) < 0.5:
+        syns = self.net.syns[self.ID]
+        sharpen_w = [syns[i].w for i in self.port_idx[self.sharpen_port]]
+        if np.dot(self.mp_inputs[self.sharpen_port], sharpen_w) < 0.5:
             a = self.rdc_exc_ones   
             exp_tau = self.tau_relax
         else: 
@@ -163,7 +557,7 @@ class ssrdc_sharp_base(unit):
             error = self.below - self.above - 2.*exp_cdf + 1. 
             #u = (np.log(r/(1.-r))/self.slope) + self.thresh
             rdc_inp = self.mp_inputs[self.rdc_port]
-            rdc_w = self.get_mp_weights(time)[self.rdc_port]
+            rdc_w = np.array([syns[i].w for i in self.port_idx[self.rdc_port]])
             u = np.sum(self.scale_facs_rdc[self.exc_idx_rdc]*rdc_inp[self.exc_idx_rdc]*rdc_w[self.exc_idx_rdc])
             I = u - self.get_mp_input_sum(time)     
             mu_exc = np.maximum( np.sum( rdc_inp[self.exc_idx_rdc] ), 0.001 )
@@ -183,27 +577,14 @@ class ssrdc_sharp_base(unit):
             sharpening port. When the sum of inputs at this port is smaller than 0.5 the scale factors
             return to 1 with a time constant of tau_relax.
         """
-        if np.dot(self.mp_inputs[self.sharpen_port], self.get_mp_weights(time)[self.sharpen_port]) < 0.5:
+        if len(self.exc_idx_rdc) == 0: # no excitatory inputs to scale
+            return
+        sharpen_w = [self.net.syns[self.ID][i].w for i in self.port_idx[self.sharpen_port]]
+        if np.dot(self.mp_inputs[self.sharpen_port], sharpen_w) < 0.5:
             syn_scale = 1.
             exp_tau = self.tau_relax
         else: # input at sharpen port >= 0.5
-            exc_rdc_inp = self.mp_inputs[self.rdc_port][self.exc_idx_rdc] # Exc. inputs at the rdc port
-            exc_rdc_w = self.get_mp_weights(time)[self.rdc_port][self.exc_idx_rdc] # Exc. weights at rdc port
-            r = self.buffer[-1] # current rate
-            if not self.autapse: # if unit has no autapses, put a fake one with zero weight
-                exc_rdc_inp = np.concatenate((exc_rdc_inp, [r]))
-                exc_rdc_w = np.concatenate((exc_rdc_w, [0]))
-                self.autapse_idx = len(exc_rdc_inp) - 1
-            rate_rank = np.argsort(exc_rdc_inp)  # array index that sorts exc_rdc_inp
-            ideal_exc_inp = np.dot(exc_rdc_w[rate_rank], self.ideal_rates)
-            my_ideal_rate = self.ideal_rates[np.where(rate_rank == self.autapse_idx)[0][0]]
-            if self.autapse:
-                u = np.sum(self.scale_facs_rdc[self.exc_idx_rdc] * exc_rdc_inp * exc_rdc_w)
-            else:
-                u = np.sum(self.scale_facs_rdc[self.exc_idx_rdc]*exc_rdc_inp[:-1]*exc_rdc_w[:-1])
-            I = u - self.get_mp_input_sum(time)     
-            syn_scale = (my_ideal_rate - I) / (ideal_exc_inp)
-            syn_scale = min(syn_scale, 10.) # hard_bound_above
+            syn_scale = min(sort_scale(self, time), 10.) # hard_bound_above
             exp_tau = self.tau_scale
         # same soft weight bounding as upd_exp_scale_mp
         x0 = self.scale_facs_rdc[self.exc_idx_rdc][0] # x0 is scalar cuz all Exc. factors are equal
@@ -288,6 +669,29 @@ class sig_ssrdc_sharp(ssrdc_sharp_base):
         acc_sum += sum([np.dot(ws[p],inps[p]) for p in self.nm_prts]) 
         return acc_sum 
 
+    def lin_inp_ports(self):
+        """ Ports added without scaling in get_mp_input_sum (see scaled_inputs_pop). """
+        return self.nm_prts
+
+    def dt_fun(self, y, s):
+        """ The derivatives function used when the network is flat. """
+        return ( cython_sig(self.thresh, self.slope, self.inp_sum[s]) - y ) * self.rtau
+
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
+    def upd_flat_inp_sum(self, time):
+        """ Updates the input sums for flat networks, as in get_mp_input_sum. """
+        self.step_inps = self.acts_win[self.acts_idx]
+        if self.step_inps.size == 0:  # when the unit has no inputs
+            self.inp_sum = np.zeros(self.min_buff_size)
+            return
+        w_vec = np.array([syn.w for syn in self.net.syns[self.ID]])
+        w_vec[self.port_idx[self.rdc_port]] *= self.scale_facs_rdc
+        w_vec[self.port_idx[self.sharpen_port]] = 0.
+        self.inp_sum = np.matmul(w_vec, self.step_inps)
+
 
 class sig_ssrdc(unit):
     """
@@ -304,6 +708,9 @@ class sig_ssrdc(unit):
     The method to usd for rate distribution control can be specified through the sort_rdc
     parameter given to the constructor.
     """
+    pop_reqs = {syn_reqs.exp_scale_mp : exp_scale_pop, # population updates in flat networks
+                syn_reqs.exp_scale_sort_mp : exp_scale_sort_pop}
+
     def __init__(self, ID, params, network):
         """ The unit constructor.
 
@@ -372,29 +779,38 @@ class sig_ssrdc(unit):
                 acc_sum += np.dot(weights[port], inps[port]) 
         return acc_sum 
 
+    def lin_inp_ports(self):
+        """ Ports added without scaling in get_mp_input_sum (see scaled_inputs_pop). """
+        return [p for p in range(self.n_ports) if p != self.rdc_port]
+
+    def dt_fun(self, y, s):
+        """ The derivatives function used when the network is flat. """
+        return ( self.f(self.inp_sum[s]) - y ) * self.rtau
+
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
+    def upd_flat_inp_sum(self, time):
+        """ Updates the input sums for flat networks, as in get_mp_input_sum. """
+        self.step_inps = self.acts_win[self.acts_idx]
+        if self.step_inps.size == 0:  # when the unit has no inputs
+            self.inp_sum = np.zeros(self.min_buff_size)
+            return
+        w_vec = np.array([syn.w for syn in self.net.syns[self.ID]])
+        w_vec[self.port_idx[self.rdc_port]] *= self.scale_facs_rdc
+        self.inp_sum = np.matmul(w_vec, self.step_inps)
+
     def upd_exp_scale_sort_mp(self, time):
         """ Updates the synaptic scale factor optionally used in some multiport ssrdc units.
 
             This method implements the exp_scale_sort_mp requirement. It uses the 'ideal_rates' 
             array produced in init_pre_syn_update. 
         """
+        if len(self.exc_idx_rdc) == 0: # no excitatory inputs to scale
+            return
         # The equations come from the APCTP notebook, 8/28/18.
-        exc_rdc_inp = self.mp_inputs[self.rdc_port][self.exc_idx_rdc] # Exc. inputs at the rdc port
-        exc_rdc_w = self.get_mp_weights(time)[self.rdc_port][self.exc_idx_rdc] # Exc. weights at rdc port
-        r = self.buffer[-1] # current rate
-        if not self.autapse: # if unit has no autapses, put a fake one with zero weight
-            exc_rdc_inp = np.concatenate((exc_rdc_inp, [r]))
-            exc_rdc_w = np.concatenate((exc_rdc_w, [0]))
-            self.autapse_idx = len(exc_rdc_inp) - 1
-        rate_rank = np.argsort(exc_rdc_inp)  # array index that sorts exc_rdc_inp
-        ideal_exc_inp = np.dot(exc_rdc_w[rate_rank], self.ideal_rates)
-        my_ideal_rate = self.ideal_rates[np.where(rate_rank == self.autapse_idx)[0][0]]
-        if self.autapse:
-            u = np.sum(self.scale_facs_rdc[self.exc_idx_rdc] * exc_rdc_inp * exc_rdc_w)
-        else:
-            u = np.sum(self.scale_facs_rdc[self.exc_idx_rdc]*exc_rdc_inp[:-1]*exc_rdc_w[:-1])
-        I = u - self.get_mp_input_sum(time)     
-        syn_scale = (my_ideal_rate - I) / (ideal_exc_inp)
+        syn_scale = sort_scale(self, time)
         # same weight bounding as upd_exp_scale_mp
         syn_scale = min(syn_scale, 10.) # hard_bound_above
         x0 = self.scale_facs_rdc[self.exc_idx_rdc][0] # x0 is scalar cuz all Exc. factors are equal
@@ -534,6 +950,10 @@ class sig_trdc(unit):
         """ The derivative function used by flat networks. """
         return ( self.f(self.inp_sum[s]) - y ) * self.rtau
  
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
     def get_mp_input_sum(self, time):
         """ The input function of sig_trdc units. """
         weights = self.get_mp_weights(time)
@@ -668,7 +1088,17 @@ class sig_trdc_sharp(trdc_sharp_base):
 
 
 class double_sigma_base(unit):
-    """ The parent class for units in the double sigma family. """
+    """ The parent class for units in the double sigma family. 
+    
+        The branch weights, slopes and thresholds are stored as numpy arrays, and
+        the input port of each branch is in the br_ports array (see init_branches).
+        With this 'branch-matrix' representation the input sum of most models in
+        the family is obtained by branch_sum, and in flat networks the branches of 
+        all units are evaluated together by ds_branch_pop.
+    """
+    soma = False # True for models with somatic inputs (the sigma_double_sigma types)
+    normal = False # True for models with normalized branch inputs (the *_normal types)
+    pop_inp_sum = ds_branch_pop # population update of branch sums in flat networks
 
     def __init__(self, ID, params, network):
         """ The unit constructor.
@@ -772,8 +1202,58 @@ class double_sigma_base(unit):
                 raise ValueError('Unknown distribution used to specify branch thresholds')
         else:
             raise ValueError('Invalid type for threshs parameter')
+        # the branch-matrix representation
+        self.br_w = np.array(self.br_w, dtype=float)
+        self.slopes = np.array(self.slopes, dtype=float)
+        self.threshs = np.array(self.threshs, dtype=float)
+        self.br_ports = None # initialized by init_branches
+        self.pop_branches = False # True when ds_branch_pop updates ds_inp_sum
+
+    def init_branches(self):
+        """ Initializes the port indexes used by the branch-matrix representation.
+
+            br_ports[i] is the input port of the i-th branch. When the 'soma' attribute
+            is True, the first port is somatic, and its index is in soma_port.
+            A 'sharpen_port' is neither a branch nor somatic.
+
+            This is not done in the constructor because sharpen_port is set by
+            constructors called after the one of double_sigma_base.
+
+            Raises:
+                ValueError
+        """
+        ports = list(range(self.n_ports))
+        if hasattr(self, 'sharpen_port'):
+            ports.remove(self.sharpen_port)
+        if self.soma:
+            self.soma_port = ports.pop(0)
+        if len(ports) != len(self.br_w):
+            raise ValueError('The number of branch ports does not match the length of branch_w')
+        self.br_ports = np.array(ports, dtype=int)
+
+    def branch_sum(self, port_sums):
+        """ Returns the input to the global sigmoidal given the input sum at each port.
+
+            Args:
+                port_sums: a numpy array. port_sums[p] is the scaled sum of the inputs 
+                           at port p. It can also be a 2D array, with one column for
+                           each substep of a simulation step.
+            Returns:
+                A float, or a 1D numpy array with one value per column of port_sums.
+        """
+        if self.br_ports is None:
+            self.init_branches()
+        x = port_sums[self.br_ports].transpose()
+        if self.normal:
+            y = np.array(self.lpf_slow_mp_inp_sum)[self.br_ports]
+            y = np.sign(y) * np.maximum(np.abs(y), 1e-3) # removing near-zero values
+            x = (x - y) / y
+        ret = np.dot(1. / (1. + np.exp(-self.slopes * (x - self.threshs))) - self.phi, 
+                     self.br_w)
+        if self.soma:
+            ret = ret + port_sums[self.soma_port]
+        return ret
 
- 
     def f(self, thresh, slope, arg):
         """ The sigmoidal function, with parameters given explicitly."""
         #return 1. / (1. + np.exp(-slope*(arg - thresh)))
@@ -784,6 +1264,34 @@ class double_sigma_base(unit):
         #return ( self.f(self.thresh, self.slope, self.get_mp_input_sum(t)) - y[0] ) * self.rtau
         return ( cython_sig(self.thresh, self.slope, self.get_mp_input_sum(t)) - y[0] ) * self.rtau
 
+    def get_mp_input_sum(self, time):
+        """ The input function of the double sigma family, using branch_sum. """
+        return self.branch_sum(np.array([np.dot(w, i) for w, i in 
+                               zip(self.get_mp_weights(time), self.get_mp_inputs(time))]))
+
+    def dt_fun(self, y, s):
+        """ Returns the derivative when state is y, at time substep s. """
+        return ( cython_sig(self.thresh, self.slope, self.ds_inp_sum[s]) - y ) * self.rtau
+
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
+    def upd_flat_mp_inp_sum(self, time):
+        """ Updates the input sums at each port, and the ds_inp_sum used by dt_fun. """
+        unit.upd_flat_mp_inp_sum(self, time)
+        if not self.pop_branches: # otherwise ds_branch_pop updates ds_inp_sum
+            self.ds_inp_sum = self.branch_sum(np.array(self.mp_inp_sum))
+
+    def rk_end_values(self, time):
+        """ unit.rk_end_values, also obtaining ds_inp_sum when ds_branch_pop is used. """
+        pop_branches = self.pop_branches
+        self.pop_branches = False
+        try:
+            return unit.rk_end_values(self, time)
+        finally:
+            self.pop_branches = pop_branches
+
  
 class double_sigma(double_sigma_base):
     """ 
@@ -839,29 +1347,6 @@ class double_sigma(double_sigma_base):
 
         """
         super(double_sigma, self).__init__(ID, params, network)
-    
-    def get_mp_input_sum(self, time):
-        """ The input function of the double sigma unit. """
-        # The two versions below require almost identical times
-        #
-        # version 1. The big zip
-        return sum( [ o*(self.f(th,sl,np.dot(w,i)) - self.phi) for o,th,sl,w,i in 
-                      zip(self.br_w, self.threshs, self.slopes, 
-                          self.get_mp_weights(time), self.get_mp_inputs(time))  ] )
-        # version 2. The accumulator
-        #ret = 0.
-        #w = self.get_mp_weights(time)
-        #inp = self.get_mp_inputs(time)
-        #for i in range(self.n_ports):
-        #    ret += self.br_w[i] * (self.f(self.threshs[i], self.slopes[i], np.dot(w[i],inp[i]))-self.phi)
-        #return ret
-
-    def dt_fun(self, y, s):
-        """ Returns the derivative when state is y, at time substep s. """
-        inp_sum = sum( [ o * (self.f(th,sl,self.mp_inp_sum[p][s]) - self.phi)
-                     for o, th, sl, p in zip(self.br_w, self.threshs, self.slopes,
-                     range(self.n_ports)) ] )
-        return ( cython_sig(self.thresh, self.slope, inp_sum) - y ) * self.rtau
 
 
 class double_sigma_normal(double_sigma_base):
@@ -882,6 +1367,7 @@ class double_sigma_normal(double_sigma_base):
     the parameters are set, they might activate only when certain input branches receive
     enough stimulation.
     """
+    normal = True # branch inputs are normalized
 
     def __init__(self, ID, params, network):
         """ The unit constructor.
@@ -922,26 +1408,8 @@ class double_sigma_normal(double_sigma_base):
         # were lists then network.create_units would interpret them as values to assign to separate units.
         super().__init__(ID, params, network)
         self.syn_needs.update([syn_reqs.mp_inputs, syn_reqs.mp_weights,
-                               syn_reqs.lpf_slow_mp_inp_sum]) 
-     
-    def get_mp_input_sum(self, time):
-        """ The input function of the normalized double sigma unit. """
-        # Removing zero or near-zero values from lpf_slow_mp_inp_sum
-        lpf_inp_sum = [np.sign(arry)*(np.maximum(np.abs(arry), 1e-3)) for arry in self.lpf_slow_mp_inp_sum]
-        #
-        # version 1. The big zip
-        return sum( [ o*( self.f(th, sl, (np.dot(w,i)-y) / y) - self.phi ) for o,th,sl,y,w,i in 
-                     zip(self.br_w, self.threshs, self.slopes, lpf_inp_sum,
-                         self.get_mp_weights(time), self.get_mp_inputs(time))  ] )
-        # version 2. The accumulator
-        #ret = 0.
-        #w = self.get_mp_weights(time)
-        #inp = self.get_mp_inputs(time)
-        #for i in range(self.n_ports):
-        #    ret += self.br_w[i] * (self.f(self.threshs[i], self.slopes[i], 
-        #            (np.dot(w[i],inp[i])-lpf_inp_sum[i])/lpf_inp_sum[i]) -  self.phi)
-        #return ret
-    
+                               syn_reqs.lpf_slow_mp_inp_sum])
+
 
 class sigma_double_sigma(double_sigma_base):
     """ 
@@ -965,6 +1433,7 @@ class sigma_double_sigma(double_sigma_base):
     the parameters are set, they might activate only when certain input branches receive
     enough stimulation.
     """
+    soma = True # port 0 receives somatic inputs
 
     def __init__(self, ID, params, network):
         """ The unit constructor.
@@ -1003,32 +1472,6 @@ class sigma_double_sigma(double_sigma_base):
         """
         self.extra_ports = 1 # Used by the parent class' creator
         super().__init__(ID, params, network)
-            
-    def get_mp_input_sum(self, time):
-        """ The input function of the sigma_double_sigma unit. """
-        w = self.get_mp_weights(time)
-        inp = self.get_mp_inputs(time)
-        # version 1 is slightly faster
-        #
-        # version 1. The big zip
-        return np.dot(w[0], inp[0]) + sum(
-                    [ o*(self.f(th,sl,np.dot(w,i)) - self.phi) for o,th,sl,w,i in 
-                      zip(self.br_w, self.threshs, self.slopes, w[1:], inp[1:]) ] )
-        # version 2. The accumulator
-        #ret = np.dot(w[0], inp[0])
-        #for i in range(1,self.n_ports):
-        #    ret += self.br_w[i-1] * (self.f(self.threshs[i-1], self.slopes[i-1], 
-        #                             np.dot(w[i],inp[i])) - self.phi)
-        #return ret
-    
-    def dt_fun(self, y, s):
-        """ Returns the derivative when state is y, at time substep s. """
-        inp_sum = self.mp_inp_sum[0][s] # input sum at port 0
-        inp_sum += sum( [ o * (self.f(th,sl,self.mp_inp_sum[p][s]) - self.phi)
-                     for o, th, sl, p in zip(self.br_w, self.threshs, self.slopes,
-                     range(1,self.n_ports)) ] )
-        return ( cython_sig(self.thresh, self.slope, inp_sum) - y ) * self.rtau
-
 
 
 class sigma_double_sigma_normal(double_sigma_base):
@@ -1051,6 +1494,8 @@ class sigma_double_sigma_normal(double_sigma_base):
 
     The equations can be seen in the "double_sigma_unit" tiddler of the programming notes wiki.
     """
+    soma = True # port 0 receives somatic inputs
+    normal = True # branch inputs are normalized
 
     def __init__(self, ID, params, network):
         """ The unit constructor.
@@ -1090,19 +1535,8 @@ class sigma_double_sigma_normal(double_sigma_base):
         self.extra_ports = 1 # The soma port        
         double_sigma_base.__init__(self, ID, params, network)
         self.syn_needs.update([syn_reqs.mp_inputs, syn_reqs.mp_weights,
-                               syn_reqs.lpf_slow_mp_inp_sum]) 
-     
-    
-    def get_mp_input_sum(self, time):
-        """ The input function of the normalized double sigma unit. """
-        # Removing zero or near-zero values from lpf_slow_mp_inp_sum
-        lpf_inp_sum = [np.sign(arry)*(np.maximum(np.abs(arry), 1e-3)) for arry in self.lpf_slow_mp_inp_sum]
-        w = self.get_mp_weights(time)
-        inp = self.get_mp_inputs(time)
-         
-        return np.dot(w[0], inp[0]) + sum( [ o*( self.f(th, sl, (np.dot(w,i)-y) / y) - self.phi ) 
-               for o,th,sl,y,w,i in zip(self.br_w, self.threshs, self.slopes, lpf_inp_sum[1:], w[1:], inp[1:]) ] )
- 
+                               syn_reqs.lpf_slow_mp_inp_sum])
+
 
 class ds_ssrdc_sharp(double_sigma_base, ssrdc_sharp_base): 
     """
@@ -1127,6 +1561,9 @@ class ds_ssrdc_sharp(double_sigma_base, ssrdc_sharp_base):
     The equations of the doulble-sigma unit can be seen in the "double_sigma_unit" tiddler of 
     the programming notes wiki.
     """
+    # These models don't use the branch-matrix representation. In flat networks their
+    # ds_inp_sum is computed by upd_flat_mp_inp_sum, as in get_mp_input_sum.
+    pop_inp_sum = None
     def __init__(self, ID, params, network):
         """ The unit constructor.
 
@@ -1190,8 +1627,24 @@ class ds_ssrdc_sharp(double_sigma_base, ssrdc_sharp_base):
                                             np.sum(self.scale_facs_rdc * ws[rdcp] * inps[rdcp]) -self.phi ) )
         acc_sum += sum( [ self.br_w[p] * ( self.f( self.threshs[p], self.slopes[p], np.dot(ws[p],inps[p]) )
                                            - self.phi ) for p in self.nm_prts ] )
-        return acc_sum 
+        return acc_sum
 
+    def upd_flat_mp_inp_sum(self, time):
+        """ Updates the port input sums, and the ds_inp_sum used by dt_fun.
+
+            ds_inp_sum[s] is the value of get_mp_input_sum at substep s.
+        """
+        unit.upd_flat_mp_inp_sum(self, time)
+        rdcp = self.rdc_port # to make lines shorter
+        if len(self.port_idx[rdcp]) > 0:
+            rdc_sum = np.matmul(self.scale_facs_rdc * self.get_mp_weights(time)[rdcp],
+                                self.mp_step_inps[rdcp])
+        else:
+            rdc_sum = np.zeros(self.min_buff_size)
+        sig = lambda p, x: 1. / (1. + np.exp(-self.slopes[p]*(x - self.threshs[p])))
+        self.ds_inp_sum = self.br_w[rdcp] * sig(rdcp, rdc_sum - self.phi)
+        for p in self.nm_prts:
+            self.ds_inp_sum += self.br_w[p] * (sig(p, self.mp_inp_sum[p]) - self.phi)
 
 
 class multiport_trdc_base(unit):
@@ -1313,24 +1766,6 @@ class double_sigma_trdc(double_sigma_base, multiport_trdc_base):
         self.unit_initialized = True  # to avoid calling the unit constructor twice
         multiport_trdc_base.__init__(self, ID, params, network)
 
-            
-    def get_mp_input_sum(self, time):
-        """ The input function of the double sigma unit. """
-        # The two versions below require almost identical times
-        #
-        # version 1. The big zip
-        return sum( [ o*(self.f(th,sl,np.dot(w,i)) - self.phi) for o,th,sl,w,i in 
-                      zip(self.br_w, self.threshs, self.slopes, 
-                          self.get_mp_weights(time), self.get_mp_inputs(time))  ] )
-        # version 2. The accumulator
-        #ret = 0.
-        #w = self.get_mp_weights(time)
-        #inp = self.get_mp_inputs(time)
-        #for i in range(self.n_ports):
-        #    ret += self.br_w[i] * (self.f(self.threshs[i], self.slopes[i], np.dot(w[i],inp[i]))-self.phi)
-        #return ret
-    
-
 
 class sigma_double_sigma_trdc(double_sigma_base, multiport_trdc_base):
     """ 
@@ -1354,6 +1789,7 @@ class sigma_double_sigma_trdc(double_sigma_base, multiport_trdc_base):
 
     The equations can be seen in the "double_sigma_unit" tiddler of the programming notes wiki.
     """
+    soma = True # port 0 receives somatic inputs
     # Inheritance for this unit has a "diamond" scheme, since both parents inherit from unit;
     # mutiport_trdc_base, however, only implements a constructor. This constructor will not
     # call the unit constructor if unit_initialized=True .
@@ -1406,23 +1842,6 @@ class sigma_double_sigma_trdc(double_sigma_base, multiport_trdc_base):
         self.unit_initialized = True  # to avoid calling the unit constructor twice
         multiport_trdc_base.__init__(self, ID, params, network)
 
-            
-    def get_mp_input_sum(self, time):
-        """ Identical to the input function of the sigma_double_sigma unit. """
-        w = self.get_mp_weights(time)
-        inp = self.get_mp_inputs(time)
-        # version 1 is slightly faster
-        #
-        # version 1. The big zip
-        return np.dot(w[0], inp[0]) + sum(
-                    [ o*(self.f(th,sl,np.dot(w,i))-self.phi) for o,th,sl,w,i in 
-                      zip(self.br_w, self.threshs, self.slopes, w[1:], inp[1:]) ] )
-        # version 2. The accumulator
-        #ret = np.dot(w[0], inp[0])
-        #for i in range(1,self.n_ports):
-        #    ret += self.br_w[i-1] * self.f(self.threshs[i-1], self.slopes[i-1], np.dot(w[i],inp[i]))
-        #return ret
-    
 
 class double_sigma_normal_trdc(double_sigma_base, multiport_trdc_base):
     """ double_sigma units with normalized inputs, and threshold-based rate distro control.
@@ -1442,6 +1861,7 @@ class double_sigma_normal_trdc(double_sigma_base, multiport_trdc_base):
     distribution control. If the unit is part of the population that projects to port 'rdc_port', this 
     will contribute to produce an exponential distribution of firing rates.
     """
+    normal = True # branch inputs are normalized
 
     def __init__(self, ID, params, network):
         """ The unit constructor.
@@ -1492,19 +1912,8 @@ class double_sigma_normal_trdc(double_sigma_base, multiport_trdc_base):
         self.unit_initialized = True  # to avoid calling the unit constructor twice
         multiport_trdc_base.__init__(self, ID, params, network)
         self.syn_needs.update([syn_reqs.mp_inputs, syn_reqs.mp_weights,
-                               syn_reqs.lpf_slow_mp_inp_sum]) 
-     
-    
-    def get_mp_input_sum(self, time):
-        """ The input function of the normalized double sigma unit. """
-        # Removing zero or near-zero values from lpf_slow_mp_inp_sum
-        lpf_inp_sum = [np.sign(arry)*(np.maximum(np.abs(arry), 1e-3)) for arry in self.lpf_slow_mp_inp_sum]
-        #
-        # version 1. The big zip
-        return sum( [ o*( self.f(th, sl, (np.dot(w,i)-y) / y) - self.phi ) for o,th,sl,y,w,i in 
-                     zip(self.br_w, self.threshs, self.slopes, lpf_inp_sum,
-                         self.get_mp_weights(time), self.get_mp_inputs(time))  ] )
-         
+                               syn_reqs.lpf_slow_mp_inp_sum])
+
 
 class double_sigma_sharp(double_sigma_base, trdc_sharp_base):
     """ 
@@ -1581,19 +1990,6 @@ class double_sigma_sharp(double_sigma_base, trdc_sharp_base):
         self.unit_initialized = True  # to avoid calling the unit constructor twice
         trdc_sharp_base.__init__(self, ID, params, network)
 
-            
-    def get_mp_input_sum(self, time):
-        """ The input function of the double sigma sharp unit. """
-        # First we should remove the inputs at the 'sharpen' port
-        weights = self.get_mp_weights(time)
-        inputs = self.get_mp_inputs(time)
-        del weights[self.sharpen_port]
-        del inputs[self.sharpen_port]
-
-        return sum( [ o*(self.f(th,sl,np.dot(w,i)) - self.phi) for o,th,sl,w,i in 
-                      zip(self.br_w, self.threshs, self.slopes, weights, inputs) ] )
- 
-
 
 class sigma_double_sigma_sharp(double_sigma_base, trdc_sharp_base):
     """ 
@@ -1616,6 +2012,7 @@ class sigma_double_sigma_sharp(double_sigma_base, trdc_sharp_base):
    
     The equations can be seen in the "double_sigma_unit" tiddler of the programming notes wiki.
     """
+    soma = True # port 0 receives somatic inputs
     # Inheritance for this unit has a "diamond" scheme, since both parents inherit from unit;
     # trdc_sharp_base, however, only implements a constructor. This constructor will not
     # call the unit constructor if unit_initialized=True .
@@ -1669,17 +2066,6 @@ class sigma_double_sigma_sharp(double_sigma_base, trdc_sharp_base):
         self.unit_initialized = True  # to avoid calling the unit constructor twice
         trdc_sharp_base.__init__(self, ID, params, network)
 
-            
-    def get_mp_input_sum(self, time):
-        """ Identical to the input function of the sigma_double_sigma unit. """
-        w = self.get_mp_weights(time)
-        inp = self.get_mp_inputs(time)
-        del w[self.sharpen_port]
-        del inp[self.sharpen_port]
-        return np.dot(w[0], inp[0]) + sum(
-                    [ o*(self.f(th,sl,np.dot(w,i))-self.phi) for o,th,sl,w,i in 
-                      zip(self.br_w, self.threshs, self.slopes, w[1:], inp[1:]) ] )
- 
 
 class double_sigma_normal_sharp(double_sigma_base, trdc_sharp_base):
     """ double_sigma units with normalized inputs and switchable threshold-based rate distro control.
@@ -1701,6 +2087,7 @@ class double_sigma_normal_sharp(double_sigma_base, trdc_sharp_base):
     rates. When the inputs to the sharpen port are smaller than 0.5 the threshold will decay exponentially
     to a default value called "thr_fix", with a rate set by "tau_fix".
     """
+    normal = True # branch inputs are normalized
 
     def __init__(self, ID, params, network):
         """ The unit constructor.
@@ -1754,21 +2141,7 @@ class double_sigma_normal_sharp(double_sigma_base, trdc_sharp_base):
         double_sigma_base.__init__(self, ID, params, network)
         self.unit_initialized = True  # to avoid calling the unit constructor twice
         trdc_sharp_base.__init__(self, ID, params, network)
-        self.syn_needs.update([syn_reqs.lpf_slow_mp_inp_sum, syn_reqs.mp_weights]) 
-     
-    
-    def get_mp_input_sum(self, time):
-        """ The input function of the normalized double sigma unit. """
-        # Removing zero or near-zero values from lpf_slow_mp_inp_sum
-        lpf_inp_sum = [np.sign(arry)*(np.maximum(np.abs(arry), 1e-3)) for arry in self.lpf_slow_mp_inp_sum]
-        w = self.get_mp_weights(time)
-        inp = self.get_mp_inputs(time)
-        del w[self.sharpen_port]
-        del inp[self.sharpen_port]
-         
-        return sum( [ o*( self.f(th, sl, (np.dot(w,i)-y) / y) - self.phi ) for o,th,sl,y,w,i in 
-                     zip(self.br_w, self.threshs, self.slopes, lpf_inp_sum, w, inp)  ] )
- 
+        self.syn_needs.update([syn_reqs.lpf_slow_mp_inp_sum, syn_reqs.mp_weights])
 
 
 class sigma_double_sigma_normal_sharp(double_sigma_base, trdc_sharp_base):
@@ -1799,6 +2172,8 @@ class sigma_double_sigma_normal_sharp(double_sigma_base, trdc_sharp_base):
 
     The preferred way to assign the ports is: 0 -> soma; 1,...,n -> branches; n+1 -> sharpen. 
     """
+    soma = True # port 0 receives somatic inputs
+    normal = True # branch inputs are normalized
 
     def __init__(self, ID, params, network):
         """ The unit constructor.
@@ -1854,22 +2229,8 @@ class sigma_double_sigma_normal_sharp(double_sigma_base, trdc_sharp_base):
         double_sigma_base.__init__(self, ID, params, network)
         self.unit_initialized = True  # to avoid calling the unit constructor twice
         trdc_sharp_base.__init__(self, ID, params, network)
-        self.syn_needs.update([syn_reqs.lpf_slow_mp_inp_sum, syn_reqs.mp_weights]) 
-     
-    
-    def get_mp_input_sum(self, time):
-        """ The input function of the normalized double sigma unit. """
-        # Removing zero or near-zero values from lpf_slow_mp_inp_sum
-        lpf_inp_sum = [np.sign(arry)*(np.maximum(np.abs(arry), 1e-3)) 
-                       for arry in self.lpf_slow_mp_inp_sum]
-        w = self.get_mp_weights(time)
-        inp = self.get_mp_inputs(time)
-        del w[self.sharpen_port]
-        del inp[self.sharpen_port]
-         
-        return np.dot(w[0], inp[0]) + sum( [ o*( self.f(th, sl, (np.dot(w,i)-y) / y) - self.phi ) 
-               for o,th,sl,y,w,i in zip(self.br_w, self.threshs, self.slopes, lpf_inp_sum[1:], w[1:], inp[1:]) ] )
- 
+        self.syn_needs.update([syn_reqs.lpf_slow_mp_inp_sum, syn_reqs.mp_weights])
+
 
 class sds_n_ssrdc_sharp(double_sigma_base, ssrdc_sharp_base): 
     """
@@ -1899,6 +2260,9 @@ class sds_n_ssrdc_sharp(double_sigma_base, ssrdc_sharp_base):
     The method to use for rate distribution control can be specified through the sort_rdc
     parameter given to the constructor.
     """
+    # These models don't use the branch-matrix representation. In flat networks their
+    # ds_inp_sum is computed by upd_flat_mp_inp_sum, as in get_mp_input_sum.
+    pop_inp_sum = None
     def __init__(self, ID, params, network):
         """ The unit constructor.
         Args:
@@ -1978,7 +2342,31 @@ class sds_n_ssrdc_sharp(double_sigma_base, ssrdc_sharp_base):
         # Adding inputs from the other ports
         acc_sum += sum( [ self.br_w[p-1] * ( self.f( self.threshs[p-1], self.slopes[p-1], 
                           (np.dot(ws[p],inps[p])-lpf_i[p])/lpf_i[p] - self.phi ) ) for p in self.nm_prts ] )
-        return acc_sum 
+        return acc_sum
+
+    def upd_flat_mp_inp_sum(self, time):
+        """ Updates the port input sums, and the ds_inp_sum used by dt_fun.
+
+            ds_inp_sum[s] is the value of get_mp_input_sum at substep s.
+        """
+        unit.upd_flat_mp_inp_sum(self, time)
+        rdcp = self.rdc_port # to make lines shorter
+        lpf_i = [np.sign(arry)*(np.maximum(np.abs(arry), 1e-3)) for arry in self.lpf_slow_mp_inp_sum]
+        if len(self.port_idx[rdcp]) > 0:
+            rdc_sum = np.matmul(self.scale_facs_rdc * self.get_mp_weights(time)[rdcp],
+                                self.mp_step_inps[rdcp])
+        else:
+            rdc_sum = np.zeros(self.min_buff_size)
+        sig = lambda p, x: 1. / (1. + np.exp(-self.slopes[p]*(x - self.threshs[p])))
+        # input from the rdc port (not normalized)
+        self.ds_inp_sum = self.br_w[rdcp] * sig(rdcp, rdc_sum - self.phi)
+        # input from the soma
+        if rdcp != 0:
+            self.ds_inp_sum += (self.mp_inp_sum[0] - lpf_i[0]) / lpf_i[0]
+        # inputs from the other ports
+        for p in self.nm_prts:
+            self.ds_inp_sum += self.br_w[p-1] * (sig(p-1, (self.mp_inp_sum[p] - lpf_i[p]) /
+                                                 lpf_i[p] - self.phi))
 
 
 class sliding_threshold_harmonic_rate_sigmoidal(unit):
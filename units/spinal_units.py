@@ -682,6 +682,10 @@ class am_oscillator(unit, rga_reqs):
         Du = (y[1] - y[0] + np.tanh(Is) * np.sin(th)) / self.tau_u
         return np.array([Du, Dc, DI])
 
+    def leak_rate(self):
+        """ Rates of the linear decay of each state variable in dt_fun. """
+        return np.array([1. / self.tau_u, 0., 0.])
+
 
 class am_oscillator2D(unit, rga_reqs):
     """
@@ -983,6 +987,10 @@ class am_osc2D_adapt(unit, rga_reqs, acc_sda_reqs):
         #      self.A * np.tanh(I[0])*np.sin(th)) / self.tau_u
         return np.array([Du, Dc])
 
+    def leak_rate(self):
+        """ Rates of the linear decay of each state variable in dt_fun. """
+        return np.array([1. / self.tau_u, 0.])
+
 #==============================================================================
 
 
@@ -1366,6 +1374,10 @@ class am_pulse(unit, rga_reqs):
         Du = (y[1] + self.A * abs(np.tanh(I[0])) * sig - y[0]) / self.tau_u
         return np.array([Du, Dc])
 
+    def leak_rate(self):
+        """ Rates of the linear decay of each state variable in dt_fun. """
+        return np.array([1. / self.tau_u, 0.])
+
 
 class logarithmic(unit):
     """ A unit with a logarithminc activation function. 
@@ -1400,6 +1412,10 @@ class logarithmic(unit):
         return (np.log( 1. + max(0., self.inp_sum[s]-self.thresh))
                 - y) / self.tau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return 1. / self.tau
+
     def upd_sc_inp_sum_diff_mp(self, time):
         """ Update the derivatives for the scaled sum of inputs at each port."""
         # TODO: there is replication of computations when the requirements
@@ -2737,7 +2753,11 @@ class chwr_linear(unit):
         return max(self.inp_sum[s] - 
                    self.lpf_slow_sc_inp_sum - 
                    self.thresh, 0.) - y
-        
+
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return 1.
+
 
 class inpsel_linear2(unit, acc_sda_reqs, rga_reqs): 
     """ A multiport linear unit that only sums inputs from ports 0 and 1.
@@ -2805,6 +2825,10 @@ class inpsel_linear2(unit, acc_sda_reqs, rga_reqs):
         I = self.mp_inp_sum[0][s] + self.mp_inp_sum[1][s] 
         return (I - y) / self.tau #if y > 0 else 0.01
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return 1. / self.tau
+
 
 class bell_shaped_1D(unit):
     """ A unit that responds maximally to a given value of the input sum.
@@ -2867,6 +2891,10 @@ class bell_shaped_1D(unit):
             diff = self.inp_sum[s] - self.center
         return self.rtau * (np.exp(-self.b*diff*diff) - y)
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
 
 class td_sigmo(sigmoidal, lpf_sc_inp_sum_mp_reqs):
     """ A sigmoidal unit used to implement a value function with the TD rule.
@@ -3021,6 +3049,10 @@ class linear_mplex(unit):
             sel_port = 1
         return ( self.mp_inp_sum[sel_port][s] - y ) * self.rtau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
 
 class v_net(sigmoidal, lpf_sc_inp_sum_mp_reqs, rga_reqs):
     """ A unit to replace the L,V units, and L__V synapses in rl5E_lite.ipynb
@@ -13,9 +13,124 @@ from scipy.integrate import odeint # to integrate ODEs
 from scipy.integrate import solve_ivp # to integrate ODEs
 from scipy.interpolate import interp1d # to interpolate values
 
+# Butcher tableaus of the explicit Runge-Kutta methods used in flat networks.
+# Each entry is (c, a, b), with the stage times c as fractions of a substep,
+# the stage coefficients a[i] (for stages 0,...,i-1), and the weights b.
+RK_TABLEAUS = {
+    'heun' : ([0., 1.], [[], [1.]], [0.5, 0.5]),
+    'ssprk3' : ([0., 1., 0.5], [[], [1.], [0.25, 0.25]], [1./6., 1./6., 2./3.]),
+    'rk4' : ([0., 0.5, 0.5, 1.], [[], [0.5], [0., 0.5], [0., 0., 1.]],
+             [1./6., 1./3., 1./3., 1./6.]) }
+# Arrays with one value per substep that dt_fun may read in flat networks. The
+# Runge-Kutta methods replace them by their values at every half substep.
+RK_SUBSTEP_ARRAYS = ['inp_sum', 'mp_inp_sum', 'mp_step_inps', 'ds_inp_sum']
+
+def refine_substeps(arr, end=None):
+    """ Values of an array of substep inputs at every half substep.
+
+        'arr' has one value per substep along its last axis, starting at the
+        beginning of the simulation step. The returned array has 2n+1 values
+        along the last axis, where n=arr.shape[-1]. Entry 2k is arr[...,k], odd
+        entries are linear interpolations, and the last entry is the value at
+        the end of the step, taken from the last entry of 'end' along its last
+        axis. When 'end' is None it is linearly extrapolated from the last two
+        substeps.
+    """
+    arr = np.asarray(arr)
+    if arr.size == 0:
+        return arr
+    n = arr.shape[-1]
+    fine = np.empty(arr.shape[:-1] + (2*n+1,))
+    fine[..., 0:2*n:2] = arr
+    if end is not None:
+        fine[..., 2*n] = np.asarray(end)[..., -1]
+    else:
+        fine[..., 2*n] = 2.*arr[..., -1] - arr[..., -2] if n > 1 else arr[..., -1]
+    fine[..., 1::2] = 0.5 * (fine[..., 0:2*n:2] + fine[..., 2::2])
+    return fine
+
+
+class w_norm_pop():
+    """ Population update of weight normalization factors in flat networks.
+
+        This class updates the l1_norm_factor, l1_norm_factor_mp, w_sum_mp, and
+        out_norm_factor requirements for a list of units. Rather than iterating
+        over the synapses of each unit, the weights of all synapses are obtained
+        from network.get_syn_weights, and the factors of all units are computed
+        with segmented sums over the synapse index of the network 
+        (see network.init_syn_index and network.segment_sum).
+
+        For the multiport requirements, each unit's attribute becomes a view into
+        an array of the population object, so all of them are updated in place.
+    """
+    def __init__(self, units, req):
+        """ The class constructor.
+
+        Args:
+            units: a list with the unit objects that have the requirement.
+            req: the requirement, from the syn_reqs Enum.
+        Raises:
+            NotImplementedError
+        """
+        self.units = units
+        self.req = req
+        self.net = units[0].net
+        net = self.net
+        if not net.syn_index_ready:
+            net.init_syn_index()
+        if req in [syn_reqs.l1_norm_factor_mp, syn_reqs.w_sum_mp]:
+            # one segment per port of each unit
+            segs = [net.in_starts[u.ID] + np.array(u.port_idx[p], dtype=int)
+                    for u in units for p in range(u.n_ports)]
+            self.facs = np.ones(len(segs))
+            pos = 0
+            for u in units:
+                setattr(u, req.name, self.facs[pos:pos+u.n_ports])
+                pos += u.n_ports
+        elif req == syn_reqs.l1_norm_factor:
+            segs = [np.arange(net.in_starts[u.ID], net.in_starts[u.ID+1])
+                    for u in units]
+        elif req == syn_reqs.out_norm_factor:
+            segs = []
+            for u in units:
+                out = net.out_order[net.out_starts[u.ID]:net.out_starts[u.ID+1]]
+                if hasattr(u, 'out_norm_type'):
+                    out = np.array([k for k in out if 
+                        net.all_syns[k].type.value == u.out_norm_type], dtype=int)
+                segs.append(out)
+            self.des_sums = np.array([u.des_out_w_abs_sum for u in units])
+        else:
+            raise NotImplementedError('w_norm_pop does not update the ' +
+                                      req.name + ' requirement')
+        self.idx = np.concatenate(segs).astype(int) if len(segs) > 0 else \
+                   np.zeros(0, dtype=int) # synapse indexes in net.all_syns
+        self.starts = np.zeros(len(segs)+1, dtype=int) # segment boundaries
+        self.starts[1:] = np.cumsum([len(seg) for seg in segs])
+
+    def update(self, time):
+        """ Update the requirement for all units. """
+        w = self.net.get_syn_weights(time)[self.idx]
+        if self.req == syn_reqs.w_sum_mp:
+            self.facs[:] = self.net.segment_sum(w, self.starts)
+            return
+        abs_sums = self.net.segment_sum(np.abs(w), self.starts) + 1e-32
+        if self.req == syn_reqs.l1_norm_factor_mp:
+            self.facs[:] = 1. / abs_sums
+        elif self.req == syn_reqs.l1_norm_factor:
+            for u, fac in zip(self.units, 1. / abs_sums):
+                u.l1_norm_factor = fac
+        else: # out_norm_factor
+            for u, fac in zip(self.units, self.des_sums / abs_sums):
+                u.out_norm_factor = fac
+
 
 class unit():
     """ The parent class of all unit models.  """
+    # population updates of requirements in flat networks (see network.init_pop_updates)
+    pop_reqs = {syn_reqs.l1_norm_factor : w_norm_pop, 
+                syn_reqs.l1_norm_factor_mp : w_norm_pop,
+                syn_reqs.w_sum_mp : w_norm_pop,
+                syn_reqs.out_norm_factor : w_norm_pop}
 
     def __init__(self, ID, params, network):
         """ The class constructor.
@@ -42,6 +157,11 @@ class unit():
                 'tau_slow' : time constant for the slow low-pass filter.
                 'n_ports' : number of input ports. Defaults to 1.
                 'integ_meth' : a string specifying an integration method for the unit.
+                               Options are 'odeint', 'solve_ivp', 'euler', 'euler_maru',
+                               'exp_euler', 'custom', the Runge-Kutta methods 'heun',
+                               'ssprk3', and 'rk4', and 'exp_leak' (for units with a
+                               leak_rate). The last four are used in flat networks, and
+                               replaced by odeint otherwise.
                 'multidim' : a Boolean value indicating whether the unit is modeled by an
                              ODE with more than one equation. Defaults to False, and is set
                 'extra_requirements' : a list of strings containing the names of
@@ -136,6 +256,9 @@ class unit():
                     self.update = self.euler_maru_update_md 
                 else:
                     self.update = self.euler_maru_update
+                # noise used by the flat integrators
+                self.noise_stream = network.get_noise_stream((0, ID),
+                                                        self.min_buff_size)
             elif params['integ_meth'] == "exp_euler":
                 if self.multidim:
                     raise NotImplementedError("Exp Euler method unavailable " +
@@ -151,6 +274,9 @@ class unit():
                                          'a "deriv_eu" derivatives function.')
                 self.syn_needs.update([syn_reqs.exp_euler_vars])
                 self.update = self.exp_euler_update
+                # noise used by the flat integrator
+                self.noise_stream = network.get_noise_stream((0, ID),
+                                                        self.min_buff_size)
             elif params['integ_meth'] == "odeint":
                 if self.multidim:
                     self.update = self.odeint_update_md
@@ -161,6 +287,13 @@ class unit():
                     self.update = self.solve_ivp_update_md
                 else:
                     self.update = self.solve_ivp_update
+            elif params['integ_meth'] in RK_TABLEAUS or params['integ_meth'] == 'exp_leak':
+                # Runge-Kutta and exp_leak methods are used in flat networks.
+                # Otherwise odeint is used, as with the default solver.
+                if self.multidim:
+                    self.update = self.odeint_update_md
+                else:
+                    self.update = self.odeint_update
             elif params['integ_meth'] == 'custom':
                 pass
             else:
@@ -713,25 +846,23 @@ class unit():
                 syn.delay_steps = min(self.net.plants[syn.preID].steps-1, 
                                       int(round(delay/self.min_delay)))
         # For each synapse you receive, add its requirements
-        for syn in self.net.syns[self.ID]:
-            self.syn_needs.update(syn.upd_requirements)
+        self.syn_needs.update(*[syn.upd_requirements for syn in self.net.syns[self.ID]])
         pre_reqs = set([syn_reqs.pre_lpf_fast, syn_reqs.pre_lpf_mid, 
                         syn_reqs.pre_lpf_slow, syn_reqs.pre_out_norm_factor])
         self.syn_needs.difference_update(pre_reqs) # the "pre_" requirements are handled below
 
         # For each projection you send, check if its
         # synapse needs the lpf presynaptic activity
-        for syn_list in self.net.syns:
-            for syn in syn_list:
-                if syn.preID == self.ID:
-                    if syn_reqs.pre_lpf_fast in syn.upd_requirements:
-                        self.syn_needs.add(syn_reqs.lpf_fast)
-                    if syn_reqs.pre_lpf_mid in syn.upd_requirements:
-                        self.syn_needs.add(syn_reqs.lpf_mid)
-                    if syn_reqs.pre_lpf_slow in syn.upd_requirements:
-                        self.syn_needs.add(syn_reqs.lpf_slow)
-                    if syn_reqs.pre_out_norm_factor in syn.upd_requirements:
-                        self.syn_needs.add(syn_reqs.out_norm_factor)
+        out_reqs = set().union(*[self.net.syns[post][loc].upd_requirements
+                                 for post, loc in self.net.out_syns[self.ID]])
+        if syn_reqs.pre_lpf_fast in out_reqs:
+            self.syn_needs.add(syn_reqs.lpf_fast)
+        if syn_reqs.pre_lpf_mid in out_reqs:
+            self.syn_needs.add(syn_reqs.lpf_mid)
+        if syn_reqs.pre_lpf_slow in out_reqs:
+            self.syn_needs.add(syn_reqs.lpf_slow)
+        if syn_reqs.pre_out_norm_factor in out_reqs:
+            self.syn_needs.add(syn_reqs.out_norm_factor)
 
         # If we require support for multiple input ports, create the port_idx list.
         # port_idx is a list whose elements are lists of integers.
@@ -1051,7 +1182,7 @@ class unit():
         ######################################################################
         #u = (np.log(r/(1.-r))/self.slope) + self.thresh
         rdc_inp = self.mp_inputs[self.rdc_port]
-        rdc_w = self.get_mp_weights(time)[self.rdc_port]
+        rdc_w = np.array([self.net.syns[self.ID][i].w for i in self.port_idx[self.rdc_port]])
         u = np.sum(self.scale_facs_rdc[self.exc_idx_rdc]*rdc_inp[self.exc_idx_rdc]*rdc_w[self.exc_idx_rdc])
         I = u - self.get_mp_input_sum(time)     
         mu_exc = np.maximum( np.sum( rdc_inp[self.exc_idx_rdc] ), 0.001 )
@@ -1154,7 +1285,7 @@ class unit():
         # step_inps is a 2D numpy array. step_inps[j,k] provides the activity
         # of the j-th input in the k-th substep of the current timestep.
         #"""
-        self.step_inps = self.acts[self.acts_idx]
+        self.step_inps = self.acts_win[self.acts_idx]
         if self.step_inps.size == 0:  # when the unit has no inputs
             self.inp_sum = np.zeros(self.min_buff_size)
             return
@@ -1174,7 +1305,7 @@ class unit():
     def upd_flat_mp_inp_sum(self, time):
         """ The multiport version of upd_flat_inp_sum. """
         # step_inps is obtained as before, for all inputs
-        self.step_inps = self.acts[self.acts_idx]
+        self.step_inps = self.acts_win[self.acts_idx]
         # mp_step_inps will be a list where the i-th entry is a slice of step_inps
         # with only the rows for the inputs at the i-th port.
         self.mp_step_inps = []
@@ -1219,11 +1350,133 @@ class unit():
                                     self.dt_fun(self.buffer[:,base+idx-1], idx) )
 
 
+    def flat_rk_update(self, time):
+        """ Explicit Runge-Kutta integration used with network.flat_update.
+
+            The method comes from the 'rk_meth' attribute, set by network.flatten
+            ('heun', 'ssprk3', or 'rk4'; see RK_TABLEAUS). Stages between substeps
+            use input sums interpolated with refine_substeps, so dt_fun is called
+            with indexes to arrays with values at every half substep. The values
+            at the end of the step come from rk_end_values. This assumes dt_fun
+            only uses its 's' argument to index the arrays in RK_SUBSTEP_ARRAYS,
+            or times (as times[s - min_buff_size]). It works for one and
+            multidimensional units.
+        """
+        c, a, b = RK_TABLEAUS[self.rk_meth]
+        c2 = [int(round(2.*ci)) for ci in c] # stage times in half substeps
+        h = self.time_bit
+        mbs = self.min_buff_size
+        base = self.buffer.shape[-1] - mbs
+        # replacing the input arrays by their refined versions during the step
+        ends = self.rk_end_values(time)
+        saved = {}
+        for name in RK_SUBSTEP_ARRAYS:
+            if name in self.__dict__:
+                val = saved[name] = self.__dict__[name]
+                if type(val) is list:
+                    setattr(self, name, [refine_substeps(v, e) for v, e in zip(val, ends[name])])
+                else:
+                    setattr(self, name, refine_substeps(val, ends[name]))
+        # times[s - min_buff_size] must be the time of half substep s, so the
+        # refined times end with the 2*mbs first half substeps, and begin
+        # with the last one (index 0). times[-mbs-1] is the time of the step's
+        # initial state, after network.flat_update rolled the buffers.
+        saved['times'] = self.times
+        saved['min_buff_size'] = mbs
+        fine_t = self.times[-mbs-1] + (0.5*h) * np.arange(2*mbs+1)
+        self.times = np.concatenate((fine_t[-1:], fine_t[:-1]))
+        self.min_buff_size = 2 * mbs
+        try:
+            for idx in range(mbs):
+                y = self.buffer[..., base+idx-1]
+                if not self.multidim:
+                    y = y[()] # a scalar rather than a 0-dimensional array
+                k = []
+                for i in range(len(c)):
+                    yi = y
+                    for j, aij in enumerate(a[i]):
+                        if aij != 0.:
+                            yi = yi + (h * aij) * k[j]
+                    k.append(self.dt_fun(yi, 2*idx + c2[i]) if not self.multidim
+                             else np.asarray(self.dt_fun(yi, 2*idx + c2[i])))
+                self.buffer[..., base+idx] = y + h * sum([bi * ki for bi, ki in zip(b, k)])
+        finally:
+            for name, val in saved.items():
+                setattr(self, name, val)
+
+
+    def rk_end_values(self, time):
+        """ The arrays in RK_SUBSTEP_ARRAYS at the end of the current step.
+
+            Used by flat_rk_update, after network.flat_update rolled the acts
+            array. The input window of the unit then begins with the inputs at
+            the end of the step (the values that linear_propagator reads before
+            the roll), so the unit's own input sum method is applied to a window
+            of one substep.
+
+            Returns:
+                A dictionary whose entries are the arrays of the unit in
+                RK_SUBSTEP_ARRAYS, with a single value along their last axis.
+        """
+        names = RK_SUBSTEP_ARRAYS + ['step_inps', 'acts_win', 'min_buff_size']
+        saved = {name : self.__dict__[name] for name in names if name in self.__dict__}
+        self.acts_win = self.acts.reshape(-1)[:, np.newaxis]
+        self.min_buff_size = 1
+        try:
+            if self.multiport and self.needs_mp_inp_sum:
+                self.upd_flat_mp_inp_sum(time)
+            else:
+                self.upd_flat_inp_sum(time)
+            return {name : self.__dict__[name] for name in RK_SUBSTEP_ARRAYS
+                    if name in self.__dict__}
+        finally:
+            for name, val in saved.items():
+                setattr(self, name, val)
+
+
+    def leak_rate(self):
+        """ The rate 'a' of the linear decay in the unit's dynamics.
+
+            A unit model whose flat derivatives function has the form
+            dt_fun(y, s) = g(y, s) - a*y can return 'a' here, so it can use the
+            'exp_leak' integration method (see flat_exp_leak_update). For
+            multidimensional units an array with a rate for each state variable
+            is returned, with 0 for variables without linear decay.
+
+            Returns:
+                None, when the unit model doesn't declare a decay rate.
+        """
+        return None
+
+
+    def flat_exp_leak_update(self, time):
+        """ Exponential Euler integration of the linear decay, used with network.flat_update.
+
+            With dt_fun(y, s) = g(y, s) - a*y, where 'a' comes from leak_rate, the
+            decay is integrated exactly while g is held constant in each substep:
+            y(t+h) = exp(-a*h)*y(t) + (1 - exp(-a*h))*g/a.
+            This equals y(t) + c*dt_fun(y(t), s), with c = (1 - exp(-a*h))/a, which
+            is smaller than h, so fast decays are stable with large substeps.
+        """
+        a = self.leak_rate()
+        h = self.time_bit
+        if self.multidim:
+            a = np.asarray(a, dtype=float)
+            c = np.full(a.shape, h)
+            nz = a != 0.
+            c[nz] = -np.expm1(-a[nz] * h) / a[nz]
+        else:
+            c = -np.expm1(-a * h) / a if a != 0. else h
+        base = self.buffer.shape[-1] - self.min_buff_size
+        for idx in range(self.min_buff_size):
+            self.buffer[..., base+idx] = self.buffer[..., base+idx-1] + ( c *
+                                         self.dt_fun(self.buffer[..., base+idx-1][()], idx) )
+
+
     def flat_euler_maru_update(self, time):
         """ The flat Euler-Maruyama integration used with one-dimensional units."""
         base = self.buffer.size - self.min_buff_size
-        noise = self.sigma * np.random.normal(loc=0., scale=self.sqrdt,
-                                              size=self.min_buff_size)
+        noise = (self.sigma * self.sqrdt) * self.noise_stream.draw()
         for idx in range(self.min_buff_size):
             self.buffer[base+idx] = self.buffer[base+idx-1] + ( self.time_bit *
                                     self.dt_fun(self.buffer[base+idx-1], idx) +
@@ -1234,8 +1487,7 @@ class unit():
         """ The Euler-Maruyama integration for flat multidimensional units"""
         base = self.buffer.shape[1] - self.min_buff_size
         nvec = np.zeros((self.dim, self.min_buff_size))
-        nvec[0,:] = self.sigma * np.random.normal(loc=0., scale=self.sqrdt,
-                                                  size=self.min_buff_size)
+        nvec[0,:] = (self.sigma * self.sqrdt) * self.noise_stream.draw()
         for idx in range(self.min_buff_size):
             self.buffer[:,base+idx] = self.buffer[:,base+idx-1] + ( self.time_bit *
                                     self.dt_fun(self.buffer[:,base+idx-1], idx) +
@@ -1245,8 +1497,7 @@ class unit():
     def flat_exp_euler_update(self, time):
         """ The exponential Euler integration used with network.flat_update. """
         base = self.buffer.size - self.min_buff_size
-        noise = self.sc3 * np.random.normal(loc=0., scale=1.,
-                                            size=self.min_buff_size)
+        noise = self.sc3 * self.noise_stream.draw()
         for idx in range(self.min_buff_size):
             self.buffer[base+idx] = self.eAt * self.buffer[base+idx-1] + ( self.c2 *
                                     self.dt_fun_eu(self.buffer[base+idx-1], idx) +
@@ -1294,6 +1545,12 @@ class source(unit):
                          Oftentimes the function giving the activity of the unit is set after 
                          the constructor has been called, using source.set_function . In this 
                          case it is good practice to set 'function' : lambda x: None
+            OPTIONAL PARAMETERS
+            'vectorized' : True if 'function' can receive a numpy array of times and
+                           return the array of activities, without side effects (e.g.
+                           random draws). This allows flatten to call it once for all
+                           the times in the buffer. Default is False, except for
+                           numpy's ufuncs.
 
             Notice that 'init_val' is still required because it is used to initialize any
             low-pass filtered values the unit might be keeping.
@@ -1303,37 +1560,36 @@ class source(unit):
         """
         unit.__init__(self, ID, params, network)
         self.get_act = params['function'] # the function which returns activation given the time
+        if 'vectorized' in params: self.vectorized = params['vectorized']
+        else: self.vectorized = False
         assert self.type is unit_types.source, ['Unit ' + str(self.ID) + 
                                                 ' instantiated with the wrong type']
 
-    def set_function(self, function):
+    def set_function(self, function, vectorized=False):
         """ 
         Set the function determiing the unit's activity value.
 
         Args:
             function: a reference to a Python function.
+            vectorized: the 'vectorized' parameter of the constructor, for 'function'.
         Raises:
             ValueError
         """
         if callable(function):
             self.get_act = function
+            self.vectorized = vectorized
         else:
             raise ValueError('The function of a source unit was set with a ' +
                              'non-callable value')
         # What if you're doing this after the connections have already been made?
         # Then net.act and syns_act_dels have links to functions other than this get_act.
         # Thus, we need to reset all those net.act entries...
-        for idx1, syn_list in enumerate(self.net.syns):
-            for idx2, syn in enumerate(syn_list):
-                if syn.preID == self.ID:
-                    self.net.act[idx1][idx2] = self.get_act
+        for post, loc in self.net.out_syns[self.ID]:
+            self.net.act[post][loc] = self.get_act
 
         # The same goes when the connection is to a plant instead of a unit...
-        for plant in self.net.plants:
-            for syn_list, inp_list in zip(plant.inp_syns, plant.inputs):
-                for idx, syn in enumerate(syn_list):
-                    if syn.preID == self.ID:
-                        inp_list[idx] = self.get_act
+        for plant_id, port, loc in self.net.plant_out_syns[self.ID]:
+            self.net.plants[plant_id].inputs[port][loc] = self.get_act
                         
     def update(self, time):
         """ 
@@ -1398,6 +1654,10 @@ class sigmoidal(unit):
         """ The derivatives function used when the network is flat. """
         return ( self.f(self.inp_sum[s]) - y ) * self.rtau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
 
 class noisy_sigmoidal(unit): 
     """
@@ -1465,6 +1725,10 @@ class noisy_sigmoidal(unit):
         """ The derivatives function used when the network is flat. """
         return ( self.f(self.inp_sum[s]) - y ) * self.rtau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
     def dt_fun_eu(self, y, s):
         """ The derivatives function for flat_exp_euler_update. """
         return  self.f(self.inp_sum[s]) * self.rtau
@@ -1512,6 +1776,10 @@ class linear(unit):
         """ The derivatives function used when the network is flat. """
         return ( self.inp_sum[s] - y ) * self.rtau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.rtau
+
 
 class noisy_linear(unit):
     """ A linear unit with passive decay and a noisy update function.
@@ -1569,6 +1837,10 @@ class noisy_linear(unit):
         """ The derivatives function used when the network is flat. """
         return ( self.inp_sum[s] - self.lambd * y ) * self.rtau
 
+    def leak_rate(self):
+        """ Rate of the linear decay in dt_fun (see unit.leak_rate). """
+        return self.lambd * self.rtau
+
     def dt_fun_eu(self, y, s):
         """ The derivatives function for flat_exp_euler_update. """
         return  self.inp_sum[s] * self.rtau